@@ -0,0 +1,295 @@
+"""
+Admission checks for starting agent runs.
+
+Before a run is enqueued, ``start_agent`` and ``initiate_agent_with_files``
+verify thread access, resolve the agent configuration, check model access
+and billing, look for an active run on the project and load the project.
+Most of these lookups are independent of each other, so ``AdmissionContext``
+starts them as soon as their inputs are known and awaits them in the order
+the endpoints used to run them. Errors are therefore reported with the same
+precedence as before, while the latency of a start is that of the slowest
+lookup rather than the sum of all of them.
+
+Each lookup runs at most once per request: the Stripe subscription in
+particular is loaded once and shared by the model-access and billing checks.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from services.billing import can_use_model, check_billing_status, get_user_subscription
+from utils.auth_utils import verify_thread_access
+from utils.logger import logger
+
+class AdmissionContext:
+    """Request-scoped lookups for admitting a run, each started at most once."""
+
+    def __init__(self, client):
+        self.client = client
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._started: Dict[str, float] = {}
+        self.timings: Dict[str, float] = {}
+
+    def once(self, name: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Start a lookup unless it is already running.
+
+        Args:
+            name: Key of the lookup within the request
+            factory: Creates the coroutine performing the lookup
+
+        Returns:
+            Task of the lookup, shared by every caller using the same name
+        """
+        task = self._tasks.get(name)
+        if task is None:
+            self._started[name] = time.perf_counter()
+            task = asyncio.create_task(factory())
+            task.add_done_callback(lambda _: self._record(name))
+            self._tasks[name] = task
+        return task
+
+    def _record(self, name: str) -> None:
+        self.timings[name] = round((time.perf_counter() - self._started[name]) * 1000, 2)
+
+    def subscription(self, account_id: str) -> Awaitable[Optional[Dict]]:
+        return self.once(f"subscription:{account_id}", lambda: get_user_subscription(account_id))
+
+    def start_entitlement_checks(self, account_id: str, model_name: str) -> Tuple[asyncio.Task, asyncio.Task]:
+        """Start the model-access and billing checks, sharing one subscription lookup."""
+        get_subscription = lambda user_id: self.subscription(user_id)
+        return (
+            self.once("model_access", lambda: can_use_model(self.client, account_id, model_name, get_subscription)),
+            self.once("billing", lambda: check_billing_status(self.client, account_id, get_subscription)),
+        )
+
+    def start_agent_lookup(self, account_id: str, agent_id: Optional[str]) -> Tuple[Optional[asyncio.Task], asyncio.Task]:
+        """Start loading the requested agent and the account's default agent together."""
+        agent_task = None
+        if agent_id:
+            agent_task = self.once(
+                "agent",
+                lambda: self.client.table('agents').select('*').eq('agent_id', agent_id).eq('account_id', account_id).execute(),
+            )
+        default_task = self.once(
+            "default_agent",
+            lambda: self.client.table('agents').select('*').eq('account_id', account_id).eq('is_default', True).execute(),
+        )
+        return agent_task, default_task
+
+    async def close(self) -> None:
+        """Cancel lookups that are no longer needed, e.g. after an earlier check failed."""
+        pending = [task for task in self._tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def resolve_agent_config(
+    agent_task: Optional[asyncio.Task],
+    default_task: asyncio.Task,
+    agent_id: Optional[str],
+    explicit: bool,
+) -> Optional[Dict[str, Any]]:
+    """
+    Pick the agent configuration for a run.
+
+    Args:
+        agent_task: Lookup of ``agent_id``, if one was given
+        default_task: Lookup of the account's default agent
+        agent_id: Agent requested or stored on the thread
+        explicit: Whether ``agent_id`` was requested explicitly, in which case
+            a missing agent is an error instead of falling back to the default
+
+    Returns:
+        The agent configuration, or None to run without one
+    """
+    if agent_task is not None:
+        agent_result = await agent_task
+        if agent_result.data:
+            return agent_result.data[0]
+        if explicit:
+            raise HTTPException(status_code=404, detail="Agent not found or access denied")
+        logger.warning(f"Stored agent_id {agent_id} not found, falling back to default")
+
+    default_agent_result = await default_task
+    if default_agent_result.data:
+        agent_config = default_agent_result.data[0]
+        logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']})")
+        return agent_config
+    return None
+
+
+async def check_entitlements(model_task: asyncio.Task, billing_task: asyncio.Task) -> None:
+    """Raise the model-access (403) or billing (402) error of a start, in that order."""
+    can_use, model_message, allowed_models = await model_task
+    if not can_use:
+        raise HTTPException(status_code=403, detail={"message": model_message, "allowed_models": allowed_models})
+
+    can_run, message, subscription = await billing_task
+    if not can_run:
+        raise HTTPException(status_code=402, detail={"message": message, "subscription": subscription})
+
+
+@dataclass
+class ThreadAdmission:
+    """Result of admitting a new run on an existing thread."""
+    project_id: str
+    account_id: str
+    thread_agent_id: Optional[str]
+    agent_config: Optional[Dict[str, Any]]
+    is_agent_builder: bool
+    target_agent_id: Optional[str]
+    sandbox_id: str
+    active_run_id: Optional[str]
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+async def admit_thread_run(
+    client,
+    thread_id: str,
+    user_id: str,
+    model_name: str,
+    requested_agent_id: Optional[str],
+    find_active_run: Callable[[Any, str], Awaitable[Optional[str]]],
+) -> ThreadAdmission:
+    """
+    Run the admission checks of ``start_agent`` concurrently.
+
+    The thread is loaded first since every other lookup depends on its
+    account or project. Everything else then runs concurrently and is
+    awaited in the order the checks used to run, so the first failing check
+    determines the error exactly as before. Nothing is modified here; the
+    caller applies side effects (stopping the active run, updating the
+    thread, inserting the run) only once the run is admitted.
+
+    Args:
+        client: Database client
+        thread_id: Thread to start the run on
+        user_id: User starting the run
+        model_name: Resolved model name
+        requested_agent_id: Agent requested explicitly, if any
+        find_active_run: Returns the ID of the project's running agent run, if any
+
+    Returns:
+        Everything the caller needs to start the run
+
+    Raises:
+        HTTPException: If a check fails
+    """
+    context = AdmissionContext(client)
+    try:
+        access_task = context.once("access", lambda: verify_thread_access(client, thread_id, user_id))
+        thread_task = context.once(
+            "thread",
+            lambda: client.table('threads').select('project_id', 'account_id', 'agent_id', 'metadata').eq('id', thread_id).execute(),
+        )
+
+        await access_task
+        thread_result = await thread_task
+        if not thread_result.data:
+            raise HTTPException(status_code=404, detail="Thread not found")
+        thread_data = thread_result.data[0]
+        project_id = thread_data.get('project_id')
+        account_id = thread_data.get('account_id')
+        thread_agent_id = thread_data.get('agent_id')
+        thread_metadata = thread_data.get('metadata') or {}
+
+        is_agent_builder = thread_metadata.get('is_agent_builder', False)
+        target_agent_id = thread_metadata.get('target_agent_id')
+        if is_agent_builder:
+            logger.info(f"Thread {thread_id} is in agent builder mode, target_agent_id: {target_agent_id}")
+
+        effective_agent_id = requested_agent_id or thread_agent_id
+        agent_task, default_task = context.start_agent_lookup(account_id, effective_agent_id)
+        model_task, billing_task = context.start_entitlement_checks(account_id, model_name)
+        active_run_task = context.once("active_run", lambda: find_active_run(client, project_id))
+        project_task = context.once("project", lambda: client.table('projects').select('*').eq('id', project_id).execute())
+
+        agent_config = await resolve_agent_config(agent_task, default_task, effective_agent_id, bool(requested_agent_id))
+        if agent_config and agent_task is not None:
+            source = "request" if requested_agent_id else "thread"
+            logger.info(f"Using agent from {source}: {agent_config['name']} ({agent_config['agent_id']})")
+        await check_entitlements(model_task, billing_task)
+        active_run_id = await active_run_task
+
+        project_result = await project_task
+        if not project_result.data:
+            raise HTTPException(status_code=404, detail="Project not found")
+        sandbox_info = project_result.data[0].get('sandbox') or {}
+        if not sandbox_info.get('id'):
+            raise HTTPException(status_code=404, detail="No sandbox found for this project")
+
+        return ThreadAdmission(
+            project_id=project_id,
+            account_id=account_id,
+            thread_agent_id=thread_agent_id,
+            agent_config=agent_config,
+            is_agent_builder=is_agent_builder,
+            target_agent_id=target_agent_id,
+            sandbox_id=sandbox_info['id'],
+            active_run_id=active_run_id,
+            timings=context.timings,
+        )
+    finally:
+        await context.close()
+
+
+async def admit_new_session(
+    client,
+    account_id: str,
+    model_name: str,
+    agent_id: Optional[str],
+    ensure_account: Callable[[Any, str], Awaitable[None]],
+) -> Tuple[Optional[Dict[str, Any]], Dict[str, float]]:
+    """
+    Run the admission checks of ``initiate_agent_with_files`` concurrently.
+
+    Args:
+        client: Database client
+        account_id: Personal account of the user (equal to the user ID)
+        model_name: Resolved model name
+        agent_id: Agent requested explicitly, if any
+        ensure_account: Creates the user and account if they do not exist yet
+
+    Returns:
+        The agent configuration (or None) and the lookup timings
+
+    Raises:
+        HTTPException: If a check fails
+    """
+    context = AdmissionContext(client)
+    try:
+        account_task = context.once("account", lambda: ensure_account(client, account_id))
+        agent_task, default_task = context.start_agent_lookup(account_id, agent_id)
+        model_task, billing_task = context.start_entitlement_checks(account_id, model_name)
+
+        await account_task
+        agent_config = await resolve_agent_config(agent_task, default_task, agent_id, explicit=True)
+        if agent_config and agent_id:
+            logger.info(f"Using custom agent: {agent_config['name']} ({agent_id})")
+        await check_entitlements(model_task, billing_task)
+        return agent_config, context.timings
+    finally:
+        await context.close()
+
+
+async def start_sandbox(sandbox_id: str, project_id: str, start: Callable[[str], Awaitable[Any]]) -> None:
+    """
+    Get or start a project's sandbox before its run is created.
+
+    Raises:
+        HTTPException: 500 if the sandbox cannot be started, so no run is
+            created that could not use it
+    """
+    try:
+        await start(sandbox_id)
+        logger.info(f"Successfully started sandbox {sandbox_id} for project {project_id}")
+    except Exception as e:
+        logger.error(f"Failed to start sandbox for project {project_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to initialize sandbox: {str(e)}")
@@ -11,16 +11,16 @@ from pydantic import BaseModel
 import tempfile
 import os
 
-from agentpress.thread_manager import ThreadManager
+from agent.admission import admit_thread_run, admit_new_session, start_sandbox
+from agent.listing import list_agents, split_csv, LIBRARY_SORT_COLUMNS, MARKETPLACE_SORTS
 from services.database import DBConnection
-from services import redis
+from services import redis, response_log, run_registry
+from services.prometheus import API_STREAM_CHUNKS
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger
-from services.billing import check_billing_status, can_use_model
 from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
-from services.llm import make_llm_api_call
-from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
+from sandbox.file_stream import write_sandbox_file, iter_upload_file
 from utils.constants import MODEL_NAME_ALIASES
 from flags.flags import is_enabled
 
@@ -132,6 +132,8 @@ class PaginationInfo(BaseModel):
     limit: int
     total: int
     pages: int
+    total_is_estimate: bool = False
+    next_cursor: Optional[str] = None
 
 class AgentsResponse(BaseModel):
     agents: List[AgentResponse]
@@ -178,17 +180,11 @@ async def cleanup():
     # Use the instance_id to find and clean up this instance's keys
     try:
         if instance_id: # Ensure instance_id is set
-            running_keys = await redis.keys(f"active_run:{instance_id}:*")
-            logger.info(f"Found {len(running_keys)} running agent runs for instance {instance_id} to clean up")
-
-            for key in running_keys:
-                # Key format: active_run:{instance_id}:{agent_run_id}
-                parts = key.split(":")
-                if len(parts) == 3:
-                    agent_run_id = parts[2]
-                    await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
-                else:
-                    logger.warning(f"Unexpected key format found: {key}")
+            running_runs = await run_registry.get_instance_runs(instance_id)
+            logger.info(f"Found {len(running_runs)} running agent runs for instance {instance_id} to clean up")
+
+            for agent_run_id in running_runs:
+                await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
         else:
             logger.warning("Instance ID not set, cannot clean up instance-specific agent runs.")
 
@@ -199,27 +195,28 @@ async def cleanup():
     await redis.close()
     logger.info("Completed cleanup of agent API resources")
 
+async def stop_orphaned_runs(dead_instance_id: str, agent_run_ids: List[str]):
+    """Fail the runs of an instance that stopped sending run registry heartbeats."""
+    for agent_run_id in agent_run_ids:
+        # The worker's last responses are only in Redis
+        try:
+            await response_log.archive_from_redis(agent_run_id)
+        except Exception as e:
+            logger.error(f"Failed to archive responses of orphaned run {agent_run_id}: {e}")
+        await stop_agent_run(agent_run_id, error_message=f"Instance {dead_instance_id} stopped responding")
+
 async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None):
     """Update database and publish stop signal to Redis."""
     logger.info(f"Stopping agent run: {agent_run_id}")
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-        # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
+    # Deferred to first use, see utils/lazy.py
+    from run_agent_background import _cleanup_redis_response_list, update_agent_run_status
 
-    # Update the agent run status in the database
-    update_success = await update_agent_run_status(
-        client, agent_run_id, final_status, error=error_message, responses=all_responses
-    )
+    # Update the agent run status in the database; the worker archives the
+    # responses (services/response_log.py)
+    update_success = await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
 
     if not update_success:
         logger.error(f"Failed to update database status for stopped/failed run {agent_run_id}")
@@ -234,22 +231,19 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
 
     # Find all instances handling this agent run and send STOP to instance-specific channels
     try:
-        instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
-        logger.debug(f"Found {len(instance_keys)} active instance keys for agent run {agent_run_id}")
-
-        for key in instance_keys:
-            # Key format: active_run:{instance_id}:{agent_run_id}
-            parts = key.split(":")
-            if len(parts) == 3:
-                instance_id_from_key = parts[1]
-                instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_key}"
-                try:
-                    await redis.publish(instance_control_channel, "STOP")
-                    logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
-                except Exception as e:
-                    logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
-            else:
-                 logger.warning(f"Unexpected key format found: {key}")
+        run_instances = await run_registry.get_run_instances(agent_run_id)
+        logger.debug(f"Found {len(run_instances)} active instances for agent run {agent_run_id}")
+
+        for instance_id_from_registry in run_instances:
+            instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_registry}"
+            try:
+                await redis.publish(instance_control_channel, "STOP")
+                logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
+            except Exception as e:
+                logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
+
+        # The run is over for every instance
+        await run_registry.release_run(agent_run_id)
 
         # Clean up the response list immediately on stop/fail
         await _cleanup_redis_response_list(agent_run_id)
@@ -358,6 +352,7 @@ Transform this basic information into a comprehensive, effective system prompt t
         ]
 
         logger.info(f"Enhancing system prompt for agent: {agent_name}")
+        from services.llm import make_llm_api_call
         response = await make_llm_api_call(
             messages=messages,
             model_name="openai/gpt-4o",
@@ -411,86 +406,37 @@ async def start_agent(
     logger.info(f"Starting new agent for thread: {thread_id} with config: model={model_name}, thinking={body.enable_thinking}, effort={body.reasoning_effort}, stream={body.stream}, context_manager={body.enable_context_manager} (Instance: {instance_id})")
     client = await db.client
 
-    await verify_thread_access(client, thread_id, user_id)
-    thread_result = await client.table('threads').select('project_id', 'account_id', 'agent_id', 'metadata').eq('id', thread_id).execute()
-    if not thread_result.data:
-        raise HTTPException(status_code=404, detail="Thread not found")
-    thread_data = thread_result.data[0]
-    project_id = thread_data.get('project_id')
-    account_id = thread_data.get('account_id')
-    thread_agent_id = thread_data.get('agent_id')
-    thread_metadata = thread_data.get('metadata', {})
-    
-    # Check if this is an agent builder thread
-    is_agent_builder = thread_metadata.get('is_agent_builder', False)
-    target_agent_id = thread_metadata.get('target_agent_id')
-    
-    if is_agent_builder:
-        logger.info(f"Thread {thread_id} is in agent builder mode, target_agent_id: {target_agent_id}")
-    
-    # Load agent configuration
-    agent_config = None
-    effective_agent_id = body.agent_id or thread_agent_id  # Use provided agent_id or the one stored in thread
-    
-    if effective_agent_id:
-        agent_result = await client.table('agents').select('*').eq('agent_id', effective_agent_id).eq('account_id', account_id).execute()
-        if not agent_result.data:
-            if body.agent_id:
-                raise HTTPException(status_code=404, detail="Agent not found or access denied")
-            else:
-                logger.warning(f"Stored agent_id {effective_agent_id} not found, falling back to default")
-                effective_agent_id = None
-        else:
-            agent_config = agent_result.data[0]
-            source = "request" if body.agent_id else "thread"
-            logger.info(f"Using agent from {source}: {agent_config['name']} ({effective_agent_id})")
-    
-    # If no agent found yet, try to get default agent for the account
-    if not agent_config:
-        default_agent_result = await client.table('agents').select('*').eq('account_id', account_id).eq('is_default', True).execute()
-        if default_agent_result.data:
-            agent_config = default_agent_result.data[0]
-            logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']})")
-    
-    # Update thread's agent_id if a different agent was explicitly requested
-    if body.agent_id and body.agent_id != thread_agent_id and agent_config:
-        try:
-            await client.table('threads').update({"agent_id": agent_config['agent_id']}).eq('thread_id', thread_id).execute()
-            logger.info(f"Updated thread {thread_id} to use agent {agent_config['agent_id']}")
-        except Exception as e:
-            logger.warning(f"Failed to update thread agent_id: {e}")
-
-    can_use, model_message, allowed_models = await can_use_model(client, account_id, model_name)
-    if not can_use:
-        raise HTTPException(status_code=403, detail={"message": model_message, "allowed_models": allowed_models})
-
-    can_run, message, subscription = await check_billing_status(client, account_id)
-    if not can_run:
-        raise HTTPException(status_code=402, detail={"message": message, "subscription": subscription})
-
-    active_run_id = await check_for_active_project_agent_run(client, project_id)
-    if active_run_id:
-        logger.info(f"Stopping existing agent run {active_run_id} for project {project_id}")
-        await stop_agent_run(active_run_id)
-
-    try:
-        # Get project data to find sandbox ID
-        project_result = await client.table('projects').select('*').eq('id', project_id).execute()
-        if not project_result.data:
-            raise HTTPException(status_code=404, detail="Project not found")
-        
-        project_data = project_result.data[0]
-        sandbox_info = project_data.get('sandbox', {})
-        if not sandbox_info.get('id'):
-            raise HTTPException(status_code=404, detail="No sandbox found for this project")
-            
-        sandbox_id = sandbox_info['id']
-        sandbox = await get_or_start_sandbox(sandbox_id)
-        logger.info(f"Successfully started sandbox {sandbox_id} for project {project_id}")
-    except Exception as e:
-        logger.error(f"Failed to start sandbox for project {project_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to initialize sandbox: {str(e)}")
-
+    # Independent checks run concurrently; nothing is modified until the run is admitted
+    admission = await admit_thread_run(
+        client, thread_id, user_id, model_name, body.agent_id, check_for_active_project_agent_run
+    )
+    project_id = admission.project_id
+    agent_config = admission.agent_config
+    is_agent_builder = admission.is_agent_builder
+    target_agent_id = admission.target_agent_id
+    logger.debug(f"Admitted run on thread {thread_id}, lookup timings (ms): {admission.timings}")
+
+    async def update_thread_agent():
+        # Update thread's agent_id if a different agent was explicitly requested
+        if body.agent_id and body.agent_id != admission.thread_agent_id and agent_config:
+            try:
+                await client.table('threads').update({"agent_id": agent_config['agent_id']}).eq('thread_id', thread_id).execute()
+                logger.info(f"Updated thread {thread_id} to use agent {agent_config['agent_id']}")
+            except Exception as e:
+                logger.warning(f"Failed to update thread agent_id: {e}")
+
+    async def stop_active_run():
+        if admission.active_run_id:
+            logger.info(f"Stopping existing agent run {admission.active_run_id} for project {project_id}")
+            await stop_agent_run(admission.active_run_id)
+
+    # The run is only inserted once the previous run is stopped and the
+    # sandbox is up, so a failure here leaves no run behind
+    await asyncio.gather(
+        start_sandbox(admission.sandbox_id, project_id, get_or_start_sandbox),
+        update_thread_agent(),
+        stop_active_run(),
+    )
     agent_run = await client.table('agent_runs').insert({
         "thread_id": thread_id, "status": "running",
         "started_at": datetime.now(timezone.utc).isoformat()
@@ -498,14 +444,15 @@ async def start_agent(
     agent_run_id = agent_run.data[0]['id']
     logger.info(f"Created new agent run: {agent_run_id}")
 
-    # Register this run in Redis with TTL using instance ID
-    instance_key = f"active_run:{instance_id}:{agent_run_id}"
+    # Register this run for this instance in the run registry
     try:
-        await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+        await run_registry.register_run(instance_id, agent_run_id)
     except Exception as e:
-        logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
+        logger.warning(f"Failed to register agent run {agent_run_id} in the run registry: {str(e)}")
 
-    # Run the agent in the background
+    # Run the agent in the background (the worker module loads the whole
+    # agent loop, so it is imported on first use, see utils/lazy.py)
+    from run_agent_background import run_agent_background
     run_agent_background.send(
         agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
         project_id=project_id,
@@ -545,13 +492,34 @@ async def get_agent_run(agent_run_id: str, user_id: str = Depends(get_current_us
     client = await db.client
     agent_run_data = await get_agent_run_with_access_check(client, agent_run_id, user_id)
     # Note: Responses are not included here by default, they are in the stream or DB
+    usage = agent_run_data.get('usage')
+    if isinstance(usage, str):
+        usage = json.loads(usage)
     return {
         "id": agent_run_data['id'],
         "threadId": agent_run_data['thread_id'],
         "status": agent_run_data['status'],
         "startedAt": agent_run_data['started_at'],
         "completedAt": agent_run_data['completed_at'],
-        "error": agent_run_data['error']
+        "error": agent_run_data['error'],
+        "usage": usage
+    }
+
+@router.get("/agent-run/{agent_run_id}/profile")
+async def get_agent_run_profile(agent_run_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
+    """Get the latency breakdown of a finished agent run."""
+    logger.info(f"Fetching agent run profile: {agent_run_id}")
+    client = await db.client
+    agent_run_data = await get_agent_run_with_access_check(client, agent_run_id, user_id)
+    profile = agent_run_data.get('profile')
+    if not profile:
+        raise HTTPException(status_code=404, detail="No profile recorded for this agent run")
+    if isinstance(profile, str):
+        profile = json.loads(profile)
+    return {
+        "id": agent_run_data['id'],
+        "status": agent_run_data['status'],
+        "profile": profile
     }
 
 @router.get("/thread/{thread_id}/agent", response_model=ThreadAgentResponse)
@@ -665,9 +633,14 @@ async def stream_agent_run(
             initial_responses = []
             if initial_responses_json:
                 initial_responses = [json.loads(r) for r in initial_responses_json]
+            elif agent_run_data['status'] != 'running':
+                # The Redis list of a finished run expires; its responses are archived
+                initial_responses = await response_log.read_responses(agent_run_id)
+            if initial_responses:
                 logger.debug(f"Sending {len(initial_responses)} initial responses for {agent_run_id}")
                 for response in initial_responses:
                     yield f"data: {json.dumps(response)}\n\n"
+                API_STREAM_CHUNKS.inc(len(initial_responses))
                 last_processed_index = len(initial_responses) - 1
             initial_yield_complete = True
 
@@ -755,6 +728,7 @@ async def stream_agent_run(
                             # logger.debug(f"Received {num_new} new responses for {agent_run_id} (index {new_start_index} onwards)")
                             for response in new_responses:
                                 yield f"data: {json.dumps(response)}\n\n"
+                                API_STREAM_CHUNKS.inc()
                                 # Check if this response signals completion
                                 if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
                                     logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
@@ -829,6 +803,7 @@ async def generate_and_update_project_name(project_id: str, prompt: str):
         messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
 
         logger.debug(f"Calling LLM ({model_name}) for project {project_id} naming.")
+        from services.llm import make_llm_api_call
         response = await make_llm_api_call(messages=messages, model_name=model_name, max_tokens=20, temperature=0.7)
 
         generated_name = None
@@ -897,32 +872,13 @@ async def initiate_agent_with_files(
     logger.info(f"[\033[91mDEBUG\033[0m] Initiating new agent with prompt and {len(files)} files (Instance: {instance_id}), model: {model_name}, enable_thinking: {enable_thinking}")
     client = db.client
     
-    # Ensure user and account exist
-    await ensure_user_and_account_exist(client, user_id)
     account_id = user_id # In Basejump, personal account_id is the same as user_id
-    
-    # Load agent configuration if agent_id is provided
-    agent_config = None
-    if agent_id:
-        agent_result = await client.table('agents').select('*').eq('agent_id', agent_id).eq('account_id', account_id).execute()
-        if not agent_result.data:
-            raise HTTPException(status_code=404, detail="Agent not found or access denied")
-        agent_config = agent_result.data[0]
-        logger.info(f"Using custom agent: {agent_config['name']} ({agent_id})")
-    else:
-        # Try to get default agent for the account
-        default_agent_result = await client.table('agents').select('*').eq('account_id', account_id).eq('is_default', True).execute()
-        if default_agent_result.data:
-            agent_config = default_agent_result.data[0]
-            logger.info(f"Using default agent: {agent_config['name']} ({agent_config['agent_id']})")
-    
-    can_use, model_message, allowed_models = await can_use_model(client, account_id, model_name)
-    if not can_use:
-        raise HTTPException(status_code=403, detail={"message": model_message, "allowed_models": allowed_models})
 
-    can_run, message, subscription = await check_billing_status(client, account_id)
-    if not can_run:
-        raise HTTPException(status_code=402, detail={"message": message, "subscription": subscription})
+    # Account setup, agent lookup and model/billing checks run concurrently
+    agent_config, admission_timings = await admit_new_session(
+        client, account_id, model_name, agent_id, ensure_user_and_account_exist
+    )
+    logger.debug(f"Admitted new session for account {account_id}, lookup timings (ms): {admission_timings}")
 
     try:
         # 1. Create Project
@@ -1022,16 +978,11 @@ async def initiate_agent_with_files(
                         safe_filename = file.filename.replace('/', '_').replace('\\', '_')
                         target_path = f"/workspace/{safe_filename}"
                         logger.info(f"Attempting to upload {safe_filename} to {target_path} in sandbox {sandbox_id}")
-                        content = await file.read()
                         upload_successful = False
                         try:
                             if hasattr(sandbox, 'fs') and hasattr(sandbox.fs, 'upload_file'):
-                                import inspect
-                                if inspect.iscoroutinefunction(sandbox.fs.upload_file):
-                                    await sandbox.fs.upload_file(content, target_path)
-                                else:
-                                    sandbox.fs.upload_file(content, target_path)
-                                logger.debug(f"Called sandbox.fs.upload_file for {target_path}")
+                                await write_sandbox_file(sandbox, target_path, iter_upload_file(file))
+                                logger.debug(f"Streamed upload to {target_path}")
                                 upload_successful = True
                             else:
                                 raise NotImplementedError("Suitable upload method not found on sandbox object.")
@@ -1068,31 +1019,32 @@ async def initiate_agent_with_files(
                 message_content += "\n\nThe following files failed to upload:\n"
                 for failed_file in failed_uploads: message_content += f"- {failed_file}\n"
 
-        # 5. Add initial user message to thread
+        # 5. Add initial user message to thread and 6. start the agent run;
+        # both only depend on the thread
         message_id = str(uuid.uuid4())
         message_payload = {"role": "user", "content": message_content}
-        await client.table('messages').insert({
-            "message_id": message_id, "thread_id": thread_id, "type": "user",
-            "is_llm_message": True, "content": json.dumps(message_payload),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-
-        # 6. Start Agent Run
-        agent_run = await client.table('agent_runs').insert({
-            "thread_id": thread_id, "status": "running",
-            "started_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
+        _, agent_run = await asyncio.gather(
+            client.table('messages').insert({
+                "message_id": message_id, "thread_id": thread_id, "type": "user",
+                "is_llm_message": True, "content": json.dumps(message_payload),
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }).execute(),
+            client.table('agent_runs').insert({
+                "thread_id": thread_id, "status": "running",
+                "started_at": datetime.now(timezone.utc).isoformat()
+            }).execute(),
+        )
         agent_run_id = agent_run.data[0]['id']
         logger.info(f"Created new agent run: {agent_run_id}")
 
-        # Register run in Redis
-        instance_key = f"active_run:{instance_id}:{agent_run_id}"
+        # Register run in the run registry
         try:
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.register_run(instance_id, agent_run_id)
         except Exception as e:
-            logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
+            logger.warning(f"Failed to register agent run {agent_run_id} in the run registry: {str(e)}")
 
         # Run agent in background
+        from run_agent_background import run_agent_background
         run_agent_background.send(
             agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
             project_id=project_id,
@@ -1128,7 +1080,8 @@ async def get_agents(
     has_default: Optional[bool] = Query(None, description="Filter by default agents"),
     has_mcp_tools: Optional[bool] = Query(None, description="Filter by agents with MCP tools"),
     has_agentpress_tools: Optional[bool] = Query(None, description="Filter by agents with AgentPress tools"),
-    tools: Optional[str] = Query(None, description="Comma-separated list of tools to filter by")
+    tools: Optional[str] = Query(None, description="Comma-separated list of tools to filter by"),
+    cursor: Optional[str] = Query(None, description="Cursor of the previous page (next_cursor), replaces page")
 ):
     """Get agents for the current user with pagination, search, sort, and filter support."""
     if not await is_enabled("custom_agents"):
@@ -1137,162 +1090,42 @@ async def get_agents(
             detail="Custom agents currently disabled. This feature is not available at the moment."
         )
     logger.info(f"Fetching agents for user: {user_id} with page={page}, limit={limit}, search='{search}', sort_by={sort_by}, sort_order={sort_order}")
-    client = await db.client
     
     try:
-        # Calculate offset
-        offset = (page - 1) * limit
-        
-        # Start building the query
-        query = client.table('agents').select('*', count='exact').eq("account_id", user_id)
-        
-        # Apply search filter
-        if search:
-            search_term = f"%{search}%"
-            query = query.or_(f"name.ilike.{search_term},description.ilike.{search_term}")
-        
-        # Apply filters
-        if has_default is not None:
-            query = query.eq("is_default", has_default)
-        
-        # For MCP and AgentPress tools filtering, we'll need to do post-processing
-        # since Supabase doesn't have great JSON array/object filtering
-        
-        # Apply sorting
-        if sort_by == "name":
-            query = query.order("name", desc=(sort_order == "desc"))
-        elif sort_by == "updated_at":
-            query = query.order("updated_at", desc=(sort_order == "desc"))
-        elif sort_by == "created_at":
-            query = query.order("created_at", desc=(sort_order == "desc"))
-        else:
-            # Default to created_at
-            query = query.order("created_at", desc=(sort_order == "desc"))
-        
-        # Execute query to get total count first
-        count_result = await query.execute()
-        total_count = count_result.count
-        
-        # Now get the actual data with pagination
-        query = query.range(offset, offset + limit - 1)
-        agents_result = await query.execute()
-        
-        if not agents_result.data:
-            logger.info(f"No agents found for user: {user_id}")
-            return {
-                "agents": [],
-                "pagination": {
-                    "page": page,
-                    "limit": limit,
-                    "total": 0,
-                    "pages": 0
-                }
-            }
-        
-        # Post-process for tool filtering and tools_count sorting
-        agents_data = agents_result.data
-        
-        # Apply tool-based filters
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools:
-            filtered_agents = []
-            tools_filter = []
-            if tools:
-                tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()]
-            
-            for agent in agents_data:
-                # Check MCP tools filter
-                if has_mcp_tools is not None:
-                    has_mcp = bool(agent.get('configured_mcps') and len(agent.get('configured_mcps', [])) > 0)
-                    if has_mcp_tools != has_mcp:
-                        continue
-                
-                # Check AgentPress tools filter
-                if has_agentpress_tools is not None:
-                    agentpress_tools = agent.get('agentpress_tools', {})
-                    has_enabled_tools = any(
-                        tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                        for tool_data in agentpress_tools.values()
-                    )
-                    if has_agentpress_tools != has_enabled_tools:
-                        continue
-                
-                # Check specific tools filter
-                if tools_filter:
-                    agent_tools = set()
-                    # Add MCP tools
-                    for mcp in agent.get('configured_mcps', []):
-                        if isinstance(mcp, dict) and 'name' in mcp:
-                            agent_tools.add(f"mcp:{mcp['name']}")
-                    
-                    # Add enabled AgentPress tools
-                    for tool_name, tool_data in agent.get('agentpress_tools', {}).items():
-                        if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False):
-                            agent_tools.add(f"agentpress:{tool_name}")
-                    
-                    # Check if any of the requested tools are present
-                    if not any(tool in agent_tools for tool in tools_filter):
-                        continue
-                
-                filtered_agents.append(agent)
-            
-            agents_data = filtered_agents
-        
-        # Handle tools_count sorting (post-processing required)
-        if sort_by == "tools_count":
-            def get_tools_count(agent):
-                mcp_count = len(agent.get('configured_mcps', []))
-                agentpress_count = sum(
-                    1 for tool_data in agent.get('agentpress_tools', {}).values()
-                    if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                )
-                return mcp_count + agentpress_count
-            
-            agents_data.sort(key=get_tools_count, reverse=(sort_order == "desc"))
-        
-        # Apply pagination to filtered results if we did post-processing
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools or sort_by == "tools_count":
-            total_count = len(agents_data)
-            agents_data = agents_data[offset:offset + limit]
-        
-        # Format the response
-        agent_list = []
-        for agent in agents_data:
-            agent_list.append(AgentResponse(
-                agent_id=agent['agent_id'],
-                account_id=agent['account_id'],
-                name=agent['name'],
-                description=agent.get('description'),
-                system_prompt=agent['system_prompt'],
-                configured_mcps=agent.get('configured_mcps', []),
-                custom_mcps=agent.get('custom_mcps', []),
-                agentpress_tools=agent.get('agentpress_tools', {}),
-                is_default=agent.get('is_default', False),
-                is_public=agent.get('is_public', False),
-                marketplace_published_at=agent.get('marketplace_published_at'),
-                download_count=agent.get('download_count', 0),
-                tags=agent.get('tags', []),
-                avatar=agent.get('avatar'),
-                avatar_color=agent.get('avatar_color'),
-                created_at=agent['created_at'],
-                updated_at=agent['updated_at']
-            ))
-        
-        total_pages = (total_count + limit - 1) // limit
-        
-        logger.info(f"Found {len(agent_list)} agents for user: {user_id} (page {page}/{total_pages})")
-        return {
-            "agents": agent_list,
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": total_count,
-                "pages": total_pages
-            }
-        }
-        
+        listing = await list_agents(
+            account_id=user_id,
+            search=search,
+            tools=split_csv(tools),
+            has_default=has_default,
+            has_mcp_tools=has_mcp_tools,
+            has_agentpress_tools=has_agentpress_tools,
+            sort_column=LIBRARY_SORT_COLUMNS.get(sort_by, "created_at"),
+            descending=(sort_order == "desc"),
+            limit=limit,
+            page=page,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching agents for user {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch agents: {str(e)}")
+    
+    agent_list = [AgentResponse(**agent) for agent in listing.rows]
+    total_pages = (listing.total + limit - 1) // limit
+    
+    logger.info(f"Found {len(agent_list)} agents for user: {user_id} (page {page}/{total_pages})")
+    return {
+        "agents": agent_list,
+        "pagination": {
+            "page": page,
+            "limit": limit,
+            "total": listing.total,
+            "pages": total_pages,
+            "total_is_estimate": listing.total_is_estimate,
+            "next_cursor": listing.next_cursor
+        }
+    }
 
 @router.get("/agents/{agent_id}", response_model=AgentResponse)
 async def get_agent(agent_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
@@ -1584,7 +1417,8 @@ async def get_marketplace_agents(
     search: Optional[str] = Query(None, description="Search in name and description"),
     tags: Optional[str] = Query(None, description="Comma-separated string of tags"),
     sort_by: Optional[str] = Query("newest", description="Sort by: newest, popular, most_downloaded, name"),
-    creator: Optional[str] = Query(None, description="Filter by creator name")
+    creator: Optional[str] = Query(None, description="Filter by creator name"),
+    cursor: Optional[str] = Query(None, description="Cursor of the previous page (next_cursor), replaces page")
 ):
     """Get public agents from the marketplace with pagination, search, sort, and filter support."""
     if not await is_enabled("agent_marketplace"):
@@ -1594,63 +1428,39 @@ async def get_marketplace_agents(
         )
     
     logger.info(f"Fetching marketplace agents with page={page}, limit={limit}, search='{search}', tags='{tags}', sort_by={sort_by}")
-    client = await db.client
+    sort_column, descending = MARKETPLACE_SORTS.get(sort_by, MARKETPLACE_SORTS["newest"])
     
     try:
-        offset = (page - 1) * limit
-        tags_array = None
-        if tags:
-            tags_array = [tag.strip() for tag in tags.split(',') if tag.strip()]
-        
-        result = await client.rpc('get_marketplace_agents', {
-            'p_search': search,
-            'p_tags': tags_array,
-            'p_limit': limit + 1,
-            'p_offset': offset
-        }).execute()
-        
-        if result.data is None:
-            result.data = []
-        
-        has_more = len(result.data) > limit
-        agents_data = result.data[:limit] 
-        if creator:
-            agents_data = [
-                agent for agent in agents_data 
-                if creator.lower() in agent.get('creator_name', '').lower()
-            ]
-
-        if sort_by == "most_downloaded":
-            agents_data = sorted(agents_data, key=lambda x: x.get('download_count', 0), reverse=True)
-        elif sort_by == "popular":
-            agents_data = sorted(agents_data, key=lambda x: x.get('download_count', 0), reverse=True)
-        elif sort_by == "name":
-            agents_data = sorted(agents_data, key=lambda x: x.get('name', '').lower())
-        else:
-            agents_data = sorted(agents_data, key=lambda x: x.get('marketplace_published_at', ''), reverse=True)
-        
-        estimated_total = (page - 1) * limit + len(agents_data)
-        if has_more:
-            estimated_total += 1
-        
-        total_pages = max(page, (estimated_total + limit - 1) // limit)
-        if has_more:
-            total_pages = page + 1
-        
-        logger.info(f"Found {len(agents_data)} marketplace agents (page {page}, estimated {total_pages} pages)")
-        return {
-            "agents": agents_data,
-            "pagination": {
-                "page": page,
-                "limit": limit,
-                "total": estimated_total,
-                "pages": total_pages
-            }
-        }
-        
+        listing = await list_agents(
+            marketplace=True,
+            search=search,
+            tags=split_csv(tags),
+            creator=creator,
+            sort_column=sort_column,
+            descending=descending,
+            limit=limit,
+            page=page,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching marketplace agents: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
+    
+    total_pages = (listing.total + limit - 1) // limit
+    logger.info(f"Found {len(listing.rows)} marketplace agents (page {page}/{total_pages})")
+    return {
+        "agents": listing.rows,
+        "pagination": {
+            "page": page,
+            "limit": limit,
+            "total": listing.total,
+            "pages": total_pages,
+            "total_is_estimate": listing.total_is_estimate,
+            "next_cursor": listing.next_cursor
+        }
+    }
 
 @router.post("/agents/{agent_id}/publish")
 async def publish_agent_to_marketplace(
@@ -822,6 +822,7 @@ Use these capabilities to provide the best possible assistance while maintaining
                         'total_iterations': self.state.total_iterations
                     }
                 )
+                self.trace.close()
             
             logger.info("Enhanced Agent cleanup completed")
             
@@ -0,0 +1,234 @@
+"""
+Per-iteration state for the agent loop.
+
+Before every LLM call the loop needs to know whether the run may continue
+(billing, last message in the thread) and which temporary context to attach
+(latest browser state, pending image context). Reading these with one query
+each costs four or five database round trips per iteration, plus the billing
+lookups.
+
+``IterationStateReader`` fetches all of it with a single call to the
+``get_iteration_state`` SQL function (database/init/04-iteration-state.sql):
+
+- the browser state is only returned when it changed since the last read;
+  otherwise the content blocks built from the previous one are reused
+- the image context is deleted in the same statement that reads it
+- the account's usage this month is read from the usage ledger on every
+  iteration; only the subscription's minute limit is reused for
+  BILLING_CHECK_INTERVAL_SECONDS
+"""
+
+import json
+import time
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from services.billing import get_usage_limit, usage_limit_message
+from services.database import db_service
+from utils.config import config
+from utils.logger import logger
+
+
+@dataclass
+class IterationState:
+    """State the agent loop acts on before an LLM call."""
+    can_run: bool
+    billing_message: str
+    latest_message_type: Optional[str]
+    temporary_content: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _parse_content(content: Any) -> Dict[str, Any]:
+    # Content may be stored as a JSON string inside the JSONB column
+    return json.loads(content) if isinstance(content, str) else content
+
+
+def browser_state_blocks(browser_content: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Content blocks describing the browser state, screenshot last."""
+    blocks = []
+    screenshot_base64 = browser_content.get("screenshot_base64")
+    screenshot_url = browser_content.get("image_url")
+
+    # Create a copy of the browser state without screenshot data
+    browser_state_text = browser_content.copy()
+    browser_state_text.pop('screenshot_base64', None)
+    browser_state_text.pop('image_url', None)
+
+    if browser_state_text:
+        blocks.append({
+            "type": "text",
+            "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
+        })
+
+    # Prioritize screenshot_url if available
+    if screenshot_url:
+        blocks.append({
+            "type": "image_url",
+            "image_url": {
+                "url": screenshot_url,
+                "format": "image/jpeg"
+            }
+        })
+    elif screenshot_base64:
+        # Fallback to base64 if URL not available
+        blocks.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{screenshot_base64}",
+            }
+        })
+    else:
+        logger.warning("Browser state found but no screenshot data.")
+    return blocks
+
+
+def image_context_blocks(image_context_content: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Content blocks showing an image the agent asked to see."""
+    base64_image = image_context_content.get("base64")
+    mime_type = image_context_content.get("mime_type")
+    file_path = image_context_content.get("file_path", "unknown file")
+
+    if not (base64_image and mime_type):
+        logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
+        return []
+    return [
+        {
+            "type": "text",
+            "text": f"Here is the image you requested to see: '{file_path}'"
+        },
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{base64_image}",
+            }
+        },
+    ]
+
+
+class IterationStateReader:
+    """Reads the agent loop state for one run, one round trip per iteration."""
+
+    def __init__(
+        self,
+        thread_id: str,
+        account_id: str,
+        client: Any,
+        db: Any = None,
+        trace: Any = None,
+        billing_check_interval: Optional[float] = None,
+    ):
+        """
+        Args:
+            thread_id: Thread the run belongs to
+            account_id: Account charged for the run
+            client: Database client of the run
+            db: Database service exposing ``execute_query`` (defaults to db_service)
+            trace: Optional Langfuse trace for parse error events
+            billing_check_interval: Seconds the subscription's minute limit is reused
+                (defaults to BILLING_CHECK_INTERVAL_SECONDS)
+        """
+        self.thread_id = thread_id
+        self.account_id = account_id
+        self.client = client
+        self.db = db or db_service
+        self.trace = trace
+        self.billing_check_interval = (
+            config.BILLING_CHECK_INTERVAL_SECONDS if billing_check_interval is None else billing_check_interval
+        )
+
+        self._minutes_limit: Optional[int] = None
+        self._limit_checked_at: Optional[float] = None
+        self._browser_state_at: Optional[datetime] = None
+        self._browser_blocks: List[Dict[str, Any]] = []
+
+        self.iterations = 0
+        self.round_trips = 0
+        self.billing_checks = 0
+        self.browser_state_refreshes = 0
+        self.overhead = 0.0
+
+    def _event(self, name: str, message: str) -> None:
+        if self.trace is not None:
+            self.trace.event(name=name, level="ERROR", status_message=message)
+
+    async def _usage_limit(self) -> Optional[int]:
+        now = time.monotonic()
+        if self._limit_checked_at is None or now - self._limit_checked_at >= self.billing_check_interval:
+            self._minutes_limit, _ = await get_usage_limit(self.account_id)
+            self._limit_checked_at = now
+            self.billing_checks += 1
+        return self._minutes_limit
+
+    async def _fetch(self, with_usage: bool) -> Dict[str, Any]:
+        self.round_trips += 1
+        raw = await self.db.execute_query(
+            "SELECT get_iteration_state($1, $2::timestamptz, $3::uuid)",
+            self.thread_id,
+            self._browser_state_at,
+            self.account_id if with_usage else None,
+            fetch="val",
+        )
+        if isinstance(raw, str):
+            raw = json.loads(raw)
+        return raw or {}
+
+    async def read(self) -> IterationState:
+        """
+        Read the state for the next iteration.
+
+        Consumes the pending image context, so call it once per iteration.
+
+        Returns:
+            IterationState; ``temporary_content`` is empty when there is nothing to attach
+        """
+        started = time.perf_counter()
+        self.iterations += 1
+        try:
+            minutes_limit = await self._usage_limit()
+            state = await self._fetch(with_usage=minutes_limit is not None)
+            if minutes_limit is None:
+                billing_message = "Local development mode - billing disabled"
+            elif (state.get("usage_seconds") or 0) / 60 >= minutes_limit:
+                return IterationState(False, usage_limit_message(minutes_limit), None)
+            else:
+                billing_message = "OK"
+
+            latest_message_type = state.get("latest_message_type")
+            if latest_message_type == "assistant":
+                return IterationState(True, billing_message, latest_message_type)
+
+            browser_state = state.get("browser_state")
+            if browser_state:
+                self._browser_state_at = datetime.fromisoformat(browser_state["created_at"])
+                self.browser_state_refreshes += 1
+                try:
+                    self._browser_blocks = browser_state_blocks(_parse_content(browser_state["content"]))
+                except Exception as e:
+                    logger.error(f"Error parsing browser state: {e}")
+                    self._event("error_parsing_browser_state", f"{e}")
+                    self._browser_blocks = []
+
+            temporary_content = list(self._browser_blocks)
+            image_context = state.get("image_context")
+            if image_context:
+                try:
+                    temporary_content.extend(image_context_blocks(_parse_content(image_context["content"])))
+                except Exception as e:
+                    logger.error(f"Error parsing image context: {e}")
+                    self._event("error_parsing_image_context", f"{e}")
+
+            return IterationState(True, billing_message, latest_message_type, temporary_content)
+        finally:
+            self.overhead += time.perf_counter() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Round trips and time spent reading state so far in the run."""
+        return {
+            "iterations": self.iterations,
+            "round_trips": self.round_trips,
+            "billing_checks": self.billing_checks,
+            "browser_state_refreshes": self.browser_state_refreshes,
+            "overhead_ms": round(self.overhead * 1000, 3),
+            "overhead_per_iteration_ms": round(self.overhead * 1000 / self.iterations, 3) if self.iterations else 0,
+        }
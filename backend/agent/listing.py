@@ -0,0 +1,325 @@
+"""
+Database-side listing of agents for the agent library and the marketplace.
+
+Search, tag, tool and default filters as well as sorting are pushed into a
+single SQL query against the ``agents`` table, using the generated
+``tool_keys`` and ``tools_count`` columns and the indexes from
+``database/init/05-agents.sql``. Pages are read with keyset pagination:
+each page returns an opaque cursor holding the sort value and agent ID of
+its last row, and the next page continues with a row comparison instead of
+an OFFSET, so deep pages cost as much as the first one. Nullable sort
+columns are sorted and compared through SORT_EXPRESSIONS, which the keyset
+indexes are built on as well. Page numbers without a cursor are still
+accepted and fall back to OFFSET.
+
+Totals are counted up to COUNT_CAP matching rows and cached for a short
+time. Beyond the cap the planner's row estimate is returned instead and the
+listing is flagged as an estimate.
+"""
+
+import base64
+import json
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services.database import db_service
+from utils.logger import logger
+
+# Matching rows counted exactly before falling back to the planner estimate
+COUNT_CAP = 10000
+
+# Seconds a total is reused for the same filters
+COUNT_CACHE_TTL = 30
+
+# Number of cached totals kept per process
+MAX_CACHED_COUNTS = 1024
+
+# Sort fields of the agent library, mapped to their column
+LIBRARY_SORT_COLUMNS = {
+    "name": "name",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "tools_count": "tools_count",
+}
+
+# Sort options of the marketplace, mapped to their column and direction
+MARKETPLACE_SORTS = {
+    "newest": ("marketplace_published_at", True),
+    "popular": ("download_count", True),
+    "most_downloaded": ("download_count", True),
+    "name": ("name", False),
+}
+
+# Sort expressions of nullable columns. A row comparison with NULL matches
+# nothing, so NULLs are replaced by a value that sorts like NULL would
+SORT_EXPRESSIONS = {
+    "created_at": "COALESCE(a.created_at, 'infinity'::timestamptz)",
+    "updated_at": "COALESCE(a.updated_at, 'infinity'::timestamptz)",
+    "marketplace_published_at": "COALESCE(a.marketplace_published_at, 'infinity'::timestamptz)",
+    "download_count": "COALESCE(a.download_count, 0)",
+}
+
+LIBRARY_COLUMNS = (
+    "a.agent_id, a.account_id, a.name, a.description, a.system_prompt, a.configured_mcps, a.custom_mcps, "
+    "a.agentpress_tools, a.is_default, a.is_public, a.marketplace_published_at, a.download_count, a.tags, "
+    "a.avatar, a.avatar_color, a.created_at, a.updated_at"
+)
+
+MARKETPLACE_COLUMNS = (
+    "a.agent_id, a.name, a.description, a.system_prompt, a.configured_mcps, a.agentpress_tools, a.tags, "
+    "a.download_count, a.marketplace_published_at, a.created_at, COALESCE(acc.name, 'Anonymous') AS creator_name, "
+    "a.avatar, a.avatar_color"
+)
+
+JSON_COLUMNS = ("configured_mcps", "custom_mcps", "agentpress_tools")
+
+# Number of configured MCPs of an agent row
+MCP_COUNT_SQL = "(CASE WHEN jsonb_typeof(a.configured_mcps) = 'array' THEN jsonb_array_length(a.configured_mcps) ELSE 0 END)"
+
+
+@dataclass
+class AgentListing:
+    """One page of agents."""
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+    total: int = 0
+    total_is_estimate: bool = False
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(sort_value: Any, agent_id: Any) -> str:
+    """Encode the position after a row as an opaque cursor."""
+    if isinstance(sort_value, datetime):
+        value = ["t", sort_value.isoformat()]
+    elif isinstance(sort_value, int):
+        value = ["i", sort_value]
+    else:
+        value = ["s", sort_value]
+    payload = json.dumps([value, str(agent_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, uuid.UUID]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Returns:
+        Sort value and agent ID of the last row of the previous page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        (kind, value), agent_id = json.loads(payload)
+        if kind == "t":
+            value = datetime.fromisoformat(value)
+        elif kind == "i":
+            value = int(value)
+        elif kind != "s" or not isinstance(value, str):
+            raise ValueError(f"unknown sort value type {kind!r}")
+        return value, uuid.UUID(agent_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}") from None
+
+
+def like_pattern(value: str) -> str:
+    """ILIKE pattern matching ``value`` as a literal substring."""
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def split_csv(value: Optional[str]) -> List[str]:
+    """Split a comma-separated query parameter into its non-empty items."""
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class _Filters:
+    """WHERE clause built from positional parameters."""
+
+    def __init__(self):
+        self.clauses: List[str] = []
+        self.args: List[Any] = []
+
+    def param(self, value: Any) -> str:
+        self.args.append(value)
+        return f"${len(self.args)}"
+
+    def add(self, clause: str) -> None:
+        self.clauses.append(clause)
+
+    @property
+    def sql(self) -> str:
+        return " AND ".join(self.clauses) if self.clauses else "TRUE"
+
+
+_counts: "OrderedDict[Tuple, Tuple[float, int, bool]]" = OrderedDict()
+
+
+async def _count(from_sql: str, filters: _Filters, db) -> Tuple[int, bool]:
+    key = (from_sql, filters.sql, tuple(tuple(arg) if isinstance(arg, list) else arg for arg in filters.args))
+    cached = _counts.get(key)
+    if cached and time.monotonic() - cached[0] < COUNT_CACHE_TTL:
+        return cached[1], cached[2]
+
+    total = await db.execute_query(
+        f"SELECT count(*) FROM (SELECT 1 FROM {from_sql} WHERE {filters.sql} LIMIT {COUNT_CAP + 1}) capped",
+        *filters.args,
+        fetch="val",
+    )
+    is_estimate = total > COUNT_CAP
+    if is_estimate:
+        try:
+            plan = await db.execute_query(
+                f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {from_sql} WHERE {filters.sql}",
+                *filters.args,
+                fetch="val",
+            )
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            total = max(total, int(plan[0]["Plan"]["Plan Rows"]))
+        except Exception as e:
+            logger.warning(f"Failed to estimate agent count: {str(e)}")
+
+    _counts[key] = (time.monotonic(), total, is_estimate)
+    _counts.move_to_end(key)
+    if len(_counts) > MAX_CACHED_COUNTS:
+        _counts.popitem(last=False)
+    return total, is_estimate
+
+
+def _normalize(row: Dict[str, Any]) -> Dict[str, Any]:
+    row.pop("_sort_value", None)
+    for key, value in row.items():
+        if isinstance(value, uuid.UUID):
+            row[key] = str(value)
+        elif isinstance(value, datetime):
+            row[key] = value.isoformat()
+        elif key in JSON_COLUMNS and isinstance(value, str):
+            row[key] = json.loads(value)
+    for key in JSON_COLUMNS:
+        if key in row and row[key] is None:
+            row[key] = {} if key == "agentpress_tools" else []
+    if "tags" in row and row["tags"] is None:
+        row["tags"] = []
+    return row
+
+
+async def list_agents(
+    *,
+    account_id: Optional[str] = None,
+    marketplace: bool = False,
+    search: Optional[str] = None,
+    tags: Optional[Sequence[str]] = None,
+    tools: Optional[Sequence[str]] = None,
+    has_default: Optional[bool] = None,
+    has_mcp_tools: Optional[bool] = None,
+    has_agentpress_tools: Optional[bool] = None,
+    creator: Optional[str] = None,
+    sort_column: str = "created_at",
+    descending: bool = True,
+    limit: int = 20,
+    page: int = 1,
+    cursor: Optional[str] = None,
+    db=None,
+) -> AgentListing:
+    """
+    List one page of agents matching the given filters.
+
+    Args:
+        account_id: Only agents owned by this account (agent library)
+        marketplace: Only public agents, with the creator name joined in
+        search: Case-insensitive substring of the name or description
+        tags: Agents having any of these tags
+        tools: Agents having any of these tool keys ('mcp:{name}' or 'agentpress:{tool}')
+        has_default: Filter on the default flag
+        has_mcp_tools: Filter on having configured MCPs
+        has_agentpress_tools: Filter on having enabled AgentPress tools
+        creator: Case-insensitive substring of the owning account's name
+        sort_column: Column to sort by, one of LIBRARY_SORT_COLUMNS or MARKETPLACE_SORTS values
+        descending: Sort direction
+        limit: Page size
+        page: 1-based page number, used with OFFSET when no cursor is given
+        cursor: Cursor of the previous page (takes precedence over page)
+        db: Database service exposing ``execute_query`` (defaults to db_service)
+
+    Returns:
+        The page with its total and the cursor of the next page, if any
+
+    Raises:
+        ValueError: If the sort column or cursor is invalid
+    """
+    db = db or db_service
+    valid_columns = {column for column, _ in MARKETPLACE_SORTS.values()} | set(LIBRARY_SORT_COLUMNS.values())
+    if sort_column not in valid_columns:
+        raise ValueError(f"Invalid sort column: {sort_column}")
+
+    filters = _Filters()
+    from_sql = "agents a"
+    if account_id is not None:
+        filters.add(f"a.account_id = {filters.param(uuid.UUID(str(account_id)))}")
+    if marketplace:
+        filters.add("a.is_public = TRUE")
+        if sort_column == "marketplace_published_at":
+            # The newest listing only shows agents that were published
+            filters.add("a.marketplace_published_at IS NOT NULL")
+    if search:
+        pattern = filters.param(like_pattern(search))
+        filters.add(f"(a.name ILIKE {pattern} OR a.description ILIKE {pattern})")
+    if tags:
+        filters.add(f"a.tags && {filters.param(list(tags))}::text[]")
+    if tools:
+        filters.add(f"a.tool_keys && {filters.param(list(tools))}::text[]")
+    if has_default is not None:
+        filters.add(f"a.is_default = {filters.param(has_default)}")
+    if has_mcp_tools is not None:
+        filters.add(f"({MCP_COUNT_SQL} > 0) = {filters.param(has_mcp_tools)}")
+    if has_agentpress_tools is not None:
+        # tools_count is the number of MCPs plus enabled AgentPress tools
+        filters.add(f"(a.tools_count > {MCP_COUNT_SQL}) = {filters.param(has_agentpress_tools)}")
+    if creator:
+        filters.add(f"EXISTS (SELECT 1 FROM accounts c WHERE c.id = a.account_id AND c.name ILIKE {filters.param(like_pattern(creator))})")
+
+    total, total_is_estimate = await _count(from_sql, filters, db)
+
+    # The count ignores the cursor, so the page predicate is added afterwards
+    page_filters = _Filters()
+    page_filters.clauses, page_filters.args = list(filters.clauses), list(filters.args)
+    sort_sql = SORT_EXPRESSIONS.get(sort_column, f"a.{sort_column}")
+    offset = 0
+    if cursor:
+        sort_value, last_agent_id = decode_cursor(cursor)
+        comparison = "<" if descending else ">"
+        page_filters.add(
+            f"({sort_sql}, a.agent_id) {comparison} ({page_filters.param(sort_value)}, {page_filters.param(last_agent_id)})"
+        )
+    else:
+        offset = (page - 1) * limit
+
+    direction = "DESC" if descending else "ASC"
+    columns = MARKETPLACE_COLUMNS if marketplace else LIBRARY_COLUMNS
+    if marketplace:
+        from_sql += " LEFT JOIN accounts acc ON acc.id = a.account_id"
+    rows = await db.execute_query(
+        f"SELECT {columns}, {sort_sql} AS _sort_value FROM {from_sql} "
+        f"WHERE {page_filters.sql} "
+        f"ORDER BY {sort_sql} {direction}, a.agent_id {direction} "
+        f"LIMIT {page_filters.param(limit + 1)} OFFSET {page_filters.param(offset)}",
+        *page_filters.args,
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["_sort_value"], rows[-1]["agent_id"])
+    return AgentListing(
+        rows=[_normalize(dict(row)) for row in rows],
+        total=total,
+        total_is_estimate=total_is_estimate,
+        next_cursor=next_cursor,
+    )
@@ -0,0 +1,224 @@
+"""
+Assembly and caching of the final system prompt for agent runs.
+
+Building the system message for a run means picking the base prompt for
+the model family, appending the sample response for non-Anthropic models,
+applying the agent's custom prompt, listing MCP tools and appending the XML
+tool examples, then counting its tokens. The result only depends on the
+agent configuration, the model family and the registered tool set, so it is
+assembled once per combination and reused by later runs in the same process.
+
+Entries are keyed by a hash of the configuration that shapes the prompt, so
+editing an agent (prompt, tools or MCP servers) produces a new key and the
+old entry simply ages out of the LRU.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from litellm import token_counter
+
+from agent.agent_builder_prompt import get_agent_builder_prompt
+from agent.gemini_prompt import get_gemini_system_prompt
+from agent.prompt import get_system_prompt
+from agent.tools.mcp_tool_wrapper import MCPToolWrapper
+from agentpress.thread_manager import ThreadManager
+from agentpress.tool import SchemaType
+from utils.logger import logger
+
+# Number of assembled prompts kept per process
+MAX_CACHED_PROMPTS = 256
+
+# Agent configuration fields that influence the system prompt
+PROMPT_CONFIG_FIELDS = ("agent_id", "system_prompt", "agentpress_tools", "configured_mcps", "custom_mcps", "updated_at")
+
+
+@dataclass(frozen=True)
+class PromptAssembly:
+    """Final system message for a run together with its token count."""
+    key: str
+    system_message: Dict[str, Any]
+    token_count: int
+
+
+_assemblies: "OrderedDict[str, PromptAssembly]" = OrderedDict()
+
+
+@lru_cache(maxsize=1)
+def _sample_response() -> str:
+    sample_response_path = os.path.join(os.path.dirname(__file__), 'sample_responses/1.txt')
+    with open(sample_response_path, 'r') as file:
+        return file.read()
+
+
+def get_model_family(model_name: str) -> str:
+    """Group model names by the base prompt they use."""
+    model_name = model_name.lower()
+    if "gemini-2.5-flash" in model_name:
+        return "gemini"
+    if "anthropic" in model_name:
+        return "anthropic"
+    return "default"
+
+
+def _build_mcp_info(mcp_wrapper_instance: MCPToolWrapper) -> str:
+    mcp_info = "\n\n--- MCP Tools Available ---\n"
+    mcp_info += "You have access to external MCP (Model Context Protocol) server tools.\n"
+    mcp_info += "MCP tools can be called directly using their native function names in the standard function calling format:\n"
+    mcp_info += '<function_calls>\n'
+    mcp_info += '<invoke name="{tool_name}">\n'
+    mcp_info += '<parameter name="param1">value1</parameter>\n'
+    mcp_info += '<parameter name="param2">value2</parameter>\n'
+    mcp_info += '</invoke>\n'
+    mcp_info += '</function_calls>\n\n'
+
+    # List available MCP tools
+    mcp_info += "Available MCP tools:\n"
+    try:
+        # Get the actual registered schemas from the wrapper
+        registered_schemas = mcp_wrapper_instance.get_schemas()
+        for method_name, schema_list in registered_schemas.items():
+            if method_name == 'call_mcp_tool':
+                continue  # Skip the fallback method
+
+            for schema in schema_list:
+                if schema.schema_type == SchemaType.OPENAPI:
+                    func_info = schema.schema.get('function', {})
+                    description = func_info.get('description', 'No description available')
+                    mcp_info += f"- **{method_name}**: {description}\n"
+
+                    # Show parameter info
+                    params = func_info.get('parameters', {})
+                    props = params.get('properties', {})
+                    if props:
+                        mcp_info += f"  Parameters: {', '.join(props.keys())}\n"
+
+    except Exception as e:
+        logger.error(f"Error listing MCP tools: {e}")
+        mcp_info += "- Error loading MCP tool list\n"
+
+    # Add critical instructions for using search results
+    mcp_info += "\n🚨 CRITICAL MCP TOOL RESULT INSTRUCTIONS 🚨\n"
+    mcp_info += "When you use ANY MCP (Model Context Protocol) tools:\n"
+    mcp_info += "1. ALWAYS read and use the EXACT results returned by the MCP tool\n"
+    mcp_info += "2. For search tools: ONLY cite URLs, sources, and information from the actual search results\n"
+    mcp_info += "3. For any tool: Base your response entirely on the tool's output - do NOT add external information\n"
+    mcp_info += "4. DO NOT fabricate, invent, hallucinate, or make up any sources, URLs, or data\n"
+    mcp_info += "5. If you need more information, call the MCP tool again with different parameters\n"
+    mcp_info += "6. When writing reports/summaries: Reference ONLY the data from MCP tool results\n"
+    mcp_info += "7. If the MCP tool doesn't return enough information, explicitly state this limitation\n"
+    mcp_info += "8. Always double-check that every fact, URL, and reference comes from the MCP tool output\n"
+    mcp_info += "\nIMPORTANT: MCP tool results are your PRIMARY and ONLY source of truth for external data!\n"
+    mcp_info += "NEVER supplement MCP results with your training data or make assumptions beyond what the tools provide.\n"
+    return mcp_info
+
+
+def build_system_content(
+    model_name: str,
+    agent_config: Optional[dict],
+    is_agent_builder: bool,
+    mcp_wrapper_instance: Optional[MCPToolWrapper],
+) -> str:
+    """Build the system prompt text for a run, without the XML tool examples."""
+    # Handle custom agent system prompt
+    if agent_config and agent_config.get('system_prompt'):
+        # Completely replace the default system prompt with the custom one
+        # This prevents confusion and tool hallucination
+        system_content = agent_config['system_prompt'].strip()
+        logger.info(f"Using ONLY custom agent system prompt for: {agent_config.get('name', 'Unknown')}")
+    elif is_agent_builder:
+        system_content = get_agent_builder_prompt()
+        logger.info("Using agent builder system prompt")
+    else:
+        family = get_model_family(model_name)
+        if family == "gemini":
+            system_content = get_gemini_system_prompt()
+        else:
+            # Use the original prompt - the LLM can only use tools that are registered
+            system_content = get_system_prompt()
+
+        # Add sample response for non-anthropic models
+        if family != "anthropic":
+            system_content = system_content + "\n\n <sample_assistant_response>" + _sample_response() + "</sample_assistant_response>"
+        logger.info("Using default system prompt only")
+
+    # Add MCP tool information to system prompt if MCP tools are configured
+    if agent_config and (agent_config.get('configured_mcps') or agent_config.get('custom_mcps')) and mcp_wrapper_instance and mcp_wrapper_instance._initialized:
+        system_content += _build_mcp_info(mcp_wrapper_instance)
+
+    return system_content
+
+
+def _assembly_key(
+    model_name: str,
+    agent_config: Optional[dict],
+    is_agent_builder: bool,
+    tool_names: Tuple[str, ...],
+    mcp_ready: bool,
+) -> str:
+    config_part = {field: agent_config.get(field) for field in PROMPT_CONFIG_FIELDS} if agent_config else None
+    payload = json.dumps({
+        "family": get_model_family(model_name),
+        "model": model_name,
+        "agent": config_part,
+        "agent_builder": bool(is_agent_builder),
+        "tools": tool_names,
+        "mcp_ready": mcp_ready,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_system_prompt_assembly(
+    thread_manager: ThreadManager,
+    model_name: str,
+    agent_config: Optional[dict] = None,
+    is_agent_builder: bool = False,
+    mcp_wrapper_instance: Optional[MCPToolWrapper] = None,
+    include_xml_examples: bool = True,
+) -> PromptAssembly:
+    """
+    Return the assembled system message for a run, building it on first use.
+
+    Args:
+        thread_manager: Thread manager whose tool registry is already populated
+        model_name: Model the run uses
+        agent_config: Custom agent configuration, if any
+        is_agent_builder: Whether the run is the agent builder
+        mcp_wrapper_instance: Initialized MCP tool wrapper, if any
+        include_xml_examples: Append the XML tool examples to the prompt
+
+    Returns:
+        PromptAssembly with the final system message and its token count
+    """
+    tool_names = tuple(sorted(thread_manager.tool_registry.get_available_functions()))
+    mcp_ready = bool(mcp_wrapper_instance and mcp_wrapper_instance._initialized)
+    key = _assembly_key(model_name, agent_config, is_agent_builder, tool_names + (str(include_xml_examples),), mcp_ready)
+
+    assembly = _assemblies.get(key)
+    if assembly is not None:
+        _assemblies.move_to_end(key)
+        logger.debug(f"Reusing assembled system prompt {key[:12]}")
+        return assembly
+
+    system_content = build_system_content(model_name, agent_config, is_agent_builder, mcp_wrapper_instance)
+    if include_xml_examples:
+        system_content += thread_manager.get_xml_examples_prompt()
+
+    system_message = {"role": "system", "content": system_content}
+    try:
+        token_count = token_counter(model=model_name, messages=[system_message])
+    except Exception as e:
+        logger.warning(f"Failed to count system prompt tokens for {model_name}: {str(e)}")
+        token_count = len(system_content) // 4
+
+    assembly = PromptAssembly(key=key, system_message=system_message, token_count=token_count)
+    _assemblies[key] = assembly
+    if len(_assemblies) > MAX_CACHED_PROMPTS:
+        _assemblies.popitem(last=False)
+    logger.debug(f"Assembled system prompt {key[:12]}: {len(system_content)} chars, {token_count} tokens")
+    return assembly
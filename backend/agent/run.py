@@ -12,7 +12,6 @@ from agent.tools.web_search_tool import SandboxWebSearchTool
 from dotenv import load_dotenv
 from utils.config import config
 
-from agent.agent_builder_prompt import get_agent_builder_prompt
 from agentpress.thread_manager import ThreadManager
 from agentpress.response_processor import ProcessorConfig
 from agent.tools.sb_shell_tool import SandboxShellTool
@@ -20,17 +19,15 @@ from agent.tools.sb_files_tool import SandboxFilesTool
 from agent.tools.sb_browser_tool import SandboxBrowserTool
 from agent.tools.data_providers_tool import DataProvidersTool
 from agent.tools.expand_msg_tool import ExpandMessageTool
-from agent.prompt import get_system_prompt
+from agent.prompt_assembly import get_system_prompt_assembly
 from utils.logger import logger
 from utils.auth_utils import get_account_id_from_thread
-from services.billing import check_billing_status
+from agent.iteration_state import IterationStateReader
 from agent.tools.sb_vision_tool import SandboxVisionTool
-from services.langfuse import langfuse
-from langfuse.client import StatefulTraceClient
-from services.langfuse import langfuse
-from agent.gemini_prompt import get_gemini_system_prompt
+from services.langfuse import Trace, langfuse
 from agent.tools.mcp_tool_wrapper import MCPToolWrapper
 from agentpress.tool import SchemaType
+from utils import run_profiler
 
 load_dotenv()
 
@@ -46,7 +43,7 @@ async def run_agent(
     reasoning_effort: Optional[str] = 'low',
     enable_context_manager: bool = True,
     agent_config: Optional[dict] = None,    
-    trace: Optional[StatefulTraceClient] = None,
+    trace: Optional[Trace] = None,
     is_agent_builder: Optional[bool] = False,
     target_agent_id: Optional[str] = None
 ):
@@ -55,7 +52,8 @@ async def run_agent(
     if agent_config:
         logger.info(f"Using custom agent: {agent_config.get('name', 'Unknown')}")
 
-    if not trace:
+    owns_trace = not trace
+    if owns_trace:
         trace = langfuse.trace(name="run_agent", session_id=thread_id, metadata={"project_id": project_id})
     thread_manager = ThreadManager(trace=trace, is_agent_builder=is_agent_builder, target_agent_id=target_agent_id)
 
@@ -157,7 +155,7 @@ async def run_agent(
         if all_mcps:
             logger.info(f"Registering MCP tool wrapper for {len(all_mcps)} MCP servers (including {len(agent_config.get('custom_mcps', []))} custom)")
             # Register the tool with all MCPs
-            thread_manager.add_tool(MCPToolWrapper, mcp_configs=all_mcps)
+            thread_manager.add_tool(MCPToolWrapper, mcp_configs=all_mcps, account_id=account_id)
             
             # Get the tool instance from the registry
             # The tool is registered with method names as keys
@@ -180,113 +178,27 @@ async def run_agent(
                             # Register each dynamic tool in the registry
                             for schema in schema_list:
                                 if schema.schema_type == SchemaType.OPENAPI:
-                                    thread_manager.tool_registry.tools[method_name] = {
-                                        "instance": mcp_wrapper_instance,
-                                        "schema": schema
-                                    }
+                                    thread_manager.tool_registry.register_function(method_name, mcp_wrapper_instance, schema)
                                     logger.debug(f"Registered dynamic MCP tool: {method_name}")
                 
                 except Exception as e:
                     logger.error(f"Failed to initialize MCP tools: {e}")
                     # Continue without MCP tools if initialization fails
 
-    # Prepare system prompt
-    # First, get the default system prompt
-    if "gemini-2.5-flash" in model_name.lower():
-        default_system_content = get_gemini_system_prompt()
-    else:
-        # Use the original prompt - the LLM can only use tools that are registered
-        default_system_content = get_system_prompt()
-        
-    # Add sample response for non-anthropic models
-    if "anthropic" not in model_name.lower():
-        sample_response_path = os.path.join(os.path.dirname(__file__), 'sample_responses/1.txt')
-        with open(sample_response_path, 'r') as file:
-            sample_response = file.read()
-        default_system_content = default_system_content + "\n\n <sample_assistant_response>" + sample_response + "</sample_assistant_response>"
-    
-    # Handle custom agent system prompt
-    if agent_config and agent_config.get('system_prompt'):
-        custom_system_prompt = agent_config['system_prompt'].strip()
-        
-        # Completely replace the default system prompt with the custom one
-        # This prevents confusion and tool hallucination
-        system_content = custom_system_prompt
-        logger.info(f"Using ONLY custom agent system prompt for: {agent_config.get('name', 'Unknown')}")
-    elif is_agent_builder:
-        system_content = get_agent_builder_prompt()
-        logger.info("Using agent builder system prompt")
-    else:
-        # Use just the default system prompt
-        system_content = default_system_content
-        logger.info("Using default system prompt only")
-    
-    # Add MCP tool information to system prompt if MCP tools are configured
-    if agent_config and (agent_config.get('configured_mcps') or agent_config.get('custom_mcps')) and mcp_wrapper_instance and mcp_wrapper_instance._initialized:
-        mcp_info = "\n\n--- MCP Tools Available ---\n"
-        mcp_info += "You have access to external MCP (Model Context Protocol) server tools.\n"
-        mcp_info += "MCP tools can be called directly using their native function names in the standard function calling format:\n"
-        mcp_info += '<function_calls>\n'
-        mcp_info += '<invoke name="{tool_name}">\n'
-        mcp_info += '<parameter name="param1">value1</parameter>\n'
-        mcp_info += '<parameter name="param2">value2</parameter>\n'
-        mcp_info += '</invoke>\n'
-        mcp_info += '</function_calls>\n\n'
-        
-        # List available MCP tools
-        mcp_info += "Available MCP tools:\n"
-        try:
-            # Get the actual registered schemas from the wrapper
-            registered_schemas = mcp_wrapper_instance.get_schemas()
-            for method_name, schema_list in registered_schemas.items():
-                if method_name == 'call_mcp_tool':
-                    continue  # Skip the fallback method
-                    
-                # Get the schema info
-                for schema in schema_list:
-                    if schema.schema_type == SchemaType.OPENAPI:
-                        func_info = schema.schema.get('function', {})
-                        description = func_info.get('description', 'No description available')
-                        # Extract server name from description if available
-                        server_match = description.find('(MCP Server: ')
-                        if server_match != -1:
-                            server_end = description.find(')', server_match)
-                            server_info = description[server_match:server_end+1]
-                        else:
-                            server_info = ''
-                        
-                        mcp_info += f"- **{method_name}**: {description}\n"
-                        
-                        # Show parameter info
-                        params = func_info.get('parameters', {})
-                        props = params.get('properties', {})
-                        if props:
-                            mcp_info += f"  Parameters: {', '.join(props.keys())}\n"
-                            
-        except Exception as e:
-            logger.error(f"Error listing MCP tools: {e}")
-            mcp_info += "- Error loading MCP tool list\n"
-        
-        # Add critical instructions for using search results
-        mcp_info += "\n🚨 CRITICAL MCP TOOL RESULT INSTRUCTIONS 🚨\n"
-        mcp_info += "When you use ANY MCP (Model Context Protocol) tools:\n"
-        mcp_info += "1. ALWAYS read and use the EXACT results returned by the MCP tool\n"
-        mcp_info += "2. For search tools: ONLY cite URLs, sources, and information from the actual search results\n"
-        mcp_info += "3. For any tool: Base your response entirely on the tool's output - do NOT add external information\n"
-        mcp_info += "4. DO NOT fabricate, invent, hallucinate, or make up any sources, URLs, or data\n"
-        mcp_info += "5. If you need more information, call the MCP tool again with different parameters\n"
-        mcp_info += "6. When writing reports/summaries: Reference ONLY the data from MCP tool results\n"
-        mcp_info += "7. If the MCP tool doesn't return enough information, explicitly state this limitation\n"
-        mcp_info += "8. Always double-check that every fact, URL, and reference comes from the MCP tool output\n"
-        mcp_info += "\nIMPORTANT: MCP tool results are your PRIMARY and ONLY source of truth for external data!\n"
-        mcp_info += "NEVER supplement MCP results with your training data or make assumptions beyond what the tools provide.\n"
-        
-        system_content += mcp_info
-    
-    system_message = { "role": "system", "content": system_content }
+    # Assemble the system prompt (base prompt, custom prompt, MCP info and XML examples),
+    # reusing a previous assembly for the same agent configuration, model and tool set
+    prompt_assembly = get_system_prompt_assembly(
+        thread_manager,
+        model_name,
+        agent_config=agent_config,
+        is_agent_builder=is_agent_builder,
+        mcp_wrapper_instance=mcp_wrapper_instance,
+    )
+    system_message = prompt_assembly.system_message
 
     iteration_count = 0
     continue_execution = True
+    state_reader = IterationStateReader(thread_id, account_id, client, trace=trace)
 
     latest_user_message = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'user').order('created_at', desc=True).limit(1).execute()
     if latest_user_message.data and len(latest_user_message.data) > 0:
@@ -298,11 +210,13 @@ async def run_agent(
     while continue_execution and iteration_count < max_iterations:
         iteration_count += 1
         logger.info(f"🔄 Running iteration {iteration_count} of {max_iterations}...")
+        run_profiler.start_iteration()
 
-        # Billing check on each iteration - still needed within the iterations
-        can_run, message, subscription = await check_billing_status(client, account_id)
-        if not can_run:
-            error_msg = f"Billing limit reached: {message}"
+        # Billing, last message, browser state and image context in one round trip
+        with run_profiler.phase(run_profiler.STATE):
+            state = await state_reader.read()
+        if not state.can_run:
+            error_msg = f"Billing limit reached: {state.billing_message}"
             trace.event(name="billing_limit_reached", level="ERROR", status_message=(f"{error_msg}"))
             # Yield a special message to indicate billing limit reached
             yield {
@@ -311,92 +225,15 @@ async def run_agent(
                 "message": error_msg
             }
             break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get('type')
-            if message_type == 'assistant':
-                logger.info(f"Last message was from assistant, stopping execution")
-                trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
-                continue_execution = False
-                break
+        if state.latest_message_type == 'assistant':
+            logger.info(f"Last message was from assistant, stopping execution")
+            trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
+            continue_execution = False
+            break
 
         # ---- Temporary Message Handling (Browser State & Image Context) ----
         temporary_message = None
-        temp_message_content_list = [] # List to hold text/image blocks
-
-        # Get the latest browser_state message
-        latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
-            try:
-                browser_content = latest_browser_state_msg.data[0]["content"]
-                if isinstance(browser_content, str):
-                    browser_content = json.loads(browser_content)
-                screenshot_base64 = browser_content.get("screenshot_base64")
-                screenshot_url = browser_content.get("image_url")
-                
-                # Create a copy of the browser state without screenshot data
-                browser_state_text = browser_content.copy()
-                browser_state_text.pop('screenshot_base64', None)
-                browser_state_text.pop('image_url', None)
-
-                if browser_state_text:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
-                    })
-                    
-                # Prioritize screenshot_url if available
-                if screenshot_url:
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": screenshot_url,
-                            "format": "image/jpeg"
-                        }
-                    })
-                elif screenshot_base64:
-                    # Fallback to base64 if URL not available
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{screenshot_base64}",
-                        }
-                    })
-                else:
-                    logger.warning("Browser state found but no screenshot data.")
-
-            except Exception as e:
-                logger.error(f"Error parsing browser state: {e}")
-                trace.event(name="error_parsing_browser_state", level="ERROR", status_message=(f"{e}"))
-
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
-            try:
-                image_context_content = latest_image_context_msg.data[0]["content"] if isinstance(latest_image_context_msg.data[0]["content"], dict) else json.loads(latest_image_context_msg.data[0]["content"])
-                base64_image = image_context_content.get("base64")
-                mime_type = image_context_content.get("mime_type")
-                file_path = image_context_content.get("file_path", "unknown file")
-
-                if base64_image and mime_type:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"Here is the image you requested to see: '{file_path}'"
-                    })
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}",
-                        }
-                    })
-                else:
-                    logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
-
-                await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
-            except Exception as e:
-                logger.error(f"Error parsing image context: {e}")
-                trace.event(name="error_parsing_image_context", level="ERROR", status_message=(f"{e}"))
+        temp_message_content_list = state.temporary_content # List to hold text/image blocks
 
         # If we have any content, construct the temporary_message
         if temp_message_content_list:
@@ -433,11 +270,12 @@ async def run_agent(
                     xml_adding_strategy="user_message"
                 ),
                 native_max_auto_continues=native_max_auto_continues,
-                include_xml_examples=True,
+                include_xml_examples=False,  # Already part of the assembled system prompt
                 enable_thinking=enable_thinking,
                 reasoning_effort=reasoning_effort,
                 enable_context_manager=enable_context_manager,
-                generation=generation
+                generation=generation,
+                system_prompt_tokens=prompt_assembly.token_count
             )
 
             if isinstance(response, dict) and "status" in response and response["status"] == "error":
@@ -565,7 +403,9 @@ async def run_agent(
             break
         generation.end(output=full_response)
 
-    langfuse.flush() # Flush Langfuse events at the end of the run
+    logger.debug(f"Iteration state reads for thread {thread_id}: {state_reader.get_stats()}")
+    if owns_trace:
+        trace.close()
   
 
 
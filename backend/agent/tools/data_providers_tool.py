@@ -7,6 +7,7 @@ from agent.tools.data_providers.YahooFinanceProvider import YahooFinanceProvider
 from agent.tools.data_providers.AmazonProvider import AmazonProvider
 from agent.tools.data_providers.ZillowProvider import ZillowProvider
 from agent.tools.data_providers.TwitterProvider import TwitterProvider
+from services.circuit_breaker import circuit_breakers
 
 class DataProvidersTool(Tool):
     """Tool for making requests to various data providers."""
@@ -176,7 +177,8 @@ Use this tool when you need to discover what endpoints are available.
                 return self.fail_response(f"Endpoint '{route}' not found in {service_name} data provider.")
             
             
-            result = data_provider.call_endpoint(route, payload)
+            async with circuit_breakers.guard(f"data_provider:{service_name}"):
+                result = data_provider.call_endpoint(route, payload)
             return self.success_response(result)
             
         except Exception as e:
@@ -9,6 +9,7 @@ import json
 from typing import Any, Dict, List, Optional
 from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, ToolSchema, SchemaType
 from mcp_local.client import MCPManager
+from services.circuit_breaker import circuit_breakers, endpoint_breaker_name
 from utils.logger import logger
 import inspect
 from mcp import ClientSession
@@ -27,15 +28,17 @@ class MCPToolWrapper(Tool):
     through the same underlying implementation.
     """
     
-    def __init__(self, mcp_configs: Optional[List[Dict[str, Any]]] = None):
+    def __init__(self, mcp_configs: Optional[List[Dict[str, Any]]] = None, account_id: Optional[str] = None):
         """
         Initialize the MCP tool wrapper.
         
         Args:
             mcp_configs: List of MCP configurations from agent's configured_mcps
+            account_id: Account running the agent, which owns the servers' circuit breakers
         """
         # Don't call super().__init__() yet - we need to set up dynamic methods first
-        self.mcp_manager = MCPManager()
+        self.account_id = account_id
+        self.mcp_manager = MCPManager(account_id)
         self.mcp_configs = mcp_configs or []
         self._initialized = False
         self._dynamic_tools = {}
@@ -496,52 +499,29 @@ class MCPToolWrapper(Tool):
     async def _execute_custom_mcp_tool(self, tool_name: str, arguments: Dict[str, Any], tool_info: Dict[str, Any]) -> ToolResult:
         """Execute a custom MCP tool call."""
         try:
-            custom_type = tool_info['custom_type']
-            custom_config = tool_info['custom_config']
-            original_tool_name = tool_info['original_name']
+            # The server name is chosen by the user; the breaker is keyed by the endpoint itself
+            breaker_name = endpoint_breaker_name(
+                "mcp", tool_info['server'], self.account_id,
+                {"type": tool_info['custom_type'], "config": tool_info['custom_config']},
+            )
+            async with circuit_breakers.guard(breaker_name):
+                custom_type = tool_info['custom_type']
+                custom_config = tool_info['custom_config']
+                original_tool_name = tool_info['original_name']
             
-            if custom_type == 'sse':
-                # Execute SSE-based custom MCP using the same pattern as _connect_sse_server
-                url = custom_config['url']
-                headers = custom_config.get('headers', {})
+                if custom_type == 'sse':
+                    # Execute SSE-based custom MCP using the same pattern as _connect_sse_server
+                    url = custom_config['url']
+                    headers = custom_config.get('headers', {})
                 
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    try:
-                        # Try with headers first (same pattern as _connect_sse_server)
-                        async with sse_client(url, headers=headers) as (read, write):
-                            async with ClientSession(read, write) as session:
-                                await session.initialize()
-                                result = await session.call_tool(original_tool_name, arguments)
-                                
-                                # Handle the result properly
-                                if hasattr(result, 'content'):
-                                    content = result.content
-                                    if isinstance(content, list):
-                                        # Extract text from content list
-                                        text_parts = []
-                                        for item in content:
-                                            if hasattr(item, 'text'):
-                                                text_parts.append(item.text)
-                                            else:
-                                                text_parts.append(str(item))
-                                        content_str = "\n".join(text_parts)
-                                    elif hasattr(content, 'text'):
-                                        content_str = content.text
-                                    else:
-                                        content_str = str(content)
-                                    
-                                    return self.success_response(content_str)
-                                else:
-                                    return self.success_response(str(result))
-                                    
-                    except TypeError as e:
-                        if "unexpected keyword argument" in str(e):
-                            # Fallback: try without headers (exact pattern from _connect_sse_server)
-                            async with sse_client(url) as (read, write):
+                    async with asyncio.timeout(30):  # 30 second timeout for tool execution
+                        try:
+                            # Try with headers first (same pattern as _connect_sse_server)
+                            async with sse_client(url, headers=headers) as (read, write):
                                 async with ClientSession(read, write) as session:
                                     await session.initialize()
                                     result = await session.call_tool(original_tool_name, arguments)
-                                    
+                                
                                     # Handle the result properly
                                     if hasattr(result, 'content'):
                                         content = result.content
@@ -558,80 +538,109 @@ class MCPToolWrapper(Tool):
                                             content_str = content.text
                                         else:
                                             content_str = str(content)
-                                        
+                                    
                                         return self.success_response(content_str)
                                     else:
                                         return self.success_response(str(result))
-                        else:
-                            raise
+                                    
+                        except TypeError as e:
+                            if "unexpected keyword argument" in str(e):
+                                # Fallback: try without headers (exact pattern from _connect_sse_server)
+                                async with sse_client(url) as (read, write):
+                                    async with ClientSession(read, write) as session:
+                                        await session.initialize()
+                                        result = await session.call_tool(original_tool_name, arguments)
+                                    
+                                        # Handle the result properly
+                                        if hasattr(result, 'content'):
+                                            content = result.content
+                                            if isinstance(content, list):
+                                                # Extract text from content list
+                                                text_parts = []
+                                                for item in content:
+                                                    if hasattr(item, 'text'):
+                                                        text_parts.append(item.text)
+                                                    else:
+                                                        text_parts.append(str(item))
+                                                content_str = "\n".join(text_parts)
+                                            elif hasattr(content, 'text'):
+                                                content_str = content.text
+                                            else:
+                                                content_str = str(content)
+                                        
+                                            return self.success_response(content_str)
+                                        else:
+                                            return self.success_response(str(result))
+                            else:
+                                raise
             
-            elif custom_type == 'http':
-                # Execute HTTP-based custom MCP
-                url = custom_config['url']
+                elif custom_type == 'http':
+                    # Execute HTTP-based custom MCP
+                    url = custom_config['url']
                 
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    async with streamablehttp_client(url) as (read, write, _):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            result = await session.call_tool(original_tool_name, arguments)
+                    async with asyncio.timeout(30):  # 30 second timeout for tool execution
+                        async with streamablehttp_client(url) as (read, write, _):
+                            async with ClientSession(read, write) as session:
+                                await session.initialize()
+                                result = await session.call_tool(original_tool_name, arguments)
                             
-                            # Handle the result properly
-                            if hasattr(result, 'content'):
-                                content = result.content
-                                if isinstance(content, list):
-                                    # Extract text from content list
-                                    text_parts = []
-                                    for item in content:
-                                        if hasattr(item, 'text'):
-                                            text_parts.append(item.text)
-                                        else:
-                                            text_parts.append(str(item))
-                                    content_str = "\n".join(text_parts)
-                                elif hasattr(content, 'text'):
-                                    content_str = content.text
-                                else:
-                                    content_str = str(content)
+                                # Handle the result properly
+                                if hasattr(result, 'content'):
+                                    content = result.content
+                                    if isinstance(content, list):
+                                        # Extract text from content list
+                                        text_parts = []
+                                        for item in content:
+                                            if hasattr(item, 'text'):
+                                                text_parts.append(item.text)
+                                            else:
+                                                text_parts.append(str(item))
+                                        content_str = "\n".join(text_parts)
+                                    elif hasattr(content, 'text'):
+                                        content_str = content.text
+                                    else:
+                                        content_str = str(content)
                                 
-                                return self.success_response(content_str)
-                            else:
-                                return self.success_response(str(result))
+                                    return self.success_response(content_str)
+                                else:
+                                    return self.success_response(str(result))
                                 
-            elif custom_type == 'json':
-                # Execute stdio-based custom MCP using the same pattern as _connect_stdio_server
-                server_params = StdioServerParameters(
-                    command=custom_config["command"],
-                    args=custom_config.get("args", []),
-                    env=custom_config.get("env", {})
-                )
+                elif custom_type == 'json':
+                    # Execute stdio-based custom MCP using the same pattern as _connect_stdio_server
+                    server_params = StdioServerParameters(
+                        command=custom_config["command"],
+                        args=custom_config.get("args", []),
+                        env=custom_config.get("env", {})
+                    )
                 
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    async with stdio_client(server_params) as (read, write):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            result = await session.call_tool(original_tool_name, arguments)
+                    async with asyncio.timeout(30):  # 30 second timeout for tool execution
+                        async with stdio_client(server_params) as (read, write):
+                            async with ClientSession(read, write) as session:
+                                await session.initialize()
+                                result = await session.call_tool(original_tool_name, arguments)
                             
-                            # Handle the result properly
-                            if hasattr(result, 'content'):
-                                content = result.content
-                                if isinstance(content, list):
-                                    # Extract text from content list
-                                    text_parts = []
-                                    for item in content:
-                                        if hasattr(item, 'text'):
-                                            text_parts.append(item.text)
-                                        else:
-                                            text_parts.append(str(item))
-                                    content_str = "\n".join(text_parts)
-                                elif hasattr(content, 'text'):
-                                    content_str = content.text
-                                else:
-                                    content_str = str(content)
+                                # Handle the result properly
+                                if hasattr(result, 'content'):
+                                    content = result.content
+                                    if isinstance(content, list):
+                                        # Extract text from content list
+                                        text_parts = []
+                                        for item in content:
+                                            if hasattr(item, 'text'):
+                                                text_parts.append(item.text)
+                                            else:
+                                                text_parts.append(str(item))
+                                        content_str = "\n".join(text_parts)
+                                    elif hasattr(content, 'text'):
+                                        content_str = content.text
+                                    else:
+                                        content_str = str(content)
                                 
-                                return self.success_response(content_str)
-                            else:
-                                return self.success_response(str(result))
-            else:
-                return self.fail_response(f"Unsupported custom MCP type: {custom_type}")
+                                    return self.success_response(content_str)
+                                else:
+                                    return self.success_response(str(result))
+                else:
+                    return self.fail_response(f"Unsupported custom MCP type: {custom_type}")
                                 
         except asyncio.TimeoutError:
             return self.fail_response(f"Tool execution timeout for {tool_name}")
@@ -5,6 +5,9 @@ from agentpress.thread_manager import ThreadManager
 from utils.logger import logger
 import os
 
+# Files larger than this are reported in the workspace state without their content
+MAX_STATE_FILE_SIZE = 1024 * 1024
+
 class SandboxFilesTool(SandboxToolsBase):
     """Tool for executing file system operations in a Daytona sandbox. All operations are performed relative to the /workspace directory."""
 
@@ -46,7 +49,10 @@ class SandboxFilesTool(SandboxToolsBase):
 
                 try:
                     full_path = f"{self.workspace_path}/{rel_path}"
-                    content = self.sandbox.fs.download_file(full_path).decode()
+                    if file_info.size > MAX_STATE_FILE_SIZE:
+                        content = None
+                    else:
+                        content = self.sandbox.fs.download_file(full_path).decode()
                     files_state[rel_path] = {
                         "content": content,
                         "is_dir": file_info.is_dir,
@@ -9,6 +9,7 @@ import json
 from typing import List, Dict, Any, Optional
 
 from litellm import token_counter, completion_cost
+from agentpress.token_usage import message_token_cache
 from services.database import DBConnection
 from services.llm import make_llm_api_call
 from utils.logger import logger
@@ -49,9 +50,10 @@ class ContextManager:
                 logger.debug(f"No messages found for thread {thread_id}")
                 return 0
             
-            # Use litellm's token_counter for accurate model-specific counting
+            # Use litellm's token_counter for accurate model-specific counting,
+            # through the per-message cache so unchanged messages are not recounted
             # This is much more accurate than the SQL-based estimation
-            token_count = token_counter(model="gpt-4", messages=messages)
+            token_count = message_token_cache.count(messages, "gpt-4")
             
             logger.info(f"Thread {thread_id} has {token_count} tokens (calculated with litellm)")
             return token_count
@@ -193,7 +195,8 @@ THE CONVERSATION HISTORY TO SUMMARIZE IS AS FOLLOWS:
                 messages=[system_message, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}],
                 temperature=0,
                 max_tokens=SUMMARY_TARGET_TOKENS,
-                stream=False
+                stream=False,
+                cache=True
             )
             
             if response and hasattr(response, 'choices') and response.choices:
@@ -12,20 +12,23 @@ import json
 import re
 import uuid
 import asyncio
+import time
 from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple, Union, Callable, Literal
 from dataclasses import dataclass
 from utils.logger import logger
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
+from agentpress.tool_scheduler import ToolScheduler
 from agentpress.xml_tool_parser import XMLToolParser
-from langfuse.client import StatefulTraceClient
-from services.langfuse import langfuse
+from services.langfuse import Trace, langfuse
+from services.prometheus import TOOL_DURATION
+from utils import run_profiler
 from agentpress.utils.json_helpers import (
     ensure_dict, ensure_list, safe_json_parse, 
     to_json_string, format_for_yield
 )
-from litellm import token_counter
+from agentpress.token_usage import StreamingTokenCounter, current_usage, message_token_cache, record_usage
 
 # Type alias for XML result adding strategy
 XmlAddingStrategy = Literal["user_message", "assistant_message", "inline_edit"]
@@ -86,7 +89,7 @@ class ProcessorConfig:
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
-    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
+    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[Trace] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
         """Initialize the ResponseProcessor.
         
         Args:
@@ -101,6 +104,8 @@ class ResponseProcessor:
             self.trace = langfuse.trace(name="anonymous:response_processor")
         # Initialize the XML parser with backwards compatibility
         self.xml_parser = XMLToolParser(strict_mode=False)
+        # Admission control and ordering for tool executions
+        self.tool_scheduler = ToolScheduler()
         self.is_agent_builder = is_agent_builder
         self.target_agent_id = target_agent_id
 
@@ -146,6 +151,7 @@ class ResponseProcessor:
         has_printed_thinking_prefix = False # Flag for printing thinking prefix only once
         agent_should_terminate = False # Flag to track if a terminating tool has been executed
         complete_native_tool_calls = [] # Initialize early for use in assistant_response_end
+        completion_counter = StreamingTokenCounter(llm_model) # Completion tokens, in case the provider reports no usage
 
         # Collect metadata for reconstructing LiteLLM response object
         streaming_metadata = {
@@ -185,7 +191,7 @@ class ResponseProcessor:
 
             __sequence = 0
 
-            async for chunk in llm_response:
+            async for chunk in run_profiler.timed_stream(llm_response):
                 # Extract streaming metadata from chunks
                 current_time = datetime.now(timezone.utc).timestamp()
                 if streaming_metadata["first_chunk_time"] is None:
@@ -221,12 +227,14 @@ class ResponseProcessor:
                         # print(delta.reasoning_content, end='', flush=True)
                         # Append reasoning to main content to be saved in the final message
                         accumulated_content += delta.reasoning_content
+                        completion_counter.add(delta.reasoning_content)
 
                     # Process content chunk
                     if delta and hasattr(delta, 'content') and delta.content:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
+                        completion_counter.add(chunk_content)
                         current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
@@ -247,11 +255,13 @@ class ResponseProcessor:
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
+                            with run_profiler.phase(run_profiler.XML_PARSE):
+                                xml_chunks = self._extract_xml_chunks(current_xml_content)
                             for xml_chunk in xml_chunks:
                                 current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
                                 xml_chunks_buffer.append(xml_chunk)
-                                result = self._parse_xml_tool_call(xml_chunk)
+                                with run_profiler.phase(run_profiler.XML_PARSE):
+                                    result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
                                     tool_call, parsing_details = result
                                     xml_tool_call_count += 1
@@ -266,7 +276,7 @@ class ResponseProcessor:
                                         if started_msg_obj: yield format_for_yield(started_msg_obj)
                                         yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                        execution_task = asyncio.create_task(self._execute_tool(tool_call))
+                                        execution_task = self.tool_scheduler.submit(tool_call, self._execute_tool)
                                         pending_tool_executions.append({
                                             "task": execution_task, "tool_call": tool_call,
                                             "tool_index": tool_index, "context": context
@@ -336,7 +346,7 @@ class ResponseProcessor:
                                 if started_msg_obj: yield format_for_yield(started_msg_obj)
                                 yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                execution_task = asyncio.create_task(self._execute_tool(tool_call_data))
+                                execution_task = self.tool_scheduler.submit(tool_call_data, self._execute_tool)
                                 pending_tool_executions.append({
                                     "task": execution_task, "tool_call": tool_call_data,
                                     "tool_index": tool_index, "context": context
@@ -352,23 +362,16 @@ class ResponseProcessor:
 
             # --- After Streaming Loop ---
             
-            if (
-                streaming_metadata["usage"]["total_tokens"] == 0
-            ):
-                logger.info("🔥 No usage data from provider, counting with litellm.token_counter")
+            usage_counted = streaming_metadata["usage"]["total_tokens"] == 0
+            if usage_counted:
+                logger.info("🔥 No usage data from provider, counting tokens incrementally")
                 
                 try:
-                    # prompt side
-                    prompt_tokens = token_counter(
-                        model=llm_model,
-                        messages=prompt_messages               # chat or plain; token_counter handles both
-                    )
+                    # prompt side: cached per-message counts
+                    prompt_tokens = message_token_cache.count(prompt_messages, llm_model)
 
-                    # completion side
-                    completion_tokens = token_counter(
-                        model=llm_model,
-                        text=accumulated_content or ""         # empty string safe
-                    )
+                    # completion side: counted while streaming
+                    completion_tokens = completion_counter.total()
 
                     streaming_metadata["usage"]["prompt_tokens"]      = prompt_tokens
                     streaming_metadata["usage"]["completion_tokens"]  = completion_tokens
@@ -383,6 +386,8 @@ class ResponseProcessor:
                     logger.warning(f"Failed to calculate usage: {str(e)}")
                     self.trace.event(name="failed_to_calculate_usage", level="WARNING", status_message=(f"Failed to calculate usage: {str(e)}"))
 
+            record_usage(llm_model, streaming_metadata["usage"]["prompt_tokens"],
+                         streaming_metadata["usage"]["completion_tokens"], counted=usage_counted)
 
             # Wait for pending tool executions from streaming phase
             tool_results_buffer = [] # Stores (tool_call, result, tool_index, context)
@@ -391,7 +396,8 @@ class ResponseProcessor:
                 self.trace.event(name="waiting_for_pending_streamed_tool_executions", level="DEFAULT", status_message=(f"Waiting for {len(pending_tool_executions)} pending streamed tool executions"))
                 # ... (asyncio.wait logic) ...
                 pending_tasks = [execution["task"] for execution in pending_tool_executions]
-                done, _ = await asyncio.wait(pending_tasks)
+                with run_profiler.phase(run_profiler.TOOL_WAIT):
+                    done, _ = await asyncio.wait(pending_tasks)
 
                 for execution in pending_tool_executions:
                     tool_idx = execution.get("tool_index", -1)
@@ -532,14 +538,16 @@ class ResponseProcessor:
                 parsed_xml_data = []
                 if config.xml_tool_calling:
                     # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
+                    with run_profiler.phase(run_profiler.XML_PARSE):
+                        xml_chunks = self._extract_xml_chunks(current_xml_content)
                     xml_chunks_buffer.extend(xml_chunks)
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
 
                     for chunk in xml_chunks_to_process:
-                         parsed_result = self._parse_xml_tool_call(chunk)
+                         with run_profiler.phase(run_profiler.XML_PARSE):
+                             parsed_result = self._parse_xml_tool_call(chunk)
                          if parsed_result:
                              tool_call, parsing_details = parsed_result
                              # Avoid adding if already processed during streaming
@@ -583,7 +591,8 @@ class ResponseProcessor:
                 elif final_tool_calls_to_process and not config.execute_on_stream:
                     logger.info(f"Executing {len(final_tool_calls_to_process)} tools ({config.tool_execution_strategy}) after stream")
                     self.trace.event(name="executing_tools_after_stream", level="DEFAULT", status_message=(f"Executing {len(final_tool_calls_to_process)} tools ({config.tool_execution_strategy}) after stream"))
-                    results_list = await self._execute_tools(final_tool_calls_to_process, config.tool_execution_strategy)
+                    with run_profiler.phase(run_profiler.TOOL_WAIT):
+                        results_list = await self._execute_tools(final_tool_calls_to_process, config.tool_execution_strategy)
                     current_tool_idx = 0
                     for tc, res in results_list:
                        # Map back using all_tool_data_map which has correct indices
@@ -784,6 +793,9 @@ class ResponseProcessor:
             raise # Use bare 'raise' to preserve the original exception with its traceback
 
         finally:
+            # Stop any tool executions still scheduled when the run is stopped or fails
+            self.tool_scheduler.cancel_all()
+
             # Save and Yield the final thread_run_end status
             try:
                 end_content = {"status_type": "thread_run_end"}
@@ -845,7 +857,8 @@ class ResponseProcessor:
                      if hasattr(response_message, 'content') and response_message.content:
                          content = response_message.content
                          if config.xml_tool_calling:
-                             parsed_xml_data = self._parse_xml_tool_calls(content)
+                             with run_profiler.phase(run_profiler.XML_PARSE):
+                                 parsed_xml_data = self._parse_xml_tool_calls(content)
                              if config.max_xml_tool_calls > 0 and len(parsed_xml_data) > config.max_xml_tool_calls:
                                  # Truncate content and tool data if limit exceeded
                                  # ... (Truncation logic similar to streaming) ...
@@ -877,6 +890,16 @@ class ResponseProcessor:
                                  })
 
 
+            # Usage as reported by the provider, counted if it reported none
+            usage = getattr(llm_response, 'usage', None)
+            if usage and getattr(usage, 'total_tokens', None):
+                record_usage(llm_model, usage.prompt_tokens, usage.completion_tokens)
+            elif current_usage() is not None:
+                completion_counter = StreamingTokenCounter(llm_model)
+                completion_counter.add(content)
+                record_usage(llm_model, message_token_cache.count(prompt_messages, llm_model),
+                             completion_counter.total(), counted=True)
+
             # --- SAVE and YIELD Final Assistant Message ---
             message_data = {"role": "assistant", "content": content, "tool_calls": native_tool_calls_for_message or None}
             assistant_message_object = await self.add_message(
@@ -900,7 +923,8 @@ class ResponseProcessor:
             if config.execute_tools and tool_calls_to_execute:
                 logger.info(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}")
                 self.trace.event(name="executing_tools_with_strategy", level="DEFAULT", status_message=(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}"))
-                tool_results = await self._execute_tools(tool_calls_to_execute, config.tool_execution_strategy)
+                with run_profiler.phase(run_profiler.TOOL_WAIT):
+                    tool_results = await self._execute_tools(tool_calls_to_execute, config.tool_execution_strategy)
 
                 for i, (returned_tool_call, result) in enumerate(tool_results):
                     original_data = all_tool_data[i]
@@ -983,6 +1007,9 @@ class ResponseProcessor:
              raise # Use bare 'raise' to preserve the original exception with its traceback
 
         finally:
+            # Stop any tool executions still scheduled when the run is stopped or fails
+            self.tool_scheduler.cancel_all()
+
              # Save and Yield the final thread_run_end status
             end_content = {"status_type": "thread_run_end"}
             end_msg_obj = await self.add_message(
@@ -1317,6 +1344,7 @@ class ResponseProcessor:
     async def _execute_tool(self, tool_call: Dict[str, Any]) -> ToolResult:
         """Execute a single tool call and return the result."""
         span = self.trace.span(name=f"execute_tool.{tool_call['function_name']}", input=tool_call["arguments"])            
+        started = time.perf_counter()
         try:
             function_name = tool_call["function_name"]
             arguments = tool_call["arguments"]
@@ -1330,23 +1358,26 @@ class ResponseProcessor:
                 except json.JSONDecodeError:
                     arguments = {"text": arguments}
             
-            # Get available functions from tool registry
-            available_functions = self.tool_registry.get_available_functions()
-            
-            # Look up the function by name
-            tool_fn = available_functions.get(function_name)
+            # Look up the function in the registry's frozen dispatch table
+            tool_fn = self.tool_registry.get_function(function_name)
             if not tool_fn:
                 logger.error(f"Tool function '{function_name}' not found in registry")
                 span.end(status_message="tool_not_found", level="ERROR")
+                # Names the model made up would add a label value each
+                TOOL_DURATION.labels(tool="unknown", status="not_found").observe(time.perf_counter() - started)
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
             
             logger.debug(f"Found tool function for '{function_name}', executing...")
-            result = await tool_fn(**arguments)
+            with run_profiler.tool_span(function_name):
+                result = await tool_fn(**arguments)
             logger.info(f"Tool execution complete: {function_name} -> {result}")
             span.end(status_message="tool_executed", output=result)
+            status = "success" if getattr(result, "success", True) else "failure"
+            TOOL_DURATION.labels(tool=function_name, status=status).observe(time.perf_counter() - started)
             return result
         except Exception as e:
             logger.error(f"Error executing tool {tool_call['function_name']}: {str(e)}", exc_info=True)
+            TOOL_DURATION.labels(tool=tool_call['function_name'], status="error").observe(time.perf_counter() - started)
             span.end(status_message="tool_execution_error", output=f"Error executing tool: {str(e)}", level="ERROR")
             return ToolResult(success=False, output=f"Error executing tool: {str(e)}")
 
@@ -1441,8 +1472,9 @@ class ResponseProcessor:
     async def _execute_tools_in_parallel(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
         """Execute tool calls in parallel and return results.
         
-        This method executes all tool calls simultaneously using asyncio.gather, which
-        can significantly improve performance when executing multiple independent tools.
+        Calls are handed to the tool scheduler, which runs independent tools
+        concurrently up to its concurrency limits and keeps calls that touch the
+        same resource (shell session, file, browser) in their original order.
         
         Args:
             tool_calls: List of tool calls to execute
@@ -1458,11 +1490,8 @@ class ResponseProcessor:
             logger.info(f"Executing {len(tool_calls)} tools in parallel: {tool_names}")
             self.trace.event(name="executing_tools_in_parallel", level="DEFAULT", status_message=(f"Executing {len(tool_calls)} tools in parallel: {tool_names}"))
             
-            # Create tasks for all tool calls
-            tasks = [self._execute_tool(tool_call) for tool_call in tool_calls]
-            
-            # Execute all tasks concurrently with error handling
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            # Execute all tool calls through the scheduler, exceptions are returned in place
+            results = await self.tool_scheduler.run_all(tool_calls, self._execute_tool)
             
             # Process results and handle any exceptions
             processed_results = []
@@ -1483,7 +1512,7 @@ class ResponseProcessor:
         except Exception as e:
             logger.error(f"Error in parallel tool execution: {str(e)}", exc_info=True)
             self.trace.event(name="error_in_parallel_tool_execution", level="ERROR", status_message=(f"Error in parallel tool execution: {str(e)}"))
-            # Return error results for all tools if the gather itself fails
+            # Return error results for all tools if scheduling itself fails
             return [(tool_call, ToolResult(success=False, output=f"Execution error: {str(e)}")) 
                     for tool_call in tool_calls]
 
@@ -13,6 +13,7 @@ This module provides comprehensive conversation management, including:
 import json
 from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
 from services.llm import make_llm_api_call
+from services.prompt_cache import get_cache_planner
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
 from agentpress.context_manager import ContextManager
@@ -22,10 +23,10 @@ from agentpress.response_processor import (
 )
 from services.database import DBConnection
 from utils.logger import logger
-from langfuse.client import StatefulGenerationClient, StatefulTraceClient
-from services.langfuse import langfuse
+from utils import run_profiler
+from services.langfuse import Observation, Trace, langfuse
 import datetime
-from litellm import token_counter
+from agentpress.token_usage import message_token_cache
 
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
@@ -38,7 +39,7 @@ class ThreadManager:
     XML-based tool execution patterns.
     """
 
-    def __init__(self, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
+    def __init__(self, trace: Optional[Trace] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
         """Initialize ThreadManager.
 
         Args:
@@ -61,6 +62,7 @@ class ThreadManager:
             target_agent_id=self.target_agent_id
         )
         self.context_manager = ContextManager()
+        self._xml_examples_prompt: Optional[tuple] = None
 
     def _is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         if not ("content" in msg and msg['content']):
@@ -105,14 +107,14 @@ class ThreadManager:
   
     def _compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
         """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = message_token_cache.count(messages, llm_model)
 
         if uncompressed_total_token_count > (max_tokens or (64 * 1000)):
             _i = 0 # Count the number of ToolResult messages
             for msg in reversed(messages): # Start from the end and work backwards
                 if self._is_tool_result_message(msg): # Only compress ToolResult messages
                     _i += 1 # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                    msg_token_count = message_token_cache.count([msg]) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
                         if _i > 1: # If this is not the most recent ToolResult message
                             message_id = msg.get('message_id') # Get the message_id
@@ -126,14 +128,14 @@ class ThreadManager:
 
     def _compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = message_token_cache.count(messages, llm_model)
 
         if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
             _i = 0 # Count the number of User messages
             for msg in reversed(messages): # Start from the end and work backwards
                 if msg.get('role') == 'user': # Only compress User messages
                     _i += 1 # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                    msg_token_count = message_token_cache.count([msg]) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
                         if _i > 1: # If this is not the most recent User message
                             message_id = msg.get('message_id') # Get the message_id
@@ -147,13 +149,13 @@ class ThreadManager:
 
     def _compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = message_token_cache.count(messages, llm_model)
         if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
             _i = 0 # Count the number of Assistant messages
             for msg in reversed(messages): # Start from the end and work backwards
                 if msg.get('role') == 'assistant': # Only compress Assistant messages
                     _i += 1 # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                    msg_token_count = message_token_cache.count([msg]) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
                         if _i > 1: # If this is not the most recent Assistant message
                             message_id = msg.get('message_id') # Get the message_id
@@ -188,13 +190,13 @@ class ThreadManager:
 
         result = messages
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = message_token_cache.count(messages, llm_model)
 
         result = self._compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
         result = self._compress_user_messages(result, llm_model, max_tokens, token_threshold)
         result = self._compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        compressed_token_count = message_token_cache.count(result, llm_model)
 
         logger.info(f"_compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}") # Log the token compression for debugging later
 
@@ -204,6 +206,32 @@ class ThreadManager:
 
         return result
 
+    def get_xml_examples_prompt(self) -> str:
+        """Render the XML tool examples block, reusing it until the tool set changes."""
+        registry_version = self.tool_registry.version
+        if self._xml_examples_prompt and self._xml_examples_prompt[0] == registry_version:
+            return self._xml_examples_prompt[1]
+
+        examples_content = ""
+        xml_examples = self.tool_registry.get_xml_examples()
+        if xml_examples:
+            examples_content = """
+--- XML TOOL CALLING ---
+
+In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
+Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
+String and scalar parameters should be specified as attributes, while content goes between tags.
+Note that spaces for string values are not stripped. The output is parsed with regular expressions.
+
+Here are the XML tools available with examples:
+"""
+            examples_content += "".join(
+                f"<{tag_name}> Example: {example}\\n" for tag_name, example in xml_examples.items()
+            )
+
+        self._xml_examples_prompt = (registry_version, examples_content)
+        return examples_content
+
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
         self.tool_registry.register_tool(tool_class, function_names, **kwargs)
@@ -242,7 +270,8 @@ class ThreadManager:
 
         try:
             # Add returning='representation' to get the inserted row data including the id
-            result = await client.table('messages').insert(data_to_insert, returning='representation').execute()
+            with run_profiler.phase(run_profiler.DB_WRITE):
+                result = await client.table('messages').insert(data_to_insert, returning='representation').execute()
             logger.info(f"Successfully added message to thread {thread_id}")
 
             if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
@@ -315,7 +344,8 @@ class ThreadManager:
         enable_thinking: Optional[bool] = False,
         reasoning_effort: Optional[str] = 'low',
         enable_context_manager: bool = True,
-        generation: Optional[StatefulGenerationClient] = None,
+        generation: Optional[Observation] = None,
+        system_prompt_tokens: Optional[int] = None,
     ) -> Union[Dict[str, Any], AsyncGenerator]:
         """Run a conversation thread with LLM integration and tool execution.
 
@@ -336,6 +366,8 @@ class ThreadManager:
             enable_thinking: Whether to enable thinking before making a decision
             reasoning_effort: The effort level for reasoning
             enable_context_manager: Whether to enable automatic context summarization.
+            system_prompt_tokens: Precomputed token count of the final system prompt
+                                  (including XML examples), saves recounting it every iteration.
 
         Returns:
             An async generator yielding response chunks or error dict
@@ -359,29 +391,8 @@ class ThreadManager:
 
         # Add XML examples to system prompt if requested, do this only ONCE before the loop
         if include_xml_examples and processor_config.xml_tool_calling:
-            xml_examples = self.tool_registry.get_xml_examples()
-            if xml_examples:
-                examples_content = """
---- XML TOOL CALLING ---
-
-In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
-Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
-String and scalar parameters should be specified as attributes, while content goes between tags.
-Note that spaces for string values are not stripped. The output is parsed with regular expressions.
-
-Here are the XML tools available with examples:
-"""
-                for tag_name, example in xml_examples.items():
-                    examples_content += f"<{tag_name}> Example: {example}\\n"
-
-                # # Save examples content to a file
-                # try:
-                #     with open('xml_examples.txt', 'w') as f:
-                #         f.write(examples_content)
-                #     logger.debug("Saved XML examples to xml_examples.txt")
-                # except Exception as e:
-                #     logger.error(f"Failed to save XML examples to file: {e}")
-
+            examples_content = self.get_xml_examples_prompt()
+            if examples_content:
                 system_content = working_system_prompt.get('content')
 
                 if isinstance(system_content, str):
@@ -411,37 +422,42 @@ Here are the XML tools available with examples:
                 # Note: processor_config is now guaranteed to exist due to check above
 
                 # 1. Get messages from thread for LLM call
-                messages = await self.get_llm_messages(thread_id)
+                with run_profiler.phase(run_profiler.MESSAGES):
+                    messages = await self.get_llm_messages(thread_id)
 
                 # 2. Check token count before proceeding
                 token_count = 0
-                try:
-                    # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
-                    token_threshold = self.context_manager.token_threshold
-                    logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
-
-                    # if token_count >= token_threshold and enable_context_manager:
-                    #     logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
-                    #     summarized = await self.context_manager.check_and_summarize_if_needed(
-                    #         thread_id=thread_id,
-                    #         add_message_callback=self.add_message,
-                    #         model=llm_model,
-                    #         force=True
-                    #     )
-                    #     if summarized:
-                    #         logger.info("Summarization complete, fetching updated messages with summary")
-                    #         messages = await self.get_llm_messages(thread_id)
-                    #         # Recount tokens after summarization, using the modified prompt
-                    #         new_token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
-                    #         logger.info(f"After summarization: token count reduced from {token_count} to {new_token_count}")
-                    #     else:
-                    #         logger.warning("Summarization failed or wasn't needed - proceeding with original messages")
-                    # elif not enable_context_manager:
-                    #     logger.info("Automatic summarization disabled. Skipping token count check and summarization.")
+                with run_profiler.phase(run_profiler.CONTEXT):
+                    try:
+                        # Use the potentially modified working_system_prompt for token counting
+                        if system_prompt_tokens is not None:
+                            token_count = system_prompt_tokens + (message_token_cache.count(messages, llm_model) if messages else 0)
+                        else:
+                            token_count = message_token_cache.count([working_system_prompt] + messages, llm_model)
+                        token_threshold = self.context_manager.token_threshold
+                        logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
+
+                        # if token_count >= token_threshold and enable_context_manager:
+                        #     logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
+                        #     summarized = await self.context_manager.check_and_summarize_if_needed(
+                        #         thread_id=thread_id,
+                        #         add_message_callback=self.add_message,
+                        #         model=llm_model,
+                        #         force=True
+                        #     )
+                        #     if summarized:
+                        #         logger.info("Summarization complete, fetching updated messages with summary")
+                        #         messages = await self.get_llm_messages(thread_id)
+                        #         # Recount tokens after summarization, using the modified prompt
+                        #         new_token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
+                        #         logger.info(f"After summarization: token count reduced from {token_count} to {new_token_count}")
+                        #     else:
+                        #         logger.warning("Summarization failed or wasn't needed - proceeding with original messages")
+                        # elif not enable_context_manager:
+                        #     logger.info("Automatic summarization disabled. Skipping token count check and summarization.")
 
-                except Exception as e:
-                    logger.error(f"Error counting tokens or summarizing: {str(e)}")
+                    except Exception as e:
+                        logger.error(f"Error counting tokens or summarizing: {str(e)}")
 
                 # 3. Prepare messages for LLM call + add temporary message if it exists
                 # Use the working_system_prompt which may contain the XML examples
@@ -472,7 +488,8 @@ Here are the XML tools available with examples:
                     openapi_tool_schemas = self.tool_registry.get_openapi_schemas()
                     logger.debug(f"Retrieved {len(openapi_tool_schemas) if openapi_tool_schemas else 0} OpenAPI tool schemas")
 
-                prepared_messages = self._compress_messages(prepared_messages, llm_model)
+                with run_profiler.phase(run_profiler.CONTEXT):
+                    prepared_messages = self._compress_messages(prepared_messages, llm_model)
 
                 # 5. Make LLM API call
                 logger.debug("Making LLM API call")
@@ -491,17 +508,19 @@ Here are the XML tools available with examples:
                               "tools": openapi_tool_schemas,
                             }
                         )
-                    llm_response = await make_llm_api_call(
-                        prepared_messages, # Pass the potentially modified messages
-                        llm_model,
-                        temperature=llm_temperature,
-                        max_tokens=llm_max_tokens,
-                        tools=openapi_tool_schemas,
-                        tool_choice=tool_choice if processor_config.native_tool_calling else None,
-                        stream=stream,
-                        enable_thinking=enable_thinking,
-                        reasoning_effort=reasoning_effort
-                    )
+                    with run_profiler.phase(run_profiler.LLM_FIRST_TOKEN):
+                        llm_response = await make_llm_api_call(
+                            prepared_messages, # Pass the potentially modified messages
+                            llm_model,
+                            temperature=llm_temperature,
+                            max_tokens=llm_max_tokens,
+                            tools=openapi_tool_schemas,
+                            tool_choice=tool_choice if processor_config.native_tool_calling else None,
+                            stream=stream,
+                            enable_thinking=enable_thinking,
+                            reasoning_effort=reasoning_effort,
+                            cache_planner=get_cache_planner(thread_id)
+                        )
                     logger.debug("Successfully received raw LLM API response stream/object")
 
                 except Exception as e:
@@ -0,0 +1,206 @@
+"""
+Incremental token accounting for the agent loop.
+
+- ``MessageTokenCache`` counts prompts as the sum of cached per-message
+  counts. ``token_counter`` counts a message list as a fixed per-request
+  overhead plus a count per message, so only messages that are new or
+  changed (e.g. by compression) are tokenized, instead of the whole thread
+  on every count. Messages are keyed by a digest of their JSON.
+- ``StreamingTokenCounter`` counts completion tokens while the response
+  streams. Text is tokenized in pieces cut at word starts (a space after a
+  non-space, before a letter), which BPE tokens of the supported encodings
+  never span, so the sum equals the count of the whole text.
+- ``RunUsage`` is the usage ledger of an agent run: prompt and completion
+  tokens of every LLM call, reported by the provider or counted here. It is
+  kept in a context variable like the run profiler, stored with the run when
+  it ends, and recording is a no-op without an active ledger.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import litellm
+from litellm import token_counter
+
+from utils.config import config
+from utils.logger import logger
+
+# Completion text buffered before the tokenized part of it is committed
+STREAM_COUNT_MIN_CHARS = 1024
+
+# Word starts: a space after a non-space and before a letter; no token spans one
+_WORD_START = re.compile(r"(?<=\S) (?=[^\W\d_])")
+
+# Message counted twice to derive the per-request overhead of ``token_counter``
+_PROBE_MESSAGE = {"role": "user", "content": "probe"}
+
+_current: ContextVar[Optional["RunUsage"]] = ContextVar("run_usage", default=None)
+
+
+def _count_text(model: str, text: str) -> int:
+    try:
+        return len(litellm.encode(model=model, text=text))
+    except Exception:
+        # e.g. special tokens in the text, which tiktoken refuses to encode
+        return token_counter(model=model, text=text)
+
+
+class MessageTokenCache:
+    """Per-message token counts of prompts, least recently used first out."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # (model, message digest) -> tokens of the message without the request overhead
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        # model -> tokens ``token_counter`` adds once per request
+        self._overheads: Dict[str, int] = {}
+        # Worker threads run agent loops of their own
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _overhead(self, model: str) -> int:
+        overhead = self._overheads.get(model)
+        if overhead is None:
+            single = token_counter(model=model, messages=[_PROBE_MESSAGE])
+            overhead = 2 * single - token_counter(model=model, messages=[_PROBE_MESSAGE, _PROBE_MESSAGE])
+            self._overheads[model] = overhead
+        return overhead
+
+    def _message_tokens(self, model: str, message: Dict[str, Any], overhead: int) -> int:
+        digest = hashlib.blake2b(
+            json.dumps(message, sort_keys=True, default=str).encode(), digest_size=16
+        ).digest()
+        key = (model, digest)
+        with self._lock:
+            tokens = self._counts.get(key)
+            if tokens is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return tokens
+        tokens = token_counter(model=model, messages=[message]) - overhead
+        with self._lock:
+            self.misses += 1
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def count(self, messages: List[Dict[str, Any]], model: str = "") -> int:
+        """
+        Count the tokens of a prompt, as ``token_counter(model=model, messages=messages)`` does.
+
+        Args:
+            messages: Messages of the prompt
+            model: Model whose tokenizer is used
+
+        Returns:
+            int: Tokens of the prompt
+        """
+        if not messages:
+            return token_counter(model=model, messages=messages)
+        overhead = self._overhead(model)
+        return overhead + sum(self._message_tokens(model, message, overhead) for message in messages)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"entries": len(self._counts), "hits": self.hits, "misses": self.misses}
+
+
+class StreamingTokenCounter:
+    """Counts the tokens of a completion as its deltas arrive."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.committed = 0
+        self._pending = ""
+        # Position in ``_pending`` of its last word start (0 for none)
+        self._cut = 0
+
+    def add(self, text: str) -> None:
+        if not text:
+            return
+        # The word start may be the last character of the previous delta
+        scan_from = max(1, len(self._pending) - 1)
+        has_space = " " in text or self._pending.endswith(" ")
+        self._pending += text
+        if has_space:
+            for match in _WORD_START.finditer(self._pending, scan_from):
+                self._cut = match.start()
+        if len(self._pending) >= STREAM_COUNT_MIN_CHARS and self._cut:
+            self.committed += _count_text(self.model, self._pending[:self._cut])
+            self._pending = self._pending[self._cut:]
+            self._cut = 0
+
+    def total(self) -> int:
+        """Tokens of everything added so far."""
+        return self.committed + (_count_text(self.model, self._pending) if self._pending else 0)
+
+
+class RunUsage:
+    """Token usage ledger of an agent run."""
+
+    def __init__(self, run_id: Optional[str] = None):
+        self.run_id = run_id
+        self.calls = 0
+        self.counted_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # model -> {"calls", "prompt_tokens", "completion_tokens"}
+        self.by_model: Dict[str, Dict[str, int]] = {}
+
+    def activate(self) -> None:
+        """Make this the ledger of the current context (the run's task and what it starts)."""
+        _current.set(self)
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, counted: bool = False) -> None:
+        """
+        Record the usage of one LLM call.
+
+        Args:
+            model: Model that answered the call
+            prompt_tokens: Tokens of the prompt
+            completion_tokens: Tokens of the completion
+            counted: Whether the tokens were counted here instead of reported by the provider
+        """
+        self.calls += 1
+        self.counted_calls += int(counted)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        entry = self.by_model.setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        entry["calls"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "counted_calls": self.counted_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "by_model": self.by_model,
+        }
+
+
+def current_usage() -> Optional[RunUsage]:
+    return _current.get()
+
+
+def record_usage(model: str, prompt_tokens: int, completion_tokens: int, counted: bool = False) -> None:
+    """Record an LLM call's usage in the current run's ledger, if there is one."""
+    usage = _current.get()
+    if usage is None:
+        return
+    try:
+        usage.record(model, int(prompt_tokens or 0), int(completion_tokens or 0), counted)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Could not record usage of {model}: {e}")
+
+
+# Shared by the thread managers and response processors of this process
+message_token_cache = MessageTokenCache(config.TOKEN_COUNT_CACHE_SIZE)
@@ -1,5 +1,5 @@
 from typing import Dict, Type, Any, List, Optional, Callable
-from agentpress.tool import Tool, SchemaType
+from agentpress.tool import Tool, SchemaType, ToolSchema
 from utils.logger import logger
 
 
@@ -19,14 +19,58 @@ class ToolRegistry:
         get_xml_tool: Get a tool by XML tag name
         get_openapi_schemas: Get OpenAPI schemas for function calling
         get_xml_examples: Get examples of XML tool usage
+        
+    Notes:
+        Dispatch tables, schemas and examples are computed once and frozen
+        until the tool set changes. Code that adds tools must go through
+        register_tool or register_function so the frozen tables are rebuilt.
     """
     
     def __init__(self):
         """Initialize a new ToolRegistry instance."""
         self.tools = {}
         self.xml_tools = {}
+        self.version = 0
+        self._frozen: Optional[Dict[str, Any]] = None
         logger.debug("Initialized new ToolRegistry instance")
     
+    def _invalidate(self):
+        """Drop the frozen tables after the tool set changed."""
+        self._frozen = None
+        self.version += 1
+    
+    def _freeze(self) -> Dict[str, Any]:
+        """Build (or return) the frozen dispatch tables and schema payloads."""
+        if self._frozen is not None:
+            return self._frozen
+        
+        functions = {}
+        for function_name, tool_info in self.tools.items():
+            functions[function_name] = getattr(tool_info['instance'], function_name)
+        for tool_info in self.xml_tools.values():
+            method_name = tool_info['method']
+            functions[method_name] = getattr(tool_info['instance'], method_name)
+        
+        openapi_schemas = [
+            tool_info['schema'].schema
+            for tool_info in self.tools.values()
+            if tool_info['schema'].schema_type == SchemaType.OPENAPI
+        ]
+        
+        xml_examples = {}
+        for tool_info in self.xml_tools.values():
+            schema = tool_info['schema']
+            if schema.xml_schema and schema.xml_schema.example:
+                xml_examples[schema.xml_schema.tag_name] = schema.xml_schema.example
+        
+        self._frozen = {
+            "functions": functions,
+            "openapi_schemas": openapi_schemas,
+            "xml_examples": xml_examples,
+        }
+        logger.debug(f"Froze tool registry v{self.version}: {len(functions)} functions, {len(openapi_schemas)} OpenAPI schemas, {len(xml_examples)} XML examples")
+        return self._frozen
+    
     def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Register a tool with optional function filtering.
         
@@ -68,32 +112,45 @@ class ToolRegistry:
                         registered_xml += 1
                         logger.debug(f"Registered XML tag {schema.xml_schema.tag_name} -> {func_name} from {tool_class.__name__}")
         
+        self._invalidate()
         logger.debug(f"Tool registration complete for {tool_class.__name__}: {registered_openapi} OpenAPI functions, {registered_xml} XML tags")
 
+    def register_function(self, function_name: str, tool_instance: Tool, schema: ToolSchema):
+        """Register a single OpenAPI function on an already created tool instance.
+        
+        Used for tools that create methods at runtime, such as MCP dynamic tools.
+        
+        Args:
+            function_name: Name of the method on the tool instance
+            tool_instance: Tool instance that owns the method
+            schema: OpenAPI schema for the function
+        """
+        self.tools[function_name] = {
+            "instance": tool_instance,
+            "schema": schema
+        }
+        self._invalidate()
+        logger.debug(f"Registered function {function_name} from {tool_instance.__class__.__name__}")
+
     def get_available_functions(self) -> Dict[str, Callable]:
         """Get all available tool functions.
         
         Returns:
-            Dict mapping function names to their implementations
+            Dict mapping function names to their implementations. The dict is
+            shared by all callers and must not be modified.
         """
-        available_functions = {}
-        
-        # Get OpenAPI tool functions
-        for tool_name, tool_info in self.tools.items():
-            tool_instance = tool_info['instance']
-            function_name = tool_name
-            function = getattr(tool_instance, function_name)
-            available_functions[function_name] = function
-            
-        # Get XML tool functions
-        for tag_name, tool_info in self.xml_tools.items():
-            tool_instance = tool_info['instance']
-            method_name = tool_info['method']
-            function = getattr(tool_instance, method_name)
-            available_functions[method_name] = function
+        return self._freeze()["functions"]
+
+    def get_function(self, function_name: str) -> Optional[Callable]:
+        """Look up a single tool function in the frozen dispatch table.
+        
+        Args:
+            function_name: Name of the tool function
             
-        logger.debug(f"Retrieved {len(available_functions)} available functions")
-        return available_functions
+        Returns:
+            The bound tool method, or None if not registered
+        """
+        return self._freeze()["functions"].get(function_name)
 
     def get_tool(self, tool_name: str) -> Dict[str, Any]:
         """Get a specific tool by name.
@@ -129,13 +186,7 @@ class ToolRegistry:
         Returns:
             List of OpenAPI-compatible schema definitions
         """
-        schemas = [
-            tool_info['schema'].schema 
-            for tool_info in self.tools.values()
-            if tool_info['schema'].schema_type == SchemaType.OPENAPI
-        ]
-        logger.debug(f"Retrieved {len(schemas)} OpenAPI schemas")
-        return schemas
+        return self._freeze()["openapi_schemas"]
 
     def get_xml_examples(self) -> Dict[str, str]:
         """Get all XML tag examples.
@@ -143,10 +194,4 @@ class ToolRegistry:
         Returns:
             Dict mapping tag names to their example usage
         """
-        examples = {}
-        for tool_info in self.xml_tools.values():
-            schema = tool_info['schema']
-            if schema.xml_schema and schema.xml_schema.example:
-                examples[schema.xml_schema.tag_name] = schema.xml_schema.example
-        logger.debug(f"Retrieved {len(examples)} XML examples")
-        return examples
+        return self._freeze()["xml_examples"]
@@ -0,0 +1,330 @@
+"""
+Concurrency-limited, dependency-aware scheduling of tool executions.
+
+The ToolScheduler sits between the ResponseProcessor and the tools it runs:
+
+- A global limit caps how many tools run at once for a single processor
+- Per-tool limits cap individual tools (e.g. only one deploy at a time)
+- Priority lanes decide which waiting call is admitted next
+- Calls that share a resource key (the same shell session, the same file,
+  the browser) run in submission order instead of racing each other
+- All scheduled work can be cancelled at once when a run stops
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+# Default cap on concurrently running tool calls per processor
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Priority lanes, lower values are admitted first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Default lane per tool function, anything not listed runs in the normal lane
+TOOL_PRIORITIES: Dict[str, int] = {
+    "ask": PRIORITY_HIGH,
+    "complete": PRIORITY_HIGH,
+    "web_browser_takeover": PRIORITY_HIGH,
+    "deploy": PRIORITY_LOW,
+}
+
+# Default per-tool concurrency limits
+TOOL_CONCURRENCY_LIMITS: Dict[str, int] = {
+    "deploy": 1,
+}
+
+# Tool functions that address a tmux session through the session_name argument
+SHELL_SESSION_FUNCTIONS = {"execute_command", "check_command_output", "terminate_command"}
+
+# Number of recent executions kept for timing statistics
+STATS_WINDOW = 1000
+
+
+@dataclass
+class ToolTiming:
+    """Timing information for a single scheduled tool call."""
+    function_name: str
+    priority: int
+    queue_wait: float
+    execution_time: float
+    success: bool
+
+
+def _get_arguments(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+    arguments = tool_call.get("arguments") or {}
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except json.JSONDecodeError:
+            return {}
+    return arguments if isinstance(arguments, dict) else {}
+
+
+def default_resource_key(tool_call: Dict[str, Any]) -> Optional[str]:
+    """
+    Derive the ordering key for a tool call.
+
+    Calls that return the same key are executed one after another in the
+    order they were submitted. Calls without a key are independent.
+
+    Args:
+        tool_call: Tool call dict with ``function_name`` and ``arguments``
+
+    Returns:
+        Resource key string, or None if the call has no ordering constraint
+    """
+    function_name = tool_call.get("function_name", "")
+    arguments = _get_arguments(tool_call)
+
+    if function_name in SHELL_SESSION_FUNCTIONS:
+        session_name = arguments.get("session_name")
+        # execute_command without a session creates a fresh one
+        return f"shell:{session_name}" if session_name else None
+
+    file_path = arguments.get("file_path")
+    if file_path:
+        return f"file:{file_path}"
+
+    if function_name.startswith("browser_"):
+        return "browser"
+
+    return None
+
+
+class ToolScheduler:
+    """Admits tool calls under global and per-tool concurrency limits."""
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        tool_limits: Optional[Dict[str, int]] = None,
+        priorities: Optional[Dict[str, int]] = None,
+        resource_key: Optional[Callable[[Dict[str, Any]], Optional[str]]] = default_resource_key,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrency: Maximum number of tool calls running at once
+            tool_limits: Per-function concurrency limits
+            priorities: Per-function priority lane (lower runs first)
+            resource_key: Function mapping a tool call to its ordering key,
+                or None to disable ordering constraints
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.max_concurrency = max_concurrency
+        self.tool_limits = dict(TOOL_CONCURRENCY_LIMITS if tool_limits is None else tool_limits)
+        self.priorities = dict(TOOL_PRIORITIES if priorities is None else priorities)
+        self.resource_key = resource_key
+
+        self._running = 0
+        self._running_by_tool: Dict[str, int] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future, str]] = []
+        self._sequence = itertools.count()
+        self._resource_tails: Dict[str, asyncio.Task] = {}
+        self._tasks: set = set()
+        self.timings: Deque[ToolTiming] = deque(maxlen=STATS_WINDOW)
+
+    def _priority_for(self, function_name: str, priority: Optional[int]) -> int:
+        if priority is not None:
+            return priority
+        return self.priorities.get(function_name, PRIORITY_NORMAL)
+
+    def _can_run(self, function_name: str) -> bool:
+        if self._running >= self.max_concurrency:
+            return False
+        limit = self.tool_limits.get(function_name)
+        return limit is None or self._running_by_tool.get(function_name, 0) < limit
+
+    def _wake_waiters(self) -> None:
+        """Admit waiting calls in priority order while capacity allows."""
+        skipped = []
+        while self._waiters and self._running < self.max_concurrency:
+            entry = heapq.heappop(self._waiters)
+            _, _, future, function_name = entry
+            if future.done():
+                continue
+            if not self._can_run(function_name):
+                # Blocked only by its per-tool limit, let lower lanes through
+                skipped.append(entry)
+                continue
+            self._acquire_slot(function_name)
+            future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def _acquire_slot(self, function_name: str) -> None:
+        self._running += 1
+        self._running_by_tool[function_name] = self._running_by_tool.get(function_name, 0) + 1
+
+    def _release_slot(self, function_name: str) -> None:
+        self._running -= 1
+        remaining = self._running_by_tool.get(function_name, 1) - 1
+        if remaining > 0:
+            self._running_by_tool[function_name] = remaining
+        else:
+            self._running_by_tool.pop(function_name, None)
+        self._wake_waiters()
+
+    async def _admit(self, function_name: str, priority: int) -> None:
+        if not self._waiters and self._can_run(function_name):
+            self._acquire_slot(function_name)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future, function_name))
+        # Waiters blocked only by their per-tool limit leave free slots that
+        # nothing else would hand out until a running call finishes
+        self._wake_waiters()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted right before cancellation, hand it back
+                self._release_slot(function_name)
+            raise
+
+    async def _run(
+        self,
+        tool_call: Dict[str, Any],
+        execute: Callable[[Dict[str, Any]], Awaitable[Any]],
+        priority: int,
+        predecessor: Optional[asyncio.Task],
+    ) -> Any:
+        function_name = tool_call.get("function_name", "unknown")
+        submitted_at = time.monotonic()
+
+        if predecessor is not None and not predecessor.done():
+            # Only ordering matters here, the predecessor's outcome is its own
+            await asyncio.wait([predecessor])
+
+        await self._admit(function_name, priority)
+        started_at = time.monotonic()
+        success = False
+        try:
+            result = await execute(tool_call)
+            success = getattr(result, "success", True)
+            return result
+        finally:
+            finished_at = time.monotonic()
+            self._release_slot(function_name)
+            self.timings.append(ToolTiming(
+                function_name=function_name,
+                priority=priority,
+                queue_wait=started_at - submitted_at,
+                execution_time=finished_at - started_at,
+                success=success,
+            ))
+
+    def submit(
+        self,
+        tool_call: Dict[str, Any],
+        execute: Callable[[Dict[str, Any]], Awaitable[Any]],
+        priority: Optional[int] = None,
+    ) -> asyncio.Task:
+        """
+        Schedule a tool call for execution.
+
+        Args:
+            tool_call: Tool call dict with ``function_name`` and ``arguments``
+            execute: Coroutine function that runs the tool call
+            priority: Explicit priority lane, overrides the per-tool default
+
+        Returns:
+            Task resolving to the result of ``execute(tool_call)``
+        """
+        function_name = tool_call.get("function_name", "unknown")
+        lane = self._priority_for(function_name, priority)
+
+        key = self.resource_key(tool_call) if self.resource_key else None
+        predecessor = self._resource_tails.get(key) if key else None
+
+        task = asyncio.create_task(self._run(tool_call, execute, lane, predecessor))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        if key:
+            self._resource_tails[key] = task
+
+            def _clear_tail(done: asyncio.Task, key: str = key) -> None:
+                if self._resource_tails.get(key) is done:
+                    del self._resource_tails[key]
+
+            task.add_done_callback(_clear_tail)
+
+        return task
+
+    async def run_all(
+        self,
+        tool_calls: List[Dict[str, Any]],
+        execute: Callable[[Dict[str, Any]], Awaitable[Any]],
+    ) -> List[Any]:
+        """
+        Schedule a batch of tool calls and wait for all of them.
+
+        Returns:
+            Results in the order of ``tool_calls``; failed calls yield their exception
+        """
+        tasks = [self.submit(tool_call, execute) for tool_call in tool_calls]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def cancel_all(self) -> int:
+        """
+        Cancel every scheduled or running tool call.
+
+        Returns:
+            Number of tasks that were cancelled
+        """
+        cancelled = 0
+        for task in list(self._tasks):
+            if not task.done():
+                task.cancel()
+                cancelled += 1
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} scheduled tool executions")
+        return cancelled
+
+    @property
+    def pending(self) -> int:
+        """Number of scheduled calls that have not finished yet."""
+        return sum(1 for task in self._tasks if not task.done())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Summarize queue wait and execution times of recent tool calls."""
+        if not self.timings:
+            return {"count": 0, "running": self._running, "waiting": len(self._waiters)}
+
+        waits = sorted(t.queue_wait for t in self.timings)
+        execs = sorted(t.execution_time for t in self.timings)
+
+        def percentile(values: List[float], pct: float) -> float:
+            return values[min(len(values) - 1, int(len(values) * pct))]
+
+        return {
+            "count": len(self.timings),
+            "running": self._running,
+            "waiting": len(self._waiters),
+            "queue_wait_avg": sum(waits) / len(waits),
+            "queue_wait_p95": percentile(waits, 0.95),
+            "queue_wait_max": waits[-1],
+            "execution_time_avg": sum(execs) / len(execs),
+            "execution_time_p95": percentile(execs, 0.95),
+            "failures": sum(1 for t in self.timings if not t.success),
+        }
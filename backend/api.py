@@ -3,7 +3,6 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 import sentry
 from contextlib import asynccontextmanager
-from agentpress.thread_manager import ThreadManager
 from services.database import DBConnection
 from datetime import datetime, timezone
 from dotenv import load_dotenv
@@ -11,6 +10,7 @@ from utils.config import config, EnvMode
 import asyncio
 from utils.logger import logger
 import time
+import uuid
 from collections import OrderedDict
 from typing import Dict, Any
 
@@ -21,9 +21,10 @@ from sandbox import api as sandbox_api
 from services import billing as billing_api
 from flags import api as feature_flags_api
 from services import transcription as transcription_api
-from services.mcp_custom import discover_custom_tools
 import sys
 from services import email_api
+from utils.lazy import preload
+from services.prometheus import CONTENT_TYPE_LATEST, REQUEST_DURATION, render_metrics
 
 
 load_dotenv()
@@ -33,14 +34,28 @@ if sys.platform == "win32":
 
 # Initialize managers
 db = DBConnection()
-instance_id = "single"
+# Set per process at startup; gunicorn imports this module once before forking
+instance_id = None
 
 # Rate limiter state
 ip_tracker = OrderedDict()
 MAX_CONCURRENT_IPS = 25
 
+# Modules the API only needs for some requests; imported in the background
+# after startup (PRELOAD_DEFERRED_MODULES) or on first use
+DEFERRED_MODULES = (
+    "run_agent_background",
+    "services.llm",
+    "services.mcp_custom",
+    "openai",
+)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Every process has its own ID in the run registry and control channels,
+    # so a dead process is detected while others are still alive
+    global instance_id
+    instance_id = str(uuid.uuid4())[:8]
     logger.info(f"Starting up FastAPI application with instance ID: {instance_id} in {config.ENV_MODE.value} mode")
     try:
         await db.initialize()
@@ -53,7 +68,7 @@ async def lifespan(app: FastAPI):
         sandbox_api.initialize(db)
         
         # Initialize Redis connection
-        from services import redis
+        from services import redis, run_registry
         try:
             await redis.initialize_async()
             logger.info("Redis connection initialized successfully")
@@ -63,9 +78,27 @@ async def lifespan(app: FastAPI):
         
         # Start background tasks
         # asyncio.create_task(agent_api.restore_running_agent_runs())
+
+        # Keep this instance alive in the run registry and fail runs of dead instances
+        registry_heartbeat = asyncio.create_task(
+            run_registry.heartbeat_loop(instance_id, on_dead_instance=agent_api.stop_orphaned_runs)
+        )
+
+        deferred_preload = None
+        if config.PRELOAD_DEFERRED_MODULES:
+            deferred_preload = asyncio.create_task(preload(DEFERRED_MODULES))
         
         yield
         
+        for task in (registry_heartbeat, deferred_preload):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
         # Clean up agent resources
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
@@ -103,12 +136,24 @@ async def log_requests_middleware(request: Request, call_next):
         response = await call_next(request)
         process_time = time.time() - start_time
         logger.debug(f"Request completed: {method} {path} | Status: {response.status_code} | Time: {process_time:.2f}s")
+        _observe_request(request, method, response.status_code, process_time)
         return response
     except Exception as e:
         process_time = time.time() - start_time
         logger.error(f"Request failed: {method} {path} | Error: {str(e)} | Time: {process_time:.2f}s")
+        _observe_request(request, method, 500, process_time)
         raise
 
+def _observe_request(request: Request, method: str, status_code: int, seconds: float) -> None:
+    # Label by route template, not path, to keep IDs out of the label values.
+    # For streaming responses this is the time until the stream starts
+    route = request.scope.get("route")
+    REQUEST_DURATION.labels(
+        method=method,
+        route=getattr(route, "path", "unmatched"),
+        status=str(status_code),
+    ).observe(seconds)
+
 # Define allowed origins based on environment
 allowed_origins = ["https://www.NEO.so", "https://NEO.so", "http://localhost:3000"]
 allow_origin_regex = None
@@ -143,6 +188,13 @@ app.include_router(transcription_api.router, prefix="/api")
 
 app.include_router(email_api.router, prefix="/api")
 
+@app.get("/api/metrics")
+async def metrics():
+    """Prometheus metrics of all API worker processes."""
+    # Merging the per-process files reads from disk, so keep it off the event loop
+    content = await asyncio.to_thread(render_metrics)
+    return Response(content=content, media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint to verify API is working."""
@@ -161,6 +213,7 @@ class CustomMCPDiscoverRequest(BaseModel):
 @app.post("/api/mcp/discover-custom-tools")
 async def discover_custom_mcp_tools(request: CustomMCPDiscoverRequest):
     try:
+        from services.mcp_custom import discover_custom_tools
         return await discover_custom_tools(request.type, request.config)
     except HTTPException:
         raise
@@ -0,0 +1,172 @@
+"""
+Benchmark for agent library and marketplace listings on a large agents table.
+
+Seeds ``--agents`` agents (a million by default) into one benchmark account,
+half of them published to the marketplace, then measures page 1 and page
+``--deep-page`` latency in two ways:
+
+- legacy: what ``get_agents`` did before, i.e. an exact COUNT(*) and an
+  OFFSET page of the same query
+- engine: ``agent.listing.list_agents``, with the deep page read through a
+  keyset cursor; ``engine_cold_count`` clears the count cache before every
+  request so the capped count and planner estimate are included
+
+The engine is also measured with a search term, a tool filter and on the
+marketplace (newest first).
+
+Needs the local Postgres from docker-compose with the init scripts applied
+(DATABASE_* settings as for the API). Seeded agents are kept for later runs
+unless ``--cleanup`` is given.
+
+Usage (from the backend directory):
+    python -m benchmarks.agent_listing --agents 1000000 --deep-page 500 --requests 50
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from agent import listing
+from agent.listing import encode_cursor, list_agents
+from services.database import db_service
+
+BENCH_ACCOUNT_SLUG = "bench-agent-listing"
+PAGE_SIZE = 20
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+async def _seed(count: int, batch: int = 100000) -> str:
+    account_id = await db_service.execute_query(
+        "INSERT INTO accounts (name, slug) VALUES ('Agent Listing Benchmark', $1) "
+        "ON CONFLICT (slug) DO UPDATE SET name = EXCLUDED.name RETURNING id",
+        BENCH_ACCOUNT_SLUG,
+        fetch="val",
+    )
+    existing = await db_service.execute_query(
+        "SELECT count(*) FROM agents WHERE account_id = $1", account_id, fetch="val"
+    )
+    for start in range(existing, count, batch):
+        await db_service.execute_query(
+            """
+            INSERT INTO agents (account_id, name, description, system_prompt, configured_mcps, agentpress_tools,
+                                is_public, marketplace_published_at, download_count, tags, created_at, updated_at)
+            SELECT $1,
+                   'Agent ' || i,
+                   'Benchmark agent number ' || i || CASE WHEN i % 100 = 0 THEN ' for research' ELSE '' END,
+                   'You are agent ' || i,
+                   CASE WHEN i % 3 = 0 THEN jsonb_build_array(jsonb_build_object('name', 'mcp-' || (i % 7))) ELSE '[]'::jsonb END,
+                   jsonb_build_object('sb_files_tool', jsonb_build_object('enabled', i % 2 = 0),
+                                      'web_search_tool', jsonb_build_object('enabled', i % 5 = 0)),
+                   i % 2 = 0,
+                   CASE WHEN i % 2 = 0 THEN now() - (i || ' seconds')::interval END,
+                   i % 1000,
+                   ARRAY['tag-' || (i % 50)],
+                   now() - (i || ' seconds')::interval,
+                   now() - (i || ' seconds')::interval
+            FROM generate_series($2::int, $3::int) AS i
+            """,
+            account_id, start, min(start + batch, count) - 1,
+            fetch="none",
+        )
+    await db_service.execute_query("ANALYZE agents", fetch="none")
+    return str(account_id)
+
+
+async def _legacy_page(account_id: str, page: int) -> None:
+    await db_service.execute_query(
+        "SELECT count(*) FROM agents WHERE account_id = $1", account_id, fetch="val"
+    )
+    await db_service.execute_query(
+        "SELECT * FROM agents WHERE account_id = $1 ORDER BY created_at DESC OFFSET $2 LIMIT $3",
+        account_id, (page - 1) * PAGE_SIZE, PAGE_SIZE,
+    )
+
+
+async def _cursor_before(where_sql: str, args: list, sort_column: str, page: int) -> str:
+    # Cursor of the last row of the page before ``page``, as the client would hold it
+    row = await db_service.execute_query(
+        f"SELECT agent_id, {sort_column} AS sort_value FROM agents WHERE {where_sql} "
+        f"ORDER BY {sort_column} DESC, agent_id DESC OFFSET {(page - 1) * PAGE_SIZE - 1} LIMIT 1",
+        *args,
+        fetch="one",
+    )
+    return encode_cursor(row["sort_value"], row["agent_id"])
+
+
+async def _measure(request, requests: int, clear_counts: bool = False) -> dict:
+    latencies = []
+    for _ in range(requests):
+        if clear_counts:
+            listing._counts.clear()
+        started = time.perf_counter()
+        await request()
+        latencies.append(time.perf_counter() - started)
+    return {"p50_ms": _percentile(latencies, 0.5), "p99_ms": _percentile(latencies, 0.99)}
+
+
+async def _run(args) -> dict:
+    await db_service.initialize()
+    account_id = await _seed(args.agents)
+    deep = args.deep_page
+    library_cursor = await _cursor_before("account_id = $1", [account_id], "created_at", deep)
+    marketplace_cursor = await _cursor_before(
+        "is_public = TRUE AND marketplace_published_at IS NOT NULL", [], "marketplace_published_at", deep
+    )
+
+    def library(**kwargs):
+        return lambda: list_agents(account_id=account_id, limit=PAGE_SIZE, **kwargs)
+
+    def marketplace(**kwargs):
+        return lambda: list_agents(
+            marketplace=True, sort_column="marketplace_published_at", limit=PAGE_SIZE, **kwargs
+        )
+
+    results = {
+        "agents": await db_service.execute_query("SELECT count(*) FROM agents", fetch="val"),
+        "page_size": PAGE_SIZE,
+        "deep_page": deep,
+    }
+    results["legacy"] = {
+        "page_1": await _measure(lambda: _legacy_page(account_id, 1), args.requests),
+        f"page_{deep}": await _measure(lambda: _legacy_page(account_id, deep), args.requests),
+    }
+    for name, clear_counts in (("engine", False), ("engine_cold_count", True)):
+        results[name] = {
+            "page_1": await _measure(library(), args.requests, clear_counts),
+            f"page_{deep}": await _measure(library(cursor=library_cursor), args.requests, clear_counts),
+            "search_page_1": await _measure(library(search="research"), args.requests, clear_counts),
+            "tool_filter_page_1": await _measure(library(tools=["mcp:mcp-3"]), args.requests, clear_counts),
+            "marketplace_page_1": await _measure(marketplace(), args.requests, clear_counts),
+            f"marketplace_page_{deep}": await _measure(marketplace(cursor=marketplace_cursor), args.requests, clear_counts),
+        }
+
+    page = await list_agents(account_id=account_id, limit=PAGE_SIZE)
+    results["total"] = page.total
+    results["total_is_estimate"] = page.total_is_estimate
+
+    if args.cleanup:
+        await db_service.execute_query("DELETE FROM accounts WHERE slug = $1", BENCH_ACCOUNT_SLUG, fetch="none")
+    await db_service.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=1_000_000, help="Agents seeded into the benchmark account")
+    parser.add_argument("--deep-page", type=int, default=500, help="Deep page number to measure")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per measurement")
+    parser.add_argument("--cleanup", action="store_true", help="Delete the benchmark account and its agents afterwards")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+End-to-end benchmark of the agent loop.
+
+Drives ``run_agent`` -> ``ThreadManager.run_thread`` -> ``ResponseProcessor``
+the way the background worker does, publishing every response to Redis, for
+``--runs`` runs of ``--iterations`` iterations each (after ``--warmup-runs``
+unmeasured ones), against:
+
+- a scripted fake local LLM (``FakeLLMServer``) that answers every iteration
+  with ``--text-chunks`` chunks of text and an XML call of the sandbox files
+  tool (create, rewrite or edit a file in turn), taking ``--first-token``
+  seconds to its first chunk and ``--token-delay`` seconds per further chunk
+- the registered sandbox tools on a ``LocalSandbox`` rooted in a temporary
+  directory
+- in-memory tables (``FakeTableDB``) charging ``--db-latency`` seconds per
+  round trip. ``DBConnection().client`` cannot be awaited the way the loop
+  uses it, so the loop does not run against Postgres in this tree
+- the local Redis
+
+Reports iterations per second, per-iteration overhead excluding model time
+(the run profiler's critical path minus LLM first-token and stream time) with
+its breakdown by stage, and RSS and Python object growth across runs. With
+``--output`` the results are also written to a file; with ``--compare`` they
+are compared to an earlier results file and the script exits with status 1
+when a metric regressed by more than ``--max-regression-percent`` (or memory
+growth per run by more than ``MEMORY_TOLERANCE_MB``).
+
+Needs the local Redis from docker-compose (REDIS_* settings as for the API).
+
+Usage (from the backend directory):
+    python -m benchmarks.agent_loop --runs 3 --iterations 100 --output before.json
+    python -m benchmarks.agent_loop --runs 3 --iterations 100 --compare before.json
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeLLMServer, FakeTableDB, LocalSandbox
+from utils import run_profiler
+
+MODEL = "openai/fake"
+
+PROJECT_ID = "project-bench"
+
+ACCOUNT_ID = "account-bench"
+
+# Chunk size of the fake LLM's replies, in characters
+CHUNK_CHARS = 8
+
+# Replies of the fake LLM, in turn; ``{n}`` is the request number
+TOOL_CALLS = [
+    """<function_calls>
+<invoke name="create_file">
+<parameter name="file_path">bench/file_{n}.txt</parameter>
+<parameter name="file_contents">Output of iteration {n}.</parameter>
+</invoke>
+</function_calls>""",
+    """<function_calls>
+<invoke name="full_file_rewrite">
+<parameter name="file_path">bench/notes.md</parameter>
+<parameter name="file_contents"># Notes
+iteration: {n}
+status: draft
+</parameter>
+</invoke>
+</function_calls>""",
+    """<function_calls>
+<invoke name="str_replace">
+<parameter name="file_path">bench/notes.md</parameter>
+<parameter name="old_str">status: draft</parameter>
+<parameter name="new_str">status: final</parameter>
+</invoke>
+</function_calls>""",
+]
+
+# Metrics compared with --compare: (path in the results, True if higher is better)
+COMPARED_METRICS = (
+    (("iterations_per_second",), True),
+    (("overhead_ms_per_iteration", "p50"), False),
+    (("overhead_ms_per_iteration", "p95"), False),
+)
+
+# Increase of RSS growth per run over the compared results that counts as a regression, in MB
+MEMORY_TOLERANCE_MB = 1.0
+
+
+def _script(args) -> list:
+    text = "Working on the next step. " * (args.text_chunks * CHUNK_CHARS // 26 + 1)
+    return [text[:args.text_chunks * CHUNK_CHARS] + call for call in TOOL_CALLS]
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))], 2)
+
+
+async def _agent_run(args, db: FakeTableDB, index: int) -> dict:
+    """One agent run, consumed and published like ``run_agent_background`` does."""
+    from agent.run import run_agent
+    from services import redis
+
+    thread_id = f"thread-bench-{index}"
+    agent_run_id = f"run-bench-{index}"
+    response_list_key = f"agent_run:{agent_run_id}:responses"
+    response_channel = f"agent_run:{agent_run_id}:new_response"
+    db.add("threads", thread_id=thread_id, account_id=ACCOUNT_ID, project_id=PROJECT_ID)
+    db.add("messages", message_id=f"{thread_id}-user", thread_id=thread_id, type="user", is_llm_message=True,
+           content={"role": "user", "content": "Keep notes of your progress in the workspace."}, metadata={})
+
+    profiler = run_profiler.RunProfiler(agent_run_id)
+    profiler.activate()
+    started = time.perf_counter()
+    responses = 0
+    pending_redis_operations = []
+    async for response in run_agent(thread_id=thread_id, project_id=PROJECT_ID, stream=True, model_name=MODEL,
+                                    max_iterations=args.iterations):
+        with run_profiler.phase(run_profiler.PUBLISH):
+            response_json = json.dumps(response)
+            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
+            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+        responses += 1
+    await asyncio.gather(*pending_redis_operations)
+    wall = time.perf_counter() - started
+    summary = profiler.summary()
+
+    await redis.delete(response_list_key)
+    # Drop the run's rows so the in-memory tables do not count as memory growth
+    for table in ("threads", "messages"):
+        db.tables[table] = [row for row in db.tables.get(table, []) if row.get("thread_id") != thread_id]
+
+    iterations = summary["iterations"]
+    model_ms = []
+    overhead_ms = []
+    breakdown = {}
+    for iteration in iterations:
+        critical = iteration["critical_path_ms"]
+        model = critical.get(run_profiler.LLM_FIRST_TOKEN, 0) + critical.get(run_profiler.LLM_STREAM, 0)
+        model_ms.append(model)
+        overhead_ms.append(iteration["wall_ms"] - model)
+        for category, ms in critical.items():
+            if category not in (run_profiler.LLM_FIRST_TOKEN, run_profiler.LLM_STREAM):
+                breakdown[category] = breakdown.get(category, 0) + ms
+    count = len(iterations) + summary["iterations_truncated"]
+    return {
+        "wall_seconds": round(wall, 3),
+        "iterations": count,
+        "iterations_per_second": round(count / wall, 2),
+        "responses": responses,
+        "setup_ms": summary["setup_ms"],
+        "model_ms": model_ms,
+        "overhead_ms": overhead_ms,
+        "breakdown_ms": breakdown,
+    }
+
+
+def _memory() -> dict:
+    gc.collect()
+    return {"rss_mb": round(_rss_mb(), 1), "python_objects": len(gc.get_objects())}
+
+
+async def _run(args, workspace: str) -> dict:
+    import agent.iteration_state as iteration_state
+    import agentpress.thread_manager as thread_manager
+    import sandbox.tool_base as tool_base
+    from services import redis
+    from services.llm import llm_router
+    from services.llm_router import Deployment
+    from utils.config import EnvMode, config
+
+    db = FakeTableDB(latency=args.db_latency, id_columns={"messages": "message_id"})
+    db.add("projects", project_id=PROJECT_ID, account_id=ACCOUNT_ID, sandbox={"id": "sandbox-bench", "pass": "bench"})
+    sandbox = LocalSandbox("sandbox-bench", root=workspace)
+    # The file the scripted replies rewrite and edit
+    sandbox.fs.upload_file(b"# Notes\nstatus: draft\n", "/workspace/bench/notes.md")
+
+    async def get_or_start_sandbox(sandbox_id):
+        return sandbox
+
+    thread_manager.DBConnection = lambda: SimpleNamespace(client=db.client)
+    iteration_state.db_service = db
+    tool_base.get_or_start_sandbox = get_or_start_sandbox
+    # Billing checks call Stripe outside local mode
+    config.ENV_MODE = EnvMode.LOCAL
+
+    runs = []
+    memory = []
+    with FakeLLMServer(first_token_latency=args.first_token, token_delay=args.token_delay,
+                       script=_script(args), reply_chunk_chars=CHUNK_CHARS) as server:
+        llm_router.register(MODEL, [Deployment(model_name=MODEL, api_base=server.api_base, api_key="fake")])
+        for index in range(args.warmup_runs + args.runs):
+            run = await _agent_run(args, db, index)
+            if index >= args.warmup_runs:
+                runs.append(run)
+                memory.append(_memory())
+    await redis.close()
+
+    overhead = [ms for run in runs for ms in run["overhead_ms"]]
+    model = [ms for run in runs for ms in run["model_ms"]]
+    iterations = sum(run["iterations"] for run in runs)
+    breakdown = {}
+    for run in runs:
+        for category, ms in run["breakdown_ms"].items():
+            breakdown[category] = breakdown.get(category, 0) + ms
+    growth_runs = max(1, len(memory) - 1)
+    return {
+        "config": vars(args),
+        "runs": len(runs),
+        "iterations": iterations,
+        "iterations_per_second": round(iterations / sum(run["wall_seconds"] for run in runs), 2),
+        "responses_per_iteration": round(sum(run["responses"] for run in runs) / iterations, 1),
+        "model_ms_per_iteration": round(statistics.mean(model), 1),
+        "overhead_ms_per_iteration": {
+            "mean": round(statistics.mean(overhead), 2),
+            "p50": _percentile(overhead, 0.5),
+            "p95": _percentile(overhead, 0.95),
+            "max": max(overhead),
+        },
+        "overhead_breakdown_ms_per_iteration": {
+            category: round(ms / iterations, 2) for category, ms in sorted(breakdown.items(), key=lambda item: -item[1])
+        },
+        "memory": {
+            "rss_mb": [sample["rss_mb"] for sample in memory],
+            "rss_growth_per_run_mb": round((memory[-1]["rss_mb"] - memory[0]["rss_mb"]) / growth_runs, 2),
+            "python_objects": [sample["python_objects"] for sample in memory],
+            "object_growth_per_run": round((memory[-1]["python_objects"] - memory[0]["python_objects"]) / growth_runs),
+        },
+        "per_run": [
+            {key: run[key] for key in ("wall_seconds", "iterations", "iterations_per_second", "responses", "setup_ms")}
+            for run in runs
+        ],
+    }
+
+
+def _lookup(results: dict, path: tuple):
+    for key in path:
+        results = results[key]
+    return results
+
+
+def _compare(results: dict, previous: dict, max_regression_percent: float) -> dict:
+    """Relative change of each compared metric and the regressions beyond the limit."""
+    changes = {}
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS:
+        name = ".".join(path)
+        before, after = _lookup(previous, path), _lookup(results, path)
+        change = (after - before) / before * 100 if before else 0.0
+        changes[name] = {"before": before, "after": after, "change_percent": round(change, 1)}
+        if (-change if higher_is_better else change) > max_regression_percent:
+            regressions.append(f"{name}: {before} -> {after} ({change:+.1f}%)")
+    before = previous["memory"]["rss_growth_per_run_mb"]
+    after = results["memory"]["rss_growth_per_run_mb"]
+    changes["memory.rss_growth_per_run_mb"] = {"before": before, "after": after}
+    if after - before > MEMORY_TOLERANCE_MB:
+        regressions.append(f"memory.rss_growth_per_run_mb: {before} -> {after}")
+    return {"changes": changes, "regressions": regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Measured agent runs")
+    parser.add_argument("--warmup-runs", type=int, default=1, help="Unmeasured runs first")
+    parser.add_argument("--iterations", type=int, default=100, help="Agent loop iterations per run")
+    parser.add_argument("--first-token", type=float, default=0.05, help="Seconds to the first LLM chunk")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="Seconds between LLM chunks")
+    parser.add_argument("--text-chunks", type=int, default=20, help="Text chunks before each tool call")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="Seconds per database round trip")
+    parser.add_argument("--output", help="Also write the results to this file (JSON)")
+    parser.add_argument("--compare", help="Earlier results file (JSON) to compare against")
+    parser.add_argument("--max-regression-percent", type=float, default=10.0,
+                        help="Allowed regression of a compared metric")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workspace:
+        results = asyncio.run(_run(args, workspace))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as previous_file:
+            results["comparison"] = _compare(results, json.load(previous_file), args.max_regression_percent)
+    print(json.dumps(results, indent=2))
+    if args.compare and results["comparison"]["regressions"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
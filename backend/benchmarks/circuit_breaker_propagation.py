@@ -0,0 +1,165 @@
+"""
+Fault-injection check of the shared circuit breakers (``services.circuit_breaker``).
+
+Starts ``--processes`` client processes, like API or worker processes, that
+call a local dependency stub (``FakeDependency``) every ``--interval``
+seconds through a circuit breaker. After ``--warmup`` healthy seconds the
+stub starts failing (``--fault error``: 503s, ``--fault slow``: answers after
+``--slow-seconds``, beyond the policy's slow call limit) for
+``--fault-seconds``, then recovers. Reports, from the requests the stub saw:
+
+- how long after the fault started each process made its last call before
+  probing began, and how many calls reached the failed dependency meanwhile
+- calls while the breaker was open or half open (the probes)
+- how long after the recovery every process was calling again
+
+With ``--isolated`` every process gets a breaker of its own, i.e. what
+per-process breakers do, for comparison.
+
+Needs the local Redis from docker-compose (REDIS_* settings as for the API).
+
+Usage (from the backend directory):
+    python -m benchmarks.circuit_breaker_propagation --processes 8 --fault error
+    python -m benchmarks.circuit_breaker_propagation --processes 8 --fault slow --isolated
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+import uuid
+
+from benchmarks.fakes import FakeDependency
+
+
+def _policy(args):
+    from services.circuit_breaker import CircuitPolicy
+
+    return CircuitPolicy(
+        failure_threshold=args.failure_threshold,
+        slow_call_threshold=args.failure_threshold,
+        slow_call_seconds=args.slow_seconds / 2,
+        window_seconds=60,
+        recovery_timeout=args.recovery_timeout,
+        success_threshold=args.success_threshold,
+        probe_timeout=max(args.recovery_timeout, int(args.slow_seconds) + 1),
+    )
+
+
+async def _call_loop(index: int, breaker_name: str, url: str, args, stop) -> None:
+    import httpx
+
+    from services.circuit_breaker import CircuitOpenError, circuit_breakers
+
+    breaker = circuit_breakers.get(breaker_name, policy=_policy(args))
+    async with httpx.AsyncClient(timeout=30) as http:
+        while not stop.is_set():
+            try:
+                async with breaker.guard():
+                    response = await http.get(url, headers={"X-Client": str(index)})
+                    response.raise_for_status()
+            except (CircuitOpenError, httpx.HTTPError):
+                pass
+            await asyncio.sleep(args.interval)
+
+
+def _client(index: int, breaker_name: str, url: str, args, stop) -> None:
+    asyncio.run(_call_loop(index, breaker_name, url, args, stop))
+
+
+async def _reset(breaker_names) -> None:
+    from services import redis
+    from services.circuit_breaker import circuit_breakers
+
+    for name in set(breaker_names):
+        await circuit_breakers.reset(name)
+    await redis.close()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000)
+
+
+def _analyze(requests, args, fault_at: float, recovered_at: float) -> dict:
+    probing_from = fault_at + args.recovery_timeout
+    clients = [str(index) for index in range(args.processes)]
+    stop_times = []
+    for client in clients:
+        before_probing = [at for at, _, c in requests if c == client and fault_at <= at < probing_from]
+        stop_times.append((max(before_probing) - fault_at) if before_probing else 0.0)
+    resume_times = []
+    for client in clients:
+        after = [at for at, _, c in requests if c == client and at >= recovered_at]
+        resume_times.append((min(after) - recovered_at) if after else None)
+    return {
+        "calls_before_fault": sum(1 for at, _, _ in requests if at < fault_at),
+        "failed_calls_until_stopped": sum(1 for at, _, _ in requests if fault_at <= at < probing_from),
+        "stop_ms_p50": _percentile(stop_times, 0.5),
+        "stop_ms_all": _percentile(stop_times, 1.0),
+        "calls_while_open": sum(1 for at, _, _ in requests if probing_from <= at < recovered_at),
+        "resume_ms_p50": _percentile([t for t in resume_times if t is not None], 0.5),
+        "resume_ms_all": None if None in resume_times else _percentile(resume_times, 1.0),
+        "processes_not_resumed": sum(1 for t in resume_times if t is None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8, help="Client processes")
+    parser.add_argument("--interval", type=float, default=0.02, help="Pause between calls of a process")
+    parser.add_argument("--fault", choices=["error", "slow"], default="error", help="Injected fault")
+    parser.add_argument("--slow-seconds", type=float, default=2.0, help="Response time of the slow fault")
+    parser.add_argument("--failure-threshold", type=int, default=5, help="Failures or slow calls that trip")
+    parser.add_argument("--recovery-timeout", type=int, default=3, help="Seconds open before probing")
+    parser.add_argument("--success-threshold", type=int, default=3, help="Successful probes that close")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Healthy seconds before the fault")
+    parser.add_argument("--fault-seconds", type=float, default=7.0, help="Duration of the fault")
+    parser.add_argument("--recover-seconds", type=float, default=6.0, help="Observed seconds after recovery")
+    parser.add_argument("--isolated", action="store_true", help="One breaker per process instead of a shared one")
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    with FakeDependency(slow_seconds=args.slow_seconds) as dependency:
+        breaker_names = [f"bench:{run_id}:{index}" if args.isolated else f"bench:{run_id}"
+                         for index in range(args.processes)]
+        clients = [context.Process(target=_client, args=(index, name, dependency.url, args, stop))
+                   for index, name in enumerate(breaker_names)]
+        for client in clients:
+            client.start()
+        # Wait until every process is calling, then start from closed breakers
+        # in case process startup made calls slow enough to trip them
+        while len({client for _, _, client in dependency.requests}) < args.processes:
+            time.sleep(0.1)
+        asyncio.run(_reset(breaker_names))
+
+        time.sleep(args.warmup)
+        fault_at = time.time()
+        dependency.fault = args.fault
+        time.sleep(args.fault_seconds)
+        recovered_at = time.time()
+        dependency.fault = None
+        time.sleep(args.recover_seconds)
+
+        stop.set()
+        for client in clients:
+            client.join(timeout=args.slow_seconds + 10)
+        requests = list(dependency.requests)
+
+    results = {
+        "mode": "isolated" if args.isolated else "shared",
+        "processes": args.processes,
+        "fault": args.fault,
+        "recovery_timeout_s": args.recovery_timeout,
+        **_analyze(requests, args, fault_at, recovered_at),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
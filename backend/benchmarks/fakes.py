@@ -0,0 +1,596 @@
+"""
+Local stand-ins used by the benchmark scripts.
+
+Nothing in here talks to a real sandbox, LLM provider or cloud service; each
+fake mimics just enough of the real client interface for the code paths
+under test.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+
+class LocalSandbox:
+    """
+    Sandbox stand-in backed by the local filesystem.
+
+    Paths are used as-is, so callers should operate inside a temporary
+    directory, or below ``root`` when given (``/workspace/a.txt`` is then
+    ``<root>/workspace/a.txt``). ``process.exec`` runs commands with the local
+    shell.
+    """
+
+    def __init__(self, sandbox_id: str = "bench", root: Optional[str] = None):
+        self.id = sandbox_id
+        self.root = root
+        self.fs = SimpleNamespace(
+            upload_file=self._upload_file,
+            download_file=self._download_file,
+            get_file_info=self._get_file_info,
+            list_files=self._list_files,
+            delete_file=lambda path: os.remove(self._path(path)),
+            create_folder=lambda path, mode: os.makedirs(self._path(path), mode=int(mode, 8), exist_ok=True),
+            set_file_permissions=lambda path, mode: os.chmod(self._path(path), int(mode, 8)),
+        )
+        self.process = SimpleNamespace(exec=self._exec)
+
+    def _path(self, path: str) -> str:
+        return os.path.join(self.root, path.lstrip("/")) if self.root else path
+
+    def _upload_file(self, content: bytes, path: str):
+        path = self._path(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def _download_file(self, path: str) -> bytes:
+        with open(self._path(path), "rb") as f:
+            return f.read()
+
+    def _get_file_info(self, path: str):
+        st = os.stat(self._path(path))
+        return SimpleNamespace(
+            name=os.path.basename(path),
+            is_dir=os.path.isdir(self._path(path)),
+            size=st.st_size,
+            mod_time=str(st.st_mtime),
+        )
+
+    def _list_files(self, path: str):
+        return [self._get_file_info(os.path.join(path, name)) for name in os.listdir(self._path(path))]
+
+    def _exec(self, command: str, timeout: int = None):
+        proc = subprocess.run(command, shell=True, capture_output=True, timeout=timeout, cwd=self.root)
+        return SimpleNamespace(exit_code=proc.returncode, result=(proc.stdout + proc.stderr).decode(errors="replace"))
+
+
+class FakeLLMServer:
+    """
+    OpenAI-compatible chat completions endpoint served locally.
+
+    Replies are derived deterministically from the request messages, with a
+    configurable time-to-first-token and per-token delay. A fraction of
+    requests can be answered with 429s or slowed down to emulate a degraded
+    provider. With ``reply``, every request is answered with that text
+    instead, streamed in chunks of ``reply_chunk_chars`` characters; with
+    ``script``, requests are answered with its replies in turn, starting over
+    after the last, and ``{n}`` in a reply becomes the request number. With
+    ``timestamp_chunks``, every streamed chunk ends in ``@<unix time>|``, the
+    time it was sent, so clients can measure delivery latency. Point
+    LiteLLM at it with ``model_name="openai/fake"`` and
+    ``api_base=server.api_base``. Run as a context manager; the server lives on
+    a background thread.
+    """
+
+    def __init__(
+        self,
+        first_token_latency: float = 0.3,
+        token_delay: float = 0.01,
+        reply_tokens: int = 50,
+        rate_limit_probability: float = 0.0,
+        slow_probability: float = 0.0,
+        slow_factor: float = 10.0,
+        seed: int = 0,
+        reply: Optional[str] = None,
+        reply_chunk_chars: int = 8,
+        script: Optional[List[str]] = None,
+        timestamp_chunks: bool = False,
+    ):
+        self.first_token_latency = first_token_latency
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.rate_limit_probability = rate_limit_probability
+        self.slow_probability = slow_probability
+        self.slow_factor = slow_factor
+        self.reply = reply
+        self.reply_chunk_chars = reply_chunk_chars
+        self.script = script
+        self.timestamp_chunks = timestamp_chunks
+        self._random = random.Random(seed)
+        self.rate_limited = 0
+        self.requests = 0
+        self.completion_tokens = 0
+        self.prompt_tokens = 0
+        self._server = None
+        self._thread = None
+        self.api_base = None
+
+    def _reply(self, messages) -> list:
+        reply = self.reply
+        if self.script:
+            reply = self.script[self.requests % len(self.script)].replace("{n}", str(self.requests))
+        if reply is not None:
+            size = self.reply_chunk_chars
+            return [reply[i:i + size] for i in range(0, len(reply), size)]
+        seed = hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+        return [f"tok{seed[i % 64]}{i} " for i in range(self.reply_tokens)]
+
+    def _app(self):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import JSONResponse, StreamingResponse
+
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            if self._random.random() < self.rate_limit_probability:
+                self.rate_limited += 1
+                return JSONResponse(
+                    {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+                    status_code=429,
+                    headers={"retry-after": "1"},
+                )
+            messages = body.get("messages", [])
+            tokens = self._reply(messages)
+            prompt_tokens = sum(len(json.dumps(m).split()) for m in messages)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            }
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += len(tokens)
+            base = {"id": f"fake-{self.requests}", "created": int(time.time()), "model": body.get("model", "fake")}
+
+            latency = self.first_token_latency
+            if self._random.random() < self.slow_probability:
+                latency *= self.slow_factor
+            await asyncio.sleep(latency)
+            if not body.get("stream"):
+                await asyncio.sleep(self.token_delay * len(tokens))
+                return {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": usage,
+                }
+
+            async def events():
+                for token in tokens:
+                    if self.timestamp_chunks:
+                        token = f"{token}@{time.time():.6f}|"
+                    chunk = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(self.token_delay)
+                final = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return app
+
+    def __enter__(self) -> "FakeLLMServer":
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        self._server = uvicorn.Server(uvicorn.Config(self._app(), host="127.0.0.1", port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        self.api_base = f"http://127.0.0.1:{port}/v1"
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+class FakeMessageDB:
+    """
+    In-memory messages table with a round-trip counter.
+
+    Serves both the Supabase-style client used by the agent loop
+    (``client.table(...).select(...).eq(...).execute()``) and
+    ``execute_query`` for the ``get_iteration_state`` SQL function, sleeping
+    ``latency`` seconds per round trip.
+    """
+
+    def __init__(self, latency: float = 0.002):
+        self.latency = latency
+        self.messages = []
+        self.round_trips = 0
+        self.client = SimpleNamespace(table=lambda name: _FakeQuery(self, name))
+
+    def add(self, thread_id: str, type: str, content) -> dict:
+        message = {
+            "message_id": f"msg-{len(self.messages)}",
+            "thread_id": thread_id,
+            "type": type,
+            "content": json.dumps(content),
+            "created_at": datetime.now(timezone.utc) + timedelta(microseconds=len(self.messages)),
+        }
+        self.messages.append(message)
+        return message
+
+    def _latest(self, thread_id: str, types, since=None):
+        rows = [
+            m for m in self.messages
+            if m["thread_id"] == thread_id and m["type"] in types and (since is None or m["created_at"] > since)
+        ]
+        return max(rows, key=lambda m: m["created_at"]) if rows else None
+
+    async def execute_query(self, query: str, *args, fetch: str = "all"):
+        if "get_iteration_state" not in query:
+            raise NotImplementedError(query)
+        await asyncio.sleep(self.latency)
+        self.round_trips += 1
+        thread_id, since, account_id = args
+
+        latest = self._latest(thread_id, ("assistant", "tool", "user"))
+        browser_state = self._latest(thread_id, ("browser_state",), since)
+        image_context = None
+        if not latest or latest["type"] != "assistant":
+            image_context = self._latest(thread_id, ("image_context",))
+            if image_context:
+                self.messages.remove(image_context)
+
+        return json.dumps({
+            "latest_message_type": latest["type"] if latest else None,
+            "browser_state": {
+                "message_id": browser_state["message_id"],
+                "content": json.loads(browser_state["content"]),
+                "created_at": browser_state["created_at"].isoformat(),
+            } if browser_state else None,
+            "image_context": {
+                "message_id": image_context["message_id"],
+                "content": json.loads(image_context["content"]),
+            } if image_context else None,
+            "usage_seconds": 0 if account_id else None,
+        })
+
+
+class _FakeQuery:
+    def __init__(self, db: FakeMessageDB, table: str):
+        self.db = db
+        self.table = table
+        self.filters = {}
+        self.operation = "select"
+        self.row_limit = None
+
+    def select(self, columns: str = "*"):
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters[column] = (value,)
+        return self
+
+    def in_(self, column: str, values):
+        self.filters[column] = tuple(values)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(self.db.latency)
+        self.db.round_trips += 1
+        rows = self.db.messages if self.table == "messages" else []
+        rows = [m for m in rows if all(m.get(c) in values for c, values in self.filters.items())]
+        if self.operation == "delete":
+            for row in rows:
+                self.db.messages.remove(row)
+            return SimpleNamespace(data=None, error=None)
+        rows = sorted(rows, key=lambda m: m["created_at"], reverse=True)[:self.row_limit]
+        return SimpleNamespace(data=rows, error=None)
+
+
+class FakeTableDB:
+    """
+    In-memory tables behind a Supabase-style client with a round-trip counter.
+
+    Supports the query builder calls used by the API endpoints and the
+    agent loop (``table``, ``from_``, ``schema``, ``select``, ``insert``,
+    ``update``, ``delete``, ``eq``, ``in_``, ``gte``, ``order``, ``limit``) and sleeps
+    ``latency`` seconds per round trip. Inserted rows get an ID in the
+    table's ``id_columns`` entry, ``id`` by default.
+    The client can be used as is or awaited, matching both ways
+    ``DBConnection().client`` is accessed. ``execute_query`` serves the
+    ``get_iteration_state`` SQL function from the ``messages`` table, without
+    browser states, image contexts or usage.
+    """
+
+    def __init__(self, latency: float = 0.005, id_columns: Optional[Dict[str, str]] = None):
+        self.latency = latency
+        self.id_columns = id_columns or {}
+        self.tables = {}
+        self.round_trips = 0
+        self.client = _FakeTableClient(self)
+
+    def add(self, table: str, **row) -> dict:
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    async def execute_query(self, query: str, *args, fetch: str = "all"):
+        if "get_iteration_state" not in query:
+            raise NotImplementedError(query)
+        await asyncio.sleep(self.latency)
+        self.round_trips += 1
+        thread_id = args[0]
+        latest = next((row for row in reversed(self.tables.get("messages", []))
+                       if row.get("thread_id") == thread_id and row.get("type") in ("assistant", "tool", "user")), None)
+        return json.dumps({
+            "latest_message_type": latest["type"] if latest else None,
+            "browser_state": None,
+            "image_context": None,
+            "usage_seconds": 0 if args[2] else None,
+        })
+
+
+class _FakeTableClient:
+    def __init__(self, db: FakeTableDB):
+        self.db = db
+
+    def __await__(self):
+        yield from ()
+        return self
+
+    def table(self, name: str):
+        return _FakeTableQuery(self.db, name)
+
+    from_ = table
+
+    def schema(self, name: str):
+        return self
+
+
+class _FakeTableQuery:
+    def __init__(self, db: FakeTableDB, table: str):
+        self.db = db
+        self.table = table
+        self.operation = "select"
+        self.data = None
+        self.filters = []
+        self.descending = False
+        self.row_limit = None
+
+    def select(self, *columns, **kwargs):
+        return self
+
+    def insert(self, data: dict, **kwargs):
+        self.operation, self.data = "insert", data
+        return self
+
+    def update(self, data: dict):
+        self.operation, self.data = "update", data
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gte(self, column: str, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        # Rows are kept in insertion order, which stands in for any column
+        self.descending = desc
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(self.db.latency)
+        self.db.round_trips += 1
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.operation == "insert":
+            row = {self.db.id_columns.get(self.table, "id"): f"{self.table}-{len(rows)}", **self.data}
+            rows.append(row)
+            return SimpleNamespace(data=[row], error=None)
+        matching = [row for row in rows if all(check(row) for check in self.filters)]
+        if self.operation == "update":
+            for row in matching:
+                row.update(self.data)
+        elif self.operation == "delete":
+            self.db.tables[self.table] = [row for row in rows if row not in matching]
+            return SimpleNamespace(data=None, error=None)
+        if self.descending:
+            matching.reverse()
+        return SimpleNamespace(data=[dict(row) for row in matching[:self.row_limit]], error=None)
+
+
+class FakeStripe:
+    """
+    Stand-in for the ``stripe`` module's subscription lookup.
+
+    ``Subscription.list`` blocks for ``latency`` seconds like the synchronous
+    Stripe SDK does and returns one active subscription on ``price_id`` for
+    every customer.
+    """
+
+    def __init__(self, price_id: str, latency: float = 0.25):
+        self.price_id = price_id
+        self.latency = latency
+        self.calls = 0
+        self.Subscription = SimpleNamespace(list=self._list_subscriptions, modify=lambda *args, **kwargs: None)
+
+    def _list_subscriptions(self, customer: str, status: str = "active"):
+        time.sleep(self.latency)
+        self.calls += 1
+        return {"data": [{
+            "id": f"sub_{customer}",
+            "created": 0,
+            "items": {"data": [{"price": {"id": self.price_id}}]},
+        }]}
+
+
+class FakeLangfuseCollector:
+    """
+    Langfuse ingestion endpoint served locally.
+
+    Accepts the SDK's batched ``POST /api/public/ingestion`` requests, counts
+    the records in them and acknowledges every record. Point the SDK at it
+    with ``host=collector.host`` (or ``LANGFUSE_HOST``) and any key pair. Run
+    as a context manager; the server lives on a background thread.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.records = 0
+        self._server = None
+        self._thread = None
+        self.host = None
+
+    def __enter__(self) -> "FakeLangfuseCollector":
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                batch = body.get("batch", [])
+                time.sleep(collector.latency)
+                collector.requests += 1
+                collector.records += len(batch)
+                reply = json.dumps({"successes": [{"id": item.get("id"), "status": 201} for item in batch],
+                                    "errors": []}).encode()
+                self.send_response(207)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.host = f"http://127.0.0.1:{self._server.server_address[1]}"
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._thread.join(timeout=5)
+
+
+class FakeDependency:
+    """
+    External HTTP dependency with switchable faults, served locally.
+
+    ``GET /`` answers 200 while ``fault`` is ``None``, 503 with
+    ``fault="error"``, and 200 after ``slow_seconds`` with ``fault="slow"``.
+    Every request is logged as ``(time.time(), fault, X-Client header)`` in
+    ``requests``, so callers in other processes can be told apart. Run as a
+    context manager; the server lives on a background thread.
+    """
+
+    def __init__(self, slow_seconds: float = 1.0):
+        self.slow_seconds = slow_seconds
+        self.fault: Optional[str] = None
+        self.requests = []
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def __enter__(self) -> "FakeDependency":
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        dependency = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fault = dependency.fault
+                dependency.requests.append((time.time(), fault, self.headers.get("X-Client")))
+                if fault == "slow":
+                    time.sleep(dependency.slow_seconds)
+                self.send_response(503 if fault == "error" else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._thread.join(timeout=5)
+
+
+class SlowStream:
+    """
+    Text stream that takes ``write_latency`` seconds per write, like stdout
+    piped to a busy log collector or a file on a slow disk. Counts what is
+    written and discards it.
+    """
+
+    def __init__(self, write_latency: float = 0.0):
+        self.write_latency = write_latency
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, text: str) -> int:
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        self.writes += 1
+        self.bytes += len(text)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
@@ -0,0 +1,127 @@
+"""
+Benchmark for the per-iteration state reads of the agent loop.
+
+Runs agent-like loops against an in-memory messages table that charges a
+fixed latency per database round trip, with one fake local LLM call per
+iteration. The thread receives tool results every iteration, a new browser
+state every few iterations and an occasional image context.
+
+Two ways of reading the loop state are compared:
+- legacy: billing check, latest message, latest browser state and latest
+  image context as separate queries (plus a delete) on every iteration
+- reader: ``IterationStateReader`` (one ``get_iteration_state`` call per
+  iteration that also returns the month's usage, browser state skipped when
+  unchanged, subscription limit reused)
+
+The legacy billing check is replaced by a stand-in that issues the two usage
+queries of ``calculate_monthly_usage``; the Stripe lookup of both is left out.
+
+Reports DB round trips and state-read overhead per run and per iteration.
+
+Usage (from the backend directory):
+    python -m benchmarks.iteration_state --runs 5 --iterations 100
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import agent.iteration_state as iteration_state
+from agent.iteration_state import IterationStateReader, browser_state_blocks, image_context_blocks
+from benchmarks.fakes import FakeLLMServer, FakeMessageDB
+
+MODEL = "openai/fake"
+
+
+async def _billing_check(client, account_id):
+    # The two usage queries of calculate_monthly_usage
+    await client.table('threads').select('thread_id').eq('account_id', account_id).execute()
+    await client.table('agent_runs').select('started_at, completed_at').eq('account_id', account_id).execute()
+    return True, "ok", None
+
+
+async def _usage_limit(account_id):
+    return 100, None
+
+
+async def _legacy_read(client, thread_id: str, account_id: str):
+    await _billing_check(client, account_id)
+    latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()
+    if latest_message.data and latest_message.data[0]['type'] == 'assistant':
+        return None
+
+    content = []
+    browser_state = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
+    if browser_state.data:
+        content.extend(browser_state_blocks(json.loads(browser_state.data[0]['content'])))
+    image_context = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
+    if image_context.data:
+        content.extend(image_context_blocks(json.loads(image_context.data[0]['content'])))
+        await client.table('messages').delete().eq('message_id', image_context.data[0]['message_id']).execute()
+    return content
+
+
+async def _run_loop(mode: str, run: int, args, server) -> dict:
+    from services.llm import make_llm_api_call
+
+    db = FakeMessageDB(latency=args.db_latency_ms / 1000)
+    thread_id, account_id = f"thread-{run}", "account"
+    db.add(thread_id, "user", {"role": "user", "content": "Build a landing page"})
+    reader = IterationStateReader(thread_id, account_id, db.client, db=db)
+
+    overhead = 0.0
+    for iteration in range(args.iterations):
+        if iteration % args.browser_every == 0:
+            db.add(thread_id, "browser_state", {"url": f"https://example.com/{iteration}", "screenshot_base64": "A" * 20000})
+        if iteration % args.image_every == 0:
+            db.add(thread_id, "image_context", {"base64": "B" * 20000, "mime_type": "image/png", "file_path": "shot.png"})
+
+        started = time.perf_counter()
+        if mode == "legacy":
+            temporary_content = await _legacy_read(db.client, thread_id, account_id)
+        else:
+            temporary_content = (await reader.read()).temporary_content
+        overhead += time.perf_counter() - started
+
+        messages = [{"role": "user", "content": f"step {iteration}"}]
+        if temporary_content:
+            messages.append({"role": "user", "content": temporary_content})
+        await make_llm_api_call(messages, MODEL, api_key="fake", api_base=server.api_base, max_tokens=20)
+        db.add(thread_id, "assistant", {"role": "assistant", "content": "running a tool"})
+        db.add(thread_id, "tool", {"role": "user", "content": "<tool_result>ok</tool_result>"})
+
+    return {"round_trips": db.round_trips, "overhead": overhead}
+
+
+async def _run(args) -> dict:
+    iteration_state.get_usage_limit = _usage_limit
+    results = {}
+    with FakeLLMServer(first_token_latency=0.0, token_delay=0.0, reply_tokens=5) as server:
+        for mode in ("legacy", "reader"):
+            runs = [await _run_loop(mode, run, args, server) for run in range(args.runs)]
+            round_trips = sum(r["round_trips"] for r in runs) / len(runs)
+            overhead = sum(r["overhead"] for r in runs) / len(runs)
+            results[mode] = {
+                "round_trips_per_run": round(round_trips, 1),
+                "round_trips_per_iteration": round(round_trips / args.iterations, 2),
+                "overhead_per_run_ms": round(overhead * 1000, 2),
+                "overhead_per_iteration_ms": round(overhead * 1000 / args.iterations, 3),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=100, help="Loop iterations per run")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="Latency of one database round trip")
+    parser.add_argument("--browser-every", type=int, default=3, help="New browser state every N iterations")
+    parser.add_argument("--image-every", type=int, default=10, help="New image context every N iterations")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
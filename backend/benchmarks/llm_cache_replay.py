@@ -0,0 +1,108 @@
+"""
+Replay benchmark for the local LLM response cache.
+
+Runs a workload of deterministic prompts (summaries of a fixed set of
+conversations, repeated) through ``make_llm_api_call`` against a fake local
+OpenAI-compatible endpoint, once without and once with ``cache=True``, for
+both streaming and non-streaming calls. Reports latency and the number of
+provider tokens saved by replayed responses.
+
+Usage (from the backend directory):
+    python -m benchmarks.llm_cache_replay --prompts 20 --repeats 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.fakes import FakeLLMServer
+
+
+def _workload(prompts: int, repeats: int):
+    conversations = [
+        [
+            {"role": "system", "content": "Summarize the conversation."},
+            {"role": "user", "content": f"Conversation {i}: " + " ".join(f"message-{i}-{j}" for j in range(200))},
+        ]
+        for i in range(prompts)
+    ]
+    return [conversations[i % prompts] for i in range(prompts * repeats)]
+
+
+async def _run_pass(server: FakeLLMServer, workload, stream: bool, cache: bool) -> dict:
+    from services.llm import make_llm_api_call
+
+    tokens_before = server.prompt_tokens + server.completion_tokens
+    requests_before = server.requests
+    latencies = []
+    for messages in workload:
+        started = time.perf_counter()
+        response = await make_llm_api_call(
+            messages=[dict(m) for m in messages],
+            model_name="openai/fake",
+            api_key="fake",
+            api_base=server.api_base,
+            temperature=0,
+            max_tokens=200,
+            stream=stream,
+            cache=cache,
+        )
+        if stream:
+            async for _ in response:
+                pass
+        latencies.append(time.perf_counter() - started)
+
+    latencies.sort()
+    return {
+        "calls": len(workload),
+        "provider_requests": server.requests - requests_before,
+        "provider_tokens": server.prompt_tokens + server.completion_tokens - tokens_before,
+        "latency_avg_ms": round(statistics.mean(latencies) * 1000, 2),
+        "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        "total_s": round(sum(latencies), 3),
+    }
+
+
+async def _run(args) -> dict:
+    from services.llm_cache import get_llm_cache
+
+    workload = _workload(args.prompts, args.repeats)
+    results = {}
+    with FakeLLMServer(first_token_latency=args.latency, token_delay=args.token_delay) as server:
+        for stream in (False, True):
+            mode = "streaming" if stream else "non_streaming"
+            get_llm_cache().clear()
+            uncached = await _run_pass(server, workload, stream, cache=False)
+            cached = await _run_pass(server, workload, stream, cache=True)
+            results[mode] = {
+                "uncached": uncached,
+                "cached": cached,
+                "tokens_saved": uncached["provider_tokens"] - cached["provider_tokens"],
+                "speedup": round(uncached["total_s"] / cached["total_s"], 2) if cached["total_s"] else None,
+            }
+    results["cache_stats"] = get_llm_cache().stats
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=20, help="Distinct deterministic prompts")
+    parser.add_argument("--repeats", type=int, default=5, help="Times each prompt is replayed")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake time to first token in seconds")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Fake delay per generated token")
+    args = parser.parse_args()
+
+    # Keep benchmark entries out of the real cache
+    os.environ["LLM_CACHE_ENABLED"] = "true"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite3")
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
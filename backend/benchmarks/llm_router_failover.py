@@ -0,0 +1,121 @@
+"""
+Failover and hedging benchmark for the LLM router.
+
+Starts several fake OpenAI-compatible endpoints that serve the same model
+with different behaviour (one fast but frequently rate limited, one with a
+slow tail, one steady) and drives concurrent agent-like runs through
+``make_llm_api_call``. Each run makes a fixed number of sequential streaming
+calls and only completes if all of them succeed.
+
+Two configurations are compared:
+- single: only the fast, rate-limited endpoint (failover and hedging off)
+- routed: all endpoints registered as equivalent deployments
+
+Reports p50/p99 time-to-first-token, per-call success and run completion rate.
+
+Usage (from the backend directory):
+    python -m benchmarks.llm_router_failover --runs 30 --calls-per-run 5
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.fakes import FakeLLMServer
+
+MODEL = "bench/equivalent-model"
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+async def _run_workload(args) -> dict:
+    from services.llm import make_llm_api_call
+
+    ttfts = []
+    calls_ok = 0
+    calls_failed = 0
+    runs_completed = 0
+
+    async def one_run(run_index: int):
+        nonlocal calls_ok, calls_failed, runs_completed
+        for call_index in range(args.calls_per_run):
+            started = time.perf_counter()
+            try:
+                stream = await make_llm_api_call(
+                    messages=[{"role": "user", "content": f"run {run_index} step {call_index}"}],
+                    model_name=MODEL,
+                    temperature=0,
+                    stream=True,
+                )
+                first = True
+                async for _ in stream:
+                    if first:
+                        ttfts.append(time.perf_counter() - started)
+                        first = False
+                calls_ok += 1
+            except Exception:
+                calls_failed += 1
+                return
+        runs_completed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_run(i) for i in range(args.runs)))
+    return {
+        "elapsed_s": round(time.perf_counter() - started, 2),
+        "ttft_p50_ms": _percentile(ttfts, 0.5),
+        "ttft_p99_ms": _percentile(ttfts, 0.99),
+        "calls_ok": calls_ok,
+        "calls_failed": calls_failed,
+        "run_completion_rate": round(runs_completed / args.runs, 3),
+    }
+
+
+async def _run(args) -> dict:
+    import services.llm as llm
+    from services.llm_router import Deployment, LLMRouter
+
+    results = {}
+    with FakeLLMServer(first_token_latency=args.latency, rate_limit_probability=args.rate_limit_rate, seed=1) as fast, \
+         FakeLLMServer(first_token_latency=args.latency * 1.5, slow_probability=args.slow_rate, seed=2) as tail, \
+         FakeLLMServer(first_token_latency=args.latency * 2, seed=3) as steady:
+
+        def deployment(server):
+            return Deployment(model_name="openai/fake", api_base=server.api_base, api_key="fake")
+
+        configurations = {
+            "single": (LLMRouter(hedging=False, max_retries=llm.MAX_RETRIES, rate_limit_delay=args.rate_limit_delay),
+                       [deployment(fast)]),
+            "routed": (LLMRouter(hedge_min_delay=args.hedge_min_delay, max_retries=llm.MAX_RETRIES,
+                                 rate_limit_delay=args.rate_limit_delay),
+                       [deployment(fast), deployment(tail), deployment(steady)]),
+        }
+        for name, (router, deployments) in configurations.items():
+            router.register(MODEL, deployments)
+            llm.llm_router = router
+            results[name] = await _run_workload(args)
+            results[name]["router"] = router.get_stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=30, help="Concurrent runs")
+    parser.add_argument("--calls-per-run", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="Base fake time to first token in seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.3, help="429 probability of the fast endpoint")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="Slow-tail probability of the second endpoint")
+    parser.add_argument("--hedge-min-delay", type=float, default=0.5)
+    parser.add_argument("--rate-limit-delay", type=float, default=2.0, help="Longest wait when all deployments cool down")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+"""
+Concurrent-run load test of the API and the background workers.
+
+For each level of ``--levels`` (concurrent runs), seeds one project and
+thread per run, starts all runs at once through
+``POST /thread/{id}/agent/start`` and attaches ``--viewers`` SSE clients per
+run to ``GET /agent-run/{id}/stream``, which read until the run's final
+status. The model is a local fake LLM (``FakeLLMServer``, in its own
+process) that streams ``--reply-tokens`` chunks per reply, each stamped with
+the time it was sent. Reports per level:
+
+- time-to-run-ID: the start request's latency (admission checks, Postgres
+  writes, run registration and enqueueing)
+- time to first chunk: from the run ID until a viewer's first content chunk
+  (queue wait in RabbitMQ, worker pickup and run setup)
+- chunk delivery latency: from the fake LLM sending a chunk until a viewer
+  received it (worker processing, Redis list and pub/sub, SSE)
+- error rates: failed starts, viewers that failed or ended without a final
+  status, and runs that ended as failed, stopped or error
+- resource use, sampled every ``--sample-interval`` seconds: CPU and RSS of
+  the API and worker process trees, Redis clients, commands/s and memory,
+  Postgres connections (all, active) and transactions/s
+
+``curves`` lists the main metrics by level, and ``limits`` the first level at
+which each latency grew beyond ``--knee-factor`` times its value at the
+lowest level, or errors exceeded ``--max-error-percent``: where the API and
+Postgres (time-to-run-ID), the workers (time to first chunk, worker CPU) and
+Redis (chunk delivery) stop scaling.
+
+By default the API (``--api-workers`` uvicorn workers) and the worker
+(``python -m dramatiq`` with ``--worker-processes`` and
+``--worker-threads``) are started with ENV_MODE=local and LiteLLM's OpenAI
+base pointed at the fake LLM. With ``--url``, an already running API is
+used instead; its workers must then be started with ``OPENAI_API_BASE`` set
+to the address this script prints, and only Redis and Postgres are sampled.
+
+Needs the local Redis, Postgres and RabbitMQ from docker-compose (REDIS_*,
+DATABASE_* and RABBITMQ_* settings as for the API). Seeded projects are
+deleted afterwards unless ``--keep`` is given.
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --levels 1,5,10,25,50 --viewers 2
+    python -m benchmarks.load_test --levels 10,50,100 --worker-processes 4 --worker-threads 8
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+import httpx
+import jwt
+
+from benchmarks.fakes import FakeLLMServer
+from services import redis
+from services.database import db_service
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_EMAIL = "load-test@bench.local"
+BENCH_ACCOUNT_SLUG = "bench-load-test"
+# Send time the fake LLM appends to every chunk (``timestamp_chunks``)
+CHUNK_STAMP = re.compile(r"@(\d+\.\d+)\|")
+# Final statuses a run's stream ends with
+FINAL_STATUSES = {"completed", "failed", "stopped", "error", "STOP", "END_STREAM", "ERROR"}
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_fake_llm(args, ready, stop) -> None:
+    with FakeLLMServer(first_token_latency=args.first_token_ms / 1000, token_delay=args.token_delay_ms / 1000,
+                       reply_tokens=args.reply_tokens, timestamp_chunks=True) as server:
+        ready.put(server.api_base)
+        stop.wait()
+
+
+def _process_trees(roots: dict) -> dict:
+    """Each root's pid and the pids of all its descendants, by component name."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    trees = {}
+    for name, root in roots.items():
+        pids, pending = [], [root]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            pending.extend(children.get(pid, []))
+        trees[name] = pids
+    return trees
+
+
+def _cpu_and_rss(pids) -> tuple:
+    cpu, rss_kb = 0.0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/status") as status:
+                rss_kb += next((int(line.split()[1]) for line in status if line.startswith("VmRSS:")), 0)
+        except (OSError, IndexError, ValueError):
+            continue
+        # utime and stime, fields 14 and 15 of /proc/<pid>/stat
+        cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return cpu, rss_kb / 1024
+
+
+class _ResourceSampler:
+    """Samples the API and worker process trees, Redis and Postgres while a level runs."""
+
+    def __init__(self, roots: dict, interval: float):
+        self.roots = roots
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _read(self) -> dict:
+        sample = {"at": time.perf_counter(), "harness_cpu": time.process_time()}
+        for name, pids in _process_trees(self.roots).items():
+            sample[f"{name}_cpu"], sample[f"{name}_rss_mb"] = _cpu_and_rss(pids)
+        info = await (await redis.get_client()).info()
+        sample["redis_clients"] = info.get("connected_clients", 0)
+        sample["redis_commands"] = info.get("total_commands_processed", 0)
+        sample["redis_memory_mb"] = info.get("used_memory", 0) / (1024 * 1024)
+        activity = await db_service.execute_query(
+            "SELECT count(*) AS connections, count(*) FILTER (WHERE state = 'active') AS active "
+            "FROM pg_stat_activity WHERE datname = current_database()",
+            fetch="one",
+        )
+        sample["postgres_connections"] = activity["connections"]
+        sample["postgres_active"] = activity["active"]
+        sample["postgres_transactions"] = await db_service.execute_query(
+            "SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()",
+            fetch="val",
+        )
+        return sample
+
+    async def _loop(self) -> None:
+        while True:
+            self.samples.append(await self._read())
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.samples.append(await self._read())
+        return self.summary()
+
+    def summary(self) -> dict:
+        first, last = self.samples[0], self.samples[-1]
+        elapsed = max(last["at"] - first["at"], 1e-9)
+        pairs = list(zip(self.samples, self.samples[1:]))
+
+        def peak_rate(key):
+            rates = [(b[key] - a[key]) / max(b["at"] - a["at"], 1e-9) for a, b in pairs]
+            return max(rates) if rates else 0.0
+
+        summary = {"harness_cpu_percent": round((last["harness_cpu"] - first["harness_cpu"]) / elapsed * 100, 1)}
+        for name in self.roots:
+            summary[f"{name}_cpu_percent"] = round((last[f"{name}_cpu"] - first[f"{name}_cpu"]) / elapsed * 100, 1)
+            summary[f"{name}_cpu_percent_peak"] = round(peak_rate(f"{name}_cpu") * 100, 1)
+            summary[f"{name}_rss_mb_peak"] = round(max(s[f"{name}_rss_mb"] for s in self.samples), 1)
+        summary.update({
+            "redis_clients_peak": max(s["redis_clients"] for s in self.samples),
+            "redis_commands_per_second": round((last["redis_commands"] - first["redis_commands"]) / elapsed, 1),
+            "redis_commands_per_second_peak": round(peak_rate("redis_commands"), 1),
+            "redis_memory_mb_peak": round(max(s["redis_memory_mb"] for s in self.samples), 1),
+            "postgres_connections_peak": max(s["postgres_connections"] for s in self.samples),
+            "postgres_active_peak": max(s["postgres_active"] for s in self.samples),
+            "postgres_transactions_per_second": round(
+                (last["postgres_transactions"] - first["postgres_transactions"]) / elapsed, 1),
+        })
+        return summary
+
+
+async def _seed(count: int, prompt: str) -> tuple:
+    """A benchmark user and account with ``count`` new projects of one thread and user message each."""
+    user_id = await db_service.execute_query(
+        "INSERT INTO users (email, password_hash, full_name) VALUES ($1, 'load-test', 'Load Test') "
+        "ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name RETURNING id",
+        BENCH_EMAIL,
+        fetch="val",
+    )
+    account_id = await db_service.execute_query(
+        "INSERT INTO accounts (name, slug, personal_account) VALUES ('Load Test', $1, TRUE) "
+        "ON CONFLICT (slug) DO UPDATE SET name = EXCLUDED.name RETURNING id",
+        BENCH_ACCOUNT_SLUG,
+        fetch="val",
+    )
+    await db_service.execute_query(
+        "INSERT INTO account_users (account_id, user_id, role) VALUES ($1, $2, 'owner') ON CONFLICT DO NOTHING",
+        account_id, user_id,
+        fetch="none",
+    )
+    projects = await db_service.execute_query(
+        "INSERT INTO projects (name, account_id) SELECT 'Load test ' || i, $1 FROM generate_series(1, $2) AS i "
+        "RETURNING id",
+        account_id, count,
+    )
+    threads = await db_service.execute_query(
+        "INSERT INTO threads (account_id, project_id, title) SELECT $1, p, 'Load test' FROM unnest($2::uuid[]) AS p "
+        "RETURNING id",
+        account_id, [project["id"] for project in projects],
+    )
+    thread_ids = [thread["id"] for thread in threads]
+    await db_service.execute_query(
+        "INSERT INTO messages (thread_id, type, is_llm_message, content) "
+        "SELECT t, 'user', TRUE, jsonb_build_object('role', 'user', 'content', $2::text) FROM unnest($1::uuid[]) AS t",
+        thread_ids, prompt,
+        fetch="none",
+    )
+    return str(user_id), str(account_id), [str(thread_id) for thread_id in thread_ids]
+
+
+async def _view(http: httpx.AsyncClient, url: str, agent_run_id: str, token: str, timeout: float) -> dict:
+    """Read a run's stream until its final status; chunk latencies come from the fake LLM's send times."""
+    view = {"latencies": [], "first_chunk_at": None, "chunks": 0, "status": None, "error": None}
+    try:
+        async with asyncio.timeout(timeout):
+            async with http.stream("GET", f"{url}/agent-run/{agent_run_id}/stream", params={"token": token}) as response:
+                if response.status_code != 200:
+                    view["error"] = f"HTTP {response.status_code}"
+                    return view
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    received = time.time()
+                    stamps = CHUNK_STAMP.findall(line)
+                    if stamps:
+                        view["chunks"] += 1
+                        if view["first_chunk_at"] is None:
+                            view["first_chunk_at"] = time.perf_counter()
+                        view["latencies"].extend(received - float(stamp) for stamp in stamps)
+                    message = json.loads(line[len("data: "):])
+                    if message.get("type") == "status" and message.get("status") in FINAL_STATUSES:
+                        view["status"] = message["status"]
+                        return view
+        view["error"] = "ended without final status"
+    except TimeoutError:
+        view["error"] = "timeout"
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        view["error"] = type(e).__name__
+    return view
+
+
+async def _run_one(http: httpx.AsyncClient, url: str, thread_id: str, token: str, args) -> dict:
+    run = {"error": None, "views": []}
+    started = time.perf_counter()
+    try:
+        response = await http.post(f"{url}/thread/{thread_id}/agent/start", json={"model_name": args.model},
+                                   headers={"Authorization": f"Bearer {token}"})
+    except httpx.HTTPError as e:
+        run["error"] = type(e).__name__
+        return run
+    run["time_to_run_id"] = time.perf_counter() - started
+    if response.status_code != 200:
+        run["error"] = f"HTTP {response.status_code}"
+        return run
+    agent_run_id = response.json()["agent_run_id"]
+    have_run_id = time.perf_counter()
+    run["views"] = await asyncio.gather(*(_view(http, url, agent_run_id, token, args.run_timeout)
+                                          for _ in range(args.viewers)))
+    first_chunks = [view["first_chunk_at"] for view in run["views"] if view["first_chunk_at"] is not None]
+    if first_chunks:
+        run["time_to_first_chunk"] = min(first_chunks) - have_run_id
+    run["duration"] = time.perf_counter() - have_run_id
+    return run
+
+
+def _error_counts(errors) -> dict:
+    counts = {}
+    for error in errors:
+        if error:
+            counts[error] = counts.get(error, 0) + 1
+    return counts
+
+
+async def _run_level(url: str, runs: int, token: str, thread_ids: list, sampler: _ResourceSampler, args) -> dict:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(args.request_timeout, read=None), limits=limits) as http:
+        sampler.start()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(_run_one(http, url, thread_id, token, args) for thread_id in thread_ids))
+        elapsed = time.perf_counter() - started
+        resources = await sampler.stop()
+
+    views = [view for run in results for view in run["views"]]
+    latencies = [latency for view in views for latency in view["latencies"]]
+    failed_runs = [run for run in results
+                   if run["views"] and not any(view["status"] == "completed" for view in run["views"])]
+    viewer_errors = [view["error"] for view in views if view["error"]]
+    start_errors = [run["error"] for run in results if run["error"]]
+    problems = len(start_errors) + len(failed_runs)
+    to_run_id = [run["time_to_run_id"] for run in results if "time_to_run_id" in run]
+    to_first_chunk = [run["time_to_first_chunk"] for run in results if "time_to_first_chunk" in run]
+    return {
+        "concurrent_runs": runs,
+        "viewers": len(views),
+        "seconds": round(elapsed, 2),
+        "time_to_run_id_p50_ms": _percentile(to_run_id, 0.5),
+        "time_to_run_id_p95_ms": _percentile(to_run_id, 0.95),
+        "time_to_run_id_max_ms": _percentile(to_run_id, 1.0),
+        "time_to_first_chunk_p50_ms": _percentile(to_first_chunk, 0.5),
+        "time_to_first_chunk_p95_ms": _percentile(to_first_chunk, 0.95),
+        "chunk_latency_p50_ms": _percentile(latencies, 0.5),
+        "chunk_latency_p95_ms": _percentile(latencies, 0.95),
+        "chunk_latency_p99_ms": _percentile(latencies, 0.99),
+        "chunks_delivered_per_second": round(len(latencies) / elapsed, 1),
+        "run_duration_p50_ms": _percentile([run["duration"] for run in results if "duration" in run], 0.5),
+        "start_errors": _error_counts(start_errors),
+        "viewer_errors": _error_counts(viewer_errors),
+        "final_statuses": _error_counts(view["status"] for view in views),
+        "error_percent": round(problems / runs * 100, 1),
+        "viewer_error_percent": round(len(viewer_errors) / len(views) * 100, 1) if views else 0.0,
+        "resources": resources,
+    }
+
+
+# Metrics of ``curves``, with the layer whose limit they show
+CURVE_METRICS = (
+    ("time_to_run_id_p95_ms", "api/postgres"),
+    ("time_to_first_chunk_p95_ms", "worker"),
+    ("chunk_latency_p95_ms", "redis/stream"),
+)
+
+
+def _curves(levels: list, roots: dict) -> dict:
+    curves = {"concurrent_runs": [level["concurrent_runs"] for level in levels]}
+    for metric, _ in CURVE_METRICS:
+        curves[metric] = [level[metric] for level in levels]
+    curves["chunks_delivered_per_second"] = [level["chunks_delivered_per_second"] for level in levels]
+    curves["error_percent"] = [level["error_percent"] for level in levels]
+    resource_keys = [f"{name}_cpu_percent" for name in roots] + [
+        "redis_commands_per_second", "redis_clients_peak", "postgres_active_peak", "postgres_transactions_per_second"]
+    for key in resource_keys:
+        curves[key] = [level["resources"][key] for level in levels]
+    return curves
+
+
+def _limits(levels: list, knee_factor: float, max_error_percent: float) -> dict:
+    limits = {}
+    for metric, layer in CURVE_METRICS:
+        baseline = levels[0][metric]
+        knee = next((level["concurrent_runs"] for level in levels[1:]
+                     if baseline and level[metric] is not None and level[metric] > baseline * knee_factor), None)
+        limits[metric] = {"layer": layer, "baseline_ms": baseline, "saturates_at_runs": knee}
+    limits["errors"] = {"max_error_percent": max_error_percent, "exceeded_at_runs": next(
+        (level["concurrent_runs"] for level in levels
+         if max(level["error_percent"], level["viewer_error_percent"]) > max_error_percent), None)}
+    return limits
+
+
+def _spawn(args, llm_api_base: str, metrics_dir: str) -> tuple:
+    env = {**os.environ, "ENV_MODE": "local", "OPENAI_API_BASE": llm_api_base, "OPENAI_API_KEY": "fake",
+           "PROMETHEUS_MULTIPROC_DIR": metrics_dir}
+    port = _free_port()
+    output = None if args.verbose else subprocess.DEVNULL
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--workers", str(args.api_workers),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=output, stderr=output,
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "dramatiq", "--processes", str(args.worker_processes),
+         "--threads", str(args.worker_threads), "run_agent_background"],
+        cwd=BACKEND_DIR, env=env, stdout=output, stderr=output,
+    )
+    url = f"http://127.0.0.1:{port}/api"
+    started = time.perf_counter()
+    while True:
+        for process in (api, worker):
+            if process.poll() is not None:
+                raise RuntimeError(f"{process.args[2]} exited with status {process.returncode} during startup")
+        if time.perf_counter() - started > args.startup_timeout:
+            raise RuntimeError(f"API not healthy after {args.startup_timeout}s")
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=1) as response:
+                if response.status == 200:
+                    break
+        except OSError:
+            time.sleep(0.1)
+    return url, [api, worker]
+
+
+async def _run(args, url: str, roots: dict) -> dict:
+    levels = []
+    created = set()
+    for runs in args.levels:
+        user_id, account_id, thread_ids = await _seed(runs, args.prompt)
+        created.add(account_id)
+        token = jwt.encode({"sub": user_id, "email": BENCH_EMAIL}, "load-test", algorithm="HS256")
+        sampler = _ResourceSampler(roots, args.sample_interval)
+        levels.append(await _run_level(url, runs, token, thread_ids, sampler, args))
+        await asyncio.sleep(args.pause)
+    if not args.keep:
+        for account_id in created:
+            await db_service.execute_query("DELETE FROM projects WHERE account_id = $1", uuid.UUID(account_id),
+                                           fetch="none")
+    return {
+        "url": url,
+        "viewers_per_run": args.viewers,
+        "reply_tokens": args.reply_tokens,
+        "levels": levels,
+        "curves": _curves(levels, roots),
+        "limits": _limits(levels, args.knee_factor, args.max_error_percent),
+    }
+
+
+async def _main(args, url: str, roots: dict) -> dict:
+    await redis.initialize_async()
+    await db_service.initialize()
+    try:
+        return await _run(args, url, roots)
+    finally:
+        await redis.close()
+        await db_service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=lambda value: [int(v) for v in value.split(",")], default=[1, 5, 10, 25, 50],
+                        help="Comma-separated concurrent run counts")
+    parser.add_argument("--viewers", type=int, default=2, help="SSE viewers per run")
+    parser.add_argument("--model", default="openai/fake", help="Model name sent to the start endpoint")
+    parser.add_argument("--prompt", default="Write a short status report.", help="User message of the seeded threads")
+    parser.add_argument("--reply-tokens", type=int, default=200, help="Streamed chunks per fake LLM reply")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Fake LLM time to first token")
+    parser.add_argument("--token-delay-ms", type=float, default=10, help="Fake LLM delay between chunks")
+    parser.add_argument("--url", help="Base URL of a running API (e.g. http://127.0.0.1:8000/api) instead of spawning")
+    parser.add_argument("--api-workers", type=int, default=1, help="uvicorn workers of the spawned API")
+    parser.add_argument("--worker-processes", type=int, default=1, help="dramatiq processes of the spawned worker")
+    parser.add_argument("--worker-threads", type=int, default=8, help="dramatiq threads per worker process")
+    parser.add_argument("--startup-timeout", type=float, default=60, help="Seconds to wait for the spawned API")
+    parser.add_argument("--request-timeout", type=float, default=30, help="Timeout of start requests")
+    parser.add_argument("--run-timeout", type=float, default=120, help="Seconds a viewer waits for the final status")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between resource samples")
+    parser.add_argument("--pause", type=float, default=2, help="Seconds between levels")
+    parser.add_argument("--knee-factor", type=float, default=2.0,
+                        help="Growth over the lowest level's latency that counts as saturated")
+    parser.add_argument("--max-error-percent", type=float, default=1.0, help="Error rate that counts as saturated")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded projects and threads")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the spawned API and worker")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    ready, stop = context.Queue(), context.Event()
+    fake_llm = context.Process(target=_serve_fake_llm, args=(args, ready, stop), daemon=True)
+    fake_llm.start()
+    llm_api_base = ready.get(timeout=30)
+    processes = []
+    try:
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            if args.url:
+                print(f"Fake LLM at {llm_api_base} (start the workers with OPENAI_API_BASE={llm_api_base})",
+                      file=sys.stderr)
+                url, roots = args.url.rstrip("/"), {}
+            else:
+                url, processes = _spawn(args, llm_api_base, metrics_dir)
+                roots = {"api": processes[0].pid, "worker": processes[1].pid}
+            results = asyncio.run(_main(args, url, roots))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        stop.set()
+        fake_llm.join(timeout=10)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Streaming throughput and event-loop latency with heavy logging.
+
+Runs ``--runs`` concurrent stand-ins of a streamed agent run in one event
+loop. Each streams ``--chunks`` chunks and, per chunk, logs
+``--info-per-chunk`` INFO and ``--debug-per-chunk`` DEBUG records from fixed
+call sites, the way the response processor and tools log while streaming.
+Records go to a rotating log file in a temporary directory and to a console
+stream taking ``--console-write-ms`` per write (``SlowStream``). Four setups
+of ``utils.logger`` are measured:
+
+- direct: the handlers called on the event loop, as before
+- queued: ``LogPipeline`` without rate limits or sampling
+- limited: ``LogPipeline`` with ``--rate-limit`` records per call site and
+  second and ``--debug-sample-percent`` of DEBUG records
+- info: as limited, with the handlers at INFO, so DEBUG calls stop at the
+  logger's level check
+
+Reports chunks per second, event-loop lag (overshoot of a 5ms ticker), the
+records written and, for the pipelines, the time to drain the queue and the
+dropped, rate-limited and sampled-out counts.
+
+Usage (from the backend directory):
+    python -m benchmarks.logging_overhead --runs 50 --chunks 400
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+from benchmarks.fakes import SlowStream
+from utils.logger import LogPipeline
+
+# Interval of the event-loop lag probe, in seconds
+TICK_SECONDS = 0.005
+
+
+class _CountingFilter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.records = 0
+
+    def filter(self, record):
+        self.records += 1
+        return True
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+def _handlers(args, log_dir: str, name: str, level: int):
+    """File and console handlers with the formats ``setup_logger`` uses."""
+    file_handler = RotatingFileHandler(os.path.join(log_dir, f"{name}.log"), maxBytes=10 * 1024 * 1024,
+                                       backupCount=5, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"))
+    console_handler = logging.StreamHandler(SlowStream(args.console_write_ms / 1000))
+    console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+    counter = _CountingFilter()
+    for handler in (file_handler, console_handler):
+        handler.setLevel(level)
+        handler.addFilter(counter)
+    return [file_handler, console_handler], counter
+
+
+async def _stream_run(logger: logging.Logger, run_index: int, args) -> int:
+    content = ""
+    for chunk_index in range(args.chunks):
+        content += f"tok{chunk_index} "
+        for _ in range(args.info_per_chunk):
+            logger.info(f"Run {run_index}: processed chunk {chunk_index} ({len(content)} chars)")
+        for _ in range(args.debug_per_chunk):
+            logger.debug(f"Run {run_index}: no XML tool call in chunk {chunk_index}: {content[-20:]!r}")
+        await asyncio.sleep(0)
+    return args.chunks
+
+
+async def _measure(logger: logging.Logger, args) -> dict:
+    lags = []
+    running = True
+
+    async def probe():
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    chunks = await asyncio.gather(*(_stream_run(logger, i, args) for i in range(args.runs)))
+    elapsed = time.perf_counter() - started
+    running = False
+    await probe_task
+    return {
+        "chunks_per_second": round(sum(chunks) / elapsed, 1),
+        "event_loop_lag_p50_ms": _percentile(lags, 0.5),
+        "event_loop_lag_p99_ms": _percentile(lags, 0.99),
+        "event_loop_lag_max_ms": round(max(lags) * 1000, 2) if lags else None,
+    }
+
+
+async def _run(args, log_dir: str) -> dict:
+    results = {"runs": args.runs, "chunks_per_run": args.chunks,
+               "calls": args.runs * args.chunks * (args.info_per_chunk + args.debug_per_chunk)}
+    setups = (
+        ("direct", logging.DEBUG, None),
+        ("queued", logging.DEBUG, (0, 100)),
+        ("limited", logging.DEBUG, (args.rate_limit, args.debug_sample_percent)),
+        ("info", logging.INFO, (args.rate_limit, args.debug_sample_percent)),
+    )
+    for name, level, limits in setups:
+        logger = logging.getLogger(f"benchmarks.logging_overhead.{name}")
+        logger.propagate = False
+        handlers, counter = _handlers(args, log_dir, name, level)
+        pipeline = None
+        if limits is None:
+            for handler in handlers:
+                logger.addHandler(handler)
+        else:
+            pipeline = LogPipeline(handlers, queue_size=args.queue_size, rate_limit_per_second=limits[0],
+                                   debug_sample_percent=limits[1])
+            logger.addHandler(pipeline.handler)
+        logger.setLevel(level)
+
+        results[name] = await _measure(logger, args)
+        if pipeline is not None:
+            drain_started = time.perf_counter()
+            pipeline.stop()
+            results[name]["drain_seconds"] = round(time.perf_counter() - drain_started, 2)
+            results[name]["pipeline"] = pipeline.get_stats()
+        # Each record passes the counter once per handler
+        results[name]["records_written"] = counter.records // len(handlers)
+        for handler in handlers:
+            handler.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50, help="Concurrent runs")
+    parser.add_argument("--chunks", type=int, default=400, help="Streamed chunks per run")
+    parser.add_argument("--info-per-chunk", type=int, default=1, help="INFO records per chunk")
+    parser.add_argument("--debug-per-chunk", type=int, default=2, help="DEBUG records per chunk")
+    parser.add_argument("--console-write-ms", type=float, default=0.05, help="Milliseconds per console write")
+    parser.add_argument("--rate-limit", type=int, default=20, help="Records per call site and second when limited")
+    parser.add_argument("--debug-sample-percent", type=int, default=10, help="DEBUG records kept when limited")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Log queue size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        print(json.dumps(asyncio.run(_run(args, log_dir)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Scrape check of the Prometheus metrics exposition.
+
+With ``--url``, scrapes a running endpoint (``/api/metrics`` of the API or the
+worker's metrics port) ``--scrapes`` times and reports the scrape latency, the
+payload size and which of the expected metric families are present.
+
+Without it, checks multi-process aggregation locally: ``--processes`` child
+processes record ``--observations`` samples of every metric into a temporary
+``PROMETHEUS_MULTIPROC_DIR``, like gunicorn or dramatiq worker processes,
+and the merged exposition is then parsed and verified:
+
+- every expected family is present
+- histogram buckets are cumulative and the ``+Inf`` bucket equals the count
+- counters and histogram counts equal the sum over all processes
+- the in-progress gauge sums the values of the live processes
+
+Usage (from the backend directory):
+    python -m benchmarks.metrics_scrape --processes 8
+    python -m benchmarks.metrics_scrape --url http://localhost:8000/api/metrics
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import urllib.request
+
+# Families every exposition contains once the processes have done some work
+EXPECTED_FAMILIES = (
+    "neo_http_request_duration_seconds",
+    "neo_stream_chunks",
+    "neo_tool_execution_duration_seconds",
+    "neo_llm_time_to_first_token_seconds",
+    "neo_llm_tokens_per_second",
+    "neo_db_pool_wait_seconds",
+    "neo_redis_command_duration_seconds",
+    "neo_agent_runs_in_progress",
+)
+
+
+def _record(observations: int, ready, release) -> None:
+    """Child process: record samples of every metric, then stay alive until released."""
+    from services import prometheus as metrics
+
+    for i in range(observations):
+        seconds = (i % 100) / 1000
+        metrics.REQUEST_DURATION.labels(method="GET", route="/api/thread/{thread_id}", status="200").observe(seconds)
+        metrics.WORKER_STREAM_CHUNKS.inc()
+        metrics.API_STREAM_CHUNKS.inc()
+        metrics.TOOL_DURATION.labels(tool="web_search", status="success").observe(seconds * 10)
+        metrics.LLM_TIME_TO_FIRST_TOKEN.labels(model="fake").observe(seconds * 20)
+        metrics.observe_llm_stream("fake", chunks=50, usage=None, seconds=1.0)
+        metrics.DB_POOL_WAIT.observe(seconds / 100)
+        metrics.REDIS_COMMAND_DURATION.labels(command="rpush").observe(seconds / 100)
+    metrics.AGENT_RUNS_IN_PROGRESS.inc()
+    ready.set()
+    release.wait()
+
+
+def _samples(text: str) -> dict:
+    from prometheus_client.parser import text_string_to_metric_families
+
+    return {family.name: family.samples for family in text_string_to_metric_families(text)}
+
+
+def _check_histograms(families: dict) -> list:
+    """Problems with bucket monotonicity or +Inf versus count, per label set."""
+    problems = []
+    for name, samples in families.items():
+        series = {}
+        for sample in samples:
+            labels = {k: v for k, v in sample.labels.items() if k != "le"}
+            key = tuple(sorted(labels.items()))
+            entry = series.setdefault(key, {"buckets": [], "count": None})
+            if sample.name.endswith("_bucket"):
+                entry["buckets"].append((float(sample.labels["le"]), sample.value))
+            elif sample.name.endswith("_count"):
+                entry["count"] = sample.value
+        for key, entry in series.items():
+            if not entry["buckets"]:
+                continue
+            values = [value for _, value in sorted(entry["buckets"])]
+            if any(later < earlier for earlier, later in zip(values, values[1:])):
+                problems.append(f"{name}{dict(key)}: buckets not cumulative")
+            if values[-1] != entry["count"]:
+                problems.append(f"{name}{dict(key)}: +Inf bucket {values[-1]} != count {entry['count']}")
+    return problems
+
+
+def _value(samples, sample_name: str, **labels) -> float:
+    return sum(
+        sample.value for sample in samples
+        if sample.name == sample_name and all(sample.labels.get(k) == v for k, v in labels.items())
+    )
+
+
+def _self_check(args) -> dict:
+    directory = tempfile.mkdtemp(prefix="neo_prometheus_")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    # Spawned children import prometheus_client with the directory already set
+    context = multiprocessing.get_context("spawn")
+    ready = [context.Event() for _ in range(args.processes)]
+    release = context.Event()
+    children = [context.Process(target=_record, args=(args.observations, ready[i], release))
+                for i in range(args.processes)]
+    started = time.perf_counter()
+    for child in children:
+        child.start()
+    for event in ready:
+        event.wait()
+    record_seconds = time.perf_counter() - started
+
+    from services.prometheus import render_metrics
+
+    latencies = []
+    for _ in range(args.scrapes):
+        scrape_started = time.perf_counter()
+        text = render_metrics().decode()
+        latencies.append(time.perf_counter() - scrape_started)
+    release.set()
+    for child in children:
+        child.join()
+
+    families = _samples(text)
+    expected_total = args.processes * args.observations
+    checks = {
+        "stream_chunks_worker": _value(families["neo_stream_chunks"], "neo_stream_chunks_total", source="worker"),
+        "request_duration_count": _value(families["neo_http_request_duration_seconds"],
+                                         "neo_http_request_duration_seconds_count"),
+        "tool_duration_count": _value(families["neo_tool_execution_duration_seconds"],
+                                      "neo_tool_execution_duration_seconds_count"),
+        "redis_command_count": _value(families["neo_redis_command_duration_seconds"],
+                                      "neo_redis_command_duration_seconds_count"),
+    }
+    runs_in_progress = _value(families["neo_agent_runs_in_progress"], "neo_agent_runs_in_progress")
+    problems = _check_histograms(families)
+    problems += [f"missing family {name}" for name in EXPECTED_FAMILIES if name not in families]
+    problems += [f"{name} = {value}, expected {expected_total}" for name, value in checks.items()
+                 if value != expected_total]
+    if runs_in_progress != args.processes:
+        problems.append(f"runs in progress = {runs_in_progress}, expected {args.processes}")
+    return {
+        "processes": args.processes,
+        "observations_per_process": args.observations,
+        "record_seconds": round(record_seconds, 2),
+        "files": len(os.listdir(directory)),
+        "payload_bytes": len(text),
+        "scrape_p50_ms": _ms(latencies, 0.5),
+        "scrape_max_ms": round(max(latencies) * 1000, 2),
+        "sums": checks,
+        "runs_in_progress": runs_in_progress,
+        "problems": problems,
+        "ok": not problems,
+    }
+
+
+def _scrape_url(args) -> dict:
+    latencies = []
+    for _ in range(args.scrapes):
+        started = time.perf_counter()
+        with urllib.request.urlopen(args.url, timeout=30) as response:
+            text = response.read().decode()
+            content_type = response.headers.get("Content-Type")
+        latencies.append(time.perf_counter() - started)
+    families = _samples(text)
+    problems = _check_histograms(families)
+    return {
+        "url": args.url,
+        "content_type": content_type,
+        "payload_bytes": len(text),
+        "families": len(families),
+        "missing_families": [name for name in EXPECTED_FAMILIES if name not in families],
+        "scrape_p50_ms": _ms(latencies, 0.5),
+        "scrape_max_ms": round(max(latencies) * 1000, 2),
+        "problems": problems,
+        "ok": not problems,
+    }
+
+
+def _ms(values, pct):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Metrics endpoint to scrape instead of the local multi-process check")
+    parser.add_argument("--processes", type=int, default=8, help="Recording processes in the local check")
+    parser.add_argument("--observations", type=int, default=1000, help="Samples per metric and process")
+    parser.add_argument("--scrapes", type=int, default=20, help="Scrapes to time")
+    args = parser.parse_args()
+
+    results = _scrape_url(args) if args.url else _self_check(args)
+    print(json.dumps(results, indent=2))
+    if not results["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Per-operation instrumentation overhead of ``PerformanceMonitor``.
+
+Measures, on a fresh monitor:
+
+- ns per recorded operation for ``observe_operation``, a
+  ``start_operation``/``end_operation`` pair and a ``@monitor_performance``
+  decorated call (minus the undecorated call), with ``--threads`` writer
+  threads recording the same operation
+- a paced run at ``--rate`` operations per second for ``--seconds``: CPU
+  share of the instrumentation (process CPU time with instrumentation minus
+  the same loop without it) and the achieved rate
+- accuracy of the histogram percentiles and of the sliding-window
+  throughput against the exact values of the recorded durations
+
+Usage (from the backend directory):
+    python -m benchmarks.performance_monitor_overhead --ops 200000 --rate 100000
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+from utils import performance_monitor as pm
+
+
+def _durations(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    # Log-normal around 20ms with a long tail, like API and tool calls
+    return [rng.lognormvariate(-4, 1) for _ in range(count)]
+
+
+def _threaded(threads: int, work) -> float:
+    """Run ``work(thread_index)`` on ``threads`` threads; return wall seconds."""
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def _ns_per_op(args) -> dict:
+    durations = _durations(args.ops, seed=1)
+    per_thread = args.ops // args.threads
+    results = {}
+
+    monitor = pm.PerformanceMonitor()
+
+    def observe(index):
+        for duration in durations[index * per_thread:(index + 1) * per_thread]:
+            monitor.observe_operation("bench", duration)
+
+    results["observe_operation_ns"] = round(_threaded(args.threads, observe) / (per_thread * args.threads) * 1e9)
+
+    def start_end(index):
+        for _ in range(per_thread):
+            monitor.end_operation(monitor.start_operation("bench_pair"))
+
+    results["start_end_pair_ns"] = round(_threaded(args.threads, start_end) / (per_thread * args.threads) * 1e9)
+
+    pm.performance_monitor = monitor
+
+    def plain():
+        return None
+
+    decorated = pm.monitor_performance("bench_decorated")(plain)
+
+    def call(function):
+        def work(index):
+            for _ in range(per_thread):
+                function()
+        return work
+
+    plain_seconds = _threaded(args.threads, call(plain))
+    decorated_seconds = _threaded(args.threads, call(decorated))
+    results["decorator_overhead_ns"] = round((decorated_seconds - plain_seconds) / (per_thread * args.threads) * 1e9)
+    return results
+
+
+def _paced(args, instrumented: bool) -> dict:
+    monitor = pm.PerformanceMonitor()
+    durations = _durations(args.rate, seed=2)
+    tick = 0.01
+    per_tick = max(1, int(args.rate * tick))
+    ops = 0
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    next_tick = started
+    while time.perf_counter() - started < args.seconds:
+        for i in range(per_tick):
+            duration = durations[(ops + i) % len(durations)]
+            if instrumented:
+                monitor.observe_operation("paced", duration)
+        ops += per_tick
+        next_tick += tick
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.perf_counter() - started
+    return {
+        "ops_per_second": round(ops / elapsed),
+        "cpu_seconds": time.process_time() - cpu_started,
+        "elapsed": elapsed,
+        "throughput_reported": round(monitor.get_operation_metrics("paced").throughput_per_second) if instrumented else None,
+    }
+
+
+def _accuracy(args) -> dict:
+    monitor = pm.PerformanceMonitor()
+    durations = _durations(args.ops, seed=3)
+    for duration in durations:
+        monitor.observe_operation("accuracy", duration)
+    metrics = monitor.get_operation_metrics("accuracy")
+    exact = sorted(durations)
+    result = {}
+    for label, q, estimate in (("p50", 0.5, metrics.p50_duration), ("p95", 0.95, metrics.p95_duration),
+                               ("p99", 0.99, metrics.p99_duration)):
+        actual = exact[min(len(exact) - 1, int(len(exact) * q))]
+        result[f"{label}_ms"] = round(estimate * 1000, 3)
+        result[f"{label}_relative_error"] = round(abs(estimate - actual) / actual, 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=200000, help="Operations per ns/op measurement")
+    parser.add_argument("--threads", type=int, default=1, help="Writer threads")
+    parser.add_argument("--rate", type=int, default=100000, help="Operations per second in the paced run")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each paced run")
+    args = parser.parse_args()
+
+    results = {"threads": args.threads, "ns_per_op": _ns_per_op(args)}
+    baseline = _paced(args, instrumented=False)
+    instrumented = _paced(args, instrumented=True)
+    overhead = instrumented["cpu_seconds"] - baseline["cpu_seconds"] * instrumented["elapsed"] / baseline["elapsed"]
+    results["paced"] = {
+        "target_ops_per_second": args.rate,
+        "achieved_ops_per_second": instrumented["ops_per_second"],
+        "reported_throughput_per_second": instrumented["throughput_reported"],
+        "instrumentation_cpu_percent": round(overhead / instrumented["elapsed"] * 100, 2),
+    }
+    results["accuracy"] = _accuracy(args)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark for cached system prompt assembly.
+
+Compares the previous per-run prompt assembly (read the sample response from
+disk, rebuild the base prompt, append the XML examples again and count the
+whole system prompt's tokens on every iteration) with the cached
+``get_system_prompt_assembly`` path. Each iteration also makes a call to a
+fake local LLM endpoint so the numbers are in proportion to a real loop.
+
+Reports run startup latency (prompt ready), per-iteration CPU time and the
+prompt token count of the last iteration; the modes agree up to the few
+tokens of message framing counted twice when the system prompt is counted
+separately.
+
+Usage (from the backend directory):
+    python -m benchmarks.prompt_assembly --runs 20 --iterations 10
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeLLMServer
+from benchmarks.tool_registry_dispatch import _build_registry
+
+MODEL = "openai/fake"
+
+
+def _thread_manager(tools: int):
+    from agentpress.thread_manager import ThreadManager
+
+    manager = SimpleNamespace(tool_registry=_build_registry(tools, 0), _xml_examples_prompt=None)
+    manager.get_xml_examples_prompt = lambda: ThreadManager.get_xml_examples_prompt(manager)
+    return manager
+
+
+def _legacy_system_message(agent_config):
+    from agent.prompt_assembly import build_system_content, _sample_response
+
+    # The previous code read the sample response file from disk on every run
+    _sample_response.cache_clear()
+    content = build_system_content(MODEL, agent_config, False, None)
+    return {"role": "system", "content": content}
+
+
+async def _run(args) -> dict:
+    from litellm import token_counter
+    from agent.prompt_assembly import get_system_prompt_assembly
+    from services.llm import make_llm_api_call
+
+    messages = [
+        {"role": "user", "content": "Build a landing page " * 50},
+        {"role": "assistant", "content": "Working on it. " * 200},
+    ]
+    results = {}
+    with FakeLLMServer(first_token_latency=0.0, token_delay=0.0, reply_tokens=20) as server:
+        for mode in ("legacy", "cached"):
+            startup, iteration_cpu = [], []
+            token_count = None
+            for run in range(args.runs):
+                manager = _thread_manager(args.tools)
+                agent_config = {"agent_id": f"agent-{run % args.agents}", "agentpress_tools": {}}
+
+                started = time.perf_counter()
+                if mode == "legacy":
+                    system_message = _legacy_system_message(agent_config)
+                    system_tokens = None
+                else:
+                    assembly = get_system_prompt_assembly(manager, MODEL, agent_config=agent_config)
+                    system_message, system_tokens = assembly.system_message, assembly.token_count
+                startup.append(time.perf_counter() - started)
+
+                for _ in range(args.iterations):
+                    cpu_started = time.process_time()
+                    working = system_message.copy()
+                    if mode == "legacy":
+                        working["content"] += manager.get_xml_examples_prompt()
+                        token_count = token_counter(model=MODEL, messages=[working] + messages)
+                    else:
+                        token_count = system_tokens + token_counter(model=MODEL, messages=messages)
+                    await make_llm_api_call(
+                        [working] + messages, MODEL, api_key="fake", api_base=server.api_base, max_tokens=50
+                    )
+                    iteration_cpu.append(time.process_time() - cpu_started)
+
+            results[mode] = {
+                "startup_avg_ms": round(sum(startup) / len(startup) * 1000, 3),
+                "startup_max_ms": round(max(startup) * 1000, 3),
+                "iteration_cpu_avg_ms": round(sum(iteration_cpu) / len(iteration_cpu) * 1000, 3),
+                "prompt_tokens": token_count,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=10, help="LLM iterations per run")
+    parser.add_argument("--agents", type=int, default=3, help="Distinct agent configurations across runs")
+    parser.add_argument("--tools", type=int, default=30, help="Registered XML tools")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
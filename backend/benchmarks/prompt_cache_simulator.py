@@ -0,0 +1,128 @@
+"""
+Offline simulator for Anthropic prompt-cache breakpoint strategies.
+
+Replays recorded or synthetic threads request by request and estimates the
+cache-read, cache-write and uncached input tokens for each strategy:
+
+- legacy: system prompt, last two user and last assistant messages
+- planner: CacheBreakpointPlanner from services.prompt_cache
+
+Input files (``--file``, repeatable) may contain either
+``{"requests": [[message, ...], ...]}`` with the exact message lists that were
+sent, or a thread export ``{"system_prompt": {...}, "messages": [...]}`` /
+``[message, ...]`` from which one request per assistant turn is derived.
+Without files, ``--synthetic`` threads are generated, including temporary
+messages and compression rewriting older tool results.
+
+Usage (from the backend directory):
+    python -m benchmarks.prompt_cache_simulator --synthetic 20 --iterations 30
+    python -m benchmarks.prompt_cache_simulator --file thread_export.json
+"""
+
+import argparse
+import copy
+import json
+import random
+
+from services.prompt_cache import (
+    CACHE_READ_COST,
+    CACHE_WRITE_COST,
+    CacheBreakpointPlanner,
+    legacy_breakpoints,
+    simulate_request,
+)
+
+
+def _requests_from_file(path: str):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "requests" in data:
+        return data["requests"]
+
+    if isinstance(data, dict):
+        system_prompt = data.get("system_prompt")
+        messages = data.get("messages", [])
+    else:
+        system_prompt, messages = None, data
+    prefix = [system_prompt] if system_prompt else []
+    return [prefix + messages[:i] for i, m in enumerate(messages) if m.get("role") == "assistant" and i > 0]
+
+
+def _synthetic_thread(rnd: random.Random, iterations: int, compress_every: int):
+    system = {"role": "system", "content": "You are an agent. " + "Tool example. " * 4000}
+    history = [{"role": "user", "content": "Build me a website " * 20}]
+    requests = []
+    for step in range(iterations):
+        request = [system] + copy.deepcopy(history)
+        if step % 5 == 0:
+            # Temporary message inserted before the last user message for this call only
+            last_user = max(i for i, m in enumerate(request) if m["role"] == "user")
+            request.insert(last_user, {"role": "user", "content": "Temporary context " * 30})
+        requests.append(request)
+
+        history.append({"role": "assistant", "content": f"Step {step}: running a tool. " * rnd.randint(5, 50)})
+        history.append({"role": "user", "content": f"<tool_result>{'output ' * rnd.randint(50, 2000)}</tool_result>"})
+        if compress_every and step and step % compress_every == 0:
+            # Compression truncates an older, long tool result
+            for message in history[:-6]:
+                if len(message["content"]) > 4000:
+                    message["content"] = message["content"][:2000] + "... (truncated)"
+                    break
+    return requests
+
+
+def _simulate(threads, strategy: str, interval: float) -> dict:
+    read = write = uncached = 0
+    for requests in threads:
+        cache = {}
+        planner = CacheBreakpointPlanner()
+        now = 0.0
+        for messages in requests:
+            messages = copy.deepcopy(messages)
+            if strategy == "planner":
+                breakpoints = planner.plan(messages, now=now)
+                planner.record(messages, breakpoints, now=now)
+            else:
+                breakpoints = legacy_breakpoints(messages)
+            r, w, u = simulate_request(messages, breakpoints, cache, now)
+            read, write, uncached = read + r, write + w, uncached + u
+            now += interval
+
+    total = read + write + uncached
+    cost = read * CACHE_READ_COST + write * CACHE_WRITE_COST + uncached
+    return {
+        "input_tokens": total,
+        "cache_read_tokens": read,
+        "cache_write_tokens": write,
+        "uncached_tokens": uncached,
+        "cache_read_ratio": round(read / total, 4) if total else 0,
+        "relative_input_cost": round(cost / total, 4) if total else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", action="append", default=[], help="Recorded thread or request log (JSON)")
+    parser.add_argument("--synthetic", type=int, default=20, help="Synthetic threads when no files are given")
+    parser.add_argument("--iterations", type=int, default=30, help="Requests per synthetic thread")
+    parser.add_argument("--compress-every", type=int, default=7, help="Rewrite an old message every N iterations (0 = never)")
+    parser.add_argument("--interval", type=float, default=20.0, help="Seconds between requests (cache TTL is 5 minutes)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.file:
+        threads = [_requests_from_file(path) for path in args.file]
+    else:
+        rnd = random.Random(args.seed)
+        threads = [_synthetic_thread(rnd, args.iterations, args.compress_every) for _ in range(args.synthetic)]
+
+    results = {
+        "threads": len(threads),
+        "requests": sum(len(t) for t in threads),
+        "strategies": {strategy: _simulate(threads, strategy, args.interval) for strategy in ("legacy", "planner")},
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
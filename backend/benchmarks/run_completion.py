@@ -0,0 +1,225 @@
+"""
+Completion latency and worker memory of agent runs with many responses.
+
+Each mode runs in its own process against the local Redis and Postgres. A
+run of ``--responses`` responses (streamed content chunks of 150-400 bytes
+and, every ``--tool-every`` responses, a tool result of ``--tool-kb``) is
+published to the run's Redis list as the worker does, then completed:
+
+- legacy: the previous completion path: ``lrange`` of the whole list, every
+  response parsed, the list written as one JSONB document with the status
+  (to a scratch table, the local schema has no ``responses`` column), then a
+  verification select
+- chunked: responses handed to ``ResponseLog`` while they are published, so
+  completion writes the last chunk and makes one small status update
+
+Reports per mode the completion latency, the growth of the process's peak
+RSS during completion over its RSS before it (peak reset through
+``/proc/self/clear_refs``), the per-response cost of ``ResponseLog.add``
+during the run, and the bytes stored. The chunked archive is read back with
+``read_responses`` and compared with what was published.
+
+Needs the local Redis and Postgres from docker-compose (REDIS_* and
+DATABASE_* settings as for the API) with the init scripts applied.
+
+Usage (from the backend directory):
+    python -m benchmarks.run_completion --responses 50000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Scratch table standing in for agent_runs.responses in legacy mode
+LEGACY_TABLE = "run_completion_benchmark"
+
+
+def _responses(count: int, tool_every: int, tool_kb: int, thread_id: str):
+    """The responses of a run, generated on the fly so the run itself holds none of them."""
+    rnd = random.Random(0)
+    words = ["the", "file", "deploy", "update", "result", "config", "error", "test", "project", "page"]
+    for index in range(count):
+        if tool_every and index % tool_every == tool_every - 1:
+            output = " ".join(rnd.choices(words, k=tool_kb * 170))
+            content = json.dumps({"role": "user", "content": json.dumps(
+                {"tool_execution": {"function_name": "execute_command", "result": {"success": True, "output": output}}})})
+            yield {"type": "tool", "message_id": str(uuid.UUID(int=rnd.getrandbits(128))), "thread_id": thread_id,
+                   "content": content, "metadata": "{}"}
+        else:
+            content = json.dumps({"role": "assistant", "content": " ".join(rnd.choices(words, k=rnd.randint(5, 40)))})
+            yield {"type": "assistant", "message_id": None, "thread_id": thread_id, "content": content,
+                   "metadata": json.dumps({"stream_status": "chunk", "thread_run_id": thread_id})}
+
+
+def _memory() -> dict:
+    """Current and peak RSS of this process in KB."""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                values[line.split(":")[0]] = int(line.split()[1])
+    return values
+
+
+def _reset_peak() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+async def _complete(mode: str, agent_run_id: str, thread_id: str, args) -> dict:
+    from services import redis
+    from services.database import db_service
+    from services.response_log import ResponseLog, read_responses, response_list_key
+
+    await redis.initialize_async()
+    await db_service.initialize()
+    key = response_list_key(agent_run_id)
+    await redis.delete(key)
+    redis_client = await redis.get_client()
+    log = ResponseLog(agent_run_id) if mode == "chunked" else None
+
+    # The run: publish every response; the worker makes one RPUSH each, batched here
+    add_cpu, published = 0.0, 0
+    pipe = redis_client.pipeline(transaction=False)
+    for response in _responses(args.responses, args.tool_every, args.tool_kb, thread_id):
+        response_json = json.dumps(response)
+        pipe.rpush(key, response_json)
+        published += len(response_json)
+        if log is not None:
+            started = time.process_time()
+            log.add(response_json)
+            add_cpu += time.process_time() - started
+        if len(pipe) >= 1000:
+            await pipe.execute()
+            # Let background chunk writes proceed, as they do between a run's LLM calls
+            await asyncio.sleep(0)
+    await pipe.execute()
+
+    before = _memory()
+    peak_reset = _reset_peak()
+    started = time.perf_counter()
+    if mode == "legacy":
+        all_responses_json = await redis.lrange(key, 0, -1)
+        all_responses = [json.loads(r) for r in all_responses_json]
+        await db_service.execute_query(
+            f"UPDATE {LEGACY_TABLE} SET status = $1, completed_at = $2, responses = $3::jsonb WHERE id = $4",
+            "completed", datetime.now(timezone.utc), json.dumps(all_responses), uuid.UUID(agent_run_id), fetch="none",
+        )
+        await db_service.execute_query(
+            f"SELECT status, completed_at FROM {LEGACY_TABLE} WHERE id = $1", uuid.UUID(agent_run_id), fetch="one",
+        )
+        del all_responses_json, all_responses
+    else:
+        archived = await log.close()
+        await db_service.execute_query(
+            "UPDATE agent_runs SET status = $1, completed_at = $2, response_count = $3 WHERE id = $4",
+            "completed", datetime.now(timezone.utc), log.count if archived else None, uuid.UUID(agent_run_id),
+            fetch="none",
+        )
+    completion = time.perf_counter() - started
+    after = _memory()
+
+    result = {
+        "completion_ms": round(completion * 1000, 1),
+        "rss_before_mb": round(before["VmRSS"] / 1024, 1),
+        "peak_growth_mb": round((after["VmHWM"] - before["VmRSS"]) / 1024, 1) if peak_reset else None,
+        "published_mb": round(published / 1024 / 1024, 1),
+    }
+    if mode == "legacy":
+        result["stored_mb"] = round(await db_service.execute_query(
+            f"SELECT pg_column_size(responses) FROM {LEGACY_TABLE} WHERE id = $1", uuid.UUID(agent_run_id),
+            fetch="val") / 1024 / 1024, 2)
+    else:
+        result["add_us_per_response"] = round(add_cpu / args.responses * 1e6, 2)
+        result["stored_mb"] = round(await db_service.execute_query(
+            "SELECT SUM(OCTET_LENGTH(data)) FROM agent_run_response_chunks WHERE agent_run_id = $1",
+            uuid.UUID(agent_run_id), fetch="val") / 1024 / 1024, 2)
+        result["chunks"] = await db_service.execute_query(
+            "SELECT COUNT(*) FROM agent_run_response_chunks WHERE agent_run_id = $1",
+            uuid.UUID(agent_run_id), fetch="val")
+        archived_responses = await read_responses(agent_run_id)
+        expected = list(_responses(args.responses, args.tool_every, args.tool_kb, thread_id))
+        result["archive_matches"] = [json.dumps(r) for r in archived_responses] == [json.dumps(r) for r in expected]
+    await redis.delete(key)
+    await db_service.close()
+    return result
+
+
+def _child(mode: str, agent_run_id: str, thread_id: str, args, results):
+    results.put(asyncio.run(_complete(mode, agent_run_id, thread_id, args)))
+
+
+async def _seed() -> tuple:
+    from services.database import db_service
+
+    await db_service.initialize()
+    account_id = await db_service.execute_query(
+        "INSERT INTO accounts (name, slug, personal_account) VALUES ('Run completion', $1, TRUE) RETURNING id",
+        f"run-completion-benchmark-{uuid.uuid4().hex[:8]}", fetch="val",
+    )
+    project_id = await db_service.execute_query(
+        "INSERT INTO projects (name, account_id) VALUES ('Run completion', $1) RETURNING id", account_id, fetch="val",
+    )
+    thread_id = await db_service.execute_query(
+        "INSERT INTO threads (account_id, project_id) VALUES ($1, $2) RETURNING id", account_id, project_id,
+        fetch="val",
+    )
+    runs = {}
+    for mode in ("legacy", "chunked"):
+        runs[mode] = await db_service.execute_query(
+            "INSERT INTO agent_runs (thread_id) VALUES ($1) RETURNING id", thread_id, fetch="val",
+        )
+    await db_service.execute_query(
+        f"CREATE TABLE IF NOT EXISTS {LEGACY_TABLE} "
+        "(id UUID PRIMARY KEY, status TEXT, completed_at TIMESTAMP WITH TIME ZONE, responses JSONB)",
+        fetch="none",
+    )
+    await db_service.execute_query(f"INSERT INTO {LEGACY_TABLE} (id) VALUES ($1)", runs["legacy"], fetch="none")
+    await db_service.close()
+    return str(account_id), str(thread_id), {mode: str(run) for mode, run in runs.items()}
+
+
+async def _clean_up(account_id: str):
+    from services.database import db_service
+
+    await db_service.initialize()
+    await db_service.execute_query(f"DROP TABLE IF EXISTS {LEGACY_TABLE}", fetch="none")
+    await db_service.execute_query("DELETE FROM accounts WHERE id = $1", uuid.UUID(account_id), fetch="none")
+    await db_service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--responses", type=int, default=50000)
+    parser.add_argument("--tool-every", type=int, default=50, help="Responses per tool result")
+    parser.add_argument("--tool-kb", type=int, default=4, help="Size of a tool result")
+    args = parser.parse_args()
+
+    account_id, thread_id, runs = asyncio.run(_seed())
+    context = multiprocessing.get_context("spawn")
+    results = {"responses": args.responses}
+    try:
+        for mode in ("legacy", "chunked"):
+            queue = context.Queue()
+            child = context.Process(target=_child, args=(mode, runs[mode], thread_id, args, queue))
+            child.start()
+            child.join()
+            if child.exitcode:
+                raise RuntimeError(f"{mode} run failed with exit code {child.exitcode}")
+            results[mode] = queue.get()
+    finally:
+        asyncio.run(_clean_up(account_id))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
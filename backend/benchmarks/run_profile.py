@@ -0,0 +1,217 @@
+"""
+Accuracy check of the per-run latency profiler (``utils.run_profiler``).
+
+Profiles a synthetic agent run driven through ``ThreadManager.run_thread`` and
+the ``ResponseProcessor`` like the background worker drives ``run_agent``,
+with known delays injected at every stage:
+
+- a fake local LLM (``FakeLLMServer``) taking ``--first-token`` seconds to
+  its first chunk and ``--token-delay`` seconds per further chunk; every
+  reply is an XML call of a ``sleep`` tool followed by ``--filler-chunks``
+  chunks of text
+- the ``sleep`` tool, taking ``--tool-seconds`` and started while the rest
+  of the reply streams
+- an in-memory messages table (``FakeTableDB``) charging ``--db-latency``
+  seconds per round trip
+- a state read of ``--state-latency`` seconds per iteration
+
+Prints the stored profile summary and, per iteration, the measured critical
+path time of each stage next to the time derived from the injected delays.
+Exits non-zero if any differs by more than ``--tolerance-ms``.
+
+Usage (from the backend directory):
+    python -m benchmarks.run_profile --iterations 3 --tool-seconds 1.0
+"""
+
+import argparse
+import asyncio
+import json
+from types import SimpleNamespace
+
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from benchmarks.fakes import FakeLLMServer, FakeTableDB
+from utils import run_profiler
+
+MODEL = "openai/fake"
+
+THREAD_ID = "thread-profile"
+
+# Chunk size of the fake LLM's replies, in characters
+CHUNK_CHARS = 8
+
+TOOL_CALL = """<function_calls>
+<invoke name="sleep">
+<parameter name="seconds">{seconds}</parameter>
+</invoke>
+</function_calls>"""
+
+
+class SleepTool(Tool):
+    """Tool with a fixed, known duration."""
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "sleep",
+            "description": "Wait for the given number of seconds.",
+            "parameters": {
+                "type": "object",
+                "properties": {"seconds": {"type": "number"}},
+                "required": ["seconds"]
+            }
+        }
+    })
+    @xml_schema(
+        tag_name="sleep",
+        mappings=[{"param_name": "seconds", "node_type": "attribute", "path": "."}],
+        example=""
+    )
+    async def sleep(self, seconds: float) -> ToolResult:
+        await asyncio.sleep(float(seconds))
+        return self.success_response(f"Slept {seconds} seconds")
+
+
+def _reply(args) -> str:
+    """Tool call padded to whole chunks, then the filler chunks."""
+    call = TOOL_CALL.format(seconds=args.tool_seconds)
+    call += " " * (-len(call) % CHUNK_CHARS)
+    return call + "filler. " * args.filler_chunks
+
+
+def _expected(args, iteration: dict) -> dict:
+    """Critical path milliseconds of one iteration implied by the injected delays."""
+    reply_chunks = len(_reply(args)) // CHUNK_CHARS
+    db_writes = iteration["counts"].get(run_profiler.DB_WRITE, 0)
+    # The fake server sleeps after every chunk before sending the usage chunk,
+    # so the stream ends reply_chunks delays after the first chunk. The
+    # tool_started message is saved on the driving task during the stream
+    stream = reply_chunks * args.token_delay - args.db_latency
+    # The tool starts once its call is parsed and tool_started is saved, and
+    # runs alongside the remaining filler chunks and the usage chunk. Chunks
+    # arrive a little later than the injected delay, so their pace is taken
+    # from the measured stream and the work done between chunks
+    critical = iteration["critical_path_ms"]
+    between_chunks = sum(critical.get(category, 0) for category in (
+        run_profiler.LLM_STREAM, run_profiler.XML_PARSE, run_profiler.PUBLISH, run_profiler.OTHER))
+    pace = (between_chunks / 1000 + args.db_latency) / reply_chunks
+    tool_critical = max(0.0, args.db_latency + args.tool_seconds - (args.filler_chunks + 1) * pace)
+    return {
+        run_profiler.STATE: args.state_latency * 1000,
+        run_profiler.MESSAGES: args.db_latency * 1000,
+        run_profiler.LLM_FIRST_TOKEN: args.first_token * 1000,
+        run_profiler.LLM_STREAM: stream * 1000,
+        run_profiler.DB_WRITE: db_writes * args.db_latency * 1000,
+        run_profiler.TOOL_WAIT: tool_critical * 1000,
+        "tool": args.tool_seconds * 1000,
+        "tool_critical": tool_critical * 1000,
+    }
+
+
+def _measured(iteration: dict) -> dict:
+    critical = iteration["critical_path_ms"]
+    tool = (iteration.get("tools") or [{"ms": 0, "critical_ms": 0}])[0]
+    measured = {category: critical.get(category, 0) for category in (
+        run_profiler.STATE, run_profiler.MESSAGES, run_profiler.LLM_FIRST_TOKEN, run_profiler.LLM_STREAM,
+        run_profiler.DB_WRITE, run_profiler.TOOL_WAIT,
+    )}
+    measured["tool"] = tool["ms"]
+    measured["tool_critical"] = tool["critical_ms"]
+    return measured
+
+
+async def _iteration(args, manager) -> None:
+    """One agent loop iteration, as ``run_agent`` and the worker run it."""
+    from agentpress.response_processor import ProcessorConfig
+
+    with run_profiler.phase(run_profiler.STATE):
+        await asyncio.sleep(args.state_latency)
+    response = await manager.run_thread(
+        thread_id=THREAD_ID,
+        system_prompt={"role": "system", "content": "You are a profiling benchmark."},
+        stream=True,
+        llm_model=MODEL,
+        llm_temperature=0,
+        tool_choice="auto",
+        processor_config=ProcessorConfig(
+            xml_tool_calling=True,
+            native_tool_calling=False,
+            execute_tools=True,
+            execute_on_stream=True,
+            tool_execution_strategy="parallel",
+            xml_adding_strategy="user_message"
+        ),
+    )
+    async for chunk in response:
+        with run_profiler.phase(run_profiler.PUBLISH):
+            json.dumps(chunk)
+
+
+async def _profiled_run(args, server: FakeLLMServer, db: FakeTableDB) -> dict:
+    from agentpress.thread_manager import ThreadManager
+    from services.llm import llm_router
+    from services.llm_router import Deployment
+
+    llm_router.register(MODEL, [Deployment(model_name=MODEL, api_base=server.api_base, api_key="fake")])
+    manager = ThreadManager()
+    manager.db = SimpleNamespace(client=db.client)
+    manager.add_tool(SleepTool)
+    db.add("messages", message_id="message-user", thread_id=THREAD_ID, type="user", is_llm_message=True,
+           content={"role": "user", "content": "Profile this run."}, metadata={})
+
+    # Unprofiled, so the LLM client and tokenizer load outside the measured run
+    await _iteration(args, manager)
+    profiler = run_profiler.RunProfiler("bench-run")
+    profiler.activate()
+    for _ in range(args.iterations):
+        run_profiler.start_iteration()
+        await _iteration(args, manager)
+    return profiler.summary()
+
+
+def _checks(args, summary: dict) -> list:
+    checks = []
+    for index, iteration in enumerate(summary["iterations"], start=1):
+        expected = _expected(args, iteration)
+        measured = _measured(iteration)
+        for name, expected_ms in expected.items():
+            error = measured[name] - expected_ms
+            checks.append({
+                "iteration": index,
+                "name": name,
+                "expected_ms": round(expected_ms),
+                "measured_ms": measured[name],
+                "error_ms": round(error),
+                "ok": abs(error) <= args.tolerance_ms,
+            })
+        unaccounted = iteration["wall_ms"] - sum(iteration["critical_path_ms"].values())
+        checks.append({"iteration": index, "name": "sum_of_categories_vs_wall", "error_ms": unaccounted,
+                       "ok": abs(unaccounted) <= len(iteration["critical_path_ms"])})
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=3, help="Agent loop iterations")
+    parser.add_argument("--first-token", type=float, default=0.5, help="Seconds to the first LLM chunk")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between LLM chunks")
+    parser.add_argument("--filler-chunks", type=int, default=30, help="Reply chunks after the tool call")
+    parser.add_argument("--tool-seconds", type=float, default=1.0, help="Duration of the sleep tool")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Seconds per database round trip")
+    parser.add_argument("--state-latency", type=float, default=0.05, help="Seconds per iteration state read")
+    parser.add_argument("--tolerance-ms", type=float, default=50, help="Allowed error per stage")
+    args = parser.parse_args()
+
+    db = FakeTableDB(latency=args.db_latency, id_columns={"messages": "message_id"})
+    with FakeLLMServer(first_token_latency=args.first_token, token_delay=args.token_delay,
+                       reply=_reply(args), reply_chunk_chars=CHUNK_CHARS) as server:
+        summary = asyncio.run(_profiled_run(args, server, db))
+
+    checks = _checks(args, summary)
+    failed = [check for check in checks if not check["ok"]]
+    print(json.dumps({"profile": summary, "checks": checks, "ok": not failed}, indent=2))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
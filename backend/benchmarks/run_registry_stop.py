@@ -0,0 +1,172 @@
+"""
+Benchmark for finding active runs with KEYS scans vs the run registry.
+
+Loads ``--keys`` unrelated keys into Redis (a million by default), registers
+``--runs`` active runs and then stops runs the way ``stop_agent_run`` does,
+in two ways:
+
+- keys: ``KEYS active_run:*:{agent_run_id}`` to find the instances
+- registry: ``services.run_registry`` per-run and per-instance sets
+
+A probe pings Redis every millisecond on a separate connection meanwhile,
+so latency spikes that other clients would see show up in its percentiles.
+The instance cleanup lookup (all runs of one instance) is measured as well.
+
+Needs the local Redis from docker-compose (REDIS_* settings as for the API).
+Filler keys are left in place for later runs unless ``--cleanup`` is given.
+
+Usage (from the backend directory):
+    python -m benchmarks.run_registry_stop --keys 1000000 --runs 200 --stops 100
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from services import redis, run_registry
+
+FILLER_PREFIX = "bench:filler"
+FILLER_SENTINEL = "bench:filler:count"
+INSTANCE_ID = "bench-instance"
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 3)
+
+
+async def _load_filler(redis_client, count: int, batch: int = 10000) -> None:
+    if int(await redis_client.get(FILLER_SENTINEL) or 0) >= count:
+        return
+    for start in range(0, count, batch):
+        pipe = redis_client.pipeline(transaction=False)
+        for i in range(start, min(start + batch, count)):
+            pipe.set(f"{FILLER_PREFIX}:{i}", "x")
+        await pipe.execute()
+    await redis_client.set(FILLER_SENTINEL, count)
+
+
+async def _delete_filler(redis_client, count: int, batch: int = 10000) -> None:
+    for start in range(0, count, batch):
+        await redis_client.unlink(*(f"{FILLER_PREFIX}:{i}" for i in range(start, min(start + batch, count))))
+    await redis_client.delete(FILLER_SENTINEL)
+
+
+class _Probe:
+    """Pings Redis on its own connection and records the round-trip times."""
+
+    def __init__(self, redis_client):
+        self.connection = redis_client.client()
+        self.latencies = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await self.connection.ping()
+            self.latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.001)
+
+    def start(self):
+        self.latencies = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return {
+            "probe_p50_ms": _percentile(self.latencies, 0.5),
+            "probe_p99_ms": _percentile(self.latencies, 0.99),
+            "probe_max_ms": _percentile(self.latencies, 1.0),
+        }
+
+
+async def _stop_with_keys(redis_client, agent_run_id: str) -> None:
+    await redis_client.publish(f"agent_run:{agent_run_id}:control", "STOP")
+    for key in await redis_client.keys(f"active_run:*:{agent_run_id}"):
+        instance_id = key.split(":")[1]
+        await redis_client.publish(f"agent_run:{agent_run_id}:control:{instance_id}", "STOP")
+
+
+async def _stop_with_registry(redis_client, agent_run_id: str) -> None:
+    await redis_client.publish(f"agent_run:{agent_run_id}:control", "STOP")
+    for instance_id in await run_registry.get_run_instances(agent_run_id):
+        await redis_client.publish(f"agent_run:{agent_run_id}:control:{instance_id}", "STOP")
+    await run_registry.release_run(agent_run_id)
+
+
+async def _measure(probe: _Probe, stop, redis_client, run_ids, cleanup_lookup) -> dict:
+    probe.start()
+    stop_latencies = []
+    for agent_run_id in run_ids:
+        started = time.perf_counter()
+        await stop(redis_client, agent_run_id)
+        stop_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    remaining = await cleanup_lookup()
+    cleanup_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    result = {
+        "stop_p50_ms": _percentile(stop_latencies, 0.5),
+        "stop_p99_ms": _percentile(stop_latencies, 0.99),
+        "instance_cleanup_lookup_ms": cleanup_ms,
+        "runs_left_on_instance": len(remaining),
+    }
+    result.update(await probe.stop())
+    return result
+
+
+async def _run(args) -> dict:
+    redis_client = await redis.initialize_async()
+    await _load_filler(redis_client, args.keys)
+    probe = _Probe(redis_client)
+
+    results = {"keys": await redis_client.dbsize(), "runs": args.runs}
+
+    run_ids = [uuid.uuid4().hex for _ in range(args.runs)]
+    for agent_run_id in run_ids:
+        await redis_client.set(f"active_run:{INSTANCE_ID}:{agent_run_id}", "running", ex=600)
+    results["keys_scan"] = await _measure(
+        probe, _stop_with_keys, redis_client, run_ids[:args.stops],
+        lambda: redis_client.keys(f"active_run:{INSTANCE_ID}:*"),
+    )
+    await redis_client.delete(*(f"active_run:{INSTANCE_ID}:{agent_run_id}" for agent_run_id in run_ids))
+
+    run_ids = [uuid.uuid4().hex for _ in range(args.runs)]
+    for agent_run_id in run_ids:
+        await run_registry.register_run(INSTANCE_ID, agent_run_id)
+    results["registry"] = await _measure(
+        probe, _stop_with_registry, redis_client, run_ids[:args.stops],
+        lambda: run_registry.get_instance_runs(INSTANCE_ID),
+    )
+    for agent_run_id in run_ids:
+        await run_registry.release_run(agent_run_id)
+    await redis_client.zrem(run_registry.INSTANCES_KEY, INSTANCE_ID)
+
+    if args.cleanup:
+        await _delete_filler(redis_client, args.keys)
+    await redis.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1_000_000, help="Unrelated keys loaded into Redis")
+    parser.add_argument("--runs", type=int, default=200, help="Active runs registered on the instance")
+    parser.add_argument("--stops", type=int, default=100, help="Runs stopped per configuration")
+    parser.add_argument("--cleanup", action="store_true", help="Delete the filler keys afterwards")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Load test for the sandbox file API.
+
+Moves large files through the upload and download endpoints of
+``sandbox/api.py`` against a filesystem-backed sandbox and reports
+throughput and peak RSS growth.
+
+Usage (from the backend directory):
+    python -m benchmarks.sandbox_file_transfer --size-mb 1024
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.fakes import LocalSandbox
+from sandbox import api as sandbox_api
+from sandbox import file_stream
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write_source_file(path: str, size: int, block: int = 1024 * 1024):
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            n = min(block, size - written)
+            f.write(os.urandom(n))
+            written += n
+
+
+def _build_app(sandbox) -> FastAPI:
+    async def _no_access_check(client, sandbox_id, user_id=None):
+        return {}
+
+    async def _get_sandbox(client, sandbox_id):
+        return sandbox
+
+    class _DB:
+        @property
+        async def client(self):
+            return None
+
+    sandbox_api.verify_sandbox_access = _no_access_check
+    sandbox_api.get_sandbox_by_id_safely = _get_sandbox
+    sandbox_api.db = _DB()
+
+    app = FastAPI()
+    app.include_router(sandbox_api.router, prefix="/api")
+    return app
+
+
+async def run(size_mb: int, range_mb: int):
+    results = {"size_mb": size_mb, "chunk_size": file_stream.TRANSFER_CHUNK_SIZE}
+    with tempfile.TemporaryDirectory() as workdir:
+        file_stream.SCRATCH_DIR = os.path.join(workdir, "scratch")
+        sandbox = LocalSandbox()
+        app = _build_app(sandbox)
+
+        source = os.path.join(workdir, "source.bin")
+        target = os.path.join(workdir, "workspace", "artifact.bin")
+        _write_source_file(source, size_mb * 1024 * 1024)
+        baseline_rss = _peak_rss_mb()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            start = time.perf_counter()
+            with open(source, "rb") as f:
+                resp = await client.post(
+                    "/api/sandboxes/bench/files",
+                    data={"path": target},
+                    files={"file": ("artifact.bin", f, "application/octet-stream")},
+                )
+            resp.raise_for_status()
+            elapsed = time.perf_counter() - start
+            results["upload_mb_s"] = round(size_mb / elapsed, 2)
+            results["upload_peak_rss_growth_mb"] = round(_peak_rss_mb() - baseline_rss, 1)
+
+            start = time.perf_counter()
+            received = 0
+            etag = None
+            async with client.stream("GET", "/api/sandboxes/bench/files/content", params={"path": target}) as resp:
+                resp.raise_for_status()
+                etag = resp.headers.get("etag")
+                async for chunk in resp.aiter_bytes():
+                    received += len(chunk)
+            elapsed = time.perf_counter() - start
+            assert received == size_mb * 1024 * 1024, f"short download: {received}"
+            results["download_mb_s"] = round(size_mb / elapsed, 2)
+            results["download_peak_rss_growth_mb"] = round(_peak_rss_mb() - baseline_rss, 1)
+
+            range_bytes = range_mb * 1024 * 1024
+            start = time.perf_counter()
+            resp = await client.get(
+                "/api/sandboxes/bench/files/content",
+                params={"path": target},
+                headers={"Range": f"bytes=-{range_bytes}"},
+            )
+            results["range_status"] = resp.status_code
+            results["range_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+            resp = await client.get(
+                "/api/sandboxes/bench/files/content",
+                params={"path": target},
+                headers={"If-None-Match": etag},
+            )
+            results["conditional_status"] = resp.status_code
+
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=512, help="Size of the transferred file in MiB")
+    parser.add_argument("--range-mb", type=int, default=8, help="Size of the tail range request in MiB")
+    args = parser.parse_args()
+    asyncio.run(run(args.size_mb, args.range_mb))
+
+
+if __name__ == "__main__":
+    main()
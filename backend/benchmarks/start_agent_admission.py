@@ -0,0 +1,168 @@
+"""
+Load test for time-to-run-ID of ``start_agent`` under concurrent starts.
+
+Fires ``--concurrency`` starts at once, for ``--rounds`` rounds, against
+in-memory tables (``FakeTableDB``, ``--db-latency`` per round trip), a
+blocking Stripe stand-in (``FakeStripe``, ``--stripe-latency`` per call) and
+a sandbox start that takes ``--sandbox-latency``. Billing runs as in
+production. Two configurations are measured:
+
+- sequential: the previous endpoint body, i.e. access check, thread, agent,
+  default agent, model access, billing, active run, project and sandbox
+  start one after another, with the Stripe SDK called on the event loop
+  (twice, once per check)
+- pipeline: ``start_agent`` with the admission pipeline from
+  ``agent.admission``
+
+Enqueueing and the run registry are replaced with no-ops, so the numbers
+cover admission and the ``agent_runs`` insert only.
+
+Usage (from the backend directory):
+    python -m benchmarks.start_agent_admission --concurrency 50 --rounds 5
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import run_agent_background as worker
+from agent import api
+from benchmarks.fakes import FakeStripe, FakeTableDB
+from services import billing
+from utils.auth_utils import verify_thread_access
+from utils.config import EnvMode, config
+from utils.constants import MODEL_ACCESS_TIERS
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+def _seed(db: FakeTableDB, count: int, prefix: str) -> list:
+    starts = []
+    for i in range(count):
+        account_id = f"{prefix}-account-{i}"
+        project_id = f"{prefix}-project-{i}"
+        thread_id = f"{prefix}-thread-{i}"
+        db.add("account_user", user_id=account_id, account_id=account_id, account_role="owner")
+        db.add("billing_customers", id=f"cus_{account_id}", account_id=account_id)
+        db.add("projects", id=project_id, project_id=project_id, account_id=account_id,
+               is_public=False, sandbox={"id": f"sandbox-{i}"})
+        db.add("threads", id=thread_id, thread_id=thread_id, project_id=project_id,
+               account_id=account_id, agent_id=None, metadata={})
+        db.add("agents", agent_id=f"{prefix}-agent-{i}", account_id=account_id, name=f"Agent {i}", is_default=True)
+        starts.append((thread_id, account_id))
+    return starts
+
+
+async def _sequential_start(db: FakeTableDB, stripe: FakeStripe, sandbox_latency: float,
+                            thread_id: str, user_id: str, model_name: str) -> str:
+    client = db.client
+
+    async def blocking_subscription(account_id):
+        customer_id = await billing.get_stripe_customer_id(client, account_id)
+        return stripe.Subscription.list(customer=customer_id, status="active")["data"][0]
+
+    await verify_thread_access(client, thread_id, user_id)
+    thread = (await client.table('threads').select('*').eq('id', thread_id).execute()).data[0]
+    account_id, project_id = thread['account_id'], thread['project_id']
+    await client.table('agents').select('*').eq('account_id', account_id).eq('is_default', True).execute()
+    can_use, _, _ = await billing.can_use_model(client, account_id, model_name, blocking_subscription)
+    can_run, _, _ = await billing.check_billing_status(client, account_id, blocking_subscription)
+    assert can_use and can_run
+    await api.check_for_active_project_agent_run(client, project_id)
+    await client.table('projects').select('*').eq('id', project_id).execute()
+    await asyncio.sleep(sandbox_latency)
+    agent_run = await client.table('agent_runs').insert({
+        "thread_id": thread_id, "status": "running",
+        "started_at": datetime.now(timezone.utc).isoformat()
+    }).execute()
+    return agent_run.data[0]['id']
+
+
+async def _pipeline_start(thread_id: str, user_id: str, model_name: str) -> str:
+    body = api.AgentStartRequest(model_name=model_name)
+    return (await api.start_agent(thread_id, body=body, user_id=user_id))["agent_run_id"]
+
+
+async def _measure(start, starts: list, concurrency: int) -> dict:
+    latencies = []
+
+    async def timed(thread_id, user_id):
+        started = time.perf_counter()
+        await start(thread_id, user_id)
+        latencies.append(time.perf_counter() - started)
+
+    wall_started = time.perf_counter()
+    for offset in range(0, len(starts), concurrency):
+        await asyncio.gather(*(timed(*args) for args in starts[offset:offset + concurrency]))
+    return {
+        "starts": len(latencies),
+        "time_to_run_id_p50_ms": _percentile(latencies, 0.5),
+        "time_to_run_id_p99_ms": _percentile(latencies, 0.99),
+        "starts_per_second": round(len(latencies) / (time.perf_counter() - wall_started), 1),
+    }
+
+
+async def _run(args) -> dict:
+    config.ENV_MODE = EnvMode.PRODUCTION
+    model_name = MODEL_ACCESS_TIERS['tier_2_20'][0]
+    stripe = FakeStripe(config.STRIPE_TIER_2_20_ID, latency=args.stripe_latency)
+    total = args.concurrency * args.rounds
+    results = {"concurrency": args.concurrency, "rounds": args.rounds}
+
+    db = FakeTableDB(latency=args.db_latency)
+    starts = _seed(db, total, "sequential")
+    results["sequential"] = await _measure(
+        lambda thread_id, user_id: _sequential_start(db, stripe, args.sandbox_latency, thread_id, user_id, model_name),
+        starts, args.concurrency,
+    )
+    results["sequential"]["db_round_trips_per_start"] = round(db.round_trips / total, 1)
+    results["sequential"]["stripe_calls_per_start"] = round(stripe.calls / total, 1)
+
+    db = FakeTableDB(latency=args.db_latency)
+    stripe.calls = 0
+    starts = _seed(db, total, "pipeline")
+
+    async def start_sandbox(sandbox_id):
+        await asyncio.sleep(args.sandbox_latency)
+
+    async def register_run(instance_id, agent_run_id):
+        pass
+
+    api.db = SimpleNamespace(client=db.client)
+    api.instance_id = "bench"
+    worker.run_agent_background = SimpleNamespace(send=lambda **kwargs: None)
+    api.run_registry = SimpleNamespace(register_run=register_run)
+    api.get_or_start_sandbox = start_sandbox
+    billing.DBConnection = lambda: SimpleNamespace(client=db.client)
+    billing.stripe.Subscription = stripe.Subscription
+    results["pipeline"] = await _measure(
+        lambda thread_id, user_id: _pipeline_start(thread_id, user_id, model_name),
+        starts, args.concurrency,
+    )
+    results["pipeline"]["db_round_trips_per_start"] = round(db.round_trips / total, 1)
+    results["pipeline"]["stripe_calls_per_start"] = round(stripe.calls / total, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50, help="Starts fired at once")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds of concurrent starts")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="Seconds per database round trip")
+    parser.add_argument("--stripe-latency", type=float, default=0.25, help="Seconds per Stripe subscription lookup")
+    parser.add_argument("--sandbox-latency", type=float, default=0.3, help="Seconds to get or start a sandbox")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
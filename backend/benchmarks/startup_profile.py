@@ -0,0 +1,186 @@
+"""
+Import-time and cold-start profile of the API process, with a budget check.
+
+Measures, each in a fresh interpreter:
+
+- import: wall time and resident memory after ``import api`` (median of
+  ``--repeat`` runs), and which heavy modules (LLM, worker, tool and SDK
+  packages) were imported eagerly instead of on first use
+- importtime: the slowest imports by cumulative time (``python -X importtime``)
+- serve (``--serve``): time from spawning one uvicorn worker until
+  ``/api/health`` first answers 200, and the worker's RSS at that point and
+  after ``--settle`` seconds, once deferred modules were preloaded. Needs
+  the local Postgres and Redis from docker-compose, like the API itself
+
+With ``--check`` the results are compared to ``startup_budget.json`` (or
+``--budget``) and the script exits with status 1 when a measurement exceeds
+its budget or a heavy module is imported at startup, so CI can fail the
+build on regressions.
+
+Usage (from the backend directory):
+    python -m benchmarks.startup_profile --repeat 5 --check
+    python -m benchmarks.startup_profile --serve --check
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+
+# Modules the API must not import at startup
+HEAVY_MODULES = (
+    "litellm",
+    "langfuse",
+    "dramatiq",
+    "openai",
+    "mcp",
+    "mailtrap",
+    "run_agent_background",
+    "agent.run",
+    "agent.prompt",
+    "agentpress.thread_manager",
+    "agent.tools.data_providers_tool",
+)
+
+IMPORT_PROBE = """
+import json, sys, time, types
+started = time.perf_counter()
+import api
+elapsed = time.perf_counter() - started
+with open("/proc/self/status") as status:
+    rss_kb = next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+# type() does not trigger lazily imported modules, unlike attribute access
+loaded = [name for name in {heavy!r} if name in sys.modules and type(sys.modules[name]) is types.ModuleType]
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_kb / 1024, "eager_heavy_modules": loaded}}))
+"""
+
+
+def _rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def _profile_import(repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE.format(heavy=HEAVY_MODULES)],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "import_seconds": round(statistics.median(run["seconds"] for run in runs), 3),
+        "import_rss_mb": round(statistics.median(run["rss_mb"] for run in runs), 1),
+        "eager_heavy_modules": runs[-1]["eager_heavy_modules"],
+    }
+
+
+def _slowest_imports(top: int) -> list:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stderr
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append((int(cumulative_us), name.strip()))
+    entries.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in entries[:top]]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _profile_serve(timeout: float, settle: float) -> dict:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/api/health"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"API exited with status {server.returncode} before becoming healthy")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"API not healthy after {timeout}s")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.05)
+        healthy_seconds = time.perf_counter() - started
+        rss_at_health = _rss_mb(server.pid)
+        time.sleep(settle)
+        return {
+            "health_seconds": round(healthy_seconds, 3),
+            "worker_rss_mb": rss_at_health,
+            "worker_rss_after_preload_mb": _rss_mb(server.pid),
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def _check(results: dict, budget: dict) -> list:
+    violations = []
+    for key, limit in budget.items():
+        if key == "eager_heavy_modules":
+            unexpected = sorted(set(results.get(key, [])) - set(limit))
+            if unexpected:
+                violations.append(f"{key}: {', '.join(unexpected)} imported at startup")
+        elif key in results and results[key] > limit:
+            violations.append(f"{key}: {results[key]} exceeds budget of {limit}")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per import measurement")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--serve", action="store_true", help="Also measure time to first healthy /api/health")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for /api/health")
+    parser.add_argument("--settle", type=float, default=10.0, help="Seconds after health before the second RSS reading")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 when over budget")
+    parser.add_argument("--budget", default=DEFAULT_BUDGET, help="Budget file (JSON)")
+    args = parser.parse_args()
+
+    results = _profile_import(args.repeat)
+    results["slowest_imports"] = _slowest_imports(args.top)
+    if args.serve:
+        results.update(_profile_serve(args.timeout, args.settle))
+
+    violations = []
+    if args.check:
+        with open(args.budget) as budget_file:
+            violations = _check(results, json.load(budget_file))
+        results["budget_violations"] = violations
+
+    print(json.dumps(results, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Replay of browser screenshot uploads against a local MinIO and Postgres.
+
+Uploads a stream of screenshots through ``StorageService.upload_file`` and
+reports throughput, peak traced memory and the storage saved by
+content-addressed deduplication. Screenshots are read from ``--replay-dir``
+when given; otherwise a synthetic pool is generated in which a share of the
+uploads repeat earlier images, the way an unchanged page is captured again
+after every browser action.
+
+Requires the docker-compose MinIO and Postgres services with
+``database/init/03-file-blobs.sql`` applied.
+
+Usage (from the backend directory):
+    python -m benchmarks.storage_dedup --uploads 2000 --duplicate-ratio 0.6
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import tracemalloc
+import uuid
+
+from services.database import db_service
+from services.storage import storage_service
+
+
+def _load_screenshots(replay_dir: str):
+    names = sorted(n for n in os.listdir(replay_dir) if n.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    for name in names:
+        with open(os.path.join(replay_dir, name), "rb") as f:
+            yield name, f.read()
+
+
+def _synthetic_screenshots(uploads: int, duplicate_ratio: float, size_kb: int, seed: int):
+    rng = random.Random(seed)
+    seen = []
+    for i in range(uploads):
+        if seen and rng.random() < duplicate_ratio:
+            yield f"screenshot_{i}.png", rng.choice(seen)
+        else:
+            payload = rng.randbytes(size_kb * 1024)
+            seen.append(payload)
+            yield f"screenshot_{i}.png", payload
+
+
+async def run(args):
+    await db_service.initialize()
+    await storage_service.initialize()
+
+    account_id = await db_service.insert("accounts", {
+        "name": "storage benchmark",
+        "slug": f"bench-{uuid.uuid4().hex[:12]}",
+    })
+    bucket = f"bench-{uuid.uuid4().hex[:8]}"
+    await storage_service._create_bucket_if_not_exists(bucket)
+
+    if args.replay_dir:
+        screenshots = _load_screenshots(args.replay_dir)
+    else:
+        screenshots = _synthetic_screenshots(args.uploads, args.duplicate_ratio, args.size_kb, args.seed)
+
+    tracemalloc.start()
+    uploaded = 0
+    logical_bytes = 0
+    deduplicated = 0
+    start = time.perf_counter()
+    for name, payload in screenshots:
+        result = await storage_service.upload_file(
+            account_id=account_id,
+            file_data=payload,
+            filename=name,
+            content_type="image/png",
+            bucket=bucket,
+        )
+        uploaded += 1
+        logical_bytes += len(payload)
+        deduplicated += int(result["deduplicated"])
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    physical_bytes = await db_service.execute_query(
+        "SELECT COALESCE(SUM(file_size), 0) FROM file_blobs WHERE bucket = $1", bucket, fetch="val"
+    )
+
+    results = {
+        "uploads": uploaded,
+        "uploads_per_sec": round(uploaded / elapsed, 1),
+        "logical_mb_per_sec": round(logical_bytes / elapsed / 1024 / 1024, 2),
+        "peak_traced_memory_mb": round(peak / 1024 / 1024, 2),
+        "deduplicated_uploads": deduplicated,
+        "logical_mb": round(logical_bytes / 1024 / 1024, 2),
+        "stored_mb": round(physical_bytes / 1024 / 1024, 2),
+        "storage_saved_pct": round(100 * (1 - physical_bytes / logical_bytes), 1) if logical_bytes else 0.0,
+    }
+    print(json.dumps(results, indent=2))
+
+    if not args.keep:
+        for row in await db_service.select("files", columns="id", where={"account_id": account_id}):
+            await storage_service.delete_file(row["id"])
+        await db_service.delete("accounts", {"id": account_id})
+        storage_service.minio_client.remove_bucket(bucket)
+    await db_service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replay-dir", help="Directory of recorded screenshots to replay in name order")
+    parser.add_argument("--uploads", type=int, default=1000, help="Number of synthetic uploads")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.5, help="Share of synthetic uploads that repeat an earlier image")
+    parser.add_argument("--size-kb", type=int, default=250, help="Size of each synthetic screenshot")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="Keep uploaded objects and rows after the run")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Validation and CPU cost of incremental token accounting (``agentpress.token_usage``).
+
+Replays recorded or synthetic threads iteration by iteration, the way
+``ThreadManager.run_thread`` prepares each LLM call: count the tokens of the
+system prompt and the messages, then ``_compress_messages`` (which counts
+the whole prompt five times and, above the model's limit, single messages).
+Each iteration starts from fresh message dicts, as loaded from the database.
+Two modes are measured on the same code path:
+
+- legacy: every count runs ``litellm.token_counter`` over the messages
+- cached: ``MessageTokenCache``, new per thread, so each thread starts cold
+
+Every cached prompt count is compared with ``token_counter`` on the same
+messages. Each assistant message is also streamed in random deltas of 1-12
+characters through ``StreamingTokenCounter`` and compared with the exact
+count of the whole text (``litellm.encode``). Reports CPU milliseconds per
+iteration of both modes, the mismatches and largest differences, and the
+CPU of counting completions while streaming versus once at the end.
+
+Input files (``--file``, repeatable) are thread exports
+``{"system_prompt": {...}, "messages": [...]}`` or ``[message, ...]``; one
+iteration is replayed per assistant message. Without files, ``--synthetic``
+threads with XML tool calls and tool results of up to ``--max-result-kb``
+are generated.
+
+Usage (from the backend directory):
+    python -m benchmarks.token_accounting --synthetic 5 --iterations 60
+    python -m benchmarks.token_accounting --file thread_export.json --model openai/gpt-4o
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+
+import litellm
+from litellm import token_counter
+
+from agentpress import thread_manager
+from agentpress.thread_manager import ThreadManager
+from agentpress.token_usage import MessageTokenCache, StreamingTokenCounter
+
+
+class _UncachedCounts:
+    """``MessageTokenCache`` stand-in counting like before: ``token_counter`` every time."""
+
+    def count(self, messages, model: str = "") -> int:
+        return token_counter(model=model, messages=messages)
+
+
+def _thread_from_file(path: str):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get("system_prompt") or {"role": "system", "content": ""}, data.get("messages", [])
+    return {"role": "system", "content": ""}, data
+
+
+def _synthetic_thread(rnd: random.Random, iterations: int, max_result_kb: int):
+    words = ["file", "project", "deploy", "test", "error", "update", "config", "result", "Ünïcödé", "漢字", "42"]
+    system = {"role": "system", "content": "You are an agent. " * 2000 + "<create-file> Example: ... \\n" * 200}
+    messages = [{"role": "user", "content": "Build me a website about " + " ".join(rnd.choices(words, k=50)),
+                 "message_id": "msg-0"}]
+    for step in range(iterations):
+        text = " ".join(rnd.choices(words, k=rnd.randint(20, 300)))
+        messages.append({"role": "assistant", "message_id": f"msg-{len(messages)}",
+                         "content": f"Step {step}: {text}\n<str-replace file_path=\"src/app_{step}.py\">"
+                                    f"<old_str>x = {step}</old_str><new_str>x = {step + 1}</new_str></str-replace>"})
+        output = " ".join(rnd.choices(words, k=rnd.randint(50, max_result_kb * 150)))
+        messages.append({"role": "user", "message_id": f"msg-{len(messages)}", "content": json.dumps(
+            {"tool_execution": {"function_name": "str_replace", "result": {"success": True, "output": output}}})})
+    return system, messages
+
+
+def _replay(system, messages, model: str, counts) -> tuple:
+    """CPU seconds of each iteration's counting and compression, and the prompt counts."""
+    manager = ThreadManager.__new__(ThreadManager)
+    thread_manager.message_token_cache = counts
+    cpu, prompt_counts = [], []
+    for index, message in enumerate(messages):
+        if message.get("role") != "assistant" or index == 0:
+            continue
+        # Fresh dicts, as read from the messages table for this iteration
+        prompt = json.loads(json.dumps([system] + messages[:index]))
+        started = time.process_time()
+        prompt_counts.append(counts.count(prompt, model))
+        manager._compress_messages(prompt, model)
+        cpu.append(time.process_time() - started)
+    return cpu, prompt_counts
+
+
+def _completions(messages, model: str, rnd: random.Random) -> dict:
+    mismatches, max_diff, streamed_cpu, final_cpu = 0, 0, 0.0, 0.0
+    texts = [m["content"] for m in messages if m.get("role") == "assistant" and isinstance(m.get("content"), str)]
+    for text in texts:
+        counter = StreamingTokenCounter(model)
+        started = time.process_time()
+        position = 0
+        while position < len(text):
+            size = rnd.randint(1, 12)
+            counter.add(text[position:position + size])
+            position += size
+        counted = counter.total()
+        streamed_cpu += time.process_time() - started
+
+        started = time.process_time()
+        exact = len(litellm.encode(model=model, text=text))
+        final_cpu += time.process_time() - started
+        if counted != exact:
+            mismatches += 1
+            max_diff = max(max_diff, abs(counted - exact))
+    return {
+        "completions": len(texts),
+        "mismatches": mismatches,
+        "max_abs_diff": max_diff,
+        "streamed_cpu_ms_per_completion": round(streamed_cpu / max(len(texts), 1) * 1000, 3),
+        "end_of_stream_cpu_ms_per_completion": round(final_cpu / max(len(texts), 1) * 1000, 3),
+    }
+
+
+def _ms(values, pct=None):
+    if not values:
+        return None
+    if pct is None:
+        return round(statistics.mean(values) * 1000, 2)
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", action="append", default=[], help="Recorded thread export (JSON)")
+    parser.add_argument("--synthetic", type=int, default=5, help="Synthetic threads when no files are given")
+    parser.add_argument("--iterations", type=int, default=60, help="Assistant turns per synthetic thread")
+    parser.add_argument("--max-result-kb", type=int, default=20, help="Largest synthetic tool result")
+    parser.add_argument("--model", default="anthropic/claude-3-7-sonnet-latest", help="Model whose tokenizer is used")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    if args.file:
+        threads = [_thread_from_file(path) for path in args.file]
+    else:
+        threads = [_synthetic_thread(rnd, args.iterations, args.max_result_kb) for _ in range(args.synthetic)]
+
+    legacy_cpu, cached_cpu = [], []
+    prompt_mismatches, prompt_max_diff, prompts = 0, 0, 0
+    hits = misses = 0
+    for system, messages in threads:
+        legacy, exact_counts = _replay(system, messages, args.model, _UncachedCounts())
+        cache = MessageTokenCache(max_entries=100000)
+        cached, cached_counts = _replay(system, messages, args.model, cache)
+        legacy_cpu.extend(legacy)
+        cached_cpu.extend(cached)
+        stats = cache.get_stats()
+        hits, misses = hits + stats["hits"], misses + stats["misses"]
+        for exact, counted in zip(exact_counts, cached_counts):
+            prompts += 1
+            if exact != counted:
+                prompt_mismatches += 1
+                prompt_max_diff = max(prompt_max_diff, abs(exact - counted))
+
+    completion_rnd = random.Random(args.seed)
+    completions = [_completions(messages, args.model, completion_rnd) for _, messages in threads]
+    results = {
+        "model": args.model,
+        "threads": len(threads),
+        "iterations": prompts,
+        "context_cpu_ms_per_iteration": {
+            "legacy": {"mean": _ms(legacy_cpu), "p50": _ms(legacy_cpu, 0.5), "p95": _ms(legacy_cpu, 0.95)},
+            "cached": {"mean": _ms(cached_cpu), "p50": _ms(cached_cpu, 0.5), "p95": _ms(cached_cpu, 0.95)},
+            "saved_mean": round(_ms(legacy_cpu) - _ms(cached_cpu), 2) if prompts else None,
+        },
+        "prompt_counts": {"mismatches": prompt_mismatches, "max_abs_diff": prompt_max_diff,
+                          "cache_hit_ratio": round(hits / max(hits + misses, 1), 4)},
+        "completion_counts": {
+            "completions": sum(c["completions"] for c in completions),
+            "mismatches": sum(c["mismatches"] for c in completions),
+            "max_abs_diff": max((c["max_abs_diff"] for c in completions), default=0),
+            "streamed_cpu_ms_per_completion": round(statistics.mean(
+                c["streamed_cpu_ms_per_completion"] for c in completions), 3),
+            "end_of_stream_cpu_ms_per_completion": round(statistics.mean(
+                c["end_of_stream_cpu_ms_per_completion"] for c in completions), 3),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Microbenchmark for ToolRegistry dispatch and prompt assembly.
+
+Registers a synthetic tool suite (static XML/OpenAPI tools plus MCP-style
+functions added at runtime) and compares the frozen dispatch tables with the
+previous behaviour of rebuilding them on every call.
+
+Usage (from the backend directory):
+    python -m benchmarks.tool_registry_dispatch --tools 40 --mcp-tools 30
+"""
+
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from agentpress.thread_manager import ThreadManager
+from agentpress.tool import Tool, ToolResult, SchemaType, ToolSchema, openapi_schema, xml_schema
+from agentpress.tool_registry import ToolRegistry
+
+
+def _make_tool_class(index: int):
+    name = f"bench_tool_{index}"
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": f"Synthetic benchmark tool {index}",
+            "parameters": {"type": "object", "properties": {"value": {"type": "string"}}, "required": ["value"]},
+        },
+    })
+    @xml_schema(
+        tag_name=name.replace("_", "-"),
+        mappings=[{"param_name": "value", "node_type": "content", "path": "."}],
+        example=f"<function_calls><invoke name=\"{name}\"><parameter name=\"value\">x</parameter></invoke></function_calls>",
+    )
+    async def method(self, value: str) -> ToolResult:
+        return self.success_response(value)
+
+    return type(f"BenchTool{index}", (Tool,), {name: method})
+
+
+class _MCPStandIn(Tool):
+    """Tool whose methods are attached at runtime, like MCPToolWrapper."""
+
+
+def _build_registry(tools: int, mcp_tools: int) -> ToolRegistry:
+    registry = ToolRegistry()
+    for i in range(tools):
+        registry.register_tool(_make_tool_class(i))
+
+    mcp = _MCPStandIn()
+    for i in range(mcp_tools):
+        name = f"mcp_tool_{i}"
+
+        async def dynamic(**kwargs):
+            return ToolResult(success=True, output="ok")
+
+        setattr(mcp, name, dynamic)
+        registry.register_function(name, mcp, ToolSchema(
+            schema_type=SchemaType.OPENAPI,
+            schema={"type": "function", "function": {"name": name, "parameters": {"type": "object", "properties": {}}}},
+        ))
+    return registry
+
+
+def _legacy_available_functions(registry: ToolRegistry):
+    functions = {}
+    for tool_name, tool_info in registry.tools.items():
+        functions[tool_name] = getattr(tool_info["instance"], tool_name)
+    for tool_info in registry.xml_tools.values():
+        functions[tool_info["method"]] = getattr(tool_info["instance"], tool_info["method"])
+    return functions
+
+
+def _legacy_prompt_assembly(registry: ToolRegistry):
+    schemas = [t["schema"].schema for t in registry.tools.values() if t["schema"].schema_type == SchemaType.OPENAPI]
+    examples = {}
+    for tool_info in registry.xml_tools.values():
+        schema = tool_info["schema"]
+        if schema.xml_schema and schema.xml_schema.example:
+            examples[schema.xml_schema.tag_name] = schema.xml_schema.example
+    content = ""
+    for tag_name, example in examples.items():
+        content += f"<{tag_name}> Example: {example}\\n"
+    return schemas, content
+
+
+def _time_per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tools", type=int, default=40, help="Number of static tool classes")
+    parser.add_argument("--mcp-tools", type=int, default=30, help="Number of runtime-registered MCP functions")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    registry = _build_registry(args.tools, args.mcp_tools)
+    manager = SimpleNamespace(tool_registry=registry, _xml_examples_prompt=None)
+    target = f"mcp_tool_{args.mcp_tools - 1}" if args.mcp_tools else "bench_tool_0"
+
+    results = {
+        "registered_functions": len(registry.get_available_functions()),
+        "dispatch_us": {
+            "legacy": round(_time_per_call(lambda: _legacy_available_functions(registry).get(target), args.iterations), 3),
+            "frozen": round(_time_per_call(lambda: registry.get_function(target), args.iterations), 3),
+        },
+        "prompt_assembly_us": {
+            "legacy": round(_time_per_call(lambda: _legacy_prompt_assembly(registry), args.iterations), 3),
+            "frozen": round(_time_per_call(
+                lambda: (registry.get_openapi_schemas(), ThreadManager.get_xml_examples_prompt(manager)),
+                args.iterations,
+            ), 3),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
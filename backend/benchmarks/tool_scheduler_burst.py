@@ -0,0 +1,123 @@
+"""
+Burst-load benchmark for the ToolScheduler.
+
+Submits bursts of synthetic tool calls (fast lookups, slow shell commands in
+shared sessions, file edits, browser actions and deploys) and records queue
+wait, execution time and throughput. Also checks that calls sharing a
+resource key never overlap and that the concurrency limits hold.
+
+Usage (from the backend directory):
+    python -m benchmarks.tool_scheduler_burst --bursts 20 --burst-size 50 --max-concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+from agentpress.tool import ToolResult
+from agentpress.tool_scheduler import ToolScheduler, default_resource_key
+
+# Synthetic tool suite: function name -> (mean latency in seconds, argument factory)
+TOOL_SUITE = {
+    "web_search": (0.02, lambda rnd: {"query": f"q{rnd.randint(0, 999)}"}),
+    "execute_command": (0.05, lambda rnd: {"command": "make", "session_name": f"s{rnd.randint(0, 3)}"}),
+    "check_command_output": (0.005, lambda rnd: {"session_name": f"s{rnd.randint(0, 3)}"}),
+    "str_replace": (0.01, lambda rnd: {"file_path": f"src/f{rnd.randint(0, 9)}.py", "old_str": "a", "new_str": "b"}),
+    "browser_click_element": (0.03, lambda rnd: {"index": rnd.randint(0, 20)}),
+    "deploy": (0.1, lambda rnd: {"name": "site", "directory_path": "dist"}),
+    "ask": (0.001, lambda rnd: {"text": "?"}),
+}
+
+
+class _Recorder:
+    """Synthetic executor that tracks overlap per resource and tool."""
+
+    def __init__(self, rnd: random.Random):
+        self.rnd = rnd
+        self.active_by_key = defaultdict(int)
+        self.active_by_tool = defaultdict(int)
+        self.active = 0
+        self.max_active = 0
+        self.max_active_by_tool = defaultdict(int)
+        self.ordering_violations = 0
+
+    async def execute(self, tool_call):
+        name = tool_call["function_name"]
+        key = default_resource_key(tool_call)
+        if key:
+            if self.active_by_key[key]:
+                self.ordering_violations += 1
+            self.active_by_key[key] += 1
+        self.active += 1
+        self.active_by_tool[name] += 1
+        self.max_active = max(self.max_active, self.active)
+        self.max_active_by_tool[name] = max(self.max_active_by_tool[name], self.active_by_tool[name])
+        try:
+            mean, _ = TOOL_SUITE[name]
+            await asyncio.sleep(self.rnd.expovariate(1 / mean))
+            return ToolResult(success=True, output=name)
+        finally:
+            self.active -= 1
+            self.active_by_tool[name] -= 1
+            if key:
+                self.active_by_key[key] -= 1
+
+
+async def _run(args) -> dict:
+    rnd = random.Random(args.seed)
+    scheduler = ToolScheduler(max_concurrency=args.max_concurrency)
+    recorder = _Recorder(rnd)
+    names = list(TOOL_SUITE)
+
+    started = time.perf_counter()
+    total = 0
+    for _ in range(args.bursts):
+        calls = []
+        for _ in range(args.burst_size):
+            name = rnd.choice(names)
+            calls.append({"function_name": name, "arguments": TOOL_SUITE[name][1](rnd)})
+        await scheduler.run_all(calls, recorder.execute)
+        total += len(calls)
+    elapsed = time.perf_counter() - started
+
+    # Cancellation: a burst of slow calls is stopped mid-flight
+    slow = [{"function_name": "deploy", "arguments": {}} for _ in range(args.burst_size)]
+    tasks = [scheduler.submit(call, recorder.execute) for call in slow]
+    await asyncio.sleep(0.01)
+    cancelled = scheduler.cancel_all()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    by_tool = defaultdict(list)
+    for timing in scheduler.timings:
+        by_tool[timing.function_name].append(timing.queue_wait)
+
+    return {
+        "calls": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_calls_per_s": round(total / elapsed, 1),
+        "stats": {k: round(v, 5) if isinstance(v, float) else v for k, v in scheduler.get_stats().items()},
+        "avg_queue_wait_by_tool_s": {name: round(sum(w) / len(w), 5) for name, w in sorted(by_tool.items())},
+        "max_concurrent": recorder.max_active,
+        "max_concurrent_deploys": recorder.max_active_by_tool["deploy"],
+        "ordering_violations": recorder.ordering_violations,
+        "cancelled_on_stop": cancelled,
+        "pending_after_stop": scheduler.pending,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Streaming throughput and event-loop latency of the agent loop's tracing.
+
+Runs ``--runs`` concurrent stand-ins of a streamed agent run in one event
+loop. Each streams ``--chunks`` chunks and records trace calls the way
+``run_agent`` and ``ResponseProcessor`` do: a generation per run,
+``--events-per-chunk`` DEFAULT-level events per chunk and, every
+``--tool-every`` chunks, a tool span with its events. Traces are exported to
+a local Langfuse collector stub (``FakeLangfuseCollector``). Four
+configurations are measured:
+
+- direct: the Langfuse SDK called inline, as before
+- async: ``services.langfuse.Tracer`` with every run and event recorded
+- sampled: ``Tracer`` with ``--sample-percent`` of runs and
+  ``--event-sample-percent`` of DEFAULT-level events recorded
+- off: tracing disabled
+
+Reports chunks per second, event-loop lag (overshoot of a 5ms ticker) and,
+after flushing, the records the collector received and the tracer's queue
+statistics (dropped and sampled-out records).
+
+Usage (from the backend directory):
+    python -m benchmarks.tracing_overhead --runs 50 --chunks 400
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.fakes import FakeLangfuseCollector
+from services.langfuse import Tracer
+
+# Interval of the event-loop lag probe, in seconds
+TICK_SECONDS = 0.005
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+async def _stream_run(tracer, run_index: int, args) -> int:
+    trace = tracer.trace(name="agent_run", id=f"bench-run-{run_index}-{time.time_ns()}",
+                         session_id=f"thread-{run_index}", metadata={"project_id": f"project-{run_index}"})
+    generation = trace.generation(name="thread_manager.run_thread")
+    generation.update(input=[{"role": "user", "content": "benchmark"}], model="fake")
+    content = ""
+    for chunk_index in range(args.chunks):
+        content += f"tok{chunk_index} "
+        for event_index in range(args.events_per_chunk):
+            trace.event(name="found_xml_tag", level="DEFAULT",
+                        status_message=f"Found XML tag: tag{event_index} in chunk {chunk_index}")
+        if args.tool_every and chunk_index % args.tool_every == args.tool_every - 1:
+            span = trace.span(name="execute_tool.web_search", input={"query": content[-40:]})
+            trace.event(name="executing_tool", level="DEFAULT", status_message="Executing tool: web_search")
+            span.end(status_message="tool_executed", output={"results": [content[-40:]]})
+        await asyncio.sleep(0)
+    generation.end(output=content)
+    trace.event(name="run_finished", level="WARNING", status_message="Run finished")
+    if hasattr(trace, "close"):
+        trace.close()
+    return args.chunks
+
+
+async def _measure(tracer, args) -> dict:
+    lags = []
+    running = True
+
+    async def probe():
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    chunks = await asyncio.gather(*(_stream_run(tracer, i, args) for i in range(args.runs)))
+    elapsed = time.perf_counter() - started
+    running = False
+    await probe_task
+    return {
+        "chunks_per_second": round(sum(chunks) / elapsed, 1),
+        "event_loop_lag_p50_ms": _percentile(lags, 0.5),
+        "event_loop_lag_p99_ms": _percentile(lags, 0.99),
+        "event_loop_lag_max_ms": round(max(lags) * 1000, 2) if lags else None,
+    }
+
+
+def _tracer(args, enabled: bool, sampled: bool) -> Tracer:
+    return Tracer(
+        enabled=enabled,
+        sample_percent=args.sample_percent if sampled else 100,
+        event_sample_percent=args.event_sample_percent if sampled else 100,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+    )
+
+
+async def _run(args) -> dict:
+    from langfuse import Langfuse
+
+    results = {"runs": args.runs, "chunks_per_run": args.chunks}
+    with FakeLangfuseCollector(latency=args.collector_latency) as collector:
+        os.environ.update(LANGFUSE_HOST=collector.host, LANGFUSE_PUBLIC_KEY="pk-bench", LANGFUSE_SECRET_KEY="sk-bench")
+
+        sdk = Langfuse(host=collector.host, public_key="pk-bench", secret_key="sk-bench")
+        results["direct"] = await _measure(sdk, args)
+        sdk.flush()
+        results["direct"]["collector_records"] = collector.records
+
+        for name, enabled, sampled in (("async", True, False), ("sampled", True, True), ("off", False, False)):
+            collector.records = 0
+            tracer = _tracer(args, enabled, sampled)
+            results[name] = await _measure(tracer, args)
+            flush_started = time.perf_counter()
+            tracer.flush(timeout=120)
+            results[name]["flush_seconds"] = round(time.perf_counter() - flush_started, 2)
+            results[name]["collector_records"] = collector.records
+            results[name]["tracer"] = tracer.get_stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50, help="Concurrent runs")
+    parser.add_argument("--chunks", type=int, default=400, help="Streamed chunks per run")
+    parser.add_argument("--events-per-chunk", type=int, default=2, help="DEFAULT-level events per chunk")
+    parser.add_argument("--tool-every", type=int, default=50, help="Chunks between tool spans (0 for none)")
+    parser.add_argument("--sample-percent", type=int, default=10, help="Runs traced in the sampled configuration")
+    parser.add_argument("--event-sample-percent", type=int, default=10, help="DEFAULT-level events kept when sampled")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Tracer export queue size")
+    parser.add_argument("--batch-size", type=int, default=200, help="Records exported per batch")
+    parser.add_argument("--collector-latency", type=float, default=0.02, help="Seconds per collector request")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
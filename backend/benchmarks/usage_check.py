@@ -0,0 +1,180 @@
+"""
+Latency of the monthly usage check for accounts with long run histories.
+
+Seeds one account per size of ``--sizes`` in the local Postgres, with that
+many completed agent runs spread over threads of ``--runs-per-thread`` runs
+and over the current and ``--months`` previous months, and records every run
+in the usage ledger (``database/init/08-usage-ledger.sql``). Two ways of
+computing the account's minutes of the current month are then timed
+``--repeats`` times each:
+
+- legacy: the previous ``calculate_monthly_usage``: the account's threads,
+  then its runs of the month by thread ID, with durations summed in Python
+- ledger: ``get_monthly_usage``, one row of ``account_usage_monthly``
+
+Both results are compared. Also timed is ``record_run_usage``, the insert a
+worker makes at each checkpoint and when a run ends, on each account.
+
+Needs the local Postgres from docker-compose (DATABASE_* settings as for
+the API) with the init scripts applied. Seeded accounts are deleted
+afterwards unless ``--keep`` is given.
+
+Usage (from the backend directory):
+    python -m benchmarks.usage_check --sizes 1000,10000,100000
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from services.database import db_service
+from services.usage_ledger import get_monthly_usage
+
+# Slug prefix of the seeded accounts
+BENCH_ACCOUNT_SLUG = "usage-check-benchmark"
+
+
+async def _legacy_monthly_usage(account_id: uuid.UUID) -> float:
+    """The queries and arithmetic of ``calculate_monthly_usage`` before the ledger."""
+    now = datetime.now(timezone.utc)
+    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    threads = await db_service.execute_query("SELECT id FROM threads WHERE account_id = $1", account_id)
+    if not threads:
+        return 0.0
+    runs = await db_service.execute_query(
+        "SELECT started_at, completed_at FROM agent_runs WHERE thread_id = ANY($1::uuid[]) AND started_at >= $2",
+        [thread["id"] for thread in threads], start_of_month,
+    )
+    now_ts = now.timestamp()
+    total_seconds = 0
+    for run in runs:
+        end_time = run["completed_at"].timestamp() if run["completed_at"] else now_ts
+        total_seconds += end_time - run["started_at"].timestamp()
+    return total_seconds / 60
+
+
+async def _seed(size: int, runs_per_thread: int, months: int) -> tuple:
+    """An account with ``size`` completed runs recorded in the ledger; returns it and one of its runs."""
+    account_id = await db_service.execute_query(
+        "INSERT INTO accounts (name, slug, personal_account) VALUES ('Usage check', $1, TRUE) RETURNING id",
+        f"{BENCH_ACCOUNT_SLUG}-{size}-{uuid.uuid4().hex[:8]}",
+        fetch="val",
+    )
+    project_id = await db_service.execute_query(
+        "INSERT INTO projects (name, account_id) VALUES ('Usage check', $1) RETURNING id",
+        account_id,
+        fetch="val",
+    )
+    await db_service.execute_query(
+        "INSERT INTO threads (account_id, project_id, title) "
+        "SELECT $1, $2, 'Usage check' FROM generate_series(1, $3)",
+        account_id, project_id, (size + runs_per_thread - 1) // runs_per_thread,
+        fetch="none",
+    )
+    # Runs start at random times between the start of the oldest month and an
+    # hour ago, so every one of them has completed
+    await db_service.execute_query("""
+        WITH thread AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY id) - 1 AS n FROM threads WHERE account_id = $1
+        ),
+        run AS (
+            SELECT i, DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+                      - MAKE_INTERVAL(months => $4)
+                      + RANDOM() * (NOW() - INTERVAL '1 hour'
+                                    - (DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+                                       - MAKE_INTERVAL(months => $4))) AS started_at,
+                   MAKE_INTERVAL(secs => 10 + RANDOM() * 1800) AS duration
+            FROM generate_series(0, $2 - 1) AS i
+        )
+        INSERT INTO agent_runs (thread_id, status, started_at, completed_at)
+        SELECT thread.id, 'completed', run.started_at, run.started_at + run.duration
+        FROM run JOIN thread ON thread.n = run.i / $3
+    """, account_id, size, runs_per_thread, months, fetch="none")
+    await db_service.execute_query("""
+        INSERT INTO usage_ledger (account_id, agent_run_id, period, seconds, final, recorded_at)
+        SELECT $1, r.id, DATE_TRUNC('month', r.started_at AT TIME ZONE 'UTC')::date,
+               EXTRACT(EPOCH FROM (r.completed_at - r.started_at)), TRUE, r.completed_at
+        FROM agent_runs r JOIN threads t ON t.id = r.thread_id
+        WHERE t.account_id = $1
+    """, account_id, fetch="none")
+    await db_service.execute_query("ANALYZE agent_runs; ANALYZE threads; ANALYZE account_usage_monthly", fetch="none")
+    agent_run_id = await db_service.execute_query(
+        "SELECT r.id FROM agent_runs r JOIN threads t ON t.id = r.thread_id WHERE t.account_id = $1 LIMIT 1",
+        account_id,
+        fetch="val",
+    )
+    return account_id, agent_run_id
+
+
+async def _timed(call, repeats: int) -> tuple:
+    latencies, result = [], None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = await call()
+        latencies.append(time.perf_counter() - started)
+    return latencies, result
+
+
+def _ms(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "mean": round(statistics.mean(values) * 1000, 3),
+        "p50": round(values[len(values) // 2] * 1000, 3),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+    }
+
+
+async def _run(args) -> dict:
+    await db_service.initialize()
+    results = {"sizes": {}}
+    seeded = []
+    try:
+        for size in args.sizes:
+            started = time.perf_counter()
+            account_id, agent_run_id = await _seed(size, args.runs_per_thread, args.months)
+            seeded.append(account_id)
+            seed_seconds = time.perf_counter() - started
+
+            legacy, legacy_minutes = await _timed(lambda: _legacy_monthly_usage(account_id), args.repeats)
+            ledger, ledger_minutes = await _timed(lambda: get_monthly_usage(str(account_id)), args.repeats)
+            checkpoint, _ = await _timed(lambda: db_service.execute_query(
+                "SELECT record_run_usage($1, $2, $3, $4, FALSE)", agent_run_id, 0.0, 0, 0, fetch="val",
+            ), args.repeats)
+            results["sizes"][size] = {
+                "seed_seconds": round(seed_seconds, 1),
+                "runs_this_month": await db_service.execute_query(
+                    "SELECT runs FROM account_usage_monthly WHERE account_id = $1 "
+                    "AND period = DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC')::date",
+                    account_id, fetch="val"),
+                "legacy_ms": _ms(legacy),
+                "ledger_ms": _ms(ledger),
+                "checkpoint_write_ms": _ms(checkpoint),
+                "minutes": {"legacy": round(legacy_minutes, 3), "ledger": round(ledger_minutes, 3)},
+                "match": abs(legacy_minutes - ledger_minutes) < 1e-6 * max(legacy_minutes, 1),
+            }
+    finally:
+        if not args.keep:
+            for account_id in seeded:
+                await db_service.execute_query("DELETE FROM accounts WHERE id = $1", account_id, fetch="none")
+        await db_service.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda value: [int(v) for v in value.split(",")], default=[1000, 10000, 100000],
+                        help="Comma-separated run counts of the seeded accounts")
+    parser.add_argument("--runs-per-thread", type=int, default=10)
+    parser.add_argument("--months", type=int, default=5, help="Previous months the runs are spread over")
+    parser.add_argument("--repeats", type=int, default=50, help="Timed usage checks per account")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded accounts")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Load test for the background worker's per-run setup and stop-signal handling.
+
+Starts ``--runs`` concurrent agent-run stand-ins in one process (one worker)
+that idle for ``--idle`` seconds and are then stopped through their control
+channels, in two configurations:
+
+- per_run: what ``run_agent_background`` did before, i.e. initialize Redis
+  and the database on every invocation, open a pub/sub subscription per run
+  and poll it every 0.1s
+- shared: ``WorkerRuntime`` initialized once per process, with all runs
+  receiving STOP through the ``StopSignalHub`` subscription
+
+Reports actor startup latency (invocation until the run listens for STOP),
+process CPU while the runs idle, Redis client connections opened by the
+worker and STOP delivery latency.
+
+Needs the local Redis and Postgres from docker-compose (REDIS_*/DATABASE_*
+settings as for the worker).
+
+Usage (from the backend directory):
+    python -m benchmarks.worker_stop_signals --runs 100 --idle 10
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from services import redis
+from services.database import DBConnection
+from services.worker_runtime import WorkerRuntime
+from utils.retry import retry
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 2)
+
+
+async def _connected_clients() -> int:
+    redis_client = await redis.get_client()
+    return (await redis_client.info("clients"))["connected_clients"]
+
+
+async def _per_run(agent_run_id: str, instance_id: str, started_at: dict, stopped_at: dict):
+    # Previous actor setup: initialize on every invocation, then one subscription per run
+    await retry(lambda: redis.initialize_async())
+    await DBConnection().initialize()
+    pubsub = await redis.create_pubsub()
+    await pubsub.subscribe(f"agent_run:{agent_run_id}:control:{instance_id}", f"agent_run:{agent_run_id}:control")
+    started_at[agent_run_id] = time.perf_counter()
+    try:
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
+            if message and message.get("type") == "message" and message.get("data") == "STOP":
+                stopped_at[agent_run_id] = time.perf_counter()
+                return
+            await redis.expire(f"active_run:{instance_id}:{agent_run_id}", redis.REDIS_KEY_TTL)
+            await asyncio.sleep(0.1)
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+
+async def _shared(runtime: WorkerRuntime, agent_run_id: str, started_at: dict, stopped_at: dict):
+    await runtime.ensure_initialized()
+    stop_signal = runtime.stop_signals.register(agent_run_id)
+    started_at[agent_run_id] = time.perf_counter()
+    try:
+        await stop_signal.wait()
+        stopped_at[agent_run_id] = time.perf_counter()
+    finally:
+        runtime.stop_signals.unregister(agent_run_id)
+
+
+async def _run_mode(mode: str, args) -> dict:
+    instance_id = f"bench-{uuid.uuid4().hex[:6]}"
+    runtime = WorkerRuntime(instance_id)
+    baseline_clients = await _connected_clients()
+    run_ids = [f"bench-{uuid.uuid4().hex[:12]}" for _ in range(args.runs)]
+    started_at, stopped_at = {}, {}
+
+    invoked = time.perf_counter()
+    if mode == "per_run":
+        tasks = [asyncio.create_task(_per_run(run_id, instance_id, started_at, stopped_at)) for run_id in run_ids]
+    else:
+        tasks = [asyncio.create_task(_shared(runtime, run_id, started_at, stopped_at)) for run_id in run_ids]
+    while len(started_at) < len(run_ids):
+        await asyncio.sleep(0.01)
+    startup = [started_at[run_id] - invoked for run_id in run_ids]
+
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    await asyncio.sleep(args.idle)
+    idle_cpu = (time.process_time() - cpu_started) / (time.perf_counter() - wall_started)
+    connections = await _connected_clients() - baseline_clients
+
+    stop_sent = time.perf_counter()
+    for run_id in run_ids:
+        # As stop_agent_run does for each instance registered for the run
+        await redis.publish(f"agent_run:{run_id}:control:{instance_id}", "STOP")
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=30)
+    delivery = [stopped_at[run_id] - stop_sent for run_id in run_ids]
+
+    await runtime.shutdown()
+    return {
+        "startup_p50_ms": _percentile(startup, 0.5),
+        "startup_p99_ms": _percentile(startup, 0.99),
+        "idle_cpu_percent": round(idle_cpu * 100, 2),
+        "redis_connections": connections,
+        "stop_delivery_p50_ms": _percentile(delivery, 0.5),
+        "stop_delivery_max_ms": _percentile(delivery, 1.0),
+    }
+
+
+async def _run(args) -> dict:
+    await redis.initialize_async()
+    results = {"runs": args.runs}
+    for mode in ("per_run", "shared"):
+        results[mode] = await _run_mode(mode, args)
+    await redis.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=100, help="Concurrent runs on the worker")
+    parser.add_argument("--idle", type=float, default=10.0, help="Seconds the runs stay active before STOP")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+-- NEO Content-Addressed File Storage
+-- Identical file contents are stored once per bucket and referenced from many
+-- rows in the files table. Safe to re-run against an existing database.
+
+-- Create file_blobs table (one row per stored object)
+CREATE TABLE IF NOT EXISTS file_blobs (
+    bucket VARCHAR(100) NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    storage_path TEXT NOT NULL,
+    file_size BIGINT NOT NULL,
+    content_type VARCHAR(100),
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (bucket, content_hash)
+);
+
+-- Link files to their blob
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(bucket, content_hash);
@@ -0,0 +1,7 @@
+-- NEO Agent Run Profiles
+-- Critical path breakdown of each agent run (utils/run_profiler.py), written
+-- with the run's final status. Safe to re-run against an existing database.
+
+ALTER TABLE agent_runs ADD COLUMN IF NOT EXISTS profile JSONB;
+
+COMMENT ON COLUMN agent_runs.profile IS 'Per-iteration critical path breakdown of the run, see RunProfiler.summary()';
@@ -0,0 +1,7 @@
+-- NEO Agent Run Token Usage
+-- Token usage ledger of each agent run (agentpress/token_usage.py), written
+-- with the run's final status. Safe to re-run against an existing database.
+
+ALTER TABLE agent_runs ADD COLUMN IF NOT EXISTS usage JSONB;
+
+COMMENT ON COLUMN agent_runs.usage IS 'Prompt and completion tokens of the run''s LLM calls, see RunUsage.summary()';
@@ -0,0 +1,129 @@
+-- NEO Usage Ledger
+-- Append-only record of the run time and tokens of agent runs, written at
+-- periodic checkpoints while a run is active and once when it ends, with
+-- monthly totals per account maintained on insert. Usage checks read one
+-- rollup row instead of every run of the account. Safe to re-run against an
+-- existing database.
+
+-- One row per checkpoint or completion of a run; rows are never updated
+CREATE TABLE IF NOT EXISTS usage_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    account_id UUID NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    -- Not a foreign key: entries outlive deleted runs
+    agent_run_id UUID,
+    period DATE NOT NULL,
+    seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    final BOOLEAN NOT NULL DEFAULT FALSE,
+    recorded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_usage_ledger_agent_run_id ON usage_ledger(agent_run_id);
+CREATE INDEX IF NOT EXISTS idx_usage_ledger_account_period ON usage_ledger(account_id, period);
+
+-- A run is completed in the ledger at most once
+CREATE UNIQUE INDEX IF NOT EXISTS idx_usage_ledger_final_run
+    ON usage_ledger(agent_run_id) WHERE final;
+
+-- Monthly totals of the ledger per account
+CREATE TABLE IF NOT EXISTS account_usage_monthly (
+    account_id UUID NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    period DATE NOT NULL,
+    seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    runs INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (account_id, period)
+);
+
+CREATE OR REPLACE FUNCTION reject_usage_ledger_update()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RAISE EXCEPTION 'usage_ledger is append-only';
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION rollup_usage_ledger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO account_usage_monthly (account_id, period, seconds, prompt_tokens, completion_tokens, runs)
+    VALUES (NEW.account_id, NEW.period, NEW.seconds, NEW.prompt_tokens, NEW.completion_tokens, NEW.final::int)
+    ON CONFLICT (account_id, period) DO UPDATE SET
+        seconds = account_usage_monthly.seconds + EXCLUDED.seconds,
+        prompt_tokens = account_usage_monthly.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = account_usage_monthly.completion_tokens + EXCLUDED.completion_tokens,
+        runs = account_usage_monthly.runs + EXCLUDED.runs,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS usage_ledger_append_only ON usage_ledger;
+CREATE TRIGGER usage_ledger_append_only
+    BEFORE UPDATE ON usage_ledger
+    FOR EACH ROW EXECUTE FUNCTION reject_usage_ledger_update();
+
+DROP TRIGGER IF EXISTS usage_ledger_rollup ON usage_ledger;
+CREATE TRIGGER usage_ledger_rollup
+    AFTER INSERT ON usage_ledger
+    FOR EACH ROW EXECUTE FUNCTION rollup_usage_ledger();
+
+-- Appends usage of a run to the ledger of its thread's account, in the
+-- current UTC month. Returns false if the run is unknown or was already
+-- completed in the ledger.
+CREATE OR REPLACE FUNCTION record_run_usage(
+    p_agent_run_id UUID,
+    p_seconds DOUBLE PRECISION,
+    p_prompt_tokens BIGINT DEFAULT 0,
+    p_completion_tokens BIGINT DEFAULT 0,
+    p_final BOOLEAN DEFAULT FALSE
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    INSERT INTO usage_ledger (account_id, agent_run_id, period, seconds, prompt_tokens, completion_tokens, final)
+    SELECT t.account_id, r.id, DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC')::date,
+           GREATEST(p_seconds, 0), p_prompt_tokens, p_completion_tokens, p_final
+    FROM agent_runs r
+    JOIN threads t ON t.id = r.thread_id
+    WHERE r.id = p_agent_run_id
+    AND t.account_id IS NOT NULL
+    ON CONFLICT (agent_run_id) WHERE final DO NOTHING;
+
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+    RETURN inserted > 0;
+END;
+$$;
+
+-- Carry over runs of the current month that ended before the ledger existed
+INSERT INTO usage_ledger (account_id, agent_run_id, period, seconds, final, recorded_at)
+SELECT t.account_id, r.id, DATE_TRUNC('month', r.started_at AT TIME ZONE 'UTC')::date,
+       GREATEST(EXTRACT(EPOCH FROM (r.completed_at - r.started_at)), 0), TRUE, r.completed_at
+FROM agent_runs r
+JOIN threads t ON t.id = r.thread_id
+WHERE r.completed_at IS NOT NULL
+AND r.started_at >= DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+AND t.account_id IS NOT NULL
+AND NOT EXISTS (SELECT 1 FROM usage_ledger l WHERE l.agent_run_id = r.id)
+ON CONFLICT (agent_run_id) WHERE final DO NOTHING;
+
+-- Record runs in progress up to now; the workers handling them predate the
+-- ledger and will not checkpoint them
+INSERT INTO usage_ledger (account_id, agent_run_id, period, seconds, final)
+SELECT t.account_id, r.id, DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC')::date,
+       GREATEST(EXTRACT(EPOCH FROM (NOW() - GREATEST(r.started_at, DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'))), 0), FALSE
+FROM agent_runs r
+JOIN threads t ON t.id = r.thread_id
+WHERE r.status = 'running'
+AND r.completed_at IS NULL
+AND t.account_id IS NOT NULL
+AND NOT EXISTS (SELECT 1 FROM usage_ledger l WHERE l.agent_run_id = r.id);
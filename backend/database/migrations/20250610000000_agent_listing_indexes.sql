@@ -0,0 +1,68 @@
+BEGIN;
+
+-- Columns and indexes for database-side filtering and keyset pagination of
+-- agent listings (agent/listing.py)
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Tool keys of an agent: 'mcp:{name}' per configured MCP and
+-- 'agentpress:{tool}' per enabled AgentPress tool
+CREATE OR REPLACE FUNCTION agent_tool_keys(p_configured_mcps JSONB, p_agentpress_tools JSONB)
+RETURNS TEXT[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT COALESCE(ARRAY(
+        SELECT 'mcp:' || (mcp->>'name')
+        FROM jsonb_array_elements(
+            CASE WHEN jsonb_typeof(p_configured_mcps) = 'array' THEN p_configured_mcps ELSE '[]'::jsonb END
+        ) AS mcp
+        WHERE jsonb_typeof(mcp) = 'object' AND mcp ? 'name'
+        UNION ALL
+        SELECT 'agentpress:' || tool.key
+        FROM jsonb_each(
+            CASE WHEN jsonb_typeof(p_agentpress_tools) = 'object' THEN p_agentpress_tools ELSE '{}'::jsonb END
+        ) AS tool
+        WHERE jsonb_typeof(tool.value) = 'object' AND tool.value->'enabled' = 'true'::jsonb
+    ), '{}');
+$$;
+
+-- Number of configured MCPs plus enabled AgentPress tools
+CREATE OR REPLACE FUNCTION agent_tools_count(p_configured_mcps JSONB, p_agentpress_tools JSONB)
+RETURNS INTEGER
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT (CASE WHEN jsonb_typeof(p_configured_mcps) = 'array' THEN jsonb_array_length(p_configured_mcps) ELSE 0 END)
+        + cardinality(ARRAY(
+            SELECT 1
+            FROM jsonb_each(
+                CASE WHEN jsonb_typeof(p_agentpress_tools) = 'object' THEN p_agentpress_tools ELSE '{}'::jsonb END
+            ) AS tool
+            WHERE jsonb_typeof(tool.value) = 'object' AND tool.value->'enabled' = 'true'::jsonb
+        ));
+$$;
+
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS tool_keys TEXT[]
+    GENERATED ALWAYS AS (agent_tool_keys(configured_mcps, agentpress_tools)) STORED;
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS tools_count INTEGER
+    GENERATED ALWAYS AS (agent_tools_count(configured_mcps, agentpress_tools)) STORED;
+
+-- Keyset pagination of an account's agents, one index per sort field; nullable
+-- columns are indexed on the sort expressions of agent/listing.py
+CREATE INDEX IF NOT EXISTS idx_agents_account_created_at ON agents(account_id, COALESCE(created_at, 'infinity'::timestamptz), agent_id);
+CREATE INDEX IF NOT EXISTS idx_agents_account_updated_at ON agents(account_id, COALESCE(updated_at, 'infinity'::timestamptz), agent_id);
+CREATE INDEX IF NOT EXISTS idx_agents_account_name ON agents(account_id, name, agent_id);
+CREATE INDEX IF NOT EXISTS idx_agents_account_tools_count ON agents(account_id, tools_count, agent_id);
+
+-- Keyset pagination of the marketplace
+CREATE INDEX IF NOT EXISTS idx_agents_public_published_at ON agents(COALESCE(marketplace_published_at, 'infinity'::timestamptz), agent_id) WHERE is_public = TRUE;
+CREATE INDEX IF NOT EXISTS idx_agents_public_download_count ON agents(COALESCE(download_count, 0), agent_id) WHERE is_public = TRUE;
+CREATE INDEX IF NOT EXISTS idx_agents_public_name ON agents(name, agent_id) WHERE is_public = TRUE;
+
+-- Search, tag and tool filters
+CREATE INDEX IF NOT EXISTS idx_agents_name_trgm ON agents USING gin(name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_agents_description_trgm ON agents USING gin(description gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_agents_tool_keys ON agents USING gin(tool_keys);
+
+COMMIT;
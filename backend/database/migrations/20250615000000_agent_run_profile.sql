@@ -0,0 +1,9 @@
+BEGIN;
+
+-- Critical path breakdown of each agent run (utils/run_profiler.py), written
+-- with the run's final status
+ALTER TABLE agent_runs ADD COLUMN IF NOT EXISTS profile JSONB;
+
+COMMENT ON COLUMN agent_runs.profile IS 'Per-iteration critical path breakdown of the run, see RunProfiler.summary()';
+
+COMMIT;
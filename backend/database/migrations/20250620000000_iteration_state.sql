@@ -0,0 +1,104 @@
+BEGIN;
+
+-- Agent loop iteration state (agent/iteration_state.py): everything the loop
+-- needs before each LLM call, read in one round trip. usage_seconds reads the
+-- usage ledger tables of 20250621000000_usage_ledger.sql.
+
+-- Latest message of a given type in a thread
+CREATE INDEX IF NOT EXISTS idx_messages_thread_type_created_at
+    ON messages(thread_id, type, created_at DESC);
+
+-- Replaced by the three argument version below
+DROP FUNCTION IF EXISTS get_iteration_state(UUID, TIMESTAMP WITH TIME ZONE);
+
+-- Returns the latest conversation message type, the latest browser state if
+-- it is newer than p_browser_state_since, and the latest image context, which
+-- is consumed (deleted) in the same statement unless the assistant spoke last.
+-- With p_account_id it also returns the account's run time this UTC month in
+-- usage_seconds: the usage ledger rollup (08-usage-ledger.sql) plus the time
+-- its running runs spent since their last checkpoint.
+CREATE OR REPLACE FUNCTION get_iteration_state(
+    p_thread_id UUID,
+    p_browser_state_since TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_account_id UUID DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    result JSONB;
+    month_start TIMESTAMP WITH TIME ZONE := DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    usage_seconds DOUBLE PRECISION;
+BEGIN
+    IF p_account_id IS NOT NULL THEN
+        SELECT COALESCE((
+            SELECT seconds
+            FROM account_usage_monthly
+            WHERE account_id = p_account_id
+            AND period = month_start::date
+        ), 0) + COALESCE((
+            SELECT SUM(GREATEST(EXTRACT(EPOCH FROM (NOW() - GREATEST(
+                COALESCE(
+                    (SELECT MAX(l.recorded_at) FROM usage_ledger l WHERE l.agent_run_id = r.id),
+                    r.started_at
+                ),
+                month_start
+            ))), 0))
+            FROM agent_runs r
+            JOIN threads t ON t.thread_id = r.thread_id
+            WHERE t.account_id = p_account_id
+            AND r.status = 'running'
+        ), 0)
+        INTO usage_seconds;
+    END IF;
+
+    WITH latest_message AS (
+        SELECT type
+        FROM messages
+        WHERE thread_id = p_thread_id
+        AND type IN ('assistant', 'tool', 'user')
+        ORDER BY created_at DESC
+        LIMIT 1
+    ),
+    browser_state AS (
+        SELECT message_id, content, created_at
+        FROM messages
+        WHERE thread_id = p_thread_id
+        AND type = 'browser_state'
+        AND (p_browser_state_since IS NULL OR created_at > p_browser_state_since)
+        ORDER BY created_at DESC
+        LIMIT 1
+    ),
+    image_context AS (
+        DELETE FROM messages
+        WHERE message_id = (
+            SELECT message_id
+            FROM messages
+            WHERE thread_id = p_thread_id
+            AND type = 'image_context'
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        -- The loop stops without using it when the assistant spoke last
+        AND NOT EXISTS (SELECT 1 FROM latest_message WHERE type = 'assistant')
+        RETURNING message_id, content
+    )
+    SELECT JSONB_BUILD_OBJECT(
+        'latest_message_type', (SELECT type FROM latest_message),
+        'browser_state', (
+            SELECT JSONB_BUILD_OBJECT('message_id', message_id, 'content', content, 'created_at', created_at)
+            FROM browser_state
+        ),
+        'image_context', (
+            SELECT JSONB_BUILD_OBJECT('message_id', message_id, 'content', content)
+            FROM image_context
+        ),
+        'usage_seconds', usage_seconds
+    )
+    INTO result;
+
+    RETURN result;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,21 @@
+BEGIN;
+
+-- Response log (services/response_log.py): responses of agent runs archived
+-- in compressed chunks while they run
+
+-- One row per chunk: zlib-compressed, newline-separated response JSON
+CREATE TABLE IF NOT EXISTS agent_run_response_chunks (
+    agent_run_id UUID NOT NULL REFERENCES agent_runs(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    first_index INTEGER NOT NULL,
+    response_count INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (agent_run_id, seq)
+);
+
+-- Responses archived for the run, set with its final status. Left NULL when
+-- some chunks could not be written, so a partial archive can be told apart
+ALTER TABLE agent_runs ADD COLUMN IF NOT EXISTS response_count INTEGER;
+
+COMMIT;
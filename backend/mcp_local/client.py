@@ -41,6 +41,7 @@ except ImportError:
         Tool = Any
         ToolResult = Any
 
+from services.circuit_breaker import circuit_breakers, endpoint_breaker_name
 from utils.logger import logger
 import os
 
@@ -61,7 +62,9 @@ class MCPConnection:
 class MCPManager:
     """Manages connections to multiple MCP servers"""
     
-    def __init__(self):
+    def __init__(self, account_id: Optional[str] = None):
+        # Account whose servers these are; their circuit breakers are its own
+        self.account_id = account_id
         self.connections: Dict[str, MCPConnection] = {}
         self._sessions: Dict[str, Tuple[Any, Any, Any]] = {}  # Store streams for cleanup
         
@@ -211,52 +214,54 @@ class MCPManager:
             raise ValueError("SMITHERY_API_KEY environment variable is not set")
         
         try:
-            # Create fresh connection for this tool call
-            config_json = json.dumps(conn.config)
-            config_b64 = base64.b64encode(config_json.encode()).decode()
-            url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
+            breaker_name = endpoint_breaker_name("mcp", qualified_name, self.account_id, conn.config)
+            async with circuit_breakers.guard(breaker_name):
+                # Create fresh connection for this tool call
+                config_json = json.dumps(conn.config)
+                config_b64 = base64.b64encode(config_json.encode()).decode()
+                url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
             
-            # Use the documented pattern with proper context management
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
+                # Use the documented pattern with proper context management
+                async with streamablehttp_client(url) as (read_stream, write_stream, _):
+                    async with ClientSession(read_stream, write_stream) as session:
+                        # Initialize the connection
+                        await session.initialize()
                     
-                    # Call the tool
-                    result = await session.call_tool(original_tool_name, arguments)
+                        # Call the tool
+                        result = await session.call_tool(original_tool_name, arguments)
             
-                    # Convert result to dict - handle MCP response properly
-                    if hasattr(result, 'content'):
-                        # Handle content which might be a list of TextContent objects
-                        content = result.content
-                        if isinstance(content, list):
-                            # Extract text from TextContent objects
-                            text_parts = []
-                            for item in content:
-                                if hasattr(item, 'text'):
-                                    text_parts.append(item.text)
-                                elif hasattr(item, 'content'):
-                                    text_parts.append(str(item.content))
-                                else:
-                                    text_parts.append(str(item))
-                            content_str = "\n".join(text_parts)
-                        elif hasattr(content, 'text'):
-                            # Single TextContent object
-                            content_str = content.text
-                        elif hasattr(content, 'content'):
-                            content_str = str(content.content)
-                        else:
-                            content_str = str(content)
+                        # Convert result to dict - handle MCP response properly
+                        if hasattr(result, 'content'):
+                            # Handle content which might be a list of TextContent objects
+                            content = result.content
+                            if isinstance(content, list):
+                                # Extract text from TextContent objects
+                                text_parts = []
+                                for item in content:
+                                    if hasattr(item, 'text'):
+                                        text_parts.append(item.text)
+                                    elif hasattr(item, 'content'):
+                                        text_parts.append(str(item.content))
+                                    else:
+                                        text_parts.append(str(item))
+                                content_str = "\n".join(text_parts)
+                            elif hasattr(content, 'text'):
+                                # Single TextContent object
+                                content_str = content.text
+                            elif hasattr(content, 'content'):
+                                content_str = str(content.content)
+                            else:
+                                content_str = str(content)
                         
-                        is_error = getattr(result, 'isError', False)
-                    else:
-                        content_str = str(result)
-                        is_error = False
+                            is_error = getattr(result, 'isError', False)
+                        else:
+                            content_str = str(result)
+                            is_error = False
                         
-                return {
-                        "content": content_str,
-                        "isError": is_error
-                }
+                    return {
+                            "content": content_str,
+                            "isError": is_error
+                    }
                 
         except Exception as e:
             logger.error(f"Error executing MCP tool {tool_name}: {str(e)}")
@@ -2,50 +2,96 @@ import sentry
 import asyncio
 import json
 import traceback
+import uuid
 from datetime import datetime, timezone
 from typing import Optional
 from services import redis
 from agent.run import run_agent
 from utils.logger import logger
 import dramatiq
-import uuid
 from agentpress.thread_manager import ThreadManager
-from services.database import DBConnection
 from services import redis
+from dramatiq.asyncio import get_event_loop_thread
 from dramatiq.brokers.rabbitmq import RabbitmqBroker
 import os
 from services.langfuse import langfuse
-from utils.retry import retry
+from services.prometheus import AGENT_RUNS_IN_PROGRESS, WORKER_STREAM_CHUNKS, serve_worker_metrics
+from utils.config import config
+from utils.run_profiler import PUBLISH, RunProfiler, phase
+from agentpress.token_usage import RunUsage
+from services.worker_runtime import WorkerRuntime
+from services.usage_ledger import RunMeter
+from services.response_log import ResponseLog
+from services import run_registry
 
 rabbitmq_host = os.getenv('RABBITMQ_HOST', 'rabbitmq')
 rabbitmq_port = int(os.getenv('RABBITMQ_PORT', 5672))
 rabbitmq_broker = RabbitmqBroker(host=rabbitmq_host, port=rabbitmq_port, middleware=[dramatiq.middleware.AsyncIO()])
 dramatiq.set_broker(rabbitmq_broker)
 
-_initialized = False
-db = DBConnection()
-instance_id = "single"
+# ID of this worker process in the run registry, the run lock and control channels
+instance_id = str(uuid.uuid4())[:8]
 
-async def initialize():
-    """Initialize the agent API with resources from the main API."""
-    global db, instance_id, _initialized
+# Redis client, database pool and the shared control-signal subscription,
+# set up once per worker process and reused by every run
+worker_runtime = WorkerRuntime(instance_id)
+db = worker_runtime.db
+
+
+class WorkerRuntimeMiddleware(dramatiq.Middleware):
+    """Warm up the worker runtime when the worker boots and release it on shutdown."""
+
+    def after_worker_boot(self, broker, worker):
+        try:
+            get_event_loop_thread().run_coroutine(worker_runtime.ensure_initialized())
+        except Exception as e:
+            # Runs retry the initialization lazily
+            logger.warning(f"Failed to initialize worker resources at boot: {e}")
+
+    def before_worker_shutdown(self, broker, worker):
+        try:
+            get_event_loop_thread().run_coroutine(worker_runtime.shutdown())
+        except Exception as e:
+            logger.warning(f"Failed to release worker resources: {e}")
 
-    # Use provided instance_id or generate a new one
-    if not instance_id:
-        # Generate instance ID
-        instance_id = str(uuid.uuid4())[:8]
-    await retry(lambda: redis.initialize_async())
-    await db.initialize()
 
-    _initialized = True
-    logger.info(f"Initialized agent API with instance ID: {instance_id}")
+rabbitmq_broker.add_middleware(WorkerRuntimeMiddleware())
+
+
+def _queue_depths() -> dict:
+    """Ready messages in each declared queue and its delay and dead-letter queues."""
+    depths = {}
+    for queue_name in rabbitmq_broker.get_declared_queues():
+        ready, delayed, dead = rabbitmq_broker.get_queue_message_counts(queue_name)
+        depths[queue_name] = ready
+        depths[f"{queue_name}.DQ"] = delayed
+        depths[f"{queue_name}.XQ"] = dead
+    return depths
+
+
+class WorkerMetricsMiddleware(dramatiq.Middleware):
+    """Serve the Prometheus metrics of all worker processes from one of them."""
+
+    def after_process_boot(self, broker):
+        try:
+            serve_worker_metrics(config.WORKER_METRICS_PORT, _queue_depths)
+        except Exception as e:
+            logger.warning(f"Failed to serve worker metrics on port {config.WORKER_METRICS_PORT}: {e}")
+
+
+rabbitmq_broker.add_middleware(WorkerMetricsMiddleware())
+
+
+async def initialize():
+    """Initialize the shared worker resources if needed."""
+    await worker_runtime.ensure_initialized()
 
 
 @dramatiq.actor
 async def run_agent_background(
     agent_run_id: str,
     thread_id: str,
-    instance_id: str, # Use the global instance ID passed during initialization
+    instance_id: str, # Instance of the API that enqueued the run
     project_id: str,
     model_name: str,
     enable_thinking: Optional[bool],
@@ -60,14 +106,14 @@ async def run_agent_background(
     try:
         await initialize()
     except Exception as e:
-        logger.critical(f"Failed to initialize Redis connection: {e}")
+        logger.critical(f"Failed to initialize worker resources: {e}")
         raise e
 
     # Idempotency check: prevent duplicate runs
     run_lock_key = f"agent_run_lock:{agent_run_id}"
     
     # Try to acquire a lock for this agent run
-    lock_acquired = await redis.set(run_lock_key, instance_id, nx=True, ex=redis.REDIS_KEY_TTL)
+    lock_acquired = await redis.set(run_lock_key, worker_runtime.instance_id, nx=True, ex=redis.REDIS_KEY_TTL)
     
     if not lock_acquired:
         # Check if the run is already being handled by another instance
@@ -77,14 +123,14 @@ async def run_agent_background(
             return
         else:
             # Lock exists but no value, try to acquire again
-            lock_acquired = await redis.set(run_lock_key, instance_id, nx=True, ex=redis.REDIS_KEY_TTL)
+            lock_acquired = await redis.set(run_lock_key, worker_runtime.instance_id, nx=True, ex=redis.REDIS_KEY_TTL)
             if not lock_acquired:
                 logger.info(f"Agent run {agent_run_id} is already being processed by another instance. Skipping duplicate execution.")
                 return
 
     sentry.sentry.set_tag("thread_id", thread_id)
 
-    logger.info(f"Starting background agent run: {agent_run_id} for thread: {thread_id} (Instance: {instance_id})")
+    logger.info(f"Starting background agent run: {agent_run_id} for thread: {thread_id} (Instance: {worker_runtime.instance_id})")
     logger.info(f"🚀 Using model: {model_name} (thinking: {enable_thinking}, reasoning_effort: {reasoning_effort})")
     if agent_config:
         logger.info(f"Using custom agent: {agent_config.get('name', 'Unknown')}")
@@ -92,57 +138,42 @@ async def run_agent_background(
     client = await db.client
     start_time = datetime.now(timezone.utc)
     total_responses = 0
-    pubsub = None
-    stop_checker = None
-    stop_signal_received = False
+    stop_signal = None
 
     # Define Redis keys and channels
     response_list_key = f"agent_run:{agent_run_id}:responses"
     response_channel = f"agent_run:{agent_run_id}:new_response"
-    instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
-    instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
-
-    async def check_for_stop_signal():
-        nonlocal stop_signal_received
-        if not pubsub: return
-        try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
-        except asyncio.CancelledError:
-            logger.info(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
-        except Exception as e:
-            logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
-            stop_signal_received = True # Stop the run if the checker fails
 
-    trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
+    trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": worker_runtime.instance_id})
+    # Latency breakdown of the run, stored with it when it ends
+    profiler = RunProfiler(agent_run_id) if config.RUN_PROFILER_ENABLED else None
+    # Token usage of the run's LLM calls, stored with it when it ends
+    run_usage = RunUsage(agent_run_id)
+    # Run time and tokens appended to the account's usage ledger while the run is active
+    usage_meter = RunMeter(agent_run_id, run_usage)
+    # Responses archived in chunks as they are produced, not read back from Redis at the end
+    response_log = ResponseLog(agent_run_id)
+    # Redis writes of responses still in flight; finished ones remove themselves
+    pending_redis_operations = set()
+    AGENT_RUNS_IN_PROGRESS.inc()
     try:
-        # Setup Pub/Sub listener for control signals
-        pubsub = await redis.create_pubsub()
-        try:
-            await retry(lambda: pubsub.subscribe(instance_control_channel, global_control_channel))
-        except Exception as e:
-            logger.error(f"Redis failed to subscribe to control channels: {e}", exc_info=True)
-            raise e
+        if profiler:
+            profiler.activate()
+        run_usage.activate()
+        usage_meter.start()
 
-        logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
-        stop_checker = asyncio.create_task(check_for_stop_signal())
+        # Control signals for this run arrive through the worker's shared subscription
+        stop_signal = worker_runtime.stop_signals.register(agent_run_id)
 
-        # Ensure active run key exists and has TTL
-        await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
+        # This process handles the run from now on, not the API instance that enqueued it
+        await run_registry.register_run(worker_runtime.instance_id, agent_run_id, handed_over_from=instance_id)
 
+        # A STOP sent before the registration went to no channel of this worker
+        run_status = await client.table('agent_runs').select('status').eq("id", agent_run_id).maybe_single().execute()
+        if run_status.data and run_status.data.get('status') != 'running':
+            logger.info(f"Agent run {agent_run_id} was stopped before it started (status: {run_status.data.get('status')})")
+            stop_signal.set()
 
         # Initialize agent generator
         agent_gen = run_agent(
@@ -159,20 +190,23 @@ async def run_agent_background(
         final_status = "running"
         error_message = None
 
-        pending_redis_operations = []
-
         async for response in agent_gen:
-            if stop_signal_received:
+            if stop_signal.is_set():
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
                 final_status = "stopped"
                 trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
                 break
 
             # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            with phase(PUBLISH):
+                response_json = json.dumps(response)
+                for operation in (redis.rpush(response_list_key, response_json), redis.publish(response_channel, "new")):
+                    task = asyncio.create_task(operation)
+                    pending_redis_operations.add(task)
+                    task.add_done_callback(pending_redis_operations.discard)
+                response_log.add(response_json)
             total_responses += 1
+            WORKER_STREAM_CHUNKS.inc()
 
             # Check for agent-signaled completion or error
             if response.get('type') == 'status':
@@ -191,15 +225,18 @@ async def run_agent_background(
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
+             completion_json = json.dumps(completion_message)
+             await redis.rpush(response_list_key, completion_json)
              await redis.publish(response_channel, "new") # Notify about the completion message
+             response_log.add(completion_json)
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Write the last chunk of the response log
+        archived = await response_log.close()
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, final_status, error=error_message, responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, final_status, error=error_message,
+                                      profile=profiler.summary() if profiler else None, usage=run_usage.summary(),
+                                      response_count=response_log.count if archived else None)
 
         # Publish final control signal (END_STREAM or ERROR)
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
@@ -214,29 +251,27 @@ async def run_agent_background(
         error_message = str(e)
         traceback_str = traceback.format_exc()
         duration = (datetime.now(timezone.utc) - start_time).total_seconds()
-        logger.error(f"Error in agent run {agent_run_id} after {duration:.2f}s: {error_message}\n{traceback_str} (Instance: {instance_id})")
+        logger.error(f"Error in agent run {agent_run_id} after {duration:.2f}s: {error_message}\n{traceback_str} (Instance: {worker_runtime.instance_id})")
         final_status = "failed"
         trace.span(name="agent_run_failed").end(status_message=error_message, level="ERROR")
 
         # Push error message to Redis list
         error_response = {"type": "status", "status": "error", "message": error_message}
+        error_json = json.dumps(error_response)
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
+            await redis.rpush(response_list_key, error_json)
             await redis.publish(response_channel, "new")
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
+        # Write the rest of the response log, including the error
+        response_log.add(error_json)
+        archived = await response_log.close()
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}", responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}",
+                                      profile=profiler.summary() if profiler else None, usage=run_usage.summary(),
+                                      response_count=response_log.count if archived else None)
 
         # Publish ERROR signal
         try:
@@ -246,27 +281,22 @@ async def run_agent_background(
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
-        # Cleanup stop checker task
-        if stop_checker and not stop_checker.done():
-            stop_checker.cancel()
-            try: await stop_checker
-            except asyncio.CancelledError: pass
-            except Exception as e: logger.warning(f"Error during stop_checker cancellation: {e}")
-
-        # Close pubsub connection
-        if pubsub:
-            try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
-            except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
+        AGENT_RUNS_IN_PROGRESS.dec()
+
+        # Record the rest of the run in the usage ledger
+        await usage_meter.close()
+
+        # Stop receiving control signals for this run
+        worker_runtime.stop_signals.unregister(agent_run_id)
+
+        # No more trace records follow for this run
+        trace.close()
 
         # Set TTL on the response list in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
-        # Remove the instance-specific active run key
-        await _cleanup_redis_instance_key(agent_run_id)
+        # Remove the finished run from the run registry
+        await _release_active_run(agent_run_id)
 
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
@@ -277,20 +307,15 @@ async def run_agent_background(
         except asyncio.TimeoutError:
             logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
 
-        logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
+        logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {worker_runtime.instance_id}) with final status: {final_status}")
 
-async def _cleanup_redis_instance_key(agent_run_id: str):
-    """Clean up the instance-specific Redis key for an agent run."""
-    if not instance_id:
-        logger.warning("Instance ID not set, cannot clean up instance key.")
-        return
-    key = f"active_run:{instance_id}:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis instance key: {key}")
+async def _release_active_run(agent_run_id: str):
+    """Remove a finished agent run from the run registry."""
     try:
-        await redis.delete(key)
-        logger.debug(f"Successfully cleaned up Redis key: {key}")
+        await run_registry.release_run(agent_run_id)
+        logger.debug(f"Released active run {agent_run_id} from the run registry")
     except Exception as e:
-        logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
+        logger.warning(f"Failed to release active run {agent_run_id}: {str(e)}")
 
 async def _cleanup_redis_run_lock(agent_run_id: str):
     """Clean up the run lock Redis key for an agent run."""
@@ -319,54 +344,51 @@ async def update_agent_run_status(
     agent_run_id: str,
     status: str,
     error: Optional[str] = None,
-    responses: Optional[list[any]] = None # Expects parsed list of dicts
+    profile: Optional[dict] = None, # Latency breakdown from RunProfiler.summary()
+    usage: Optional[dict] = None, # Token usage from RunUsage.summary()
+    response_count: Optional[int] = None # Responses archived by ResponseLog
 ) -> bool:
     """
     Centralized function to update agent run status.
+    The responses are archived separately (services/response_log.py), so this
+    is a single small update of the run's row, retried only on errors.
     Returns True if update was successful.
     """
-    try:
-        update_data = {
-            "status": status,
-            "completed_at": datetime.now(timezone.utc).isoformat()
-        }
-
-        if error:
-            update_data["error"] = error
-
-        if responses:
-            # Ensure responses are stored correctly as JSONB
-            update_data["responses"] = responses
-
-        # Retry up to 3 times
-        for retry in range(3):
-            try:
-                update_result = await client.table('agent_runs').update(update_data).eq("id", agent_run_id).execute()
-
-                if hasattr(update_result, 'data') and update_result.data:
-                    logger.info(f"Successfully updated agent run {agent_run_id} status to '{status}' (retry {retry})")
-
-                    # Verify the update
-                    verify_result = await client.table('agent_runs').select('status', 'completed_at').eq("id", agent_run_id).execute()
-                    if verify_result.data:
-                        actual_status = verify_result.data[0].get('status')
-                        completed_at = verify_result.data[0].get('completed_at')
-                        logger.info(f"Verified agent run update: status={actual_status}, completed_at={completed_at}")
-                    return True
-                else:
-                    logger.warning(f"Database update returned no data for agent run {agent_run_id} on retry {retry}: {update_result}")
-                    if retry == 2:  # Last retry
-                        logger.error(f"Failed to update agent run status after all retries: {agent_run_id}")
-                        return False
-            except Exception as db_error:
-                logger.error(f"Database error on retry {retry} updating status for {agent_run_id}: {str(db_error)}")
-                if retry < 2:  # Not the last retry yet
-                    await asyncio.sleep(0.5 * (2 ** retry))  # Exponential backoff
-                else:
-                    logger.error(f"Failed to update agent run status after all retries: {agent_run_id}", exc_info=True)
-                    return False
-    except Exception as e:
-        logger.error(f"Unexpected error updating agent run status for {agent_run_id}: {str(e)}", exc_info=True)
-        return False
+    update_data = {
+        "status": status,
+        "completed_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    if error:
+        update_data["error"] = error
+
+    if profile:
+        update_data["profile"] = profile
+
+    if usage and usage.get("calls"):
+        update_data["usage"] = usage
+
+    if response_count is not None:
+        update_data["response_count"] = response_count
+
+    # Retry up to 3 times
+    for retry in range(3):
+        try:
+            update_result = await client.table('agent_runs').update(update_data).eq("id", agent_run_id).execute()
+            if getattr(update_result, 'error', None):
+                raise RuntimeError(update_result.error)
+        except Exception as db_error:
+            logger.error(f"Database error on retry {retry} updating status for {agent_run_id}: {str(db_error)}")
+            if retry < 2:  # Not the last retry yet
+                await asyncio.sleep(0.5 * (2 ** retry))  # Exponential backoff
+                continue
+            logger.error(f"Failed to update agent run status after all retries: {agent_run_id}", exc_info=True)
+            return False
+
+        if not getattr(update_result, 'data', None):
+            logger.warning(f"Agent run {agent_run_id} not found when updating its status to '{status}'")
+            return False
+        logger.info(f"Updated agent run {agent_run_id} status to '{status}'")
+        return True
 
     return False
@@ -3,10 +3,14 @@ import urllib.parse
 from typing import Optional
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter, Form, Depends, Request
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
 from sandbox.sandbox import get_or_start_sandbox, delete_sandbox
+from sandbox.file_stream import (
+    RangeNotSatisfiable, build_etag, etag_matches, parse_range_header,
+    iter_sandbox_file, iter_upload_file, write_sandbox_file
+)
 from utils.logger import logger
 from utils.auth_utils import get_optional_user_id
 from services.database import DBConnection
@@ -162,12 +166,9 @@ async def create_file(
         # Get sandbox using the safer method
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
-        # Read file content directly from the uploaded file
-        content = await file.read()
-        
-        # Create file using raw binary content
-        sandbox.fs.upload_file(content, path)
-        logger.info(f"File created at {path} in sandbox {sandbox_id}")
+        # Stream the upload into the sandbox in bounded chunks
+        size = await write_sandbox_file(sandbox, path, iter_upload_file(file))
+        logger.info(f"File created at {path} in sandbox {sandbox_id} ({size} bytes)")
         
         return {"status": "success", "created": True, "path": path}
     except Exception as e:
@@ -244,29 +245,53 @@ async def read_file(
         # Get sandbox using the safer method
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
-        # Read file directly - don't check existence first with a separate call
+        # Stat the file first so conditional and range requests never read content
         try:
-            content = sandbox.fs.download_file(path)
-        except Exception as download_err:
-            logger.error(f"Error downloading file {path} from sandbox {sandbox_id}: {str(download_err)}")
+            file_info = sandbox.fs.get_file_info(path)
+        except Exception as stat_err:
+            logger.error(f"Error reading file info for {path} in sandbox {sandbox_id}: {str(stat_err)}")
             raise HTTPException(
                 status_code=404, 
-                detail=f"Failed to download file: {str(download_err)}"
+                detail=f"Failed to download file: {str(stat_err)}"
             )
         
-        # Return a Response object with the content directly
-        filename = os.path.basename(path)
-        logger.info(f"Successfully read file {filename} from sandbox {sandbox_id}")
+        file_size = file_info.size
+        etag = build_etag(file_size, file_info.mod_time)
         
         # Ensure proper encoding by explicitly using UTF-8 for the filename in Content-Disposition header
         # This applies RFC 5987 encoding for the filename to support non-ASCII characters
+        filename = os.path.basename(path)
         encoded_filename = filename.encode('utf-8').decode('latin-1')
-        content_disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
+        headers = {
+            "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+        }
+        
+        if etag_matches(request.headers.get("if-none-match") if request else None, etag):
+            logger.debug(f"File {path} in sandbox {sandbox_id} not modified")
+            return Response(status_code=304, headers=headers)
+        
+        try:
+            byte_range = parse_range_header(request.headers.get("range") if request else None, file_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+        
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        else:
+            start, end = 0, file_size - 1
+            status_code = 200
+        headers["Content-Length"] = str(max(0, end - start + 1))
         
-        return Response(
-            content=content,
+        logger.info(f"Streaming file {filename} from sandbox {sandbox_id} (bytes {start}-{end}/{file_size})")
+        return StreamingResponse(
+            iter_sandbox_file(sandbox, path, start, end, file_size),
+            status_code=status_code,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": content_disposition}
+            headers=headers
         )
     except HTTPException:
         # Re-raise HTTP exceptions without wrapping
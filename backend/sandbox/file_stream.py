@@ -0,0 +1,225 @@
+"""
+Chunked file transfer helpers for sandbox file access.
+
+The sandbox filesystem API only exposes whole-file ``upload_file`` and
+``download_file`` calls. These helpers move large files in fixed-size chunks
+so that a single transfer never holds more than ``TRANSFER_CHUNK_SIZE`` bytes
+in memory, and provide the ETag / Range plumbing used by the sandbox API.
+"""
+
+import asyncio
+import hashlib
+import shlex
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from utils.logger import logger
+
+# Upper bound on the bytes a single transfer keeps in memory
+TRANSFER_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Scratch directory inside the sandbox used for staging chunks
+SCRATCH_DIR = "/tmp/.neo-transfer"
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header cannot be served for the given file size."""
+
+    def __init__(self, file_size: int):
+        super().__init__(f"Requested range not satisfiable for size {file_size}")
+        self.file_size = file_size
+
+
+def build_etag(size: int, mod_time) -> str:
+    """
+    Build a weak ETag from file metadata without reading the file content.
+
+    Args:
+        size: File size in bytes
+        mod_time: Modification time as reported by the sandbox
+
+    Returns:
+        Weak ETag string suitable for the ETag response header
+    """
+    digest = hashlib.sha1(f"{size}:{mod_time}".encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag using weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``bytes=`` Range header.
+
+    Multi-range requests and unknown units are ignored (the full file is
+    served), as permitted by RFC 9110.
+
+    Args:
+        range_header: Raw Range header value
+        file_size: Size of the file being requested
+
+    Returns:
+        Inclusive ``(start, end)`` byte offsets, or None to serve the full file
+
+    Raises:
+        RangeNotSatisfiable: If the range lies entirely outside the file
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    start_str, sep, end_str = spec.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if start_str == "":
+            # Suffix range: last N bytes
+            suffix = int(end_str)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(file_size)
+            start = max(0, file_size - suffix)
+            end = file_size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+    except ValueError:
+        return None
+
+    if start >= file_size or start > end:
+        raise RangeNotSatisfiable(file_size)
+    return start, min(end, file_size - 1)
+
+
+async def _exec(sandbox, command: str, timeout: int = 300):
+    """Run a shell command in the sandbox off the event loop and check its exit code."""
+    response = await asyncio.to_thread(sandbox.process.exec, f"/bin/sh -c {shlex.quote(command)}", timeout=timeout)
+    if response.exit_code != 0:
+        raise RuntimeError(f"Sandbox command failed with exit code {response.exit_code}: {response.result}")
+    return response
+
+
+async def iter_sandbox_file(
+    sandbox,
+    path: str,
+    start: int,
+    end: int,
+    file_size: Optional[int] = None,
+    chunk_size: int = TRANSFER_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Stream the inclusive byte range ``[start, end]`` of a sandbox file.
+
+    Files of known ``file_size`` that fit into one chunk are fetched with a
+    single download, as that reads the whole file. Other ranges are staged chunk by chunk into a scratch file inside the sandbox
+    with ``dd`` and downloaded one at a time, so memory use stays bounded by
+    ``chunk_size`` regardless of the file size.
+    """
+    length = end - start + 1
+    if length <= 0:
+        return
+
+    if file_size is not None and file_size <= chunk_size:
+        content = await asyncio.to_thread(sandbox.fs.download_file, path)
+        yield content[start:end + 1]
+        return
+
+    scratch = f"{SCRATCH_DIR}/{uuid.uuid4().hex}.chunk"
+    quoted_path = shlex.quote(path)
+    quoted_scratch = shlex.quote(scratch)
+    try:
+        await _exec(sandbox, f"mkdir -p {SCRATCH_DIR}")
+        offset = start
+        while offset <= end:
+            count = min(chunk_size, end - offset + 1)
+            await _exec(
+                sandbox,
+                f"dd if={quoted_path} of={quoted_scratch} bs={chunk_size} skip={offset} count={count} "
+                f"iflag=skip_bytes,count_bytes status=none"
+            )
+            chunk = await asyncio.to_thread(sandbox.fs.download_file, scratch)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        try:
+            await _exec(sandbox, f"rm -f {quoted_scratch}", timeout=30)
+        except Exception as e:
+            logger.warning(f"Failed to remove transfer scratch file {scratch}: {str(e)}")
+
+
+async def write_sandbox_file(
+    sandbox,
+    path: str,
+    chunks: AsyncIterator[bytes]
+) -> int:
+    """
+    Write a stream of chunks to a sandbox file.
+
+    A stream that fits into a single chunk is uploaded directly. Longer
+    streams are uploaded as numbered part files next to the target and
+    concatenated inside the sandbox, so only one chunk is held in memory.
+
+    Returns:
+        Total number of bytes written
+    """
+    iterator = chunks.__aiter__()
+    first = await anext(iterator, b"")
+    second = await anext(iterator, None)
+
+    if second is None:
+        await asyncio.to_thread(sandbox.fs.upload_file, first, path)
+        return len(first)
+
+    async def remaining() -> AsyncIterator[bytes]:
+        yield first
+        yield second
+        async for rest in iterator:
+            yield rest
+
+    part_prefix = f"{path}.upload-{uuid.uuid4().hex[:12]}"
+    quoted_prefix = shlex.quote(part_prefix)
+    total = 0
+    index = 0
+    try:
+        async for chunk in remaining():
+            if not chunk:
+                continue
+            await asyncio.to_thread(sandbox.fs.upload_file, chunk, f"{part_prefix}.{index:06d}")
+            total += len(chunk)
+            index += 1
+
+        await _exec(sandbox, f"cat {quoted_prefix}.* > {shlex.quote(path)}")
+        logger.debug(f"Assembled {index} parts ({total} bytes) into {path}")
+        return total
+    finally:
+        try:
+            await _exec(sandbox, f"rm -f {quoted_prefix}.*", timeout=30)
+        except Exception as e:
+            logger.warning(f"Failed to remove upload parts for {path}: {str(e)}")
+
+
+async def iter_upload_file(upload, chunk_size: int = TRANSFER_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield the contents of a FastAPI ``UploadFile`` in ``chunk_size`` pieces."""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
@@ -1,9 +1,10 @@
 import sentry_sdk
-from sentry_sdk.integrations.dramatiq import DramatiqIntegration
 import os
 
 sentry_dsn = os.getenv("SENTRY_DSN", None)
 if sentry_dsn:
+  # Imports dramatiq, so only loaded when Sentry is enabled
+  from sentry_sdk.integrations.dramatiq import DramatiqIntegration
   sentry_sdk.init(
       dsn=sentry_dsn,
       integrations=[DramatiqIntegration()],
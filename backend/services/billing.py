@@ -5,12 +5,14 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Request
-from typing import Optional, Dict, Tuple
+from typing import Awaitable, Callable, Optional, Dict, Tuple
+import asyncio
 import stripe
 from datetime import datetime, timezone
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.database import DBConnection
+from services.usage_ledger import get_monthly_usage
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES
@@ -97,8 +99,10 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         if not customer_id:
             return None
             
-        # Get all active subscriptions for the customer
-        subscriptions = stripe.Subscription.list(
+        # Get all active subscriptions for the customer (the Stripe SDK is
+        # blocking, so it runs in a thread to keep other requests moving)
+        subscriptions = await asyncio.to_thread(
+            stripe.Subscription.list,
             customer=customer_id,
             status='active'
         )
@@ -157,57 +161,21 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         return None
 
 async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
-    # Get start of current month in UTC
-    now = datetime.now(timezone.utc)
-    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-    
-    # First get all threads for this user
-    threads_result = await client.table('threads') \
-        .select('thread_id') \
-        .eq('account_id', user_id) \
-        .execute()
-    
-    if not threads_result.data:
-        return 0.0
-    
-    thread_ids = [t['thread_id'] for t in threads_result.data]
-    
-    # Then get all agent runs for these threads in current month
-    runs_result = await client.table('agent_runs') \
-        .select('started_at, completed_at') \
-        .in_('thread_id', thread_ids) \
-        .gte('started_at', start_of_month.isoformat()) \
-        .execute()
-    
-    if not runs_result.data:
-        return 0.0
-    
-    # Calculate total minutes
-    total_seconds = 0
-    now_ts = now.timestamp()
-    
-    for run in runs_result.data:
-        start_time = datetime.fromisoformat(run['started_at'].replace('Z', '+00:00')).timestamp()
-        if run['completed_at']:
-            end_time = datetime.fromisoformat(run['completed_at'].replace('Z', '+00:00')).timestamp()
-        else:
-            # For running jobs, use current time
-            end_time = now_ts
-        
-        total_seconds += (end_time - start_time)
-    
-    return total_seconds / 60  # Convert to minutes
+    """Agent run minutes of the current month for a user, from the usage ledger rollup."""
+    return await get_monthly_usage(user_id)
 
-async def get_allowed_models_for_user(client, user_id: str):
+async def get_allowed_models_for_user(client, user_id: str, get_subscription: Optional[Callable[[str], Awaitable[Optional[Dict]]]] = None):
     """
     Get the list of models allowed for a user based on their subscription tier.
     
+    Args:
+        get_subscription: Loader for the user's subscription, defaults to get_user_subscription
+    
     Returns:
         List of model names allowed for the user's subscription tier.
     """
 
-    subscription = await get_user_subscription(user_id)
+    subscription = await (get_subscription or get_user_subscription)(user_id)
     tier_name = 'free'
     
     if subscription:
@@ -226,7 +194,7 @@ async def get_allowed_models_for_user(client, user_id: str):
     return MODEL_ACCESS_TIERS.get(tier_name, MODEL_ACCESS_TIERS['free'])  # Default to free tier if unknown
 
 
-async def can_use_model(client, user_id: str, model_name: str):
+async def can_use_model(client, user_id: str, model_name: str, get_subscription: Optional[Callable[[str], Awaitable[Optional[Dict]]]] = None):
     if config.ENV_MODE == EnvMode.LOCAL:
         logger.info("Running in local development mode - billing checks are disabled")
         return True, "Local development mode - billing disabled", {
@@ -235,30 +203,33 @@ async def can_use_model(client, user_id: str, model_name: str):
             "minutes_limit": "no limit"
         }
         
-    allowed_models = await get_allowed_models_for_user(client, user_id)
+    allowed_models = await get_allowed_models_for_user(client, user_id, get_subscription)
     resolved_model = MODEL_NAME_ALIASES.get(model_name, model_name)
     if resolved_model in allowed_models:
         return True, "Model access allowed", allowed_models
     
     return False, f"Your current subscription plan does not include access to {model_name}. Please upgrade your subscription or choose from your available models: {', '.join(allowed_models)}", allowed_models
 
-async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optional[Dict]]:
+async def get_usage_limit(user_id: str, get_subscription: Optional[Callable[[str], Awaitable[Optional[Dict]]]] = None) -> Tuple[Optional[int], Dict]:
     """
-    Check if a user can run agents based on their subscription and usage.
+    Monthly agent run minutes included in a user's subscription.
+    
+    Args:
+        get_subscription: Loader for the user's subscription, defaults to get_user_subscription
     
     Returns:
-        Tuple[bool, str, Optional[Dict]]: (can_run, message, subscription_info)
+        Tuple[Optional[int], Dict]: (minutes_limit, subscription_info); the limit is None in local development mode
     """
     if config.ENV_MODE == EnvMode.LOCAL:
         logger.info("Running in local development mode - billing checks are disabled")
-        return True, "Local development mode - billing disabled", {
+        return None, {
             "price_id": "local_dev",
             "plan_name": "Local Development",
             "minutes_limit": "no limit"
         }
     
     # Get current subscription
-    subscription = await get_user_subscription(user_id)
+    subscription = await (get_subscription or get_user_subscription)(user_id)
     # print("Current subscription:", subscription)
     
     # If no subscription, they can use free tier
@@ -281,12 +252,32 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
         logger.warning(f"Unknown subscription tier: {price_id}, defaulting to free tier")
         tier_info = SUBSCRIPTION_TIERS[config.STRIPE_FREE_TIER_ID]
     
+    return tier_info['minutes'], subscription
+
+def usage_limit_message(minutes_limit: int) -> str:
+    """Message returned when a user has used up the minutes of their plan."""
+    return f"Monthly limit of {minutes_limit} minutes reached. Please upgrade your plan or wait until next month."
+
+async def check_billing_status(client, user_id: str, get_subscription: Optional[Callable[[str], Awaitable[Optional[Dict]]]] = None) -> Tuple[bool, str, Optional[Dict]]:
+    """
+    Check if a user can run agents based on their subscription and usage.
+    
+    Args:
+        get_subscription: Loader for the user's subscription, defaults to get_user_subscription
+    
+    Returns:
+        Tuple[bool, str, Optional[Dict]]: (can_run, message, subscription_info)
+    """
+    minutes_limit, subscription = await get_usage_limit(user_id, get_subscription)
+    if minutes_limit is None:
+        return True, "Local development mode - billing disabled", subscription
+    
     # Calculate current month's usage
     current_usage = await calculate_monthly_usage(client, user_id)
     
     # Check if within limits
-    if current_usage >= tier_info['minutes']:
-        return False, f"Monthly limit of {tier_info['minutes']} minutes reached. Please upgrade your plan or wait until next month.", subscription
+    if current_usage >= minutes_limit:
+        return False, usage_limit_message(minutes_limit), subscription
     
     return True, "OK", subscription
 
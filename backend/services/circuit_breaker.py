@@ -0,0 +1,502 @@
+"""
+Circuit breakers for external dependencies, shared by all API and worker processes.
+
+Each dependency (an LLM deployment, an MCP server, a data provider) has a
+breaker named ``{kind}:{name}``, for example ``llm:openai/gpt-4o`` or
+``data_provider:linkedin``. Its state lives in Redis, so a dependency found
+down by one process is skipped by all of them. Endpoints configured by users
+(MCP servers) are named by ``endpoint_breaker_name``, a digest of the account
+and the endpoint's configuration, so one tenant's failing server never opens
+the breaker of another's:
+
+- closed: calls go through. Failures, and calls slower than the kind's
+  ``slow_call_seconds``, are counted in a sliding window; reaching the
+  failure or slow call threshold opens the breaker.
+- open: calls are rejected with ``CircuitOpenError`` until the recovery
+  timeout has passed.
+- half open: a single probe call at a time is let through. A failed probe
+  reopens the breaker, ``success_threshold`` successful probes close it.
+
+State changes are made atomically by Lua scripts, which also publish them on
+``CIRCUIT_CHANNEL``. Every process keeps a local copy of the states, updated
+from its own script results, from that channel and by a periodic refresh, so
+checking a closed breaker costs no Redis round trip; neither does a success
+while closed.
+
+If Redis cannot be reached, breakers stay closed: they never block calls
+because of their own dependency.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+# Channel on which state changes are published to every process
+CIRCUIT_CHANNEL = "circuit_breakers"
+
+# Redis key prefix of the breaker states
+KEY_PREFIX = "circuit"
+
+# Seconds a breaker operation may wait for Redis before the call goes ahead without it
+REDIS_TIMEOUT = 1.0
+
+# Seconds Redis is left alone after it could not be reached
+REDIS_RETRY_INTERVAL = 10.0
+
+# Backoff bounds in seconds when the state subscription has to be re-established
+MIN_RESUBSCRIBE_DELAY = 1.0
+MAX_RESUBSCRIBE_DELAY = 30.0
+
+# Seconds between warnings about an unreachable Redis
+WARNING_INTERVAL = 60
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class CircuitPolicy:
+    """When a breaker trips and how it recovers."""
+    failure_threshold: int = 5        # failures in the window that open the breaker
+    slow_call_threshold: int = 10     # slow calls in the window that open the breaker
+    slow_call_seconds: Optional[float] = None  # calls slower than this count as slow
+    window_seconds: int = 60          # sliding window of failures and slow calls
+    recovery_timeout: int = 30        # seconds open before probing
+    success_threshold: int = 3        # successful probes that close the breaker
+    probe_timeout: int = 60           # seconds before a probe that never reported is given up
+
+
+# Policies per dependency kind (the breaker name up to the first ':')
+POLICIES: Dict[str, CircuitPolicy] = {
+    "llm": CircuitPolicy(failure_threshold=5, slow_call_seconds=30.0, recovery_timeout=30, probe_timeout=120),
+    "mcp": CircuitPolicy(failure_threshold=5, slow_call_seconds=20.0, recovery_timeout=60),
+    "data_provider": CircuitPolicy(failure_threshold=5, slow_call_seconds=15.0, recovery_timeout=60),
+}
+
+# Policy of breakers whose kind has none of its own
+DEFAULT_POLICY = CircuitPolicy()
+
+
+def endpoint_breaker_name(kind: str, label: str, account_id: Optional[str], endpoint: Any) -> str:
+    """
+    Breaker name of an endpoint configured by a user, never shared with other accounts.
+
+    Args:
+        kind: Dependency kind, which selects the policy
+        label: Readable name of the endpoint, e.g. the server name
+        account_id: Account the endpoint is configured for
+        endpoint: Everything that identifies the endpoint and its credentials (URL, headers, config)
+
+    Returns:
+        str: ``{kind}:{label}:{digest}``
+    """
+    digest = hashlib.sha256(
+        json.dumps([account_id, endpoint], sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+    return f"{kind}:{label}:{digest}"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name: str, retry_in: float = 0.0):
+        if retry_in > 0:
+            message = f"Circuit breaker for {name} is open, retry in {retry_in:.0f}s"
+        else:
+            message = f"Circuit breaker for {name} is half open and already probing"
+        super().__init__(message)
+        self.name = name
+        self.retry_in = retry_in
+
+
+# KEYS: state hash, window zset; ARGV: now ms, window ms, threshold, recovery ms, member, name, channel
+# Returns {state, open until ms}
+_RECORD_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local now = tonumber(ARGV[1])
+local function open()
+    local until_ms = now + tonumber(ARGV[4])
+    redis.call('HSET', KEYS[1], 'state', 'open', 'until', until_ms, 'successes', 0)
+    redis.call('HINCRBY', KEYS[1], 'trips', 1)
+    redis.call('DEL', KEYS[2])
+    redis.call('PUBLISH', ARGV[7], cjson.encode({name = ARGV[6], state = 'open', ['until'] = until_ms}))
+    return {'open', until_ms}
+end
+if state == 'open' then
+    return {'open', tonumber(redis.call('HGET', KEYS[1], 'until')) or 0}
+end
+if state == 'half_open' then
+    return open()
+end
+redis.call('ZADD', KEYS[2], now, ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[2]))
+redis.call('PEXPIRE', KEYS[2], ARGV[2])
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[3]) then
+    return open()
+end
+return {'closed', 0}
+"""
+
+# KEYS: state hash, probe key; ARGV: now ms, probe ms, name, channel
+# Returns {state, open until ms, allowed}
+_ACQUIRE_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local now = tonumber(ARGV[1])
+if state == 'closed' then
+    return {'closed', 0, 1}
+end
+if state == 'open' then
+    local until_ms = tonumber(redis.call('HGET', KEYS[1], 'until')) or 0
+    if now < until_ms then
+        return {'open', until_ms, 0}
+    end
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'successes', 0)
+    redis.call('DEL', KEYS[2])
+    redis.call('PUBLISH', ARGV[4], cjson.encode({name = ARGV[3], state = 'half_open', ['until'] = 0}))
+end
+if redis.call('SET', KEYS[2], 1, 'NX', 'PX', ARGV[2]) then
+    return {'half_open', 0, 1}
+end
+return {'half_open', 0, 0}
+"""
+
+# KEYS: state hash, probe key, failures zset, slow zset; ARGV: success threshold, name, channel
+# Returns {state, open until ms}
+_SUCCESS_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state ~= 'half_open' then
+    return {state, tonumber(redis.call('HGET', KEYS[1], 'until')) or 0}
+end
+redis.call('DEL', KEYS[2])
+if redis.call('HINCRBY', KEYS[1], 'successes', 1) < tonumber(ARGV[1]) then
+    return {'half_open', 0}
+end
+redis.call('HSET', KEYS[1], 'state', 'closed', 'until', 0, 'successes', 0)
+redis.call('DEL', KEYS[3], KEYS[4])
+redis.call('PUBLISH', ARGV[3], cjson.encode({name = ARGV[2], state = 'closed', ['until'] = 0}))
+return {'closed', 0}
+"""
+
+
+class _BackingOff(ConnectionError):
+    """Redis is not asked because it could not be reached a moment ago."""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class CircuitBreaker:
+    """Shared breaker of one dependency, with a local copy of its state."""
+
+    def __init__(self, name: str, policy: CircuitPolicy, registry: "CircuitBreakerRegistry"):
+        self.name = name
+        self.policy = policy
+        self._registry = registry
+        self.state = CLOSED
+        # Epoch milliseconds until which an open breaker rejects calls
+        self.open_until = 0
+        self._refreshed = 0.0
+
+        self.rejected = 0
+        self.failures = 0
+        self.slow_calls = 0
+
+    def _key(self, suffix: str = "") -> str:
+        return f"{KEY_PREFIX}:{self.name}{suffix}"
+
+    def _apply(self, state: str, open_until: Any) -> None:
+        state = _decode(state)
+        if state != self.state:
+            log = logger.warning if state == OPEN else logger.info
+            log(f"Circuit breaker for {self.name} is now {state}")
+        self.state = state
+        self.open_until = int(open_until or 0)
+        self._refreshed = time.monotonic()
+
+    def is_open(self) -> bool:
+        """Whether calls are currently rejected, according to the local copy of the state."""
+        return self.state == OPEN and _now_ms() < self.open_until
+
+    async def acquire(self) -> None:
+        """
+        Admit a call or reject it.
+
+        Closed breakers admit calls locally. Open and half open ones ask
+        Redis, which hands out the half open probe slots.
+
+        Raises:
+            CircuitOpenError: The breaker is open, or half open with its probe in flight
+        """
+        if not self._registry.enabled:
+            return
+        self._registry.maybe_refresh(self)
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN and _now_ms() < self.open_until:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, (self.open_until - _now_ms()) / 1000)
+
+        result = await self._registry.run_script(
+            _ACQUIRE_SCRIPT,
+            keys=[self._key(), self._key(":probe")],
+            args=[_now_ms(), self.policy.probe_timeout * 1000, self.name, CIRCUIT_CHANNEL],
+        )
+        if result is None:
+            return
+        state, open_until, allowed = result
+        self._apply(state, open_until)
+        if not int(allowed):
+            self.rejected += 1
+            raise CircuitOpenError(self.name, (self.open_until - _now_ms()) / 1000 if self.state == OPEN else 0.0)
+
+    async def record_success(self, seconds: Optional[float] = None) -> None:
+        """
+        Record a successful call.
+
+        Args:
+            seconds: Duration of the call; a call slower than the policy's
+                ``slow_call_seconds`` counts towards the slow call threshold
+        """
+        if not self._registry.enabled:
+            return
+        slow = self.policy.slow_call_seconds
+        if seconds is not None and slow is not None and seconds > slow:
+            self.slow_calls += 1
+            await self._record(":slow", self.policy.slow_call_threshold)
+            return
+        if self.state == CLOSED:
+            return
+        result = await self._registry.run_script(
+            _SUCCESS_SCRIPT,
+            keys=[self._key(), self._key(":probe"), self._key(":failures"), self._key(":slow")],
+            args=[self.policy.success_threshold, self.name, CIRCUIT_CHANNEL],
+        )
+        if result is not None:
+            self._apply(result[0], result[1])
+
+    async def record_failure(self) -> None:
+        """Record a failed call."""
+        if not self._registry.enabled:
+            return
+        self.failures += 1
+        await self._record(":failures", self.policy.failure_threshold)
+
+    async def _record(self, window_suffix: str, threshold: int) -> None:
+        result = await self._registry.run_script(
+            _RECORD_SCRIPT,
+            keys=[self._key(), self._key(window_suffix)],
+            args=[
+                _now_ms(), self.policy.window_seconds * 1000, threshold, self.policy.recovery_timeout * 1000,
+                uuid.uuid4().hex, self.name, CIRCUIT_CHANNEL,
+            ],
+        )
+        if result is None:
+            return
+        self._apply(result[0], result[1])
+
+    @asynccontextmanager
+    async def guard(self):
+        """
+        Admit a call, then record its outcome and duration.
+
+        Raises:
+            CircuitOpenError: The call was not admitted
+        """
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield self
+        except asyncio.CancelledError:
+            self.release_probe()
+            raise
+        except Exception:
+            await self.record_failure()
+            raise
+        await self.record_success(time.monotonic() - started)
+
+    def release_probe(self) -> None:
+        """Free the probe slot of a probe that will not report, instead of waiting for it to time out."""
+        if not self._registry.enabled or self.state == CLOSED:
+            return
+
+        async def release():
+            try:
+                client = await self._registry._client()
+                await client.delete(self._key(":probe"))
+            except Exception as e:
+                logger.debug(f"Failed to release probe of {self.name}: {e}")
+
+        asyncio.get_running_loop().create_task(release())
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "open_until": self.open_until or None,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "slow_calls": self.slow_calls,
+        }
+
+
+class CircuitBreakerRegistry:
+    """Breakers of this process and the subscription that keeps them current."""
+
+    def __init__(self, refresh_seconds: float = 5.0, enabled: bool = True):
+        self.refresh_seconds = refresh_seconds
+        self.enabled = enabled
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._listener_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Monotonic time until which Redis is not asked again after it could not be reached
+        self._unreachable_until = 0.0
+        self._last_warning = 0.0
+
+    def get(self, name: str, policy: Optional[CircuitPolicy] = None) -> CircuitBreaker:
+        """
+        Breaker of a dependency, created on first use.
+
+        Args:
+            name: ``{kind}:{dependency}``, the kind selects the policy from ``POLICIES``
+            policy: Policy overriding the kind's, used when the breaker is created
+        """
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            kind = name.split(":", 1)[0]
+            breaker = CircuitBreaker(name, policy or POLICIES.get(kind, DEFAULT_POLICY), self)
+            self._breakers[name] = breaker
+        return breaker
+
+    @asynccontextmanager
+    async def guard(self, name: str):
+        """``CircuitBreaker.guard`` of the named breaker."""
+        async with self.get(name).guard() as breaker:
+            yield breaker
+
+    def is_open(self, name: str) -> bool:
+        breaker = self._breakers.get(name)
+        return breaker is not None and breaker.is_open()
+
+    def maybe_refresh(self, breaker: CircuitBreaker) -> None:
+        """Reload a breaker's state in the background if it was not updated for a while."""
+        self._ensure_listener()
+        if time.monotonic() - breaker._refreshed > self.refresh_seconds:
+            breaker._refreshed = time.monotonic()
+            asyncio.get_running_loop().create_task(self.refresh(breaker))
+
+    def _unreachable(self, error: Exception) -> None:
+        if isinstance(error, _BackingOff):
+            return
+        now = time.monotonic()
+        self._unreachable_until = now + REDIS_RETRY_INTERVAL
+        if now - self._last_warning > WARNING_INTERVAL:
+            self._last_warning = now
+            logger.warning(f"Circuit breaker state unavailable, letting calls through: {error}")
+
+    async def _client(self):
+        if time.monotonic() < self._unreachable_until:
+            raise _BackingOff("Redis was unreachable recently")
+        return await asyncio.wait_for(redis.get_client(), timeout=REDIS_TIMEOUT)
+
+    async def run_script(self, script: str, keys, args) -> Optional[Tuple[Any, ...]]:
+        """Run a state script; ``None`` if Redis could not be reached in time."""
+        try:
+            client = await self._client()
+            return await asyncio.wait_for(client.eval(script, len(keys), *keys, *args), timeout=REDIS_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._unreachable(e)
+            return None
+
+    async def refresh(self, breaker: CircuitBreaker) -> None:
+        """Reload a breaker's state from Redis."""
+        breaker._refreshed = time.monotonic()
+        try:
+            client = await self._client()
+            state, open_until = await asyncio.wait_for(
+                client.hmget(breaker._key(), "state", "until"), timeout=REDIS_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._unreachable(e)
+            return
+        breaker._apply(state or CLOSED, open_until)
+
+    def _ensure_listener(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and not self._listener.done() and self._listener_loop is loop:
+            return
+        self._listener = loop.create_task(self._listen())
+        self._listener_loop = loop
+
+    def _dispatch(self, data: Any) -> None:
+        try:
+            change = json.loads(_decode(data))
+        except (TypeError, ValueError):
+            return
+        breaker = self._breakers.get(change.get("name"))
+        if breaker is not None:
+            breaker._apply(change.get("state", CLOSED), change.get("until"))
+
+    async def _listen(self) -> None:
+        delay = MIN_RESUBSCRIBE_DELAY
+        while True:
+            pubsub = None
+            try:
+                pubsub = (await self._client()).pubsub()
+                await pubsub.subscribe(CIRCUIT_CHANNEL)
+                delay = MIN_RESUBSCRIBE_DELAY
+                # Changes published before the subscription are picked up by a refresh
+                for breaker in self._breakers.values():
+                    breaker._refreshed = 0.0
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self._dispatch(message.get("data"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._unreachable(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RESUBSCRIBE_DELAY)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception as e:
+                        logger.debug(f"Error closing circuit breaker subscription: {e}")
+
+    async def reset(self, name: str) -> None:
+        """Close a breaker in every process."""
+        breaker = self.get(name)
+        client = await redis.get_client()
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(breaker._key(), breaker._key(":failures"), breaker._key(":slow"), breaker._key(":probe"))
+        pipe.publish(CIRCUIT_CHANNEL, json.dumps({"name": name, "state": CLOSED, "until": 0}))
+        await pipe.execute()
+        breaker._apply(CLOSED, 0)
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        return {name: breaker.as_dict() for name, breaker in self._breakers.items()}
+
+
+# Breakers of this process
+circuit_breakers = CircuitBreakerRegistry(
+    refresh_seconds=config.CIRCUIT_BREAKER_REFRESH_SECONDS,
+    enabled=config.CIRCUIT_BREAKERS_ENABLED,
+)
@@ -8,6 +8,7 @@ Provides database operations, connection management, and query utilities.
 import os
 import asyncio
 import logging
+import time
 from typing import Dict, Any, Optional, List, Union
 from datetime import datetime, timezone
 import asyncpg
@@ -16,6 +17,7 @@ import json
 from contextlib import asynccontextmanager
 
 from utils.config import config
+from services.prometheus import DB_POOL_WAIT
 
 logger = logging.getLogger(__name__)
 
@@ -84,8 +86,13 @@ class DatabaseService:
         if not self._initialized:
             await self.initialize()
         
-        async with self.pool.acquire() as conn:
+        started = time.perf_counter()
+        conn = await self.pool.acquire()
+        DB_POOL_WAIT.observe(time.perf_counter() - started)
+        try:
             yield conn
+        finally:
+            await self.pool.release(conn)
     
     async def execute_query(
         self,
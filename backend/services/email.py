@@ -1,8 +1,10 @@
 import os
 import logging
 from typing import Optional
-import mailtrap as mt
 from utils.config import config
+from utils.lazy import lazy_import
+
+mt = lazy_import("mailtrap")
 
 logger = logging.getLogger(__name__)
 
@@ -1,12 +1,344 @@
+"""
+Sampled, asynchronous Langfuse tracing.
+
+The agent loop records many trace events per run: per streamed chunk, per
+parsed XML tag and per tool. Calling the Langfuse SDK for each of them builds
+and validates every record on the event loop. Instead, ``langfuse.trace()``
+returns a lightweight handle whose methods only append a record to a bounded
+queue, and a background exporter thread replays the records against the SDK
+in batches. The SDK then uploads them from its own thread as before.
+
+- Runs are sampled by trace ID (``LANGFUSE_SAMPLE_PERCENT``), so the API and
+  the worker make the same decision for a run. Unsampled runs, and all runs
+  when tracing is disabled, get a shared no-op handle.
+- DEFAULT-level events are sampled per event name
+  (``LANGFUSE_EVENT_SAMPLE_PERCENT``, ``LANGFUSE_EVENT_SAMPLE_OVERRIDES``);
+  warnings and errors are always kept.
+- When the queue is full, records are dropped and counted instead of
+  blocking the caller.
+- Timestamps are taken when a record is made, so the export delay does not
+  shift them in Langfuse.
+"""
+
+import atexit
 import os
-from langfuse import Langfuse
+import queue
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set, Tuple
+
+from utils.config import config
+from utils.logger import logger
+
+# Traces whose SDK clients the exporter keeps for later records; the least
+# recently used are released beyond this (traces that are never closed)
+MAX_OPEN_TRACES = 1000
+
+# Seconds the exporter waits for new records before checking again
+EXPORT_IDLE_SECONDS = 0.5
+
+# Event levels that are never sampled out
+ALWAYS_KEPT_LEVELS = frozenset({"WARNING", "ERROR", "CRITICAL"})
+
+# (operation, trace ID, observation ID, keyword arguments for the SDK call)
+Record = Tuple[str, str, Optional[str], Optional[Dict[str, Any]]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_overrides(value: str) -> Dict[str, int]:
+    """Parse ``"name:percent,name:percent"`` into a mapping."""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, percent = item.partition(":")
+        try:
+            overrides[name.strip()] = int(percent)
+        except ValueError:
+            logger.warning(f"Invalid Langfuse event sample override: {item}")
+    return overrides
+
+
+class NoopTrace:
+    """Trace, span or generation that is not recorded."""
+
+    id = None
+
+    def update(self, **kwargs) -> "NoopTrace":
+        return self
+
+    def event(self, **kwargs) -> "NoopTrace":
+        return self
+
+    def span(self, **kwargs) -> "NoopTrace":
+        return self
+
+    def generation(self, **kwargs) -> "NoopTrace":
+        return self
+
+    def end(self, **kwargs) -> "NoopTrace":
+        return self
+
+    def close(self) -> None:
+        pass
+
+
+NOOP_TRACE = NoopTrace()
+
+
+class Observation:
+    """Span or generation of a sampled trace."""
+
+    __slots__ = ("_exporter", "trace_id", "id")
+
+    def __init__(self, exporter: "_Exporter", trace_id: str, observation_id: str):
+        self._exporter = exporter
+        self.trace_id = trace_id
+        self.id = observation_id
+
+    def update(self, **kwargs) -> "Observation":
+        self._exporter.put(("update", self.trace_id, self.id, kwargs))
+        return self
+
+    def end(self, **kwargs) -> "Observation":
+        kwargs.setdefault("end_time", _now())
+        self._exporter.put(("end", self.trace_id, self.id, kwargs))
+        return self
+
+
+class Trace:
+    """Sampled trace. Every call only queues a record for the exporter."""
+
+    __slots__ = ("_tracer", "id")
+
+    def __init__(self, tracer: "Tracer", trace_id: str):
+        self._tracer = tracer
+        self.id = trace_id
+
+    def update(self, **kwargs) -> "Trace":
+        self._tracer.exporter.put(("trace_update", self.id, None, kwargs))
+        return self
+
+    def event(self, *, name: str, level: str = "DEFAULT", **kwargs) -> "Trace":
+        if level not in ALWAYS_KEPT_LEVELS and not self._tracer.keep_event(name):
+            return self
+        kwargs.setdefault("start_time", _now())
+        self._tracer.exporter.put(("event", self.id, None, dict(kwargs, name=name, level=level)))
+        return self
+
+    def span(self, **kwargs) -> Observation:
+        return self._observation("span", kwargs)
+
+    def generation(self, **kwargs) -> Observation:
+        return self._observation("generation", kwargs)
+
+    def _observation(self, kind: str, kwargs: Dict[str, Any]) -> Observation:
+        observation = Observation(self._tracer.exporter, self.id, kwargs.pop("id", None) or str(uuid.uuid4()))
+        kwargs.setdefault("start_time", _now())
+        self._tracer.exporter.put((kind, self.id, observation.id, kwargs))
+        return observation
+
+    def close(self) -> None:
+        """Release the exporter's state for this trace; call once no more records follow."""
+        self._tracer.exporter.put(("close", self.id, None, None))
+
+
+class _Exporter:
+    """Bounded record queue and the thread replaying it against the Langfuse SDK."""
+
+    def __init__(self, queue_size: int, batch_size: int):
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._reset()
+        # Threads do not survive the fork of gunicorn or dramatiq worker
+        # processes, so each process starts its own exporter on first use
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._started = False
+        self._queue: "queue.Queue[Record]" = queue.Queue(maxsize=self._queue_size)
+        self._client = None
+        # SDK clients of open traces and of their spans and generations
+        self._traces: "OrderedDict[str, Any]" = OrderedDict()
+        self._observations: Dict[str, Any] = {}
+        self._trace_observations: Dict[str, Set[str]] = {}
+        self.queued = 0
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._reported_drops = 0
+
+    def put(self, record: Record) -> None:
+        """Queue a record without blocking; drop it if the queue is full."""
+        if not self._started:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if not self._started:
+                threading.Thread(target=self._run, name="langfuse-exporter", daemon=True).start()
+                self._started = True
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = [self._queue.get(timeout=EXPORT_IDLE_SECONDS)]
+            except queue.Empty:
+                continue
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                try:
+                    self._apply(record)
+                except Exception as e:
+                    self.failed += 1
+                    logger.debug(f"Failed to export Langfuse {record[0]} record: {e}")
+            self.exported += len(batch)
+            if self.dropped > self._reported_drops:
+                logger.warning(f"Dropped {self.dropped - self._reported_drops} Langfuse records, export queue full")
+                self._reported_drops = self.dropped
+
+    def _sdk(self):
+        if self._client is None:
+            from langfuse import Langfuse
+            self._client = Langfuse(enabled=True)
+        return self._client
+
+    def _trace(self, trace_id: str, kwargs: Optional[Dict[str, Any]] = None):
+        trace = self._traces.get(trace_id)
+        if trace is None or kwargs is not None:
+            # Also recreates traces whose creation was dropped or evicted;
+            # Langfuse merges records by trace ID
+            trace = self._sdk().trace(id=trace_id, **(kwargs or {}))
+            self._traces[trace_id] = trace
+            while len(self._traces) > MAX_OPEN_TRACES:
+                self._release(next(iter(self._traces)))
+        self._traces.move_to_end(trace_id)
+        return trace
+
+    def _release(self, trace_id: str) -> None:
+        self._traces.pop(trace_id, None)
+        for observation_id in self._trace_observations.pop(trace_id, ()):
+            self._observations.pop(observation_id, None)
+
+    def _apply(self, record: Record) -> None:
+        operation, trace_id, observation_id, kwargs = record
+        if operation == "close":
+            self._release(trace_id)
+        elif operation in ("update", "end"):
+            observation = self._observations.get(observation_id)
+            if observation is not None:
+                getattr(observation, operation)(**kwargs)
+        elif operation == "trace":
+            self._trace(trace_id, kwargs)
+        elif operation == "trace_update":
+            self._trace(trace_id).update(**kwargs)
+        elif operation == "event":
+            self._trace(trace_id).event(**kwargs)
+        else:
+            self._observations[observation_id] = getattr(self._trace(trace_id), operation)(id=observation_id, **kwargs)
+            self._trace_observations.setdefault(trace_id, set()).add(observation_id)
+
+    def pending(self) -> int:
+        return self.queued - self.exported
+
+    def flush(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while self.pending() > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self._client is not None:
+            self._client.flush()
+
+
+class Tracer:
+    """Creates trace handles; owns the sampling settings and the exporter."""
+
+    def __init__(
+        self,
+        enabled: bool,
+        sample_percent: int = 100,
+        event_sample_percent: int = 100,
+        event_sample_overrides: Optional[Dict[str, int]] = None,
+        queue_size: int = 10000,
+        batch_size: int = 200,
+    ):
+        self.enabled = enabled
+        self.sample_percent = sample_percent
+        self.event_sample_percent = event_sample_percent
+        self.event_sample_overrides = event_sample_overrides or {}
+        self.exporter = _Exporter(queue_size, batch_size)
+        self.runs_sampled_out = 0
+        self.events_sampled_out = 0
+        if enabled:
+            atexit.register(self.flush)
+
+    def trace(self, *, id: Optional[str] = None, **kwargs):
+        """
+        Start a trace.
+
+        Args:
+            id: Trace ID, e.g. the agent run ID; generated if omitted
+            **kwargs: Trace attributes passed to ``Langfuse.trace``
+
+        Returns:
+            A ``Trace``, or ``NOOP_TRACE`` if tracing is disabled or the trace
+            is not sampled
+        """
+        if not self.enabled:
+            return NOOP_TRACE
+        trace_id = id or str(uuid.uuid4())
+        if self.sample_percent < 100 and zlib.crc32(trace_id.encode()) % 100 >= self.sample_percent:
+            self.runs_sampled_out += 1
+            return NOOP_TRACE
+        kwargs.setdefault("timestamp", _now())
+        self.exporter.put(("trace", trace_id, None, kwargs))
+        return Trace(self, trace_id)
+
+    def keep_event(self, name: str) -> bool:
+        percent = self.event_sample_overrides.get(name, self.event_sample_percent)
+        if percent >= 100 or random.random() * 100 < percent:
+            return True
+        self.events_sampled_out += 1
+        return False
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """Block until queued records are exported and uploaded, or ``timeout`` passes."""
+        if self.enabled:
+            self.exporter.flush(timeout)
 
-public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
-secret_key = os.getenv("LANGFUSE_SECRET_KEY")
-host = os.getenv("LANGFUSE_HOST", "https://cloud.langfuse.com")
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self.exporter.queued,
+            "exported": self.exporter.exported,
+            "pending": self.exporter.pending(),
+            "dropped": self.exporter.dropped,
+            "failed": self.exporter.failed,
+            "runs_sampled_out": self.runs_sampled_out,
+            "events_sampled_out": self.events_sampled_out,
+        }
 
-enabled = False
-if public_key and secret_key:
-    enabled = True
 
-langfuse = Langfuse(enabled=enabled)
+langfuse = Tracer(
+    enabled=bool(config.LANGFUSE_PUBLIC_KEY and config.LANGFUSE_SECRET_KEY),
+    sample_percent=config.LANGFUSE_SAMPLE_PERCENT,
+    event_sample_percent=config.LANGFUSE_EVENT_SAMPLE_PERCENT,
+    event_sample_overrides=_parse_overrides(config.LANGFUSE_EVENT_SAMPLE_OVERRIDES),
+    queue_size=config.LANGFUSE_QUEUE_SIZE,
+    batch_size=config.LANGFUSE_EXPORT_BATCH_SIZE,
+)
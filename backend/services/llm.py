@@ -5,19 +5,20 @@ This module provides a unified interface for making API calls to different LLM p
 (OpenAI, Anthropic, Groq, etc.) using LiteLLM. It includes support for:
 - Streaming responses
 - Tool calls and function calling
-- Retry logic with exponential backoff
+- Retries, failover and hedging across equivalent deployments
 - Model-specific configurations
 - Comprehensive error handling and logging
 """
 
 from typing import Union, Dict, Any, Optional, AsyncGenerator, List
 import os
-import json
 import asyncio
-from openai import OpenAIError
 import litellm
 from utils.logger import logger
 from utils.config import config
+from services.llm_cache import get_llm_cache, build_cache_key
+from services.llm_router import build_router, Deployment, RETRYABLE_ERRORS
+from services.prompt_cache import CacheBreakpointPlanner
 
 # litellm.set_verbose=True
 litellm.modify_params=True
@@ -25,7 +26,6 @@ litellm.modify_params=True
 # Constants
 MAX_RETRIES = 2
 RATE_LIMIT_DELAY = 30
-RETRY_DELAY = 0.1
 
 class LLMError(Exception):
     """Base exception for LLM-related errors."""
@@ -64,12 +64,31 @@ def setup_api_keys() -> None:
     else:
         logger.warning(f"Missing AWS credentials for Bedrock integration - access_key: {bool(aws_access_key)}, secret_key: {bool(aws_secret_key)}, region: {aws_region}")
 
-async def handle_error(error: Exception, attempt: int, max_attempts: int) -> None:
-    """Handle API errors with appropriate delays and logging."""
-    delay = RATE_LIMIT_DELAY if isinstance(error, litellm.exceptions.RateLimitError) else RETRY_DELAY
-    logger.warning(f"Error on attempt {attempt + 1}/{max_attempts}: {str(error)}")
-    logger.debug(f"Waiting {delay} seconds before retry...")
-    await asyncio.sleep(delay)
+def provider_headers(model_name: str) -> Optional[Dict[str, str]]:
+    """Extra HTTP headers the provider of a model expects, if any."""
+    extra_headers = {}
+
+    # # Add Claude-specific headers
+    if "claude" in model_name.lower() or "anthropic" in model_name.lower():
+        # extra_headers["anthropic-beta"] = "max-tokens-3-5-sonnet-2024-07-15"
+        extra_headers["anthropic-beta"] = "output-128k-2025-02-19"
+        logger.debug("Added Claude-specific headers")
+
+    # Add OpenRouter-specific parameters
+    if model_name.startswith("openrouter/"):
+        logger.debug(f"Preparing OpenRouter parameters for model: {model_name}")
+
+        # Add optional site URL and app name from config
+        site_url = config.OR_SITE_URL
+        app_name = config.OR_APP_NAME
+        if site_url:
+            extra_headers["HTTP-Referer"] = site_url
+        if app_name:
+            extra_headers["X-Title"] = app_name
+        if site_url or app_name:
+            logger.debug(f"Added OpenRouter site URL and app name to headers")
+
+    return extra_headers or None
 
 def prepare_params(
     messages: List[Dict[str, Any]],
@@ -85,7 +104,8 @@ def prepare_params(
     top_p: Optional[float] = None,
     model_id: Optional[str] = None,
     enable_thinking: Optional[bool] = False,
-    reasoning_effort: Optional[str] = 'low'
+    reasoning_effort: Optional[str] = 'low',
+    cache_planner: Optional[CacheBreakpointPlanner] = None
 ) -> Dict[str, Any]:
     """Prepare parameters for the API call."""
     params = {
@@ -123,29 +143,9 @@ def prepare_params(
         })
         logger.debug(f"Added {len(tools)} tools to API parameters")
 
-    # # Add Claude-specific headers
-    if "claude" in model_name.lower() or "anthropic" in model_name.lower():
-        params["extra_headers"] = {
-            # "anthropic-beta": "max-tokens-3-5-sonnet-2024-07-15"
-            "anthropic-beta": "output-128k-2025-02-19"
-        }
-        logger.debug("Added Claude-specific headers")
-
-    # Add OpenRouter-specific parameters
-    if model_name.startswith("openrouter/"):
-        logger.debug(f"Preparing OpenRouter parameters for model: {model_name}")
-
-        # Add optional site URL and app name from config
-        site_url = config.OR_SITE_URL
-        app_name = config.OR_APP_NAME
-        if site_url or app_name:
-            extra_headers = params.get("extra_headers", {})
-            if site_url:
-                extra_headers["HTTP-Referer"] = site_url
-            if app_name:
-                extra_headers["X-Title"] = app_name
-            params["extra_headers"] = extra_headers
-            logger.debug(f"Added OpenRouter site URL and app name to headers")
+    extra_headers = provider_headers(model_name)
+    if extra_headers:
+        params["extra_headers"] = extra_headers
 
     # Add Bedrock-specific parameters
     if model_name.startswith("bedrock/"):
@@ -155,7 +155,7 @@ def prepare_params(
             params["model_id"] = "arn:aws:bedrock:us-west-2:935064898258:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0"
             logger.debug(f"Auto-set model_id for Claude 3.7 Sonnet: {params['model_id']}")
 
-    # Apply Anthropic prompt caching (minimal implementation)
+    # Apply Anthropic prompt caching
     # Check model name *after* potential modifications (like adding bedrock/ prefix)
     effective_model_name = params.get("model", model_name) # Use model from params if set, else original
     if "claude" in effective_model_name.lower() or "anthropic" in effective_model_name.lower():
@@ -165,67 +165,10 @@ def prepare_params(
         if not isinstance(messages, list):
             return params # Return early if messages format is unexpected
 
-        # 1. Process the first message if it's a system prompt with string content
-        if messages and messages[0].get("role") == "system":
-            content = messages[0].get("content")
-            if isinstance(content, str):
-                # Wrap the string content in the required list structure
-                messages[0]["content"] = [
-                    {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
-                ]
-            elif isinstance(content, list):
-                 # If content is already a list, check if the first text block needs cache_control
-                 for item in content:
-                     if isinstance(item, dict) and item.get("type") == "text":
-                         if "cache_control" not in item:
-                             item["cache_control"] = {"type": "ephemeral"}
-                             break # Apply to the first text block only for system prompt
-
-        # 2. Find and process relevant user and assistant messages (limit to 4 max)
-        last_user_idx = -1
-        second_last_user_idx = -1
-        last_assistant_idx = -1
-
-        for i in range(len(messages) - 1, -1, -1):
-            role = messages[i].get("role")
-            if role == "user":
-                if last_user_idx == -1:
-                    last_user_idx = i
-                elif second_last_user_idx == -1:
-                    second_last_user_idx = i
-            elif role == "assistant":
-                if last_assistant_idx == -1:
-                    last_assistant_idx = i
-
-            # Stop searching if we've found all needed messages (system, last user, second last user, last assistant)
-            found_count = sum(idx != -1 for idx in [last_user_idx, second_last_user_idx, last_assistant_idx])
-            if found_count >= 3:
-                break
-
-        # Helper function to apply cache control
-        def apply_cache_control(message_idx: int, message_role: str):
-            if message_idx == -1:
-                return
-
-            message = messages[message_idx]
-            content = message.get("content")
-
-            if isinstance(content, str):
-                message["content"] = [
-                    {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
-                ]
-            elif isinstance(content, list):
-                for item in content:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        if "cache_control" not in item:
-                           item["cache_control"] = {"type": "ephemeral"}
-
-        # Apply cache control to the identified messages (max 4: system, last user, second last user, last assistant)
-        # System message is always at index 0 if present
-        apply_cache_control(0, "system")
-        apply_cache_control(last_user_idx, "last user")
-        apply_cache_control(second_last_user_idx, "second last user")
-        apply_cache_control(last_assistant_idx, "last assistant")
+        # Without thread history the planner still caches the system prompt and the request tail
+        planner = cache_planner or CacheBreakpointPlanner()
+        breakpoints = planner.apply(messages)
+        logger.debug(f"Prompt cache breakpoints at message indices {breakpoints}")
 
     # Add reasoning_effort for Anthropic models if enabled
     use_thinking = enable_thinking if enable_thinking is not None else False
@@ -253,7 +196,10 @@ async def make_llm_api_call(
     top_p: Optional[float] = None,
     model_id: Optional[str] = None,
     enable_thinking: Optional[bool] = False,
-    reasoning_effort: Optional[str] = 'low'
+    reasoning_effort: Optional[str] = 'low',
+    cache: bool = False,
+    cache_ttl: Optional[int] = None,
+    cache_planner: Optional[CacheBreakpointPlanner] = None
 ) -> Union[Dict[str, Any], AsyncGenerator]:
     """
     Make an API call to a language model using LiteLLM.
@@ -273,6 +219,11 @@ async def make_llm_api_call(
         model_id: Optional ARN for Bedrock inference profiles
         enable_thinking: Whether to enable thinking
         reasoning_effort: Level of reasoning effort
+        cache: Serve and store the response in the local LLM response cache.
+            Only use for deterministic calls (e.g. temperature 0 summaries)
+        cache_ttl: Cache entry lifetime in seconds, defaults to LLM_CACHE_TTL_SECONDS
+        cache_planner: Prompt-cache breakpoint planner tracking earlier requests of the thread;
+            the request is committed to it once the call succeeded
 
     Returns:
         Union[Dict[str, Any], AsyncGenerator]: API response or stream
@@ -298,36 +249,70 @@ async def make_llm_api_call(
         top_p=top_p,
         model_id=model_id,
         enable_thinking=enable_thinking,
-        reasoning_effort=reasoning_effort
+        reasoning_effort=reasoning_effort,
+        cache_planner=cache_planner
     )
-    last_error = None
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.debug(f"Attempt {attempt + 1}/{MAX_RETRIES}")
-            # logger.debug(f"API request parameters: {json.dumps(params, indent=2)}")
-
-            response = await litellm.acompletion(**params)
-            logger.debug(f"Successfully received API response from {model_name}")
-            logger.debug(f"Response: {response}")
-            return response
-
-        except (litellm.exceptions.RateLimitError, OpenAIError, json.JSONDecodeError) as e:
-            last_error = e
-            await handle_error(e, attempt, MAX_RETRIES)
 
+    llm_cache = get_llm_cache() if cache else None
+    cache_key = None
+    if llm_cache:
+        try:
+            cache_key = build_cache_key(params)
+            cached = await (llm_cache.get_stream(cache_key) if stream else llm_cache.get_response(cache_key))
+            if cached is not None:
+                logger.debug(f"Serving {model_name} response from LLM cache ({cache_key[:12]})")
+                return cached
         except Exception as e:
-            logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
-            raise LLMError(f"API call failed: {str(e)}")
+            logger.warning(f"LLM cache lookup failed, calling provider: {str(e)}")
+            cache_key = None
+
+    def build_params(deployment: Deployment) -> Dict[str, Any]:
+        if deployment.model_name == model_name and not deployment.api_base and not deployment.api_key:
+            return params
+        # Alternative deployments send the same request, cache breakpoints
+        # included; only the endpoint and its provider headers differ
+        alternate = dict(params, model=deployment.model_name)
+        for name, value in (("api_key", deployment.api_key or api_key), ("api_base", deployment.api_base or api_base)):
+            if value:
+                alternate[name] = value
+            else:
+                alternate.pop(name, None)
+        if deployment.model_name != model_name:
+            alternate.pop("model_id", None)
+        extra_headers = provider_headers(deployment.model_name)
+        if extra_headers:
+            alternate["extra_headers"] = extra_headers
+        else:
+            alternate.pop("extra_headers", None)
+        return alternate
 
-    error_msg = f"Failed to make API call after {MAX_RETRIES} attempts"
-    if last_error:
-        error_msg += f". Last error: {str(last_error)}"
-    logger.error(error_msg, exc_info=True)
-    raise LLMRetryError(error_msg)
+    try:
+        response = await llm_router.acompletion(model_name, build_params, stream=stream)
+    except RETRYABLE_ERRORS as e:
+        error_msg = f"Failed to make API call to {model_name} after retries and failover. Last error: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        raise LLMRetryError(error_msg)
+    except Exception as e:
+        logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
+        raise LLMError(f"API call failed: {str(e)}")
+
+    logger.debug(f"Successfully received API response from {model_name}")
+    if cache_planner:
+        # The provider wrote the planned prefixes; streams got here with their first chunk
+        cache_planner.commit()
+    if cache_key:
+        if stream:
+            response = llm_cache.record_stream(cache_key, model_name, response, cache_ttl)
+        else:
+            await llm_cache.store_response(cache_key, model_name, response, cache_ttl)
+    return response
 
 # Initialize API keys on module import
 setup_api_keys()
 
+# Routes calls across equivalent deployments of a model (see MODEL_DEPLOYMENTS)
+llm_router = build_router(max_retries=MAX_RETRIES, rate_limit_delay=RATE_LIMIT_DELAY)
+
 # Test code for OpenRouter integration
 async def test_openrouter():
     """Test the OpenRouter integration with a simple query."""
@@ -0,0 +1,264 @@
+"""
+Local, content-addressed cache for deterministic LLM calls.
+
+Entries are keyed by a hash of the model, the generation parameters and the
+normalized messages, and stored in a small SQLite database on local disk.
+Both non-streaming responses and streamed chunk sequences can be cached;
+streamed entries are replayed chunk by chunk so callers iterating over a
+stream do not need to know whether it came from the provider or the cache.
+
+The cache is opt-in per call (see ``make_llm_api_call(cache=True)``) and is
+only meant for calls whose output is fully determined by their input, such as
+zero-temperature summarization prompts. Outside local mode it stays off unless
+LLM_CACHE_ENABLED is set.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from utils.logger import logger
+from utils.config import config
+
+# Parameters that never influence the generated content. ``stream`` is kept:
+# streamed and complete responses are stored in different forms
+_IGNORED_PARAMS = {"api_key", "api_base", "extra_headers", "stream_options", "model_id"}
+
+
+def _normalize_content(content: Any) -> Any:
+    """Normalize message content so equivalent prompts hash identically."""
+    if isinstance(content, list):
+        blocks = []
+        for block in content:
+            if isinstance(block, dict):
+                # Prompt-caching markers do not change the generated output
+                block = {k: v for k, v in block.items() if k != "cache_control" and v is not None}
+            blocks.append(block)
+        if len(blocks) == 1 and isinstance(blocks[0], dict) and blocks[0].get("type") == "text":
+            return blocks[0].get("text", "")
+        return blocks
+    if isinstance(content, str):
+        return content.strip()
+    return content
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop empty fields and prompt-cache markers from a message list."""
+    normalized = []
+    for message in messages:
+        entry = {k: v for k, v in message.items() if v is not None and k not in ("message_id", "cache_control")}
+        if "content" in entry:
+            entry["content"] = _normalize_content(entry["content"])
+        normalized.append(entry)
+    return normalized
+
+
+def build_cache_key(params: Dict[str, Any]) -> str:
+    """
+    Build the content-addressed cache key for prepared LLM call parameters.
+
+    Args:
+        params: Parameters as returned by ``prepare_params``
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    keyed = {
+        k: v for k, v in params.items()
+        if k not in _IGNORED_PARAMS and k != "messages" and v is not None
+    }
+    keyed["messages"] = normalize_messages(params.get("messages") or [])
+    payload = json.dumps(keyed, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _to_dict(obj: Any) -> Dict[str, Any]:
+    if isinstance(obj, dict):
+        return obj
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    return json.loads(json.dumps(obj, default=lambda o: getattr(o, "__dict__", str(o))))
+
+
+def _usage_tokens(data: Dict[str, Any]) -> int:
+    usage = data.get("usage") or {}
+    return int(usage.get("total_tokens") or 0)
+
+
+class LLMResponseCache:
+    """Size-bounded SQLite store for LLM responses with per-entry TTLs."""
+
+    def __init__(self, path: str, max_bytes: int, default_ttl: int):
+        """
+        Initialize the cache.
+
+        Args:
+            path: SQLite database file
+            max_bytes: Upper bound for the total size of stored payloads
+            default_ttl: Default time-to-live of an entry in seconds
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "tokens_saved": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    streamed INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    tokens INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str, streamed: bool) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT payload, tokens, expires_at FROM llm_cache WHERE key = ? AND streamed = ?",
+                (key, int(streamed))
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            payload, tokens, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+            self.stats["tokens_saved"] += tokens
+        return json.loads(payload)
+
+    def _put(self, key: str, model: str, streamed: bool, data: Any, tokens: int, ttl: Optional[int]) -> None:
+        payload = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            logger.debug(f"LLM response of {len(payload)} bytes exceeds cache size, not caching")
+            return
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, streamed, payload, size, tokens, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, int(streamed), payload, len(payload), tokens, expires_at, now)
+            )
+            self.stats["stores"] += 1
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drop expired entries, then least recently used ones until under the size bound."""
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall()
+        victims = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        self.stats["evictions"] += len(victims)
+
+    async def get_response(self, key: str) -> Optional[Any]:
+        """Return a cached non-streaming response, or None on a miss."""
+        data = await asyncio.to_thread(self._get, key, False)
+        if data is None:
+            return None
+        import litellm
+        return litellm.ModelResponse(**data)
+
+    async def store_response(self, key: str, model: str, response: Any, ttl: Optional[int] = None) -> None:
+        """Store a non-streaming response."""
+        try:
+            data = _to_dict(response)
+            await asyncio.to_thread(self._put, key, model, False, data, _usage_tokens(data), ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store LLM response in cache: {str(e)}")
+
+    async def get_stream(self, key: str) -> Optional[AsyncGenerator]:
+        """Return a replay generator for a cached stream, or None on a miss."""
+        chunks = await asyncio.to_thread(self._get, key, True)
+        if chunks is None:
+            return None
+
+        async def replay() -> AsyncGenerator:
+            from litellm.types.utils import ModelResponseStream
+            for chunk in chunks:
+                yield ModelResponseStream(**chunk)
+
+        return replay()
+
+    def record_stream(self, key: str, model: str, stream: AsyncGenerator, ttl: Optional[int] = None) -> AsyncGenerator:
+        """
+        Wrap a provider stream so its chunks are stored once it completes.
+
+        Streams that are abandoned or fail part way are not cached.
+        """
+        async def recorder() -> AsyncGenerator:
+            chunks = []
+            tokens = 0
+            async for chunk in stream:
+                data = _to_dict(chunk)
+                tokens = _usage_tokens(data) or tokens
+                chunks.append(data)
+                yield chunk
+            try:
+                await asyncio.to_thread(self._put, key, model, True, chunks, tokens, ttl)
+            except Exception as e:
+                logger.warning(f"Failed to store LLM stream in cache: {str(e)}")
+
+        return recorder()
+
+    def clear(self) -> None:
+        """Remove all cached entries."""
+        with self._lock:
+            self._connect().execute("DELETE FROM llm_cache")
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Return the process-wide LLM response cache, or None when disabled."""
+    global _cache
+    if not config.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = LLMResponseCache(
+            # Resolved once, so a later change of working directory does not move it
+            path=os.path.abspath(os.path.expanduser(config.LLM_CACHE_PATH)),
+            max_bytes=config.LLM_CACHE_MAX_MB * 1024 * 1024,
+            default_ttl=config.LLM_CACHE_TTL_SECONDS,
+        )
+    return _cache
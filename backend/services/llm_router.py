@@ -0,0 +1,471 @@
+"""
+Latency-aware routing of LLM requests across equivalent deployments.
+
+A model name can be served by several deployments, for example the same
+Claude model through Anthropic directly and through OpenRouter (see
+``MODEL_DEPLOYMENTS`` in ``utils.constants``). The router keeps rolling
+time-to-first-token, error-rate and rate-limit statistics per deployment and:
+
+- sends each request to the healthiest available deployment
+- fails over to the next deployment immediately on errors and 429s instead
+  of sleeping, putting rate-limited deployments into a cooldown
+- optionally hedges streaming requests whose first token is slow by starting
+  the same request on the runner-up deployment, within a budget of hedged
+  requests, and closes the stream that loses the race
+- skips deployments whose shared circuit breaker is open, so a provider found
+  down by one process is avoided by all of them (see
+  ``services.circuit_breaker``)
+
+Alternative deployments are only registered when LLM_ALTERNATE_DEPLOYMENTS_ENABLED
+is set and the provider of the alternative has an API key configured. Models
+without alternatives are routed as a single deployment, so statistics are
+still collected for them.
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
+
+import litellm
+from openai import OpenAIError
+
+from utils.logger import logger
+from utils.config import config
+from services.circuit_breaker import CircuitOpenError, circuit_breakers
+from services.prometheus import LLM_TIME_TO_FIRST_TOKEN, observe_llm_stream
+from utils.constants import MODEL_DEPLOYMENTS
+
+# Statistics older than this many seconds no longer influence routing
+STATS_HORIZON = 300
+
+# Maximum samples kept per deployment
+STATS_WINDOW = 200
+
+# Smoothing factor for the time-to-first-token moving average
+EWMA_ALPHA = 0.2
+
+# Assumed time to first token for deployments without recent samples
+DEFAULT_TTFT = 2.0
+
+# How strongly the recent error rate penalizes a deployment's score
+ERROR_PENALTY = 4.0
+
+# Cooldown bounds for rate-limited deployments (seconds)
+MIN_COOLDOWN = 1.0
+MAX_COOLDOWN = 60.0
+
+# Pause before retrying a single deployment after a non rate-limit error
+RETRY_DELAY = 0.1
+
+# Errors that are worth retrying on another attempt or deployment
+# (litellm's Timeout and APIConnectionError are OpenAIErrors)
+RETRYABLE_ERRORS = (litellm.exceptions.RateLimitError, OpenAIError, json.JSONDecodeError, asyncio.TimeoutError)
+
+
+def _is_provider_failure(error: Exception) -> bool:
+    """
+    Whether an error says something about the deployment's health.
+
+    Timeouts, connection errors and 5xx responses do. Other 4xx responses
+    (invalid or oversized requests, bad credentials) are caused by the
+    request, so they must not open a breaker shared by every user.
+    """
+    if isinstance(error, (litellm.exceptions.Timeout, litellm.exceptions.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return not (isinstance(status_code, int) and 400 <= status_code < 500)
+
+
+@dataclass
+class Deployment:
+    """A concrete way of serving a model: LiteLLM model name plus endpoint overrides."""
+    model_name: str
+    api_base: Optional[str] = None
+    api_key: Optional[str] = None
+    stats: "DeploymentStats" = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.stats is None:
+            self.stats = DeploymentStats()
+
+    @property
+    def key(self) -> str:
+        return f"{self.model_name}@{self.api_base}" if self.api_base else self.model_name
+
+    @property
+    def breaker(self):
+        return circuit_breakers.get(f"llm:{self.key}")
+
+
+class DeploymentStats:
+    """Rolling latency, error and rate-limit statistics of one deployment."""
+
+    def __init__(self):
+        self.samples: Deque[Tuple[float, bool, Optional[float]]] = deque(maxlen=STATS_WINDOW)
+        self.ewma_ttft: Optional[float] = None
+        self.cooldown_until = 0.0
+        self.consecutive_rate_limits = 0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limits = 0
+        self.hedged = 0
+
+    def _recent(self, now: Optional[float] = None) -> List[Tuple[float, bool, Optional[float]]]:
+        cutoff = (now or time.monotonic()) - STATS_HORIZON
+        return [s for s in self.samples if s[0] >= cutoff]
+
+    def _update_ewma(self, seconds: float) -> None:
+        if self.ewma_ttft is None:
+            self.ewma_ttft = seconds
+        else:
+            self.ewma_ttft = EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma_ttft
+
+    def record_success(self, ttft: float) -> None:
+        self.requests += 1
+        self.consecutive_rate_limits = 0
+        self.samples.append((time.monotonic(), True, ttft))
+        self._update_ewma(ttft)
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.samples.append((time.monotonic(), False, None))
+
+    def record_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        self.record_failure()
+        self.rate_limits += 1
+        self.consecutive_rate_limits += 1
+        backoff = retry_after if retry_after else MIN_COOLDOWN * (2 ** (self.consecutive_rate_limits - 1))
+        self.cooldown_until = time.monotonic() + min(max(backoff, MIN_COOLDOWN), MAX_COOLDOWN)
+
+    def record_abandoned(self, elapsed: float) -> None:
+        """A hedged request lost the race; its first token took at least ``elapsed``."""
+        self._update_ewma(elapsed)
+
+    def available(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) >= self.cooldown_until
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        recent = self._recent(now)
+        if not recent:
+            return 0.0
+        return sum(1 for _, ok, _ in recent if not ok) / len(recent)
+
+    def ttft_percentile(self, pct: float, now: Optional[float] = None) -> Optional[float]:
+        values = sorted(ttft for _, ok, ttft in self._recent(now) if ok)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct))]
+
+    def score(self, now: Optional[float] = None) -> float:
+        """Expected cost of routing to this deployment, lower is better."""
+        recent = self._recent(now)
+        ttft = self.ewma_ttft if recent and self.ewma_ttft is not None else DEFAULT_TTFT
+        return ttft * (1 + ERROR_PENALTY * self.error_rate(now))
+
+    def as_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limits": self.rate_limits,
+            "hedged": self.hedged,
+            "error_rate": round(self.error_rate(now), 4),
+            "ewma_ttft": round(self.ewma_ttft, 4) if self.ewma_ttft is not None else None,
+            "ttft_p50": self.ttft_percentile(0.5, now),
+            "ttft_p99": self.ttft_percentile(0.99, now),
+            "cooling_down": not self.available(now),
+        }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Extract a Retry-After hint in seconds from a provider error, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _credentials_configured(model_name: str) -> bool:
+    """Whether the API key of the provider serving a LiteLLM model name is set."""
+    provider = model_name.split("/", 1)[0].upper()
+    return bool(getattr(config, f"{provider}_API_KEY", None))
+
+
+async def _close_stream(stream: Any) -> None:
+    """Close a provider stream that will not be read further, releasing its connection."""
+    close = getattr(stream, "aclose", None)
+    if close is None:
+        return
+    try:
+        await close()
+    except Exception as e:
+        logger.debug(f"Error closing LLM stream: {str(e)}")
+
+
+async def _prepend(first_chunk: Any, iterator, model_name: Optional[str] = None) -> AsyncGenerator:
+    """Yield ``first_chunk`` and then the rest of the stream, recording its throughput."""
+    first_at = time.monotonic()
+    chunks = 1
+    usage = getattr(first_chunk, "usage", None)
+    try:
+        yield first_chunk
+        async for chunk in iterator:
+            chunks += 1
+            usage = getattr(chunk, "usage", None) or usage
+            yield chunk
+        if model_name is not None:
+            observe_llm_stream(model_name, chunks, usage, time.monotonic() - first_at)
+    finally:
+        await _close_stream(iterator)
+
+
+async def _discard(stream: AsyncGenerator) -> None:
+    """Close a stream returned by ``LLMRouter._start`` that lost a hedge race."""
+    try:
+        # Closing an unstarted generator skips its body; step past the buffered
+        # first chunk so the close reaches the provider stream
+        await stream.__anext__()
+    except StopAsyncIteration:
+        return
+    except Exception as e:
+        logger.debug(f"Error discarding hedged LLM stream: {str(e)}")
+    await stream.aclose()
+
+
+async def _empty_stream() -> AsyncGenerator:
+    return
+    yield
+
+
+class LLMRouter:
+    """Routes LLM calls to the healthiest of a model's equivalent deployments."""
+
+    def __init__(
+        self,
+        hedging: bool = False,
+        hedge_budget: float = 0.1,
+        hedge_min_delay: float = 2.0,
+        max_retries: int = 2,
+        rate_limit_delay: float = 30,
+    ):
+        """
+        Initialize the router.
+
+        Args:
+            hedging: Whether slow first tokens trigger a hedged request
+            hedge_budget: Maximum fraction of requests that may be hedged
+            hedge_min_delay: Minimum seconds to wait for a first token before hedging
+            max_retries: Minimum number of attempts per call
+            rate_limit_delay: Longest wait when every deployment is cooling down
+        """
+        self.hedging = hedging
+        self.hedge_budget = hedge_budget
+        self.hedge_min_delay = hedge_min_delay
+        self.max_retries = max_retries
+        self.rate_limit_delay = rate_limit_delay
+        self._groups: Dict[str, List[Deployment]] = {}
+        self._requests = 0
+        self._hedges = 0
+
+    def register(self, model_name: str, deployments: List[Deployment]) -> None:
+        """Register the deployments that can serve ``model_name``."""
+        if not deployments:
+            raise ValueError(f"No deployments given for {model_name}")
+        self._groups[model_name] = deployments
+
+    def deployments_for(self, model_name: str) -> List[Deployment]:
+        if model_name not in self._groups:
+            self._groups[model_name] = [Deployment(model_name=model_name)]
+        return self._groups[model_name]
+
+    @staticmethod
+    def _available(deployment: Deployment, now: Optional[float] = None) -> bool:
+        return deployment.stats.available(now) and not deployment.breaker.is_open()
+
+    def rank(self, model_name: str) -> List[Deployment]:
+        """Order deployments by availability, then by score."""
+        now = time.monotonic()
+        return sorted(
+            self.deployments_for(model_name),
+            key=lambda d: (not self._available(d, now), d.stats.score(now))
+        )
+
+    def _hedge_delay(self, deployment: Deployment) -> float:
+        p95 = deployment.stats.ttft_percentile(0.95)
+        return max(self.hedge_min_delay, p95 or 0.0)
+
+    def _hedge_allowed(self) -> bool:
+        # Always allow the first hedge so a cold router can still react to a slow deployment
+        return self.hedging and self._hedges < max(1.0, self.hedge_budget * self._requests)
+
+    async def _start(self, deployment: Deployment, build_params: Callable[[Deployment], Dict[str, Any]], stream: bool):
+        """Issue the request and wait for the full response, or the first chunk of a stream."""
+        params = build_params(deployment)
+        breaker = deployment.breaker
+        await breaker.acquire()
+        started = time.monotonic()
+        response = None
+        try:
+            response = await litellm.acompletion(**params)
+            if not stream:
+                deployment.stats.record_success(time.monotonic() - started)
+                # The duration of a whole completion says little about the provider's health
+                await breaker.record_success()
+                return response
+            iterator = response.__aiter__()
+            try:
+                first_chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                deployment.stats.record_success(time.monotonic() - started)
+                await breaker.record_success()
+                return _empty_stream()
+        except asyncio.CancelledError:
+            deployment.stats.record_abandoned(time.monotonic() - started)
+            breaker.release_probe()
+            if stream and response is not None:
+                await _close_stream(response)
+            raise
+        except litellm.exceptions.RateLimitError as e:
+            # Rate limits are handled by the cooldown, not the breaker
+            deployment.stats.record_rate_limit(_retry_after(e))
+            breaker.release_probe()
+            logger.warning(f"Rate limited by {deployment.key}, cooling down")
+            raise
+        except Exception as e:
+            if _is_provider_failure(e):
+                deployment.stats.record_failure()
+                await breaker.record_failure()
+            else:
+                breaker.release_probe()
+            raise
+
+        ttft = time.monotonic() - started
+        deployment.stats.record_success(ttft)
+        await breaker.record_success(ttft)
+        LLM_TIME_TO_FIRST_TOKEN.labels(model=deployment.model_name).observe(ttft)
+        return _prepend(first_chunk, iterator, deployment.model_name)
+
+    async def _hedged(self, primary: Deployment, backup: Optional[Deployment], build_params, stream: bool):
+        first = asyncio.create_task(self._start(primary, build_params, stream))
+        # Only the first token of a stream is hedged; a complete response taking
+        # long says nothing about the deployment and would double its cost
+        if backup is None or not stream or not self._hedge_allowed():
+            return await first
+
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self._hedge_delay(primary))
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done:
+            return first.result()
+
+        logger.info(f"No first token from {primary.key} yet, hedging with {backup.key}")
+        self._hedges += 1
+        primary.stats.hedged += 1
+        second = asyncio.create_task(self._start(backup, build_params, stream))
+
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    # Both requests may have produced a first token at once
+                    for task in succeeded[1:]:
+                        await _discard(task.result())
+                    return succeeded[0].result()
+                error = next(iter(done)).exception()
+            raise error
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await _discard(task.result())
+
+    async def acompletion(
+        self,
+        model_name: str,
+        build_params: Callable[[Deployment], Dict[str, Any]],
+        stream: bool = False,
+    ):
+        """
+        Route a completion request.
+
+        Args:
+            model_name: Requested model name
+            build_params: Builds the ``litellm.acompletion`` parameters for a deployment
+            stream: Whether the request streams
+
+        Returns:
+            The provider response or stream
+
+        Raises:
+            The last retryable error once all attempts failed; other errors immediately
+        """
+        self._requests += 1
+        attempts = max(self.max_retries, len(self.deployments_for(model_name)))
+        last_error: Optional[Exception] = None
+
+        for attempt in range(attempts):
+            ranked = self.rank(model_name)
+            primary = ranked[0]
+            now = time.monotonic()
+            if not primary.stats.available(now):
+                # Every deployment is rate limited, wait for the first one to cool down
+                delay = min(primary.stats.cooldown_until - now, self.rate_limit_delay)
+                logger.debug(f"All deployments of {model_name} cooling down, waiting {delay:.1f}s")
+                await asyncio.sleep(delay)
+            backup = ranked[1] if len(ranked) > 1 and self._available(ranked[1]) else None
+
+            try:
+                logger.debug(f"Attempt {attempt + 1}/{attempts} for {model_name} via {primary.key}")
+                return await self._hedged(primary, backup, build_params, stream)
+            except CircuitOpenError as e:
+                # Fail over without pausing; with every breaker open the request fails fast
+                last_error = e
+                logger.warning(f"Skipping {primary.key} for {model_name}: {str(e)}")
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                logger.warning(f"Error on attempt {attempt + 1}/{attempts} for {model_name}: {str(e)}")
+                if not isinstance(e, litellm.exceptions.RateLimitError) and len(ranked) == 1:
+                    await asyncio.sleep(RETRY_DELAY)
+
+        raise last_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self._requests,
+            "hedges": self._hedges,
+            "deployments": {
+                model: {d.key: d.stats.as_dict() for d in deployments}
+                for model, deployments in self._groups.items()
+            },
+        }
+
+
+def build_router(max_retries: int, rate_limit_delay: float) -> LLMRouter:
+    """Create a router configured from settings, with the default deployment groups registered."""
+    router = LLMRouter(
+        hedging=config.LLM_HEDGING_ENABLED,
+        hedge_budget=config.LLM_HEDGE_BUDGET_PERCENT / 100,
+        hedge_min_delay=config.LLM_HEDGE_MIN_DELAY_MS / 1000,
+        max_retries=max_retries,
+        rate_limit_delay=rate_limit_delay,
+    )
+    if not config.LLM_ALTERNATE_DEPLOYMENTS_ENABLED:
+        return router
+    for model_name, alternatives in MODEL_DEPLOYMENTS.items():
+        usable = [name for name in alternatives if name != model_name and _credentials_configured(name)]
+        if usable:
+            router.register(model_name, [Deployment(model_name=name) for name in [model_name] + usable])
+    return router
@@ -0,0 +1,190 @@
+"""
+Prometheus metrics for the API and the background worker.
+
+Both run as several processes (gunicorn workers, dramatiq worker processes),
+so with ``PROMETHEUS_MULTIPROC_DIR`` set every process writes its samples to
+memory-mapped files in that directory and a scrape merges the files of all
+processes. Without it, metrics cover the scraping process only, which is
+enough for local development.
+
+- The API serves the merged metrics of its workers at ``/api/metrics``.
+- The background worker serves them on ``WORKER_METRICS_PORT`` from the first
+  dramatiq process to boot, together with the depth of the task queues.
+
+The directory must be emptied before the processes start (see the Dockerfile
+and docker-compose commands), otherwise samples of earlier processes are
+reported again.
+"""
+
+import fcntl
+import os
+import tempfile
+from typing import Any, Callable, Dict, Optional
+
+from utils.config import config
+from utils.logger import logger
+
+# prometheus_client picks the multiprocess value store at import time
+if config.PROMETHEUS_MULTIPROC_DIR:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", config.PROMETHEUS_MULTIPROC_DIR)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+# Bucket bounds in seconds for request, tool and LLM latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Bucket bounds in seconds for pool waits and Redis commands
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+# Bucket bounds for LLM output throughput, in tokens per second
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 300, 500)
+
+REQUEST_DURATION = Histogram(
+    "neo_http_request_duration_seconds",
+    "Time until the response starts, by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+STREAM_CHUNKS = Counter(
+    "neo_stream_chunks_total",
+    "Agent run responses published by the worker or streamed to clients by the API",
+    ["source"],
+)
+WORKER_STREAM_CHUNKS = STREAM_CHUNKS.labels(source="worker")
+API_STREAM_CHUNKS = STREAM_CHUNKS.labels(source="api")
+
+TOOL_DURATION = Histogram(
+    "neo_tool_execution_duration_seconds",
+    "Tool execution time",
+    ["tool", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "neo_llm_time_to_first_token_seconds",
+    "Time from the LLM request until the first streamed chunk",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+
+LLM_TOKENS_PER_SECOND = Histogram(
+    "neo_llm_tokens_per_second",
+    "Completion tokens per second of a stream after its first chunk",
+    ["model"],
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+
+DB_POOL_WAIT = Histogram(
+    "neo_db_pool_wait_seconds",
+    "Time waiting for a database connection from the pool",
+    buckets=FAST_BUCKETS,
+)
+
+REDIS_COMMAND_DURATION = Histogram(
+    "neo_redis_command_duration_seconds",
+    "Redis command round-trip time",
+    ["command"],
+    buckets=FAST_BUCKETS,
+)
+
+AGENT_RUNS_IN_PROGRESS = Gauge(
+    "neo_agent_runs_in_progress",
+    "Agent runs executing in the background worker",
+    multiprocess_mode="livesum",
+)
+
+
+def observe_llm_stream(model: str, chunks: int, usage: Any, seconds: float) -> None:
+    """
+    Record the output throughput of a finished LLM stream.
+
+    Args:
+        model: Model of the deployment that served the stream
+        chunks: Chunks received, used when the stream reported no usage
+        usage: Usage of the final chunk, if the provider sent one
+        seconds: Time from the first to the last chunk
+    """
+    tokens = getattr(usage, "completion_tokens", None) or chunks
+    if seconds > 0:
+        LLM_TOKENS_PER_SECOND.labels(model=model).observe(tokens / seconds)
+
+
+def _registry() -> CollectorRegistry:
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> bytes:
+    """Metrics of all processes in the text exposition format."""
+    return generate_latest(_registry())
+
+
+class QueueDepthCollector:
+    """Reports the depth of the task queues when scraped."""
+
+    def __init__(self, get_depths: Callable[[], Dict[str, int]]):
+        self._get_depths = get_depths
+
+    def collect(self):
+        family = GaugeMetricFamily("neo_queue_depth", "Messages waiting in the task queue", labels=["queue"])
+        try:
+            for queue_name, depth in self._get_depths().items():
+                family.add_metric([queue_name], depth)
+        except Exception as e:
+            logger.warning(f"Failed to read task queue depths: {e}")
+        yield family
+
+
+# Lock file held by the process serving the worker metrics
+_exposition_lock: Optional[Any] = None
+
+
+def serve_worker_metrics(port: int, get_queue_depths: Optional[Callable[[], Dict[str, int]]] = None) -> bool:
+    """
+    Serve the worker's metrics unless another worker process already does.
+
+    Called in every worker process at boot; the first process to take the
+    lock file for ``port`` serves the metrics on it, merged across processes
+    when PROMETHEUS_MULTIPROC_DIR is set. The other processes do not try to
+    bind the port.
+
+    Args:
+        port: Port of the HTTP endpoint
+        get_queue_depths: Returns the depth of each task queue
+
+    Returns:
+        Whether this process serves the metrics
+    """
+    global _exposition_lock
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or tempfile.gettempdir()
+    lock = open(os.path.join(directory, f"worker_metrics_{port}.lock"), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _exposition_lock = lock
+
+    registry = _registry()
+    if get_queue_depths is not None:
+        registry.register(QueueDepthCollector(get_queue_depths))
+    start_http_server(port, registry=registry)
+    logger.info(f"Serving worker metrics on port {port} (pid {os.getpid()})")
+    return True
+
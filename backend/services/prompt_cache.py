@@ -0,0 +1,296 @@
+"""
+Prompt-cache breakpoint planning for Anthropic requests.
+
+Anthropic caches a request prefix at each ``cache_control`` breakpoint (at
+most four per request). A later request reads from the cache when one of its
+breakpoints, or one of the ~20 blocks before it, ends on exactly the same
+prefix. Placing breakpoints well therefore depends on what was sent before:
+
+- the system prompt (with tool examples) is stable across iterations and runs
+- the end of the previous request is the longest prefix already written
+- messages rewritten by compression break the prefix from that point on
+
+``CacheBreakpointPlanner`` remembers the prefixes sent earlier in a thread
+and places the breakpoints to read the longest cached prefix and write the
+prefixes that the next iteration is most likely to reuse.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Maximum number of cache_control breakpoints Anthropic accepts per request
+MAX_BREAKPOINTS = 4
+
+# Number of blocks before a breakpoint that Anthropic checks for cache hits
+LOOKBACK_BLOCKS = 20
+
+# Prefixes shorter than this are not cached by Anthropic
+MIN_CACHEABLE_TOKENS = 1024
+
+# Lifetime of an ephemeral cache entry in seconds
+CACHE_TTL = 300
+
+# Relative price of cache writes and reads compared to uncached input tokens
+CACHE_WRITE_COST = 1.25
+CACHE_READ_COST = 0.1
+
+# Number of threads whose planner state is kept per process
+MAX_TRACKED_THREADS = 1000
+
+
+def estimate_tokens(message: Dict[str, Any]) -> int:
+    """Cheap token estimate for a message (about four characters per token)."""
+    content = message.get("content")
+    if isinstance(content, str):
+        length = len(content)
+    elif isinstance(content, list):
+        length = sum(len(block.get("text", "")) if isinstance(block, dict) else len(str(block)) for block in content)
+    else:
+        length = len(json.dumps(content, default=str)) if content is not None else 0
+    if message.get("tool_calls"):
+        length += len(json.dumps(message["tool_calls"], default=str))
+    return length // 4 + 4
+
+
+def _strip_cache_control(content: Any) -> Any:
+    if isinstance(content, list):
+        return [
+            {k: v for k, v in block.items() if k != "cache_control"} if isinstance(block, dict) else block
+            for block in content
+        ]
+    return content
+
+
+def prefix_fingerprints(messages: List[Dict[str, Any]]) -> List[str]:
+    """
+    Cumulative fingerprints of every message prefix.
+
+    ``fingerprints[i]`` identifies ``messages[:i + 1]``, ignoring existing
+    cache_control markers.
+    """
+    digest = hashlib.sha1()
+    fingerprints = []
+    for message in messages:
+        normalized = {k: v for k, v in message.items() if k not in ("cache_control", "message_id")}
+        if "content" in normalized:
+            content = _strip_cache_control(normalized["content"])
+            if isinstance(content, list) and len(content) == 1 and isinstance(content[0], dict) and content[0].get("type") == "text":
+                content = content[0].get("text", "")
+            normalized["content"] = content
+        digest.update(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8"))
+        fingerprints.append(digest.copy().hexdigest())
+    return fingerprints
+
+
+def cumulative_tokens(messages: List[Dict[str, Any]]) -> List[int]:
+    total = 0
+    totals = []
+    for message in messages:
+        total += estimate_tokens(message)
+        totals.append(total)
+    return totals
+
+
+def apply_breakpoints(messages: List[Dict[str, Any]], indices: List[int]) -> None:
+    """
+    Put cache_control on the last text block of the given messages and remove it everywhere else.
+
+    Messages are modified in place, string content is wrapped into a text block where needed.
+    """
+    chosen = set(indices)
+    for i, message in enumerate(messages):
+        content = message.get("content")
+        if isinstance(content, list):
+            for block in content:
+                if isinstance(block, dict):
+                    block.pop("cache_control", None)
+        if i not in chosen:
+            continue
+        if isinstance(content, str):
+            message["content"] = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+        elif isinstance(content, list):
+            for block in reversed(content):
+                if isinstance(block, dict) and block.get("type") == "text":
+                    block["cache_control"] = {"type": "ephemeral"}
+                    break
+
+
+def legacy_breakpoints(messages: List[Dict[str, Any]]) -> List[int]:
+    """Breakpoints of the original fixed strategy: system, last two user and last assistant messages."""
+    indices = []
+    if messages and messages[0].get("role") == "system":
+        indices.append(0)
+    users = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+    assistants = [i for i, m in enumerate(messages) if m.get("role") == "assistant"]
+    indices.extend(users[-2:])
+    indices.extend(assistants[-1:])
+    return sorted(set(indices))
+
+
+class CacheBreakpointPlanner:
+    """Chooses cache breakpoints for successive requests of one thread."""
+
+    def __init__(self, min_cacheable_tokens: int = MIN_CACHEABLE_TOKENS, ttl: float = CACHE_TTL):
+        self.min_cacheable_tokens = min_cacheable_tokens
+        self.ttl = ttl
+        # Prefix fingerprint -> time it was last written or read
+        self._written: Dict[str, float] = {}
+        self._last_fingerprints: List[str] = []
+        # Prefixes of the last applied request, recorded once it succeeded
+        self._pending: Optional[Tuple[List[str], List[int], List[int]]] = None
+
+    def _cached(self, fingerprint: str, now: float) -> bool:
+        written_at = self._written.get(fingerprint)
+        return written_at is not None and now - written_at < self.ttl
+
+    def plan(self, messages: List[Dict[str, Any]], now: Optional[float] = None) -> List[int]:
+        """
+        Choose up to MAX_BREAKPOINTS message indices for cache_control.
+
+        The plan, in order of priority:
+        1. the longest prefix that is still cached (cache read)
+        2. the end of the request, which the next iteration extends (cache write)
+        3. the last assistant message, which survives temporary messages
+           inserted before the final user message
+        4. the system prompt, shared by every request in the thread
+        5. the end of the prefix unchanged since the previous request, so a
+           rewrite of later messages (e.g. compression) does not lose it
+        """
+        now = time.time() if now is None else now
+        if not messages:
+            return []
+        fingerprints = prefix_fingerprints(messages)
+        tokens = cumulative_tokens(messages)
+        last = len(messages) - 1
+
+        def cacheable(i: int) -> bool:
+            return tokens[i] >= self.min_cacheable_tokens
+
+        chosen: List[int] = []
+
+        read_point = next((i for i in range(last, -1, -1) if self._cached(fingerprints[i], now)), None)
+        if read_point is not None:
+            chosen.append(read_point)
+
+        if cacheable(last) and last not in chosen:
+            chosen.append(last)
+
+        last_assistant = next((i for i in range(last - 1, -1, -1) if messages[i].get("role") == "assistant"), None)
+        if last_assistant is not None and last_assistant not in chosen and cacheable(last_assistant):
+            chosen.append(last_assistant)
+
+        if messages[0].get("role") == "system" and cacheable(0) and 0 not in chosen:
+            chosen.append(0)
+
+        previous = set(self._last_fingerprints)
+        stable_end = next((i for i in range(last, -1, -1) if fingerprints[i] in previous), None)
+        if stable_end is not None and stable_end not in chosen and cacheable(stable_end):
+            chosen.append(stable_end)
+
+        # Bridge long uncached stretches the lookback window cannot cover
+        anchor = read_point if read_point is not None else 0
+        while len(chosen) < MAX_BREAKPOINTS and last - anchor > LOOKBACK_BLOCKS:
+            anchor += LOOKBACK_BLOCKS
+            if anchor not in chosen and cacheable(anchor):
+                chosen.append(anchor)
+
+        return sorted(chosen[:MAX_BREAKPOINTS])
+
+    def _remember(self, fingerprints: List[str], tokens: List[int], breakpoints: List[int], now: float) -> None:
+        for i in breakpoints:
+            if tokens[i] >= self.min_cacheable_tokens:
+                self._written[fingerprints[i]] = now
+        self._last_fingerprints = fingerprints
+        self._written = {fp: at for fp, at in self._written.items() if now - at < self.ttl}
+
+    def record(self, messages: List[Dict[str, Any]], breakpoints: List[int], now: Optional[float] = None) -> None:
+        """Remember the prefixes written and read by a successful request."""
+        now = time.time() if now is None else now
+        self._remember(prefix_fingerprints(messages), cumulative_tokens(messages), breakpoints, now)
+
+    def apply(self, messages: List[Dict[str, Any]]) -> List[int]:
+        """
+        Plan breakpoints and mark them on ``messages``.
+
+        Nothing is recorded until ``commit`` is called, so a request that
+        fails, is cancelled or loses a hedge does not count as cached.
+        """
+        breakpoints = self.plan(messages)
+        apply_breakpoints(messages, breakpoints)
+        self._pending = (prefix_fingerprints(messages), cumulative_tokens(messages), breakpoints)
+        return breakpoints
+
+    def commit(self, now: Optional[float] = None) -> None:
+        """Record the request of the last ``apply`` after the provider accepted it."""
+        if self._pending is None:
+            return
+        fingerprints, tokens, breakpoints = self._pending
+        self._pending = None
+        self._remember(fingerprints, tokens, breakpoints, time.time() if now is None else now)
+
+
+def simulate_request(
+    messages: List[Dict[str, Any]],
+    breakpoints: List[int],
+    cache: Dict[str, float],
+    now: float,
+    ttl: float = CACHE_TTL,
+    min_cacheable_tokens: int = MIN_CACHEABLE_TOKENS,
+) -> Tuple[int, int, int]:
+    """
+    Estimate Anthropic's cache accounting for one request.
+
+    ``cache`` maps written prefix fingerprints to their write time and is
+    updated in place.
+
+    Returns:
+        ``(cache_read_tokens, cache_write_tokens, uncached_tokens)``
+    """
+    if not messages:
+        return 0, 0, 0
+    fingerprints = prefix_fingerprints(messages)
+    tokens = cumulative_tokens(messages)
+    total = tokens[-1]
+
+    def hit(i: int) -> bool:
+        written_at = cache.get(fingerprints[i])
+        return written_at is not None and now - written_at < ttl
+
+    read_end = -1
+    for bp in breakpoints:
+        for i in range(bp, max(-1, bp - LOOKBACK_BLOCKS - 1), -1):
+            if hit(i):
+                read_end = max(read_end, i)
+                break
+
+    read_tokens = tokens[read_end] if read_end >= 0 else 0
+    writable = [i for i in breakpoints if tokens[i] >= min_cacheable_tokens]
+    last_bp = max(writable) if writable else -1
+    write_tokens = tokens[last_bp] - read_tokens if last_bp > read_end else 0
+
+    for i in writable:
+        cache[fingerprints[i]] = now
+    if read_end >= 0:
+        cache[fingerprints[read_end]] = now
+
+    uncached = total - read_tokens - write_tokens
+    return read_tokens, write_tokens, uncached
+
+
+_planners: "OrderedDict[str, CacheBreakpointPlanner]" = OrderedDict()
+
+
+def get_cache_planner(thread_id: str) -> CacheBreakpointPlanner:
+    """Return the breakpoint planner for a thread, keeping the most recent threads only."""
+    planner = _planners.get(thread_id)
+    if planner is None:
+        planner = CacheBreakpointPlanner()
+        _planners[thread_id] = planner
+        if len(_planners) > MAX_TRACKED_THREADS:
+            _planners.popitem(last=False)
+    else:
+        _planners.move_to_end(thread_id)
+    return planner
@@ -2,10 +2,23 @@ import redis.asyncio as redis
 import os
 from dotenv import load_dotenv
 import asyncio
+import time
 from utils.logger import logger
+from services.prometheus import REDIS_COMMAND_DURATION
 from typing import List, Any
 from utils.retry import retry
 
+class TimedRedis(redis.Redis):
+    """Redis client that records the round-trip time of each command."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_DURATION.labels(command=str(args[0]).lower()).observe(time.perf_counter() - started)
+
+
 # Redis client
 client: redis.Redis | None = None
 _initialized = False
@@ -33,7 +46,7 @@ def initialize():
     logger.info(f"Initializing Redis connection to {redis_host}:{redis_port}")
 
     # Create Redis client with basic configuration
-    client = redis.Redis(
+    client = TimedRedis(
         host=redis_host,
         port=redis_port,
         password=redis_password,
@@ -0,0 +1,151 @@
+"""
+Archive of agent run responses (``database/init/09-run-response-log.sql``).
+
+Workers publish every response of a run to its Redis list as it is produced.
+``ResponseLog`` is handed the same serialized responses and writes them to
+``agent_run_response_chunks`` in zlib-compressed chunks of
+RESPONSE_LOG_CHUNK_SIZE responses, in the background while the run goes on.
+When the run ends only the last partial chunk is left to write, so
+completion neither reads the Redis list back nor holds every response of
+the run in memory.
+"""
+
+import asyncio
+import json
+import zlib
+from typing import Any, Dict, List, Optional
+
+from services import redis
+from services.database import db_service
+from utils.config import config
+from utils.logger import logger
+
+# Uncompressed size at which a chunk is cut before it has RESPONSE_LOG_CHUNK_SIZE responses
+MAX_CHUNK_BYTES = 1024 * 1024
+
+# Fast compression; response JSON is repetitive enough for level 1 to shrink it several times
+COMPRESSION_LEVEL = 1
+
+
+def response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+class ResponseLog:
+    """Writes the responses of one agent run to the archive in chunks."""
+
+    def __init__(self, agent_run_id: str, db=None, chunk_size: Optional[int] = None,
+                 first_index: int = 0, first_seq: int = 0):
+        self.agent_run_id = agent_run_id
+        self.db = db or db_service
+        self.chunk_size = config.RESPONSE_LOG_CHUNK_SIZE if chunk_size is None else chunk_size
+        # Responses added so far, including those archived before first_index
+        self.count = first_index
+        self._seq = first_seq
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._writes: set = set()
+        # Chunks whose write failed, retried once when the log is closed
+        self._failed: List[tuple] = []
+
+    def add(self, response_json: str) -> None:
+        """Append a serialized response, writing a chunk in the background once one is full."""
+        self._buffer.append(response_json)
+        self._buffer_bytes += len(response_json)
+        self.count += 1
+        if len(self._buffer) >= self.chunk_size or self._buffer_bytes >= MAX_CHUNK_BYTES:
+            self._cut()
+
+    def _cut(self) -> None:
+        if not self._buffer:
+            return
+        chunk = (self._seq, self.count - len(self._buffer), self._buffer)
+        self._seq += 1
+        self._buffer = []
+        self._buffer_bytes = 0
+        task = asyncio.create_task(self._write(*chunk))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, seq: int, first_index: int, responses: List[str]) -> bool:
+        try:
+            data = await asyncio.to_thread(zlib.compress, "\n".join(responses).encode(), COMPRESSION_LEVEL)
+            await self.db.execute_query("""
+                INSERT INTO agent_run_response_chunks (agent_run_id, seq, first_index, response_count, data)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (agent_run_id, seq) DO NOTHING
+            """, self.agent_run_id, seq, first_index, len(responses), data, fetch="none")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to archive responses {first_index}-{first_index + len(responses) - 1} "
+                           f"of agent run {self.agent_run_id}: {e}")
+            self._failed.append((seq, first_index, responses))
+            return False
+
+    async def close(self) -> bool:
+        """
+        Write the remaining responses and wait for all chunk writes.
+
+        Returns:
+            bool: Whether every response added was archived
+        """
+        self._cut()
+        if self._writes:
+            await asyncio.gather(*self._writes)
+        failed, self._failed = self._failed, []
+        for chunk in failed:
+            await self._write(*chunk)
+        if self._failed:
+            logger.error(f"Responses of agent run {self.agent_run_id} were not fully archived "
+                         f"({len(self._failed)} chunks lost)")
+            return False
+        return True
+
+
+async def archive_from_redis(agent_run_id: str, db=None) -> int:
+    """
+    Archive the responses in a run's Redis list that its worker did not, e.g. because it died.
+
+    Args:
+        agent_run_id: Run whose list is archived
+        db: Database service, defaults to the shared one
+
+    Returns:
+        int: Responses newly archived
+    """
+    db = db or db_service
+    archived = await db.execute_query("""
+        SELECT COALESCE(MAX(seq) + 1, 0) AS next_seq, COALESCE(SUM(response_count), 0) AS responses
+        FROM agent_run_response_chunks WHERE agent_run_id = $1
+    """, agent_run_id, fetch="one")
+    log = ResponseLog(agent_run_id, db, first_index=archived["responses"], first_seq=archived["next_seq"])
+    while True:
+        page = await redis.lrange(response_list_key(agent_run_id), log.count, log.count + log.chunk_size - 1)
+        if not page:
+            break
+        for response_json in page:
+            log.add(response_json)
+    await log.close()
+    return log.count - archived["responses"]
+
+
+async def read_responses(agent_run_id: str, db=None) -> List[Dict[str, Any]]:
+    """
+    Responses of a run from the archive, in order.
+
+    Args:
+        agent_run_id: Run whose responses are read
+        db: Database service, defaults to the shared one
+
+    Returns:
+        List[Dict[str, Any]]: The archived responses
+    """
+    rows = await (db or db_service).execute_query(
+        "SELECT data FROM agent_run_response_chunks WHERE agent_run_id = $1 ORDER BY seq",
+        agent_run_id,
+    )
+    return [
+        json.loads(line)
+        for row in rows
+        for line in zlib.decompress(row["data"]).decode().split("\n")
+    ]
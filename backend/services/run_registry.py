@@ -0,0 +1,164 @@
+"""
+Indexed registry of active agent runs in Redis.
+
+Runs are tracked in two sets so that lookups never scan the keyspace:
+
+- ``instance_runs:{instance_id}``: runs active on an instance
+- ``run_instances:{agent_run_id}``: instances handling a run
+
+Instances heartbeat into the ``run_registry:instances`` sorted set (scored by
+the time of their last heartbeat). An instance whose heartbeat is older than
+INSTANCE_TIMEOUT is considered dead: its sets are removed and the runs no
+other instance is handling are handed to the caller so they can be marked as
+failed.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from services import redis
+from utils.logger import logger
+
+# Sorted set of instance IDs scored by their last heartbeat
+INSTANCES_KEY = "run_registry:instances"
+
+# Seconds between heartbeats of a live instance
+HEARTBEAT_INTERVAL = 30
+
+# Seconds without a heartbeat after which an instance is considered dead
+INSTANCE_TIMEOUT = 300
+
+
+def instance_runs_key(instance_id: str) -> str:
+    return f"instance_runs:{instance_id}"
+
+
+def run_instances_key(agent_run_id: str) -> str:
+    return f"run_instances:{agent_run_id}"
+
+
+async def register_run(instance_id: str, agent_run_id: str, handed_over_from: Optional[str] = None) -> None:
+    """
+    Record that an instance is handling a run.
+
+    Args:
+        instance_id: Instance handling the run
+        agent_run_id: Run to register
+        handed_over_from: Instance that registered the run before, e.g. the
+            API instance that enqueued it; it no longer handles the run
+    """
+    redis_client = await redis.get_client()
+    pipe = redis_client.pipeline(transaction=True)
+    if handed_over_from and handed_over_from != instance_id:
+        pipe.srem(instance_runs_key(handed_over_from), agent_run_id)
+        pipe.srem(run_instances_key(agent_run_id), handed_over_from)
+    pipe.sadd(instance_runs_key(instance_id), agent_run_id)
+    pipe.expire(instance_runs_key(instance_id), redis.REDIS_KEY_TTL)
+    pipe.sadd(run_instances_key(agent_run_id), instance_id)
+    pipe.expire(run_instances_key(agent_run_id), redis.REDIS_KEY_TTL)
+    pipe.zadd(INSTANCES_KEY, {instance_id: time.time()})
+    await pipe.execute()
+
+
+async def release_run(agent_run_id: str) -> None:
+    """Remove a finished or stopped run from every instance that registered it."""
+    redis_client = await redis.get_client()
+    instance_ids = await redis_client.smembers(run_instances_key(agent_run_id))
+    pipe = redis_client.pipeline(transaction=True)
+    for instance_id in instance_ids:
+        pipe.srem(instance_runs_key(instance_id), agent_run_id)
+    pipe.delete(run_instances_key(agent_run_id))
+    await pipe.execute()
+
+
+async def get_run_instances(agent_run_id: str) -> List[str]:
+    """Instances currently handling a run."""
+    redis_client = await redis.get_client()
+    return list(await redis_client.smembers(run_instances_key(agent_run_id)))
+
+
+async def get_instance_runs(instance_id: str) -> List[str]:
+    """Runs currently active on an instance."""
+    redis_client = await redis.get_client()
+    return list(await redis_client.smembers(instance_runs_key(instance_id)))
+
+
+async def heartbeat(instance_id: str, agent_run_ids: Optional[Iterable[str]] = None) -> None:
+    """
+    Mark an instance as alive and extend the lifetime of its sets.
+
+    Args:
+        instance_id: Instance sending the heartbeat
+        agent_run_ids: Runs known to be active locally; they are re-added in
+            case their entries expired
+    """
+    redis_client = await redis.get_client()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(INSTANCES_KEY, {instance_id: time.time()})
+    for agent_run_id in agent_run_ids or ():
+        pipe.sadd(instance_runs_key(instance_id), agent_run_id)
+        pipe.sadd(run_instances_key(agent_run_id), instance_id)
+        pipe.expire(run_instances_key(agent_run_id), redis.REDIS_KEY_TTL)
+    pipe.expire(instance_runs_key(instance_id), redis.REDIS_KEY_TTL)
+    await pipe.execute()
+
+
+async def expire_dead_instances(timeout: float = INSTANCE_TIMEOUT) -> Dict[str, List[str]]:
+    """
+    Remove instances that stopped sending heartbeats.
+
+    Several instances may run this concurrently; each dead instance is
+    claimed by exactly one of them.
+
+    Returns:
+        Mapping of each dead instance claimed by this call to its runs that
+        no other instance is handling
+    """
+    redis_client = await redis.get_client()
+    dead = await redis_client.zrangebyscore(INSTANCES_KEY, "-inf", time.time() - timeout)
+    expired = {}
+    for instance_id in dead:
+        if not await redis_client.zrem(INSTANCES_KEY, instance_id):
+            continue  # Claimed by another instance
+        agent_run_ids = list(await redis_client.smembers(instance_runs_key(instance_id)))
+        pipe = redis_client.pipeline(transaction=True)
+        for agent_run_id in agent_run_ids:
+            pipe.srem(run_instances_key(agent_run_id), instance_id)
+        pipe.delete(instance_runs_key(instance_id))
+        for agent_run_id in agent_run_ids:
+            pipe.scard(run_instances_key(agent_run_id))
+        results = await pipe.execute()
+
+        # Runs still handled by another instance are left alone
+        remaining = results[len(agent_run_ids) + 1:]
+        orphaned = [agent_run_id for agent_run_id, count in zip(agent_run_ids, remaining) if count == 0]
+        logger.warning(f"Instance {instance_id} missed its heartbeats, released {len(agent_run_ids)} runs ({len(orphaned)} orphaned)")
+        expired[instance_id] = orphaned
+    return expired
+
+
+async def heartbeat_loop(
+    instance_id: str,
+    on_dead_instance: Optional[Callable[[str, List[str]], Awaitable[None]]] = None,
+    interval: float = HEARTBEAT_INTERVAL,
+) -> None:
+    """
+    Send heartbeats for an instance until cancelled, reaping dead instances each time.
+
+    Args:
+        instance_id: Instance to keep alive
+        on_dead_instance: Called with each dead instance and its orphaned runs
+        interval: Seconds between heartbeats
+    """
+    while True:
+        try:
+            await heartbeat(instance_id)
+            for dead_instance_id, agent_run_ids in (await expire_dead_instances()).items():
+                if on_dead_instance:
+                    await on_dead_instance(dead_instance_id, agent_run_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Run registry heartbeat failed for instance {instance_id}: {e}")
+        await asyncio.sleep(interval)
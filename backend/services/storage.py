@@ -7,12 +7,15 @@ Provides file upload, download, and management capabilities.
 
 import os
 import uuid
+import hashlib
 import logging
 import mimetypes
-from typing import Dict, Any, Optional, List, BinaryIO
+import tempfile
+from typing import Dict, Any, Optional, List, BinaryIO, Tuple
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-import aiofiles
 from minio import Minio
+from minio.commonconfig import CopySource
 from minio.error import S3Error
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
@@ -22,6 +25,26 @@ from utils.config import config
 
 logger = logging.getLogger(__name__)
 
+# Multipart part size for streaming uploads; bounds memory held per upload
+UPLOAD_PART_SIZE = 10 * 1024 * 1024
+
+# Read size used when hashing or spooling streams
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _hash_stream(stream: BinaryIO) -> Tuple[str, int]:
+    """Return the SHA-256 hex digest and length of a seekable stream, rewinding it afterwards."""
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    while True:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
 class StorageService:
     """
     NEO Storage Service - MinIO-based object storage.
@@ -74,86 +97,270 @@ class StorageService:
         loop = asyncio.get_event_loop()
         await loop.run_in_executor(self.executor, _check_and_create)
     
-    def _generate_file_path(self, account_id: str, filename: str, bucket: str = None) -> str:
-        """Generate unique file path."""
-        bucket = bucket or self.default_bucket
-        file_id = str(uuid.uuid4())
-        timestamp = datetime.now().strftime('%Y/%m/%d')
-        return f"{account_id}/{timestamp}/{file_id}_{filename}"
+    def _upload_path(self) -> str:
+        """Unique object name an upload is written to before it becomes a blob."""
+        return f"uploads/{uuid.uuid4()}"
     
-    async def upload_file(
+    def _blob_path(self, content_hash: str) -> str:
+        """Content-addressed object name for a blob."""
+        return f"blobs/{content_hash[:2]}/{content_hash}"
+    
+    @asynccontextmanager
+    async def _blob_lock(self, bucket: str, content_hash: str):
+        """
+        Hold a transaction-scoped advisory lock on one blob.
+        
+        Creating and releasing the same content are serialized, so an object
+        is never removed after a concurrent upload has re-created its row.
+        Yields the locked connection.
+        """
+        async with db_service.get_connection() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock(hashtext($1 || '/' || $2))",
+                    bucket, content_hash
+                )
+                yield conn
+    
+    async def _acquire_blob(
+        self,
+        bucket: str,
+        content_hash: str,
+        file_size: int,
+        content_type: str,
+        put_object
+    ) -> Tuple[str, bool]:
+        """
+        Reference an existing blob or store a new one.
+        
+        New content is uploaded to a unique path without holding the lock, so
+        no database connection waits on the transfer. The lock is only taken
+        to record the blob and move the object to its content-addressed path.
+        
+        Args:
+            bucket: Target bucket
+            content_hash: SHA-256 of the content
+            file_size: Content length in bytes
+            content_type: MIME type stored with a new object
+            put_object: Blocking callable that writes the object to a given path
+        
+        Returns:
+            Tuple of (storage_path, deduplicated)
+        """
+        # The row lock orders this against a concurrent release, which deletes
+        # the row before removing the object
+        existing = await db_service.execute_query("""
+            UPDATE file_blobs SET ref_count = ref_count + 1
+            WHERE bucket = $1 AND content_hash = $2
+            RETURNING storage_path
+        """, bucket, content_hash, fetch="val")
+        if existing:
+            return existing, True
+        
+        loop = asyncio.get_event_loop()
+        upload_path = self._upload_path()
+        
+        def _move(storage_path: str):
+            self.minio_client.copy_object(
+                bucket_name=bucket,
+                object_name=storage_path,
+                source=CopySource(bucket, upload_path)
+            )
+        
+        def _remove_upload():
+            self.minio_client.remove_object(
+                bucket_name=bucket,
+                object_name=upload_path
+            )
+        
+        await loop.run_in_executor(self.executor, put_object, upload_path)
+        try:
+            async with self._blob_lock(bucket, content_hash) as conn:
+                row = await conn.fetchrow("""
+                    INSERT INTO file_blobs (bucket, content_hash, storage_path, file_size, content_type)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (bucket, content_hash)
+                    DO UPDATE SET ref_count = file_blobs.ref_count + 1
+                    RETURNING storage_path, (xmax = 0) AS inserted
+                """, bucket, content_hash, self._blob_path(content_hash), file_size, content_type)
+                if row['inserted']:
+                    # Under the lock, so a concurrent release of the same
+                    # content cannot remove the object after it is moved;
+                    # a failed move rolls back the new row
+                    await loop.run_in_executor(self.executor, _move, row['storage_path'])
+            return row['storage_path'], not row['inserted']
+        finally:
+            await loop.run_in_executor(self.executor, _remove_upload)
+    
+    async def _release_blob(self, bucket: str, content_hash: Optional[str], storage_path: str):
+        """Drop one reference to a blob and remove the object once unreferenced."""
+        def _delete(remove_path: str):
+            self.minio_client.remove_object(
+                bucket_name=bucket,
+                object_name=remove_path
+            )
+        
+        loop = asyncio.get_event_loop()
+        if not content_hash:
+            # Legacy row written before deduplication; it owns its object
+            await loop.run_in_executor(self.executor, _delete, storage_path)
+            return
+        
+        async with self._blob_lock(bucket, content_hash) as conn:
+            await conn.execute("""
+                UPDATE file_blobs SET ref_count = ref_count - 1
+                WHERE bucket = $1 AND content_hash = $2
+            """, bucket, content_hash)
+            remove_path = await conn.fetchval("""
+                DELETE FROM file_blobs
+                WHERE bucket = $1 AND content_hash = $2 AND ref_count <= 0
+                RETURNING storage_path
+            """, bucket, content_hash)
+            if remove_path:
+                # Removed under the lock, before an upload of the same content can recreate it
+                await loop.run_in_executor(self.executor, _delete, remove_path)
+    
+    async def _store(
         self,
         account_id: str,
-        file_data: bytes,
+        stream: BinaryIO,
         filename: str,
         content_type: str = None,
         bucket: str = None,
         is_public: bool = False,
         metadata: Dict = None
     ) -> Dict[str, Any]:
-        """Upload file to storage."""
+        """Store a seekable stream as a deduplicated blob and record it in the files table."""
         if not self._initialized:
             await self.initialize()
         
+        bucket = bucket or self.default_bucket
+        
+        # Detect content type if not provided
+        if not content_type:
+            content_type, _ = mimetypes.guess_type(filename)
+            content_type = content_type or 'application/octet-stream'
+        
+        loop = asyncio.get_event_loop()
+        content_hash, file_size = await loop.run_in_executor(self.executor, _hash_stream, stream)
+        
+        # Stream the object to MinIO in multipart chunks
+        def _upload(storage_path: str):
+            stream.seek(0)
+            self.minio_client.put_object(
+                bucket_name=bucket,
+                object_name=storage_path,
+                data=stream,
+                length=file_size,
+                content_type=content_type,
+                part_size=UPLOAD_PART_SIZE
+            )
+        
+        storage_path, deduplicated = await self._acquire_blob(
+            bucket, content_hash, file_size, content_type, _upload
+        )
+        
+        # Store file metadata in database
         try:
-            bucket = bucket or self.default_bucket
-            
-            # Generate unique file path
-            storage_path = self._generate_file_path(account_id, filename, bucket)
-            
-            # Detect content type if not provided
-            if not content_type:
-                content_type, _ = mimetypes.guess_type(filename)
-                content_type = content_type or 'application/octet-stream'
-            
-            # Upload file to MinIO
-            def _upload():
-                from io import BytesIO
-                file_stream = BytesIO(file_data)
-                self.minio_client.put_object(
-                    bucket_name=bucket,
-                    object_name=storage_path,
-                    data=file_stream,
-                    length=len(file_data),
-                    content_type=content_type
-                )
-            
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(self.executor, _upload)
-            
-            # Store file metadata in database
             file_id = await db_service.insert('files', {
                 'account_id': account_id,
-                'filename': os.path.basename(storage_path),
+                'filename': filename,
                 'original_filename': filename,
                 'content_type': content_type,
-                'file_size': len(file_data),
+                'file_size': file_size,
                 'storage_path': storage_path,
                 'bucket': bucket,
                 'is_public': is_public,
+                'content_hash': content_hash,
                 'metadata': metadata or {}
             })
-            
-            # Generate URL
-            url = await self.get_file_url(file_id, bucket)
-            
+        except Exception:
+            await self._release_blob(bucket, content_hash, storage_path)
+            raise
+        
+        # Generate URL
+        url = await self.get_file_url(file_id, bucket)
+        
+        if deduplicated:
+            logger.info(f"File deduplicated: {filename} -> {storage_path}")
+        else:
             logger.info(f"File uploaded: {filename} -> {storage_path}")
-            
-            return {
-                'id': file_id,
-                'filename': filename,
-                'storage_path': storage_path,
-                'content_type': content_type,
-                'file_size': len(file_data),
-                'url': url,
-                'bucket': bucket,
-                'is_public': is_public
-            }
-            
+        
+        return {
+            'id': file_id,
+            'filename': filename,
+            'storage_path': storage_path,
+            'content_type': content_type,
+            'file_size': file_size,
+            'url': url,
+            'bucket': bucket,
+            'is_public': is_public,
+            'content_hash': content_hash,
+            'deduplicated': deduplicated
+        }
+    
+    async def upload_file(
+        self,
+        account_id: str,
+        file_data: bytes,
+        filename: str,
+        content_type: str = None,
+        bucket: str = None,
+        is_public: bool = False,
+        metadata: Dict = None
+    ) -> Dict[str, Any]:
+        """Upload file to storage."""
+        from io import BytesIO
+        
+        try:
+            return await self._store(
+                account_id=account_id,
+                stream=BytesIO(file_data),
+                filename=filename,
+                content_type=content_type,
+                bucket=bucket,
+                is_public=is_public,
+                metadata=metadata
+            )
         except Exception as e:
             logger.error(f"File upload failed: {e}")
             raise
     
+    async def upload_stream(
+        self,
+        account_id: str,
+        stream: BinaryIO,
+        filename: str,
+        content_type: str = None,
+        bucket: str = None,
+        is_public: bool = False,
+        metadata: Dict = None
+    ) -> Dict[str, Any]:
+        """
+        Upload a file-like object without loading it into memory.
+        
+        Non-seekable streams are spooled to a temporary file first so the
+        content can be hashed before it is sent.
+        """
+        try:
+            if stream.seekable():
+                return await self._store(account_id, stream, filename, content_type, bucket, is_public, metadata)
+            
+            with tempfile.SpooledTemporaryFile(max_size=HASH_CHUNK_SIZE) as spool:
+                def _spool():
+                    while True:
+                        chunk = stream.read(HASH_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        spool.write(chunk)
+                
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(self.executor, _spool)
+                return await self._store(account_id, spool, filename, content_type, bucket, is_public, metadata)
+        except Exception as e:
+            logger.error(f"Stream upload failed: {e}")
+            raise
+    
     async def upload_file_from_path(
         self,
         account_id: str,
@@ -167,18 +374,16 @@ class StorageService:
         """Upload file from local path."""
         filename = filename or os.path.basename(file_path)
         
-        async with aiofiles.open(file_path, 'rb') as f:
-            file_data = await f.read()
-        
-        return await self.upload_file(
-            account_id=account_id,
-            file_data=file_data,
-            filename=filename,
-            content_type=content_type,
-            bucket=bucket,
-            is_public=is_public,
-            metadata=metadata
-        )
+        with open(file_path, 'rb') as f:
+            return await self.upload_stream(
+                account_id=account_id,
+                stream=f,
+                filename=filename,
+                content_type=content_type,
+                bucket=bucket,
+                is_public=is_public,
+                metadata=metadata
+            )
     
     async def upload_base64_image(
         self,
@@ -273,15 +478,12 @@ class StorageService:
             
             file_info = file_info[0]
             
-            # Delete file from MinIO
-            def _delete():
-                self.minio_client.remove_object(
-                    bucket_name=file_info['bucket'],
-                    object_name=file_info['storage_path']
-                )
-            
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(self.executor, _delete)
+            # Release the blob; the object is removed once nothing references it
+            await self._release_blob(
+                file_info['bucket'],
+                file_info.get('content_hash'),
+                file_info['storage_path']
+            )
             
             # Delete file metadata from database
             await db_service.delete('files', {'id': file_id})
@@ -1,5 +1,4 @@
 import os
-import openai
 import tempfile
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from pydantic import BaseModel
@@ -41,6 +40,9 @@ async def transcribe_audio(
         # Reset file pointer
         await audio_file.seek(0)
         
+        # Imported here so the API starts without the SDK; preloaded after startup
+        import openai
+
         # Initialize OpenAI client
         client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         
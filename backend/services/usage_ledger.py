@@ -0,0 +1,110 @@
+"""
+Usage ledger of agent runs (``database/init/08-usage-ledger.sql``).
+
+Run time and tokens are appended to ``usage_ledger`` by the worker handling
+a run: every USAGE_CHECKPOINT_SECONDS while the run is active and once when
+it ends, each entry covering the time since the previous one. An insert
+trigger keeps ``account_usage_monthly`` up to date, so a usage check reads a
+single row however many runs the account has. Usage of an active run is
+visible at most one checkpoint interval late.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from agentpress.token_usage import RunUsage
+from services.database import db_service
+from utils.config import config
+from utils.logger import logger
+
+
+class RunMeter:
+    """Records the usage of one agent run in the ledger while it runs."""
+
+    def __init__(self, agent_run_id: str, run_usage: Optional[RunUsage] = None, db=None,
+                 checkpoint_seconds: Optional[float] = None):
+        self.agent_run_id = agent_run_id
+        self.run_usage = run_usage
+        self.db = db or db_service
+        self.checkpoint_seconds = (
+            config.USAGE_CHECKPOINT_SECONDS if checkpoint_seconds is None else checkpoint_seconds
+        )
+        # Usage up to these marks is in the ledger
+        self._recorded_at = time.monotonic()
+        self._recorded_prompt_tokens = 0
+        self._recorded_completion_tokens = 0
+        self._closed = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start recording checkpoints in the background."""
+        if self._task is None and self.checkpoint_seconds > 0:
+            self._task = asyncio.create_task(self._checkpoints())
+
+    async def _checkpoints(self) -> None:
+        while not self._closed.is_set():
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout=self.checkpoint_seconds)
+            except asyncio.TimeoutError:
+                await self._record(final=False)
+
+    async def _record(self, final: bool) -> bool:
+        async with self._lock:
+            now = time.monotonic()
+            prompt_tokens = self.run_usage.prompt_tokens if self.run_usage else 0
+            completion_tokens = self.run_usage.completion_tokens if self.run_usage else 0
+            try:
+                recorded = await self.db.execute_query(
+                    "SELECT record_run_usage($1, $2, $3, $4, $5)",
+                    self.agent_run_id,
+                    now - self._recorded_at,
+                    prompt_tokens - self._recorded_prompt_tokens,
+                    completion_tokens - self._recorded_completion_tokens,
+                    final,
+                    fetch="val",
+                )
+            except Exception as e:
+                # The next checkpoint covers this interval as well
+                logger.warning(f"Failed to record usage of agent run {self.agent_run_id}: {e}")
+                return False
+            self._recorded_at = now
+            self._recorded_prompt_tokens = prompt_tokens
+            self._recorded_completion_tokens = completion_tokens
+            # False for an unknown run or one already completed in the ledger
+            return bool(recorded)
+
+    async def close(self) -> bool:
+        """
+        Stop the checkpoints and record the rest of the run as its completion.
+
+        Returns:
+            bool: Whether the completion was recorded (only once per run)
+        """
+        self._closed.set()
+        if self._task is not None:
+            await self._task
+        return await self._record(final=True)
+
+
+async def get_monthly_usage(account_id: str, db=None) -> float:
+    """
+    Agent run minutes of an account in the current UTC month.
+
+    Args:
+        account_id: Account whose usage is read
+        db: Database service, defaults to the shared one
+
+    Returns:
+        float: Minutes recorded in the ledger this month
+    """
+    now = datetime.now(timezone.utc)
+    seconds = await (db or db_service).execute_query(
+        "SELECT seconds FROM account_usage_monthly WHERE account_id = $1 AND period = $2",
+        account_id,
+        datetime(now.year, now.month, 1).date(),
+        fetch="val",
+    )
+    return (seconds or 0) / 60
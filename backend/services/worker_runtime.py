@@ -0,0 +1,248 @@
+"""
+Process-wide resources for the background agent worker.
+
+A worker process runs many agent runs concurrently on one event loop. The
+Redis client and database pool are set up once per process by
+``WorkerRuntime`` and checked periodically; when a check fails they are torn
+down and reconnected on the next run that needs them.
+
+Control signals (STOP, END_STREAM, ERROR) for every run on this worker
+arrive through a single pattern subscription to the worker's instance
+channels (``agent_run:*:control:{instance_id}``), held by ``StopSignalHub``,
+which hands each signal to the run it targets. Signals for runs of other
+workers are not delivered to this process at all. Runs wait on an
+``asyncio.Event`` instead of keeping their own subscription and polling loop.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from services import redis, run_registry
+from services.database import DBConnection, db_service
+from utils.config import config
+from utils.logger import logger
+from utils.retry import retry
+
+# Longest wait for a control message before the listener checks its connection again
+LISTEN_TIMEOUT = 1.0
+
+# Backoff bounds in seconds when the control subscription has to be re-established
+MIN_RESUBSCRIBE_DELAY = 0.5
+MAX_RESUBSCRIBE_DELAY = 10.0
+
+# Seconds to wait for the control subscription when starting the hub
+SUBSCRIBE_TIMEOUT = 10.0
+
+
+def control_channel_run_id(channel: str) -> Optional[str]:
+    """Agent run ID of a control channel (``agent_run:{id}:control[:{instance_id}]``)."""
+    parts = channel.split(":")
+    if len(parts) in (3, 4) and parts[0] == "agent_run" and parts[2] == "control":
+        return parts[1]
+    return None
+
+
+class StopSignalHub:
+    """Delivers control signals to local runs through one shared subscription."""
+
+    def __init__(self, instance_id: str):
+        self.instance_id = instance_id
+        self._runs: Dict[str, asyncio.Event] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._heartbeater: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+        self.signals_received = 0
+        self.signals_delivered = 0
+        self.resubscribes = 0
+
+    @property
+    def patterns(self) -> tuple:
+        # stop_agent_run publishes STOP to the channel of every instance registered for the run
+        return (f"agent_run:*:control:{self.instance_id}",)
+
+    @property
+    def running(self) -> bool:
+        return self._listener is not None and not self._listener.done()
+
+    async def start(self) -> None:
+        """Start the shared subscription and wait until it is established."""
+        if not self.running:
+            self._listener = asyncio.create_task(self._listen())
+            self._heartbeater = asyncio.create_task(self._heartbeat())
+        await asyncio.wait_for(self._subscribed.wait(), timeout=SUBSCRIBE_TIMEOUT)
+
+    async def stop(self) -> None:
+        """Cancel the listener and heartbeat tasks."""
+        for task in (self._listener, self._heartbeater):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listener = self._heartbeater = None
+        self._subscribed.clear()
+
+    def register(self, agent_run_id: str) -> asyncio.Event:
+        """
+        Start tracking a local run.
+
+        Returns:
+            Event that is set once a STOP signal for the run arrives
+        """
+        event = self._runs.get(agent_run_id)
+        if event is None:
+            event = asyncio.Event()
+            self._runs[agent_run_id] = event
+        return event
+
+    def unregister(self, agent_run_id: str) -> None:
+        self._runs.pop(agent_run_id, None)
+
+    def _dispatch(self, channel: Any, data: Any) -> None:
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self.signals_received += 1
+        if data != "STOP":
+            return
+        agent_run_id = control_channel_run_id(channel)
+        event = self._runs.get(agent_run_id) if agent_run_id else None
+        if event is not None and not event.is_set():
+            logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {self.instance_id})")
+            self.signals_delivered += 1
+            event.set()
+
+    async def _listen(self) -> None:
+        delay = MIN_RESUBSCRIBE_DELAY
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.psubscribe(*self.patterns)
+                self._subscribed.set()
+                delay = MIN_RESUBSCRIBE_DELAY
+                logger.debug(f"Subscribed to control patterns: {', '.join(self.patterns)}")
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_TIMEOUT)
+                    if message and message.get("type") == "pmessage":
+                        self._dispatch(message.get("channel"), message.get("data"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                self.resubscribes += 1
+                logger.warning(f"Control subscription failed, resubscribing in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RESUBSCRIBE_DELAY)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception as e:
+                        logger.debug(f"Error closing control subscription: {e}")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                await run_registry.heartbeat(self.instance_id, list(self._runs))
+            except Exception as e:
+                logger.warning(f"Failed to send run registry heartbeat: {e}")
+            await asyncio.sleep(run_registry.HEARTBEAT_INTERVAL)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active_runs": len(self._runs),
+            "subscribed": self._subscribed.is_set(),
+            "signals_received": self.signals_received,
+            "signals_delivered": self.signals_delivered,
+            "resubscribes": self.resubscribes,
+        }
+
+
+class WorkerRuntime:
+    """Redis, database and control-signal resources shared by all runs of a worker process."""
+
+    def __init__(self, instance_id: str, health_check_interval: Optional[float] = None):
+        """
+        Args:
+            instance_id: ID of this worker instance, used in control channels and the run registry
+            health_check_interval: Seconds between connection health checks
+                (defaults to WORKER_HEALTH_CHECK_INTERVAL_SECONDS)
+        """
+        self.instance_id = instance_id
+        self.health_check_interval = (
+            config.WORKER_HEALTH_CHECK_INTERVAL_SECONDS if health_check_interval is None else health_check_interval
+        )
+        self.db = DBConnection()
+        self.stop_signals = StopSignalHub(instance_id)
+        self._lock = asyncio.Lock()
+        self._initialized = False
+        self._checked_at = 0.0
+
+        self.initializations = 0
+        self.reconnects = 0
+
+    async def ensure_initialized(self) -> None:
+        """
+        Set up shared resources on first use and re-check them once per health check interval.
+
+        Cheap when the resources are up and were checked recently, so every
+        actor invocation can call it.
+        """
+        if self._initialized and time.monotonic() - self._checked_at < self.health_check_interval:
+            return
+        async with self._lock:
+            if not self._initialized:
+                await self._initialize()
+            elif time.monotonic() - self._checked_at >= self.health_check_interval and not await self._healthy():
+                logger.warning(f"Worker resources unhealthy, reconnecting (Instance: {self.instance_id})")
+                self.reconnects += 1
+                await self._reset()
+                await self._initialize()
+            self._checked_at = time.monotonic()
+
+    async def _initialize(self) -> None:
+        await retry(lambda: redis.initialize_async())
+        await self.db.initialize()
+        await self.stop_signals.start()
+        self._initialized = True
+        self.initializations += 1
+        logger.info(f"Initialized worker resources with instance ID: {self.instance_id}")
+
+    async def _healthy(self) -> bool:
+        try:
+            redis_client = await redis.get_client()
+            await redis_client.ping()
+            async with db_service.get_connection() as conn:
+                await conn.fetchval('SELECT 1')
+            return self.stop_signals.running
+        except Exception as e:
+            logger.warning(f"Worker health check failed: {e}")
+            return False
+
+    async def _reset(self) -> None:
+        self._initialized = False
+        await self.stop_signals.stop()
+        for close in (redis.close, self.db.disconnect):
+            try:
+                await close()
+            except Exception as e:
+                logger.warning(f"Error closing worker resource: {e}")
+
+    async def shutdown(self) -> None:
+        """Release the shared resources when the worker process stops."""
+        async with self._lock:
+            if self._initialized:
+                await self._reset()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "initialized": self._initialized,
+            "initializations": self.initializations,
+            "reconnects": self.reconnects,
+            "stop_signals": self.stop_signals.get_stats(),
+        }
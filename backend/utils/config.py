@@ -124,6 +124,20 @@ class Configuration:
     
     # Model configuration
     MODEL_TO_USE: Optional[str] = "anthropic/claude-3-7-sonnet-latest"
+
+    # Local LLM response cache, used by calls that opt in with cache=True.
+    # Enabled by default in local mode only; the path should be absolute
+    LLM_CACHE_ENABLED: bool = False
+    LLM_CACHE_PATH: str = os.path.join(os.path.expanduser("~"), ".cache", "neo", "llm_cache.sqlite3")
+    LLM_CACHE_MAX_MB: int = 256
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+
+    # LLM routing across equivalent deployments; alternatives (e.g. OpenRouter)
+    # and hedging of slow streams are opt-in as they can double provider spend
+    LLM_ALTERNATE_DEPLOYMENTS_ENABLED: bool = False
+    LLM_HEDGING_ENABLED: bool = False
+    LLM_HEDGE_BUDGET_PERCENT: int = 10
+    LLM_HEDGE_MIN_DELAY_MS: int = 2000
     
     # Database configuration (replaces Supabase)
     DATABASE_URL: Optional[str] = None
@@ -144,6 +158,39 @@ class Configuration:
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: str
     REDIS_SSL: bool = True
+
+    # Seconds between health checks of the background worker's Redis and database connections
+    WORKER_HEALTH_CHECK_INTERVAL_SECONDS: int = 30
+
+    # Lowest level written to the log file; the console logs WARNING and up in production
+    LOG_LEVEL: str = "DEBUG"
+    # Log records buffered for the background log writer; beyond this, records are dropped and counted
+    LOG_QUEUE_SIZE: int = 10000
+    # Records below WARNING that one logging call site may write per second (0 for no limit)
+    LOG_RATE_LIMIT_PER_SECOND: int = 20
+    # Percentage of DEBUG records written
+    LOG_DEBUG_SAMPLE_PERCENT: int = 100
+
+    # Record a critical path breakdown of each agent run and store it with the run
+    RUN_PROFILER_ENABLED: bool = True
+
+    # Token counts of prompt messages kept per worker process, so unchanged messages are not tokenized again
+    TOKEN_COUNT_CACHE_SIZE: int = 50000
+
+    # Responses per compressed chunk of an agent run's archived response log
+    RESPONSE_LOG_CHUNK_SIZE: int = 500
+
+    # Circuit breakers of external dependencies, shared by all processes through Redis
+    CIRCUIT_BREAKERS_ENABLED: bool = True
+    # Seconds after which a process reloads a breaker's state even without a published change
+    CIRCUIT_BREAKER_REFRESH_SECONDS: int = 5
+
+    # Errors kept in the error handler's history, oldest dropped first
+    ERROR_HISTORY_LIMIT: int = 1000
+
+    # Import the API's deferred modules (agent loop, LLM and SDK clients) in the
+    # background once it is up, instead of on the first request that needs them
+    PRELOAD_DEFERRED_MODULES: bool = True
     
     # NEO Isolator configuration (replaces Daytona)
     ISOLATOR_URL: str = "http://localhost:8001"
@@ -172,7 +219,14 @@ class Configuration:
     STRIPE_WEBHOOK_SECRET: Optional[str] = None
     STRIPE_DEFAULT_PLAN_ID: Optional[str] = None
     STRIPE_DEFAULT_TRIAL_DAYS: int = 14
-    
+
+    # Seconds the subscription minute limit is reused between agent loop
+    # iterations; usage itself is read on every iteration
+    BILLING_CHECK_INTERVAL_SECONDS: int = 60
+
+    # Seconds between usage ledger checkpoints of an active agent run
+    USAGE_CHECKPOINT_SECONDS: int = 60
+
     # Stripe Product IDs
     STRIPE_PRODUCT_ID_PROD: str = 'prod_SCl7AQ2C8kK1CD'
     STRIPE_PRODUCT_ID_STAGING: str = 'prod_SCgIj3G7yPOAWY'
@@ -185,6 +239,22 @@ class Configuration:
     LANGFUSE_PUBLIC_KEY: Optional[str] = None
     LANGFUSE_SECRET_KEY: Optional[str] = None
     LANGFUSE_HOST: str = "https://cloud.langfuse.com"
+    # Percentage of runs traced, decided by trace ID so every process agrees
+    LANGFUSE_SAMPLE_PERCENT: int = 100
+    # Percentage of DEFAULT-level events kept in traced runs; warnings and errors are always kept
+    LANGFUSE_EVENT_SAMPLE_PERCENT: int = 100
+    # Per-event sample percentages, e.g. "found_xml_tag:0,executing_tool:10"
+    LANGFUSE_EVENT_SAMPLE_OVERRIDES: str = ""
+    # Trace records buffered for the background exporter; further records are dropped
+    LANGFUSE_QUEUE_SIZE: int = 10000
+    LANGFUSE_EXPORT_BATCH_SIZE: int = 200
+
+    # Prometheus metrics
+    # Directory shared by the API or worker processes for multi-process
+    # metrics; emptied before they start. Unset, metrics cover one process
+    PROMETHEUS_MULTIPROC_DIR: Optional[str] = None
+    # Port of the background worker's metrics endpoint
+    WORKER_METRICS_PORT: int = 9191
 
     @property
     def STRIPE_PRODUCT_ID(self) -> str:
@@ -207,6 +277,9 @@ class Configuration:
             
         logger.info(f"Environment mode: {self.ENV_MODE.value}")
         
+        # Mode-dependent defaults, overridden by the environment below
+        self.LLM_CACHE_ENABLED = self.ENV_MODE == EnvMode.LOCAL
+        
         # Load configuration from environment variables
         self._load_from_env()
         
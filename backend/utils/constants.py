@@ -142,4 +142,20 @@ MODEL_NAME_ALIASES = {
     
     # "qwen/qwen3-235b-a22b": "openrouter/qwen/qwen3-235b-a22b",
     # "xai/grok-3-mini-fast-beta": "xai/grok-3-mini-fast-beta",  # Commented out in constants.py
-}
\ No newline at end of file
+}
+# Equivalent deployments per model, in order of preference. The LLM router
+# fails over and hedges between them based on observed latency and errors.
+MODEL_DEPLOYMENTS = {
+    "anthropic/claude-sonnet-4-20250514": [
+        "anthropic/claude-sonnet-4-20250514",
+        "openrouter/anthropic/claude-sonnet-4",
+    ],
+    "anthropic/claude-3-7-sonnet-latest": [
+        "anthropic/claude-3-7-sonnet-latest",
+        "openrouter/anthropic/claude-3.7-sonnet",
+    ],
+    "openai/gpt-4o": [
+        "openai/gpt-4o",
+        "openrouter/openai/gpt-4o",
+    ],
+}
@@ -3,7 +3,8 @@ Enhanced Error Handling System for NEO Agent
 
 This module provides comprehensive error handling, recovery, and resilience features:
 - Intelligent error categorization and recovery strategies
-- Circuit breaker pattern for external services
+- Circuit breaker pattern for external services, shared across processes
+  (see ``services.circuit_breaker``)
 - Retry mechanisms with exponential backoff
 - Error context preservation and analysis
 - Automatic fallback mechanisms
@@ -15,12 +16,16 @@ import functools
 import logging
 import time
 import traceback
+from collections import deque
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Callable, Dict, List, Optional, Type, Union
+from typing import Any, Callable, Deque, Dict, List, Optional, Type, Union
 from dataclasses import dataclass, field
 import json
 
+from services.circuit_breaker import OPEN, circuit_breakers
+from utils.config import config
+
 class ErrorSeverity(Enum):
     LOW = "low"
     MEDIUM = "medium"
@@ -67,23 +72,12 @@ class ErrorContext:
     recovery_attempted: bool = False
     recovery_successful: bool = False
 
-@dataclass
-class CircuitBreakerState:
-    """State tracking for circuit breaker pattern."""
-    failure_count: int = 0
-    last_failure_time: Optional[datetime] = None
-    state: str = "closed"  # closed, open, half_open
-    failure_threshold: int = 5
-    recovery_timeout: int = 60  # seconds
-    success_threshold: int = 3  # successes needed to close circuit
-
 class EnhancedErrorHandler:
     """Enhanced error handler with intelligent recovery strategies."""
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.error_history: List[ErrorContext] = []
-        self.circuit_breakers: Dict[str, CircuitBreakerState] = {}
+        self.error_history: Deque[ErrorContext] = deque(maxlen=config.ERROR_HISTORY_LIMIT)
         self.error_patterns: Dict[str, int] = {}
         self.recovery_strategies: Dict[ErrorCategory, RecoveryStrategy] = {
             ErrorCategory.NETWORK: RecoveryStrategy.RETRY,
@@ -303,34 +297,17 @@ class EnhancedErrorHandler:
         error_context.recovery_successful = True
     
     async def _circuit_breaker_recovery(self, error_context: ErrorContext):
-        """Implement circuit breaker pattern for external services."""
+        """Record the failure with the service's shared circuit breaker."""
         service_name = error_context.context_data.get("service_name", "unknown")
+        circuit_breaker = circuit_breakers.get(service_name)
         
-        if service_name not in self.circuit_breakers:
-            self.circuit_breakers[service_name] = CircuitBreakerState()
-        
-        circuit_breaker = self.circuit_breakers[service_name]
-        
-        # Update failure count
-        circuit_breaker.failure_count += 1
-        circuit_breaker.last_failure_time = datetime.now()
-        
-        # Check if circuit should be opened
-        if (circuit_breaker.failure_count >= circuit_breaker.failure_threshold and 
-            circuit_breaker.state == "closed"):
-            circuit_breaker.state = "open"
+        # Failures, trips and half-open probing are tracked in Redis for all processes
+        was_open = circuit_breaker.state == OPEN
+        await circuit_breaker.record_failure()
+        if circuit_breaker.state == OPEN and not was_open:
             self.performance_metrics["circuit_breaker_trips"] += 1
-            self.logger.warning(f"Circuit breaker opened for {service_name}")
-        
-        # Check if circuit can be half-opened
-        elif (circuit_breaker.state == "open" and 
-              circuit_breaker.last_failure_time and
-              datetime.now() - circuit_breaker.last_failure_time > 
-              timedelta(seconds=circuit_breaker.recovery_timeout)):
-            circuit_breaker.state = "half_open"
-            self.logger.info(f"Circuit breaker half-opened for {service_name}")
         
-        error_context.recovery_successful = circuit_breaker.state != "open"
+        error_context.recovery_successful = not circuit_breaker.is_open()
     
     async def _fallback_recovery(self, error_context: ErrorContext):
         """Implement fallback recovery mechanisms."""
@@ -416,21 +393,18 @@ class EnhancedErrorHandler:
                 reverse=True
             )[:10]),
             "circuit_breaker_states": {
-                name: state.state for name, state in self.circuit_breakers.items()
+                name: state["state"] for name, state in circuit_breakers.states().items()
             }
         }
     
-    def reset_circuit_breaker(self, service_name: str):
-        """Manually reset a circuit breaker."""
-        if service_name in self.circuit_breakers:
-            self.circuit_breakers[service_name] = CircuitBreakerState()
-            self.logger.info(f"Circuit breaker reset for {service_name}")
+    async def reset_circuit_breaker(self, service_name: str):
+        """Manually reset a circuit breaker in every process."""
+        await circuit_breakers.reset(service_name)
+        self.logger.info(f"Circuit breaker reset for {service_name}")
     
     def is_circuit_open(self, service_name: str) -> bool:
         """Check if circuit breaker is open for a service."""
-        if service_name not in self.circuit_breakers:
-            return False
-        return self.circuit_breakers[service_name].state == "open"
+        return circuit_breakers.is_open(service_name)
 
 # Global error handler instance
 error_handler = EnhancedErrorHandler()
@@ -500,9 +474,9 @@ def get_error_stats() -> Dict[str, Any]:
     """Get current error statistics."""
     return error_handler.get_error_statistics()
 
-def reset_circuit_breaker(service_name: str):
+async def reset_circuit_breaker(service_name: str):
     """Reset circuit breaker for a service."""
-    error_handler.reset_circuit_breaker(service_name)
+    await error_handler.reset_circuit_breaker(service_name)
 
 def is_service_available(service_name: str) -> bool:
     """Check if service is available (circuit breaker not open)."""
@@ -0,0 +1,73 @@
+"""
+Deferred imports for the API process.
+
+Most API requests never touch the LLM, worker, tool or SDK modules, so the
+API imports them on first use instead of at startup. Two helpers support
+this:
+
+- ``lazy_import`` returns a module whose import runs on first attribute
+  access, for SDKs used throughout a module (``mailtrap``). Before Python
+  3.12 that first access is not thread-safe, so it is only meant for modules
+  first used on the event loop; SDKs also called from worker threads are
+  imported normally or inside the function using them
+- ``preload`` imports deferred modules in a background thread once the API
+  is serving, so the first request that needs them does not pay the import
+"""
+
+import asyncio
+import importlib
+import importlib.util
+import sys
+import time
+from types import ModuleType
+from typing import Dict, Iterable
+
+from utils.logger import logger
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Import a module on first attribute access.
+
+    Args:
+        name: Absolute module name
+
+    Returns:
+        The module, already imported if it was loaded before
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def _import_all(module_names: Iterable[str]) -> Dict[str, float]:
+    timings = {}
+    for name in module_names:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"Failed to preload {name}: {e}")
+            continue
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+async def preload(module_names: Iterable[str]) -> Dict[str, float]:
+    """
+    Import deferred modules without blocking the event loop.
+
+    Returns:
+        Milliseconds spent importing each module
+    """
+    timings = await asyncio.to_thread(_import_all, list(module_names))
+    logger.info(f"Preloaded deferred modules in {sum(timings.values()):.0f}ms: {timings}")
+    return timings
@@ -6,23 +6,40 @@ This module provides a unified logging interface with:
 - Log levels for different environments
 - Correlation IDs for request tracing
 - Contextual information for debugging
+- Non-blocking writes: records are queued and written to the file and the
+  console by a background thread, so logging never waits for disk or stdout
+  on the event loop. When the queue is full, records are dropped and counted.
+- Rate limiting and sampling of frequent records: each call site may log
+  ``LOG_RATE_LIMIT_PER_SECOND`` records below WARNING per second, and DEBUG
+  records are sampled to ``LOG_DEBUG_SAMPLE_PERCENT``. Warnings and errors
+  always pass.
+- The logger's level is the lowest level of its handlers, so calls below it
+  (e.g. ``logger.debug`` with ``LOG_LEVEL=INFO``) return after a cached level
+  check.
 """
 
+import atexit
 import logging
 import json
+import queue
+import random
 import sys
 import os
 from datetime import datetime, timezone
 from contextvars import ContextVar
 from functools import wraps
 import traceback
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Tuple
 
 from utils.config import config, EnvMode
 
 # Context variable for request correlation ID
 request_id: ContextVar[str] = ContextVar('request_id', default='')
 
+# Seconds over which a call site's records are counted against its rate limit
+RATE_LIMIT_WINDOW_SECONDS = 1.0
+
 class JSONFormatter(logging.Formatter):
     """Custom JSON formatter for structured logging."""
     
@@ -54,9 +71,166 @@ class JSONFormatter(logging.Formatter):
             
         return json.dumps(log_data)
 
+class RateLimitFilter(logging.Filter):
+    """
+    Limits frequent records below WARNING, per logger and call site.
+
+    A call site (logger name, file and line) may pass ``per_second`` records
+    per second; further records are dropped, and the next record the site
+    passes notes how many were suppressed. DEBUG records are sampled to
+    ``debug_sample_percent`` first. Counts are not locked, so concurrent
+    threads may miscount a record now and then.
+    """
+
+    def __init__(self, per_second: int = 0, debug_sample_percent: int = 100):
+        """
+        Args:
+            per_second: Records per call site and second (0 for no limit)
+            debug_sample_percent: Percentage of DEBUG records kept
+        """
+        super().__init__()
+        self.per_second = per_second
+        self.debug_sample_percent = debug_sample_percent
+        # (logger, file, line) -> [window start, records passed in window, records suppressed]
+        self._sites: Dict[Tuple[str, str, int], List] = {}
+        self.rate_limited = 0
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if (record.levelno < logging.INFO and self.debug_sample_percent < 100
+                and random.random() * 100 >= self.debug_sample_percent):
+            self.sampled_out += 1
+            return False
+        if self.per_second <= 0:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = [record.created, 0, 0]
+        elif record.created - site[0] >= RATE_LIMIT_WINDOW_SECONDS:
+            site[0] = record.created
+            site[1] = 0
+        if site[1] >= self.per_second:
+            site[2] += 1
+            self.rate_limited += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.msg = f'{record.msg} [{site[2]} similar records suppressed]'
+            site[2] = 0
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queues records for a ``QueueListener`` without blocking; counts those dropped when the queue is full."""
+
+    # Renders exception tracebacks before records are queued
+    _exception_formatter = logging.Formatter()
+
+    def __init__(self, queue_size: int):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._reported_drops = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Render the message and traceback now, since arguments and exceptions
+        may change before the listener formats the record. Unlike the base
+        class, the record is not copied: this handler is its logger's only one.
+        """
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped > self._reported_drops:
+            dropped = self.dropped - self._reported_drops
+            notice = logging.makeLogRecord({
+                'name': record.name,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f'Dropped {dropped} log records, log queue full',
+            })
+            try:
+                self.queue.put_nowait(notice)
+                self._reported_drops = self.dropped
+            except queue.Full:
+                pass
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room instead of failing when stopped with a full queue
+        self.queue.put(self._sentinel)
+
+class LogPipeline:
+    """A logger's queue handler and the background thread writing its records to the real handlers."""
+
+    def __init__(self, handlers: List[logging.Handler], queue_size: int,
+                 rate_limit_per_second: int = 0, debug_sample_percent: int = 100):
+        """
+        Args:
+            handlers: Handlers the records are written to, each with its own level
+            queue_size: Records buffered before new ones are dropped
+            rate_limit_per_second: Records below WARNING per call site and second (0 for no limit)
+            debug_sample_percent: Percentage of DEBUG records kept
+        """
+        self.handlers = handlers
+        self.filter = RateLimitFilter(rate_limit_per_second, debug_sample_percent)
+        self.handler = NonBlockingQueueHandler(queue_size)
+        self.handler.addFilter(self.filter)
+        self.listener = None
+        self._start()
+        # Threads do not survive the fork of gunicorn or dramatiq worker
+        # processes, so each child starts its own listener on a new queue
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self) -> None:
+        self.handler.queue = queue.Queue(maxsize=self.handler.queue_size)
+        self.listener = _Listener(self.handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Write the queued records and stop the listener thread."""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'queue_size': self.handler.queue_size,
+            'pending': self.handler.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'rate_limited': self.filter.rate_limited,
+            'sampled_out': self.filter.sampled_out,
+        }
+
+# Pipelines of the loggers set up by setup_logger, by logger name
+_pipelines: Dict[str, LogPipeline] = {}
+
+def _file_level() -> int:
+    level = logging.getLevelName(config.LOG_LEVEL.upper())
+    if not isinstance(level, int):
+        print(f"Invalid LOG_LEVEL: {config.LOG_LEVEL}, using DEBUG")
+        return logging.DEBUG
+    return level
+
 def setup_logger(name: str = 'agentpress') -> logging.Logger:
     """
     Set up a centralized logger with both file and console handlers.
+
+    Both handlers are fed by a ``LogPipeline``: the logger itself only
+    filters and queues records.
     
     Args:
         name: The name of the logger
@@ -77,6 +251,8 @@ def setup_logger(name: str = 'agentpress') -> logging.Logger:
         print(f"Error creating log directory: {e}")
         return logger
     
+    handlers = []
+
     # File handler with rotation
     try:
         log_file = os.path.join(log_dir, f'{name}_{datetime.now().strftime("%Y%m%d")}.log')
@@ -86,7 +262,7 @@ def setup_logger(name: str = 'agentpress') -> logging.Logger:
             backupCount=5,
             encoding='utf-8'
         )
-        file_handler.setLevel(logging.DEBUG)
+        file_handler.setLevel(_file_level())
         
         # Create formatters
         file_formatter = logging.Formatter(
@@ -94,8 +270,7 @@ def setup_logger(name: str = 'agentpress') -> logging.Logger:
         )
         file_handler.setFormatter(file_formatter)
         
-        # Add file handler to logger
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
         print(f"Added file handler for: {log_file}")
     except Exception as e:
         print(f"Error setting up file handler: {e}")
@@ -113,12 +288,24 @@ def setup_logger(name: str = 'agentpress') -> logging.Logger:
         )
         console_handler.setFormatter(console_formatter)
         
-        # Add console handler to logger
-        logger.addHandler(console_handler)
-        logger.info(f"Added console handler with level: {console_handler.level}")
-        logger.info(f"Log file will be created at: {log_dir}")
+        handlers.append(console_handler)
     except Exception as e:
         print(f"Error setting up console handler: {e}")
+
+    if handlers:
+        pipeline = LogPipeline(
+            handlers,
+            queue_size=config.LOG_QUEUE_SIZE,
+            rate_limit_per_second=config.LOG_RATE_LIMIT_PER_SECOND,
+            debug_sample_percent=config.LOG_DEBUG_SAMPLE_PERCENT,
+        )
+        logger.addHandler(pipeline.handler)
+        # Records below every handler's level are discarded by the logger's cached level check
+        logger.setLevel(min(handler.level for handler in handlers))
+        atexit.register(pipeline.stop)
+        _pipelines[name] = pipeline
+        logger.info(f"Logging through a background writer (level: {logging.getLevelName(logger.level)})")
+        logger.info(f"Log file will be created at: {log_dir}")
     
     # # Test logging
     # logger.debug("Logger setup complete - DEBUG test")
@@ -127,5 +314,10 @@ def setup_logger(name: str = 'agentpress') -> logging.Logger:
     
     return logger
 
+def get_logging_stats(name: str = 'agentpress') -> Dict[str, int]:
+    """Queue and filter counts of a logger set up by ``setup_logger``; empty if it has no pipeline."""
+    pipeline = _pipelines.get(name)
+    return pipeline.get_stats() if pipeline else {}
+
 # Create default logger instance
-logger = setup_logger() 
\ No newline at end of file
+logger = setup_logger() 
@@ -0,0 +1,235 @@
+"""
+Metric primitives for hot paths.
+
+Writers never take a lock: every metric keeps one shard per thread
+(``ThreadSharded``), each shard has a single writer, and readers merge the
+shards when a value is requested. Updates are constant time:
+
+- ``Counter``: monotonically increasing count
+- ``Histogram``: logarithmic buckets (8 per power of two, about 5% relative
+  error) for percentiles of durations; histograms with the same layout merge
+  by adding bucket counts, across threads, processes or time
+- ``SlidingWindowRate``: events per second over a trailing window, kept in a
+  ring of per-second slots
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Generic, List, TypeVar
+
+T = TypeVar("T")
+
+# Buckets per power of two; each bucket spans a factor of 2**(1/8), about 9%
+SUB_BUCKETS = 8
+# Values at or below 2**MIN_EXPONENT (about 1µs in seconds) share the first bucket
+MIN_EXPONENT = -20
+# Values at or above 2**MAX_EXPONENT (about 4.5h in seconds) share the last bucket
+MAX_EXPONENT = 14
+BUCKET_COUNT = (MAX_EXPONENT - MIN_EXPONENT) * SUB_BUCKETS + 2
+_MIN_VALUE = 2.0 ** MIN_EXPONENT
+
+
+def bucket_index(value: float) -> int:
+    """Index of the histogram bucket holding ``value``."""
+    if value <= _MIN_VALUE:
+        return 0
+    index = int((math.log2(value) - MIN_EXPONENT) * SUB_BUCKETS) + 1
+    return index if index < BUCKET_COUNT else BUCKET_COUNT - 1
+
+
+def bucket_upper_bound(index: int) -> float:
+    """Upper bound of the values in a histogram bucket."""
+    if index >= BUCKET_COUNT - 1:
+        return math.inf
+    return 2.0 ** (MIN_EXPONENT + max(index, 0) / SUB_BUCKETS)
+
+
+class ThreadSharded(Generic[T]):
+    """One instance of a metric per thread, so writers never contend."""
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._shards: Dict[int, T] = {}
+
+    def local(self) -> T:
+        """The calling thread's shard, created on first use."""
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            # Thread IDs are reused after a thread exits; the new thread then
+            # continues the shard of the old one, which no longer writes to it
+            shard = self._shards.setdefault(ident, self._factory())
+        return shard
+
+    def shards(self) -> List[T]:
+        return list(self._shards.values())
+
+    def clear(self) -> None:
+        self._shards.clear()
+
+
+class _Cell:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self):
+        self._cells: ThreadSharded[_Cell] = ThreadSharded(_Cell)
+
+    def inc(self, amount: float = 1) -> None:
+        self._cells.local().value += amount
+
+    @property
+    def value(self) -> float:
+        return sum(cell.value for cell in self._cells.shards())
+
+    def reset(self) -> None:
+        self._cells.clear()
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative values, e.g. durations in seconds.
+
+    Not thread-safe on its own: give each writer its own histogram (see
+    ``ThreadSharded``) and ``merge`` them for reading.
+    """
+
+    __slots__ = ("counts", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram") -> "Histogram":
+        """Add the observations of ``other`` to this histogram."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @classmethod
+    def merged(cls, histograms) -> "Histogram":
+        result = cls()
+        for histogram in histograms:
+            result.merge(histogram)
+        return result
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate a percentile.
+
+        Args:
+            q: Percentile between 0 and 1
+
+        Returns:
+            The midpoint of the bucket holding the percentile, clamped to the
+            observed minimum and maximum; 0.0 without observations
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                lower = bucket_upper_bound(index - 1) if index > 0 else 0.0
+                upper = bucket_upper_bound(index)
+                estimate = (lower + upper) / 2 if upper != math.inf else self.max
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, object]:
+        """Sparse representation for export, keyed by bucket index."""
+        return {
+            "buckets": {index: count for index, count in enumerate(self.counts) if count},
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "Histogram":
+        histogram = cls()
+        for index, count in data["buckets"].items():
+            histogram.counts[int(index)] = count
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"] if data["min"] is not None else math.inf
+        histogram.max = data["max"]
+        return histogram
+
+
+class SlidingWindowRate:
+    """
+    Events per second over the last ``window_seconds``.
+
+    Keeps one slot per second in a ring; a slot is reset when its second comes
+    around again. Until the window has filled, rates are taken over the
+    seconds since the first event. Not thread-safe on its own, like
+    ``Histogram``.
+    """
+
+    __slots__ = ("window_seconds", "first_event", "_seconds", "_counts")
+
+    def __init__(self, window_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self.first_event = None
+        self._seconds = [-1] * window_seconds
+        self._counts = [0] * window_seconds
+
+    def add(self, now: float, amount: float = 1) -> None:
+        if self.first_event is None:
+            self.first_event = now
+        second = int(now)
+        slot = second % self.window_seconds
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._counts[slot] = 0
+        self._counts[slot] += amount
+
+    def total(self, now: float) -> float:
+        """Events in the window ending at ``now``."""
+        oldest = int(now) - self.window_seconds
+        return sum(count for second, count in zip(self._seconds, self._counts) if second > oldest)
+
+    def covered_seconds(self, now: float) -> float:
+        """Length of the window, or the time since the first event if shorter."""
+        if self.first_event is None:
+            return self.window_seconds
+        return max(1.0, min(self.window_seconds, now - self.first_event))
+
+    def rate(self, now: float) -> float:
+        return self.total(now) / self.covered_seconds(now)
+
+
+def merged_rate(windows, now: float) -> float:
+    """Combined rate of several windows of the same length."""
+    windows = list(windows)
+    if not windows:
+        return 0.0
+    return sum(window.total(now) for window in windows) / max(window.covered_seconds(now) for window in windows)
@@ -12,15 +12,18 @@ This module provides comprehensive performance monitoring and optimization:
 """
 
 import asyncio
+import itertools
 import time
 import threading
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Callable
+from typing import Dict, List, Optional, Any, Callable, Tuple
 from dataclasses import dataclass, field
 from collections import deque
 import json
 
+from utils.metrics import Histogram, SlidingWindowRate, ThreadSharded, merged_rate
+
 try:
     import psutil
     PSUTIL_AVAILABLE = True
@@ -63,6 +66,74 @@ class OperationMetrics:
     last_call_time: Optional[datetime] = None
     error_rate: float = 0.0
     throughput_per_second: float = 0.0
+    p50_duration: float = 0.0
+    p95_duration: float = 0.0
+    p99_duration: float = 0.0
+
+class _OperationShard:
+    """One thread's share of an operation's metrics."""
+    __slots__ = ("calls", "failures", "durations", "rate", "last_call")
+
+    def __init__(self, window_seconds: int):
+        self.calls = 0
+        self.failures = 0
+        self.durations = Histogram()
+        self.rate = SlidingWindowRate(window_seconds)
+        self.last_call = 0.0
+
+class OperationStats:
+    """
+    Call counts, latency histogram and call rate of one operation.
+
+    Each thread records into its own shard, so recording takes constant time
+    and no lock; readers merge the shards.
+    """
+
+    def __init__(self, operation_name: str, window_seconds: int = 60):
+        self.operation_name = operation_name
+        self._shards: ThreadSharded[_OperationShard] = ThreadSharded(lambda: _OperationShard(window_seconds))
+
+    def record(self, duration: float, success: bool):
+        now = time.time()
+        shard = self._shards.local()
+        shard.calls += 1
+        if not success:
+            shard.failures += 1
+        shard.durations.observe(duration)
+        shard.rate.add(now)
+        shard.last_call = now
+
+    def error_rate(self) -> float:
+        shards = self._shards.shards()
+        calls = sum(shard.calls for shard in shards)
+        return sum(shard.failures for shard in shards) / calls if calls else 0.0
+
+    def histogram(self) -> Histogram:
+        return Histogram.merged(shard.durations for shard in self._shards.shards())
+
+    def snapshot(self) -> OperationMetrics:
+        """Merge the shards into an ``OperationMetrics`` view."""
+        shards = self._shards.shards()
+        durations = Histogram.merged(shard.durations for shard in shards)
+        calls = sum(shard.calls for shard in shards)
+        failures = sum(shard.failures for shard in shards)
+        last_call = max((shard.last_call for shard in shards), default=0.0)
+        return OperationMetrics(
+            operation_name=self.operation_name,
+            total_calls=calls,
+            successful_calls=calls - failures,
+            failed_calls=failures,
+            total_duration=durations.sum,
+            min_duration=durations.min,
+            max_duration=durations.max,
+            avg_duration=durations.mean,
+            last_call_time=datetime.fromtimestamp(last_call) if last_call else None,
+            error_rate=failures / calls if calls else 0.0,
+            throughput_per_second=merged_rate((shard.rate for shard in shards), time.time()),
+            p50_duration=durations.percentile(0.5),
+            p95_duration=durations.percentile(0.95),
+            p99_duration=durations.percentile(0.99),
+        )
 
 class PerformanceMonitor:
     """Comprehensive performance monitoring system."""
@@ -74,12 +145,18 @@ class PerformanceMonitor:
         # Metrics storage
         self.metrics_history: deque = deque(maxlen=max_history_size)
         self.resource_history: deque = deque(maxlen=max_history_size)
-        self.operation_metrics: Dict[str, OperationMetrics] = {}
+        self.operation_metrics: Dict[str, OperationStats] = {}
+        self.rate_window_seconds = 60
+        
+        # Operations started with start_operation, by operation ID
+        self._operation_starts: Dict[str, Tuple[str, float]] = {}
+        self._operation_ids = itertools.count()
         
         # Monitoring state
         self.monitoring_active = False
         self.monitoring_interval = 10  # seconds
         self.monitoring_thread: Optional[threading.Thread] = None
+        self._last_resource_sample = 0.0
         
         # Performance thresholds
         self.thresholds = {
@@ -96,9 +173,8 @@ class PerformanceMonitor:
         # Performance optimization suggestions
         self.optimization_suggestions: List[str] = []
         
-        # Start monitoring if psutil is available
-        if PSUTIL_AVAILABLE:
-            self.start_monitoring()
+        # Resources are sampled when a summary is requested; the background
+        # loop only runs once alert callbacks are registered
     
     def start_monitoring(self):
         """Start background performance monitoring."""
@@ -137,8 +213,8 @@ class PerformanceMonitor:
             return
         
         try:
-            # CPU usage
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU usage since the previous sample, without blocking
+            cpu_percent = psutil.cpu_percent(interval=None)
             
             # Memory usage
             memory = psutil.virtual_memory()
@@ -170,6 +246,7 @@ class PerformanceMonitor:
             )
             
             self.resource_history.append(resource_usage)
+            self._last_resource_sample = time.monotonic()
             
             # Record individual metrics
             self.record_metric("cpu_percent", cpu_percent, "percent")
@@ -195,90 +272,38 @@ class PerformanceMonitor:
     
     def start_operation(self, operation_name: str) -> str:
         """Start timing an operation."""
-        operation_id = f"{operation_name}_{int(time.time() * 1000)}"
-        
-        # Initialize operation metrics if not exists
-        if operation_name not in self.operation_metrics:
-            self.operation_metrics[operation_name] = OperationMetrics(
-                operation_name=operation_name
-            )
-        
-        # Store start time
-        setattr(self, f"_start_time_{operation_id}", time.time())
-        
+        operation_id = f"{operation_name}_{next(self._operation_ids)}"
+        self._operation_starts[operation_id] = (operation_name, time.perf_counter())
         return operation_id
     
     def end_operation(self, operation_id: str, success: bool = True, error: str = None):
         """End timing an operation and record metrics."""
-        start_time_attr = f"_start_time_{operation_id}"
-        
-        if not hasattr(self, start_time_attr):
+        started = self._operation_starts.pop(operation_id, None)
+        if started is None:
             self.logger.warning(f"No start time found for operation {operation_id}")
             return
         
-        start_time = getattr(self, start_time_attr)
-        duration = time.time() - start_time
-        
-        # Extract operation name from operation_id
-        operation_name = operation_id.rsplit('_', 1)[0]
-        
-        # Update operation metrics
-        metrics = self.operation_metrics[operation_name]
-        metrics.total_calls += 1
-        metrics.total_duration += duration
-        metrics.last_call_time = datetime.now()
-        
-        if success:
-            metrics.successful_calls += 1
-        else:
-            metrics.failed_calls += 1
-        
-        # Update duration statistics
-        metrics.min_duration = min(metrics.min_duration, duration)
-        metrics.max_duration = max(metrics.max_duration, duration)
-        metrics.avg_duration = metrics.total_duration / metrics.total_calls
-        
-        # Update error rate
-        metrics.error_rate = metrics.failed_calls / metrics.total_calls
-        
-        # Calculate throughput (operations per second over last minute)
-        recent_calls = self._count_recent_calls(operation_name, 60)
-        metrics.throughput_per_second = recent_calls / 60.0
-        
-        # Record metric
-        self.record_metric(
-            f"operation_duration_{operation_name}",
-            duration * 1000,  # Convert to milliseconds
-            "ms",
-            {"operation": operation_name, "success": str(success)}
-        )
-        
-        # Clean up start time
-        delattr(self, start_time_attr)
+        operation_name, start_time = started
+        self.observe_operation(operation_name, time.perf_counter() - start_time, success)
+    
+    def observe_operation(self, operation_name: str, duration: float, success: bool = True):
+        """Record a finished operation of ``duration`` seconds."""
+        stats = self.operation_metrics.get(operation_name)
+        if stats is None:
+            stats = self.operation_metrics.setdefault(
+                operation_name, OperationStats(operation_name, self.rate_window_seconds)
+            )
+        stats.record(duration, success)
         
         # Check for performance issues
-        self._check_operation_performance(operation_name, duration, success)
+        self._check_operation_performance(stats, duration, success)
     
-    def _count_recent_calls(self, operation_name: str, seconds: int) -> int:
-        """Count recent calls for an operation within specified seconds."""
-        if operation_name not in self.operation_metrics:
-            return 0
-        
-        metrics = self.operation_metrics[operation_name]
-        if not metrics.last_call_time:
-            return 0
-        
-        # This is a simplified implementation
-        # In a real system, you'd track individual call timestamps
-        cutoff_time = datetime.now() - timedelta(seconds=seconds)
-        
-        # For now, estimate based on average call rate
-        if metrics.last_call_time > cutoff_time:
-            return min(metrics.total_calls, int(metrics.throughput_per_second * seconds))
-        
-        return 0
+    def get_operation_metrics(self, operation_name: str) -> Optional[OperationMetrics]:
+        """Get the merged metrics of an operation."""
+        stats = self.operation_metrics.get(operation_name)
+        return stats.snapshot() if stats else None
     
-    def _check_operation_performance(self, operation_name: str, duration: float, success: bool):
+    def _check_operation_performance(self, stats: OperationStats, duration: float, success: bool):
         """Check operation performance against thresholds."""
         duration_ms = duration * 1000
         
@@ -286,16 +311,17 @@ class PerformanceMonitor:
         if duration_ms > self.thresholds["response_time_ms"]:
             self._trigger_alert(
                 "high_response_time",
-                f"Operation {operation_name} took {duration_ms:.2f}ms (threshold: {self.thresholds['response_time_ms']}ms)"
+                f"Operation {stats.operation_name} took {duration_ms:.2f}ms (threshold: {self.thresholds['response_time_ms']}ms)"
             )
         
-        # Check error rate
-        metrics = self.operation_metrics[operation_name]
-        if metrics.error_rate > self.thresholds["error_rate"]:
-            self._trigger_alert(
-                "high_error_rate",
-                f"Operation {operation_name} has error rate {metrics.error_rate:.2%} (threshold: {self.thresholds['error_rate']:.2%})"
-            )
+        # Check error rate; it only rises when a call fails
+        if not success:
+            error_rate = stats.error_rate()
+            if error_rate > self.thresholds["error_rate"]:
+                self._trigger_alert(
+                    "high_error_rate",
+                    f"Operation {stats.operation_name} has error rate {error_rate:.2%} (threshold: {self.thresholds['error_rate']:.2%})"
+                )
     
     def _analyze_performance(self):
         """Analyze current performance and generate insights."""
@@ -348,7 +374,8 @@ class PerformanceMonitor:
             suggestions.append("Consider cleaning up temporary files or implementing log rotation")
         
         # Operation-specific suggestions
-        for operation_name, metrics in self.operation_metrics.items():
+        for operation_name, stats in list(self.operation_metrics.items()):
+            metrics = stats.snapshot()
             if metrics.avg_duration > 2.0:  # 2 seconds
                 suggestions.append(f"Operation '{operation_name}' is slow (avg: {metrics.avg_duration:.2f}s) - consider optimization")
             
@@ -384,9 +411,17 @@ class PerformanceMonitor:
     def add_alert_callback(self, callback: Callable):
         """Add callback for performance alerts."""
         self.alert_callbacks.append(callback)
+        if PSUTIL_AVAILABLE:
+            self.start_monitoring()
+    
+    def _refresh_resources(self):
+        """Sample system resources unless the latest sample is recent enough."""
+        if time.monotonic() - self._last_resource_sample >= self.monitoring_interval:
+            self._collect_system_metrics()
     
     def get_performance_summary(self) -> Dict[str, Any]:
         """Get comprehensive performance summary."""
+        self._refresh_resources()
         summary = {
             "timestamp": datetime.now().isoformat(),
             "monitoring_active": self.monitoring_active,
@@ -409,7 +444,8 @@ class PerformanceMonitor:
             }
         
         # Operation metrics
-        for operation_name, metrics in self.operation_metrics.items():
+        for operation_name, stats in list(self.operation_metrics.items()):
+            metrics = stats.snapshot()
             summary["operations"][operation_name] = {
                 "total_calls": metrics.total_calls,
                 "successful_calls": metrics.successful_calls,
@@ -417,6 +453,9 @@ class PerformanceMonitor:
                 "avg_duration_ms": metrics.avg_duration * 1000,
                 "min_duration_ms": metrics.min_duration * 1000 if metrics.min_duration != float('inf') else 0,
                 "max_duration_ms": metrics.max_duration * 1000,
+                "p50_duration_ms": metrics.p50_duration * 1000,
+                "p95_duration_ms": metrics.p95_duration * 1000,
+                "p99_duration_ms": metrics.p99_duration * 1000,
                 "error_rate": metrics.error_rate,
                 "throughput_per_second": metrics.throughput_per_second,
                 "last_call": metrics.last_call_time.isoformat() if metrics.last_call_time else None
@@ -451,6 +490,7 @@ class PerformanceMonitor:
         self.metrics_history.clear()
         self.resource_history.clear()
         self.operation_metrics.clear()
+        self._operation_starts.clear()
         self.optimization_suggestions.clear()
         self.logger.info("Performance metrics reset")
     
@@ -459,6 +499,11 @@ class PerformanceMonitor:
         data = {
             "export_timestamp": datetime.now().isoformat(),
             "summary": self.get_performance_summary(),
+            # Mergeable latency histograms, e.g. across workers (see utils.metrics.Histogram.from_dict)
+            "operation_histograms": {
+                name: stats.histogram().to_dict()
+                for name, stats in list(self.operation_metrics.items())
+            },
             "metrics_history": [
                 {
                     "timestamp": metric.timestamp.isoformat(),
@@ -497,24 +542,24 @@ def monitor_performance(operation_name: str = None):
         
         if asyncio.iscoroutinefunction(func):
             async def async_wrapper(*args, **kwargs):
-                operation_id = performance_monitor.start_operation(op_name)
+                started = time.perf_counter()
                 try:
                     result = await func(*args, **kwargs)
-                    performance_monitor.end_operation(operation_id, success=True)
+                    performance_monitor.observe_operation(op_name, time.perf_counter() - started, success=True)
                     return result
-                except Exception as e:
-                    performance_monitor.end_operation(operation_id, success=False, error=str(e))
+                except Exception:
+                    performance_monitor.observe_operation(op_name, time.perf_counter() - started, success=False)
                     raise
             return async_wrapper
         else:
             def sync_wrapper(*args, **kwargs):
-                operation_id = performance_monitor.start_operation(op_name)
+                started = time.perf_counter()
                 try:
                     result = func(*args, **kwargs)
-                    performance_monitor.end_operation(operation_id, success=True)
+                    performance_monitor.observe_operation(op_name, time.perf_counter() - started, success=True)
                     return result
-                except Exception as e:
-                    performance_monitor.end_operation(operation_id, success=False, error=str(e))
+                except Exception:
+                    performance_monitor.observe_operation(op_name, time.perf_counter() - started, success=False)
                     raise
             return sync_wrapper
     
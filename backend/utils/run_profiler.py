@@ -0,0 +1,318 @@
+"""
+Per-run latency profiler for the agent loop.
+
+One task drives an agent run: the worker's actor iterates ``run_agent``, which
+iterates ``ThreadManager.run_thread`` and the ``ResponseProcessor``. Whatever
+that task waits for or computes is on the critical path of the run. Tools
+started while the response streams run in tasks of their own and only delay
+the run while the loop waits for them.
+
+- ``phase(category)`` marks time on the driving task. Phases nest, and an
+  inner phase pauses the outer one, so every moment of an iteration is
+  counted exactly once. Time outside any phase is reported as ``other``. In
+  any other task ``phase`` does nothing.
+- ``tool_span(name)`` records the execution of a tool, in whichever task it
+  runs.
+- ``RunProfiler.summary()`` returns a compact per-iteration breakdown: time
+  on the critical path per category, the largest contributor, and for each
+  tool its duration and the part of it the loop spent waiting.
+
+The profiler of the current run is kept in a context variable, so the
+instrumented modules need no extra parameters. Without a profiler, ``phase``
+and ``tool_span`` are no-ops.
+"""
+
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, AsyncIterable, Dict, List, Optional, Tuple
+
+# Critical path categories
+STATE = "state"                      # iteration state read (billing, last message, browser state)
+MESSAGES = "messages"                # loading the thread's messages for the prompt
+CONTEXT = "context"                  # token counting and context compression
+LLM_FIRST_TOKEN = "llm_first_token"  # LLM request until its first chunk (whole response when not streaming)
+LLM_STREAM = "llm_stream"            # waiting for further chunks of the LLM stream
+XML_PARSE = "xml_parse"              # extracting and parsing XML tool calls
+TOOL_WAIT = "tool_wait"              # waiting for tool executions to finish
+DB_WRITE = "db_write"                # saving messages with ``add_message``
+PUBLISH = "publish"                  # serializing and publishing responses to Redis
+OTHER = "other"                      # everything else on the driving task
+
+# Iterations kept in a summary; later ones only count towards the run totals
+MAX_PROFILE_ITERATIONS = 100
+
+# Tools listed per iteration in a summary, longest first
+MAX_PROFILE_TOOLS = 20
+
+_current: ContextVar[Optional["RunProfiler"]] = ContextVar("run_profiler", default=None)
+
+
+class _Iteration:
+    __slots__ = ("start", "end", "totals", "counts", "tools", "tool_waits")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.end: Optional[float] = None
+        self.totals: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        # (tool name, start, end)
+        self.tools: List[Tuple[str, float, float]] = []
+        # (start, end) of TOOL_WAIT phases
+        self.tool_waits: List[Tuple[float, float]] = []
+
+
+class _Phase:
+    __slots__ = ("_profiler", "_category", "_active")
+
+    def __init__(self, profiler: "RunProfiler", category: str):
+        self._profiler = profiler
+        self._category = category
+        self._active = False
+
+    def __enter__(self):
+        profiler = self._profiler
+        if asyncio.current_task() is profiler.task:
+            self._active = True
+            profiler._enter(self._category)
+        return self
+
+    def __exit__(self, *exc):
+        if self._active:
+            self._profiler._exit(self._category)
+        return False
+
+
+class _ToolSpan:
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler: "RunProfiler", name: str):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = self._profiler.clock()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self._profiler
+        profiler._iteration.tools.append((self._name, self._start, profiler.clock()))
+        return False
+
+
+class _NullContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class RunProfiler:
+    """Critical path breakdown of one agent run."""
+
+    def __init__(self, run_id: Optional[str] = None, clock=time.perf_counter):
+        """
+        Args:
+            run_id: ID of the profiled agent run
+            clock: Monotonic clock in seconds, replaceable for tests and benchmarks
+        """
+        self.run_id = run_id
+        self.clock = clock
+        self.task: Optional[asyncio.Task] = None
+        self._started = clock()
+        self._finished: Optional[float] = None
+        # Time before the first iteration: tool registration, prompt assembly
+        self._setup = _Iteration(self._started)
+        self._iteration = self._setup
+        self._iterations: List[_Iteration] = []
+        self._stack: List[str] = []
+        self._mark = self._started
+        self._wait_started = 0.0
+
+    def activate(self) -> None:
+        """Make this the current run's profiler, driven by the calling task."""
+        self.task = asyncio.current_task()
+        _current.set(self)
+
+    def _charge(self, now: float) -> None:
+        category = self._stack[-1] if self._stack else OTHER
+        totals = self._iteration.totals
+        totals[category] = totals.get(category, 0.0) + (now - self._mark)
+        self._mark = now
+
+    def _enter(self, category: str) -> None:
+        now = self.clock()
+        self._charge(now)
+        self._stack.append(category)
+        counts = self._iteration.counts
+        counts[category] = counts.get(category, 0) + 1
+        if category == TOOL_WAIT:
+            self._wait_started = now
+
+    def _exit(self, category: str) -> None:
+        now = self.clock()
+        self._charge(now)
+        self._stack.pop()
+        if category == TOOL_WAIT:
+            self._iteration.tool_waits.append((self._wait_started, now))
+
+    def phase(self, category: str) -> _Phase:
+        return _Phase(self, category)
+
+    def tool_span(self, name: str) -> _ToolSpan:
+        return _ToolSpan(self, name)
+
+    def start_iteration(self) -> None:
+        """Close the current iteration (or the setup) and start the next one."""
+        now = self.clock()
+        self._charge(now)
+        self._iteration.end = now
+        self._iteration = _Iteration(now)
+        self._iterations.append(self._iteration)
+
+    def finish(self) -> None:
+        """Close the last iteration; later phases are not counted."""
+        if self._finished is not None:
+            return
+        now = self.clock()
+        self._charge(now)
+        self._iteration.end = now
+        self._finished = now
+        # Tool spans still open are dropped with the iteration they end in
+        self._iteration = _Iteration(now)
+        if _current.get() is self:
+            _current.set(None)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Compact breakdown of the run, for storing with the run.
+
+        Returns:
+            ``wall_ms``, ``setup_ms``, run totals per category
+            (``critical_path_ms``), the largest category (``bottleneck``) and
+            up to ``MAX_PROFILE_ITERATIONS`` iterations with their own totals,
+            phase counts and tools
+        """
+        self.finish()
+        totals: Dict[str, float] = {}
+        for iteration in [self._setup] + self._iterations:
+            for category, seconds in iteration.totals.items():
+                totals[category] = totals.get(category, 0.0) + seconds
+        return {
+            "version": 1,
+            "wall_ms": _ms(self._finished - self._started),
+            "setup_ms": _ms(sum(self._setup.totals.values())),
+            "critical_path_ms": _ms_by_category(totals),
+            "bottleneck": _bottleneck(totals),
+            "iterations": [_summarize(iteration) for iteration in self._iterations[:MAX_PROFILE_ITERATIONS]],
+            "iterations_truncated": max(0, len(self._iterations) - MAX_PROFILE_ITERATIONS),
+        }
+
+
+def _ms(seconds: float) -> int:
+    return round(seconds * 1000)
+
+
+def _ms_by_category(totals: Dict[str, float]) -> Dict[str, int]:
+    return {category: _ms(seconds) for category, seconds in sorted(totals.items(), key=lambda item: -item[1])
+            if _ms(seconds) > 0}
+
+
+def _bottleneck(totals: Dict[str, float]) -> Optional[str]:
+    return max(totals, key=totals.get) if totals else None
+
+
+def _critical_tool_time(iteration: _Iteration) -> Dict[int, float]:
+    """
+    Seconds the loop waited for each tool, by index in ``iteration.tools``.
+
+    Walks every wait backwards from its end: the tool finishing last is the
+    one the loop waited for, back to where that tool started; then the tool
+    finishing last before that point, and so on. Waits for tools that ran in
+    parallel are attributed once, to the tool that held the loop up.
+    """
+    blocked: Dict[int, float] = {}
+    by_end = sorted(range(len(iteration.tools)), key=lambda index: -iteration.tools[index][2])
+    for wait_start, wait_end in iteration.tool_waits:
+        cursor = wait_end
+        for index in by_end:
+            if cursor <= wait_start:
+                break
+            _, start, end = iteration.tools[index]
+            if start >= cursor or end <= wait_start:
+                continue
+            seconds = min(end, cursor) - max(start, wait_start)
+            if seconds > 0:
+                blocked[index] = blocked.get(index, 0.0) + seconds
+                cursor = max(start, wait_start)
+    return blocked
+
+
+def _summarize(iteration: _Iteration) -> Dict[str, Any]:
+    blocked = _critical_tool_time(iteration)
+    tools = sorted(
+        (
+            {"name": name, "ms": _ms(end - start), "critical_ms": _ms(blocked.get(index, 0.0))}
+            for index, (name, start, end) in enumerate(iteration.tools)
+        ),
+        key=lambda tool: -tool["ms"],
+    )
+    summary = {
+        "wall_ms": _ms(sum(iteration.totals.values())),
+        "critical_path_ms": _ms_by_category(iteration.totals),
+        "bottleneck": _bottleneck(iteration.totals),
+        "counts": dict(iteration.counts),
+    }
+    if tools:
+        summary["tools"] = tools[:MAX_PROFILE_TOOLS]
+    return summary
+
+
+def current_profiler() -> Optional[RunProfiler]:
+    return _current.get()
+
+
+def phase(category: str):
+    """Context manager marking time of the current run's driving task as ``category``."""
+    profiler = _current.get()
+    if profiler is None:
+        return _NULL
+    return _Phase(profiler, category)
+
+
+def tool_span(name: str):
+    """Context manager recording a tool execution of the current run."""
+    profiler = _current.get()
+    if profiler is None:
+        return _NULL
+    return _ToolSpan(profiler, name)
+
+
+def start_iteration() -> None:
+    """Start the next agent loop iteration of the current run, if profiled."""
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.start_iteration()
+
+
+async def timed_stream(stream: AsyncIterable, category: str = LLM_STREAM) -> AsyncGenerator:
+    """Yield the items of ``stream``, marking the waits for each item as ``category``."""
+    profiler = _current.get()
+    if profiler is None:
+        async for item in stream:
+            yield item
+        return
+    iterator = stream.__aiter__()
+    while True:
+        with profiler.phase(category):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item